@@ -3,6 +3,9 @@
 # This file is part of cloud-init. See LICENSE file for license information.
 
 import argparse
+import itertools
+import json
+import os
 import re
 import sys
 
@@ -10,6 +13,7 @@ from cloudinit.util import json_dumps
 from datetime import datetime
 from . import dump
 from . import show
+from . import trace
 
 
 def get_parser(parser=None):
@@ -29,6 +33,9 @@ def get_parser(parser=None):
     parser_blame.add_argument(
         '-o', '--outfile', action='store', dest='outfile', default='-',
         help='specify where to write output. ')
+    parser_blame.add_argument(
+        '-l', '--last', action='store', dest='last', type=int, default=None,
+        help='only analyze the last LAST boot records.')
     parser_blame.set_defaults(action=('blame', analyze_blame))
 
     parser_show = subparsers.add_parser(
@@ -42,6 +49,9 @@ def get_parser(parser=None):
     parser_show.add_argument('-o', '--outfile', action='store',
                              dest='outfile', default='-',
                              help='specify where to write output.')
+    parser_show.add_argument('-l', '--last', action='store', dest='last',
+                             type=int, default=None,
+                             help='only analyze the last LAST boot records.')
     parser_show.set_defaults(action=('show', analyze_show))
     parser_dump = subparsers.add_parser(
         'dump', help='Dump cloud-init events in JSON format')
@@ -61,6 +71,24 @@ def get_parser(parser=None):
                              dest='outfile', default='-',
                              help='specify where to write output.')
     parser_boot.set_defaults(action=('boot', analyze_boot))
+    parser_trace = subparsers.add_parser(
+        'trace', help='Print the critical path of events during each boot')
+    parser_trace.add_argument('-i', '--infile', action='store',
+                              dest='infile',
+                              default='/var/log/cloud-init.log',
+                              help='specify where to read input.')
+    parser_trace.add_argument('-o', '--outfile', action='store',
+                              dest='outfile', default='-',
+                              help='specify where to write output.')
+    parser_trace.add_argument('-f', '--format', action='store',
+                              dest='trace_format', default='text',
+                              choices=['text', 'chrome'],
+                              help='write a text report or a Chrome'
+                                   ' trace-event JSON file.')
+    parser_trace.add_argument('-l', '--last', action='store', dest='last',
+                              type=int, default=None,
+                              help='only analyze the last LAST boot records.')
+    parser_trace.set_defaults(action=('trace', analyze_trace))
     return parser
 
 
@@ -154,8 +182,10 @@ def analyze_blame(name, args):
     (infh, outfh) = configure_io(args)
     blame_format = '     %ds (%n)'
     r = re.compile(r'(^\s+\d+\.\d+)', re.MULTILINE)
-    for idx, record in enumerate(show.show_events(_get_events(infh),
-                                                  blame_format)):
+    records = show.show_events(_get_events(infh, args.last), blame_format)
+    if args.last:
+        records = records[-args.last:]
+    for idx, record in enumerate(records):
         srecs = sorted(filter(r.match, record), reverse=True)
         outfh.write('-- Boot Record %02d --\n' % (idx + 1))
         outfh.write('\n'.join(srecs) + '\n')
@@ -184,8 +214,11 @@ def analyze_show(name, args):
         Finished stage: (modules-final) 0.NNN seconds
     """
     (infh, outfh) = configure_io(args)
-    for idx, record in enumerate(show.show_events(_get_events(infh),
-                                                  args.print_format)):
+    records = show.show_events(_get_events(infh, args.last),
+                               args.print_format)
+    if args.last:
+        records = records[-args.last:]
+    for idx, record in enumerate(records):
         outfh.write('-- Boot Record %02d --\n' % (idx + 1))
         outfh.write('The total time elapsed since completing an event is'
                     ' printed after the "@" character.\n')
@@ -195,18 +228,71 @@ def analyze_show(name, args):
     outfh.write('%d boot records analyzed\n' % (idx + 1))
 
 
+def analyze_trace(name, args):
+    """Report the critical path and stage self times of each boot.
+
+    Example output follows:
+        -- Boot Record 01 --
+        Critical path: 11.52400 seconds
+        init-local @00.00000s +00.94200s
+        |`->init-local/search-NoCloud @00.11000s +00.40300s
+        init-network @03.83600s +02.72100s
+        ...
+
+        Stage times (total, self, children):
+          init-local: 00.94200s 00.53900s 00.40300s
+          ...
+
+    With --format chrome, the boots are written as Chrome trace-event JSON,
+    which flame chart viewers such as chrome://tracing or Perfetto load.
+    """
+    (infh, outfh) = configure_io(args)
+    boots = trace.build_event_trees(_get_events(infh, args.last))
+    if args.last:
+        boots = boots[-args.last:]
+    if args.trace_format == 'chrome':
+        outfh.write(json_dumps(trace.to_chrome_trace(boots)) + '\n')
+        return
+    for boot in boots:
+        outfh.write('-- %s --\n' % boot['name'])
+        outfh.write('\n'.join(trace.format_trace(boot)) + '\n\n')
+    outfh.write('%d boot records analyzed\n' % len(boots))
+
+
 def analyze_dump(name, args):
     """Dump cloud-init events in json format"""
     (infh, outfh) = configure_io(args)
     outfh.write(json_dumps(_get_events(infh)) + '\n')
 
 
-def _get_events(infile):
-    rawdata = None
-    events, rawdata = show.load_events_infile(infile)
-    if not events:
-        events, _ = dump.dump_events(rawdata=rawdata)
-    return events
+def _get_events(infile, last=None):
+    """Return the events of a JSON dump or cloud-init log file handle.
+
+    Log files are parsed as a stream. When last is set and infile is a
+    regular file, parsing starts at the last boot records, using the offsets
+    found by dump.index_boots.
+    """
+    first = infile.readline()
+    if first.lstrip().startswith(('[', '{')):
+        rawdata = first + infile.read()
+        try:
+            return json.loads(rawdata)
+        except ValueError:
+            return list(dump.iter_events(rawdata.splitlines()))
+    lines = itertools.chain([first], infile)
+    if last and _is_regular_file(infile):
+        offsets = dump.index_boots(infile.name)
+        if len(offsets) > last:
+            infile.seek(offsets[-last])
+            lines = infile
+    return list(dump.iter_events(lines))
+
+
+def _is_regular_file(infile):
+    try:
+        return os.path.isfile(infile.name) and infile.seekable()
+    except (AttributeError, TypeError, ValueError):
+        return False
 
 
 def configure_io(args):
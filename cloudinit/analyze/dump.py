@@ -2,10 +2,18 @@
 
 import calendar
 from datetime import datetime
+import hashlib
+import os
+import re
 import sys
+import time
 
+from cloudinit import log as logging
 from cloudinit import subp
 from cloudinit import util
+from cloudinit.atomic_helper import write_json
+
+LOG = logging.getLogger(__name__)
 
 stage_to_description = {
     'finished': 'finished running cloud-init',
@@ -28,10 +36,18 @@ CLOUD_INIT_JOURNALCTL_FMT = "%b %d %H:%M:%S.%f %Y"
 DEFAULT_FMT = "%b %d %H:%M:%S %Y"
 
 
+# 2016-08-30T21:53:25.972325+00:00, also with a space instead of the T
+ISO8601_RE = re.compile(
+    r'(?P<date>\d{4}-\d{2}-\d{2})[T ](?P<time>\d{2}:\d{2}:\d{2})'
+    r'(?P<fraction>\.\d+)?(?P<offset>Z|[+-]\d{2}:?\d{2})?$')
+
+# Abbreviated month names which start syslog and journalctl timestamps
+SYSLOG_MONTHS = frozenset(calendar.month_abbr[m] for m in range(1, 13))
+
+
 def parse_timestamp(timestampstr):
     # default syslog time does not include the current year
-    months = [calendar.month_abbr[m] for m in range(1, 13)]
-    if timestampstr.split()[0] in months:
+    if timestampstr.split()[0] in SYSLOG_MONTHS:
         # Aug 29 22:55:26
         FMT = DEFAULT_FMT
         if '.' in timestampstr:
@@ -45,12 +61,37 @@ def parse_timestamp(timestampstr):
         dt = datetime.strptime(timestampstr, CLOUD_INIT_ASCTIME_FMT)
         timestamp = dt.strftime("%s.%f")
     else:
-        # allow date(1) to handle other formats we don't expect
-        timestamp = parse_timestamp_from_date(timestampstr)
+        # 2016-08-30T21:53:25.972325+00:00 (rsyslog and journalctl -o
+        # short-iso-precise), parsed in-process as date(1) is slow
+        timestamp = parse_timestamp_iso8601(timestampstr)
+        if timestamp is None:
+            # allow date(1) to handle other formats we don't expect
+            timestamp = parse_timestamp_from_date(timestampstr)
 
     return float(timestamp)
 
 
+def parse_timestamp_iso8601(timestampstr):
+    """Return the timestamp of an ISO 8601 string, or None if it is not."""
+    match = ISO8601_RE.match(timestampstr)
+    if not match:
+        return None
+    dt = datetime.strptime(
+        '%s %s' % (match.group('date'), match.group('time')),
+        '%Y-%m-%d %H:%M:%S')
+    fraction = float(match.group('fraction') or 0)
+    offset = match.group('offset')
+    if offset is None:
+        # Timestamps without an offset are local time, as for date(1)
+        return time.mktime(dt.timetuple()) + fraction
+    timestamp = calendar.timegm(dt.timetuple()) + fraction
+    if offset != 'Z':
+        hours, minutes = int(offset[1:3]), int(offset[-2:])
+        sign = -1 if offset[0] == '-' else 1
+        timestamp -= sign * (hours * 3600 + minutes * 60)
+    return timestamp
+
+
 def parse_timestamp_from_date(timestampstr):
     out, _ = subp.subp(['date', '+%s.%3N', '-d', timestampstr])
     timestamp = out.strip()
@@ -143,11 +184,33 @@ def parse_ci_logline(line):
     return event
 
 
-def dump_events(cisource=None, rawdata=None):
-    events = []
-    event = None
-    CI_EVENT_MATCHES = ['start:', 'finish:', 'Cloud-init v.']
+CI_EVENT_MATCHES = ['start:', 'finish:', 'Cloud-init v.']
+
+# Written by index_boots to skip scanning logs which were already indexed
+BOOT_INDEX_FILE = '/run/cloud-init/analyze-boot-index.json'
+# Bytes at the start of an indexed log which must not change between scans
+BOOT_INDEX_HEAD_SIZE = 4096
+
+
+def iter_events(cisource):
+    """Yield each event parsed from an iterable of cloud-init log lines.
+
+    cisource is consumed lazily, so a file handle is streamed rather than
+    read into memory.
+    """
+    for line in cisource:
+        if not any(match in line for match in CI_EVENT_MATCHES):
+            continue
+        try:
+            event = parse_ci_logline(line)
+        except ValueError:
+            sys.stderr.write('Skipping invalid entry\n')
+            continue
+        if event:
+            yield event
+
 
+def dump_events(cisource=None, rawdata=None):
     if not any([cisource, rawdata]):
         raise ValueError('Either cisource or rawdata parameters are required')
 
@@ -156,17 +219,78 @@ def dump_events(cisource=None, rawdata=None):
     else:
         data = cisource.readlines()
 
-    for line in data:
-        for match in CI_EVENT_MATCHES:
-            if match in line:
-                try:
-                    event = parse_ci_logline(line)
-                except ValueError:
-                    sys.stderr.write('Skipping invalid entry\n')
-                if event:
-                    events.append(event)
-
-    return events, data
+    return list(iter_events(data)), data
+
+
+def _banner_stage(line):
+    """Return the stage of a 'Cloud-init v. running' banner line, or None."""
+    _, found, rest = line.partition(b"Cloud-init v. ")
+    if not found:
+        return None
+    _, found, rest = rest.partition(b" running '")
+    if not found:
+        return None
+    stage = rest.partition(b"'")[0].decode('utf-8', 'replace')
+    stage = stage.replace(':', '-')
+    if stage == 'init':
+        stage = 'init-network'
+    return stage
+
+
+def _head_digest(stream, size):
+    stream.seek(0)
+    return hashlib.sha256(stream.read(size)).hexdigest()
+
+
+def index_boots(path, index_file=None):
+    """Return the byte offsets at which each boot starts in the log at path.
+
+    A boot starts at a stage banner, such as "Cloud-init v. 21.1 running
+    'init-local'", for a stage which already ran since the previous boot
+    start. The offsets and scanning state are cached in index_file, which
+    defaults to BOOT_INDEX_FILE, so that later calls only scan what was
+    appended to the log since. The log is scanned again from the start when
+    it was replaced or truncated.
+    """
+    if index_file is None:
+        index_file = BOOT_INDEX_FILE
+    with open(path, 'rb') as stream:
+        stat = os.fstat(stream.fileno())
+        try:
+            cached = util.load_json(util.load_file(index_file))
+        except (IOError, OSError, ValueError):
+            cached = {}
+        state = {'path': os.path.realpath(path), 'inode': stat.st_ino,
+                 'size': 0, 'offsets': [], 'stages': []}
+        if (cached.get('path') == state['path'] and
+                cached.get('inode') == state['inode'] and
+                cached.get('size', 0) <= stat.st_size and
+                cached.get('head') == _head_digest(
+                    stream, cached.get('head_size', 0))):
+            state = cached
+        offset = state['size']
+        stream.seek(offset)
+        for line in stream:
+            if not line.endswith(b'\n'):
+                # Do not index a line which is still being written
+                break
+            stage = _banner_stage(line)
+            if stage:
+                if not state['offsets'] or stage in state['stages']:
+                    state['offsets'].append(offset)
+                    state['stages'] = []
+                state['stages'].append(stage)
+            offset += len(line)
+        if offset != state['size']:
+            state['size'] = offset
+            state['head_size'] = min(offset, BOOT_INDEX_HEAD_SIZE)
+            state['head'] = _head_digest(stream, state['head_size'])
+            try:
+                write_json(index_file, state)
+            except (IOError, OSError) as e:
+                LOG.debug("Unable to cache analyze boot index in %s: %s",
+                          index_file, e)
+    return state['offsets']
 
 
 def main():
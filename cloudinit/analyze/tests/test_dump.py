@@ -3,8 +3,10 @@
 from datetime import datetime
 from textwrap import dedent
 
+from cloudinit.analyze import dump
 from cloudinit.analyze.dump import (
-    dump_events, parse_ci_logline, parse_timestamp)
+    dump_events, index_boots, iter_events, parse_ci_logline, parse_timestamp)
+from cloudinit import util
 from cloudinit.util import write_file
 from cloudinit.subp import which
 from cloudinit.tests.helpers import CiTestCase, mock, skipIf
@@ -43,6 +45,16 @@ class TestParseTimestamp(CiTestCase):
         self.assertEqual(
             float(dt.strftime('%s.%f')), parse_timestamp(journal_stamp))
 
+    @mock.patch("cloudinit.analyze.dump.parse_timestamp_from_date")
+    def test_parse_timestamp_handles_iso8601_in_process(self, m_from_date):
+        """ISO 8601 timestamps are parsed without calling date(1)."""
+        for stamp in ('2016-08-30T21:53:25.972325+00:00',
+                      '2016-08-30 21:53:25.972325+00:00',
+                      '2016-08-30T23:53:25.972325+02:00',
+                      '2016-08-30T21:53:25.972325Z'):
+            self.assertEqual(1472594005.972325, parse_timestamp(stamp))
+        self.assertEqual(0, m_from_date.call_count)
+
     @skipIf(not which("date"), "'date' command not available.")
     def test_parse_unexpected_timestamp_format_with_date_command(self):
         """Dump sends unexpected timestamp formats to date for processing."""
@@ -114,11 +126,9 @@ class TestParseCILogLine(CiTestCase):
             'name': 'modules-final',
             'origin': 'cloudinit',
             'result': 'SUCCESS',
-            'timestamp': 1472594005.972}
-        m_parse_from_date.return_value = "1472594005.972"
+            'timestamp': 1472594005.972325}
         self.assertEqual(expected, parse_ci_logline(line))
-        m_parse_from_date.assert_has_calls(
-            [mock.call("2016-08-30 21:53:25.972325+00:00")])
+        self.assertEqual(0, m_parse_from_date.call_count)
 
     def test_parse_logline_returns_event_for_amazon_linux_2_line(self):
         line = (
@@ -153,12 +163,9 @@ class TestDumpEvents(CiTestCase):
     @mock.patch("cloudinit.analyze.dump.parse_timestamp_from_date")
     def test_dump_events_with_rawdata(self, m_parse_from_date):
         """Rawdata is split and parsed into a tuple of events and data"""
-        m_parse_from_date.return_value = "1472594005.972"
         events, data = dump_events(rawdata=SAMPLE_LOGS)
         expected_data = SAMPLE_LOGS.splitlines()
-        self.assertEqual(
-            [mock.call("2016-08-30 21:53:25.972325+00:00")],
-            m_parse_from_date.call_args_list)
+        self.assertEqual(0, m_parse_from_date.call_count)
         self.assertEqual(expected_data, data)
         year = datetime.now().year
         dt1 = datetime.strptime(
@@ -175,7 +182,7 @@ class TestDumpEvents(CiTestCase):
             'name': 'modules-final',
             'origin': 'cloudinit',
             'result': 'SUCCESS',
-            'timestamp': 1472594005.972}]
+            'timestamp': 1472594005.972325}]
         self.assertEqual(expected_events, events)
 
     @mock.patch("cloudinit.analyze.dump.parse_timestamp_from_date")
@@ -183,8 +190,6 @@ class TestDumpEvents(CiTestCase):
         """Cisource file is read and parsed into a tuple of events and data."""
         tmpfile = self.tmp_path('logfile')
         write_file(tmpfile, SAMPLE_LOGS)
-        m_parse_from_date.return_value = 1472594005.972
-
         events, data = dump_events(cisource=open(tmpfile))
         year = datetime.now().year
         dt1 = datetime.strptime(
@@ -201,8 +206,116 @@ class TestDumpEvents(CiTestCase):
             'name': 'modules-final',
             'origin': 'cloudinit',
             'result': 'SUCCESS',
-            'timestamp': 1472594005.972}]
+            'timestamp': 1472594005.972325}]
         self.assertEqual(expected_events, events)
         self.assertEqual(SAMPLE_LOGS.splitlines(), [d.strip() for d in data])
-        m_parse_from_date.assert_has_calls(
-            [mock.call("2016-08-30 21:53:25.972325+00:00")])
+        self.assertEqual(0, m_parse_from_date.call_count)
+
+
+BOOT_LOG = dedent("""\
+2017-05-22 18:02:01,088 - util.py[DEBUG]: Cloud-init v. 0.7.9 running\
+ 'init-local' at Mon, 22 May 2017 18:02:01 +0000. Up 2.0 seconds.
+2017-05-22 18:02:02,088 - util.py[DEBUG]: Cloud-init v. 0.7.9 running\
+ 'init' at Mon, 22 May 2017 18:02:02 +0000. Up 3.0 seconds.
+2017-05-22 18:02:03,088 - util.py[DEBUG]: Cloud-init v. 0.7.9 running\
+ 'modules:config' at Mon, 22 May 2017 18:02:03 +0000. Up 4.0 seconds.
+""")
+
+
+class TestIterEvents(CiTestCase):
+
+    def test_iter_events_streams_lines(self):
+        """Events are yielded lazily as lines are consumed."""
+        lines = iter(BOOT_LOG.splitlines())
+        events = iter_events(lines)
+        self.assertEqual('init-local', next(events)['name'])
+        self.assertEqual('init-network', next(events)['name'])
+        self.assertEqual(1, len(list(lines)))
+
+    def test_iter_events_skips_invalid_entries_once(self):
+        """An unparseable line does not repeat the previous event."""
+        lines = BOOT_LOG.splitlines()
+        lines.insert(1, '2017-05-22 18:02:01,588 - x.py[DEBUG]: start:')
+        with mock.patch('sys.stderr'):
+            events = list(iter_events(lines))
+        self.assertEqual(
+            ['init-local', 'init-network', 'modules-config'],
+            [e['name'] for e in events])
+
+
+class TestIndexBoots(CiTestCase):
+
+    def setUp(self):
+        super(TestIndexBoots, self).setUp()
+        self.log = self.tmp_path('cloud-init.log')
+        self.index = self.tmp_path('index.json')
+
+    def test_index_boots_finds_each_boot(self):
+        """A boot starts where a stage banner repeats."""
+        write_file(self.log, BOOT_LOG * 3)
+        self.assertEqual(
+            [0, len(BOOT_LOG), 2 * len(BOOT_LOG)],
+            index_boots(self.log, index_file=self.index))
+
+    def test_index_boots_only_scans_appended_data(self):
+        """Cached offsets are reused and only new lines are scanned."""
+        write_file(self.log, BOOT_LOG * 2)
+        index_boots(self.log, index_file=self.index)
+        write_file(self.log, BOOT_LOG, omode='a')
+        with mock.patch('cloudinit.analyze.dump._banner_stage',
+                        wraps=dump._banner_stage) as m_stage:
+            offsets = index_boots(self.log, index_file=self.index)
+        self.assertEqual([0, len(BOOT_LOG), 2 * len(BOOT_LOG)], offsets)
+        self.assertEqual(3, m_stage.call_count)
+
+    def test_index_boots_rescans_replaced_log(self):
+        """A rotated or truncated log is indexed from the start again."""
+        write_file(self.log, BOOT_LOG * 3)
+        index_boots(self.log, index_file=self.index)
+        write_file(self.log, 'unrelated\n' + BOOT_LOG)
+        self.assertEqual(
+            [len('unrelated\n')],
+            index_boots(self.log, index_file=self.index))
+
+    def test_index_boots_ignores_unwritable_index(self):
+        """Offsets are still returned when the index cannot be written."""
+        write_file(self.log, BOOT_LOG)
+        index = self.tmp_path('missing/index.json')
+        with mock.patch('cloudinit.analyze.dump.write_json',
+                        side_effect=PermissionError()):
+            self.assertEqual([0], index_boots(self.log, index_file=index))
+
+
+class TestGetEvents(CiTestCase):
+
+    def setUp(self):
+        super(TestGetEvents, self).setUp()
+        self.log = self.tmp_path('cloud-init.log')
+        write_file(self.log, BOOT_LOG * 3)
+
+    def test_get_events_streams_whole_log(self):
+        """All events of a log are returned without --last."""
+        from cloudinit.analyze.__main__ import _get_events
+        with open(self.log) as stream:
+            self.assertEqual(9, len(_get_events(stream)))
+
+    def test_get_events_seeks_to_last_boots(self):
+        """Only the events of the last boots are parsed with --last."""
+        from cloudinit.analyze.__main__ import _get_events
+        index = self.tmp_path('index.json')
+        with mock.patch('cloudinit.analyze.dump.BOOT_INDEX_FILE', index):
+            with open(self.log) as stream:
+                events = _get_events(stream, last=2)
+        self.assertEqual(6, len(events))
+        with open(self.log) as stream:
+            self.assertEqual(events[-6:], _get_events(stream)[-6:])
+
+    def test_get_events_reads_json_dump(self):
+        """A JSON dump of events is loaded rather than parsed as a log."""
+        from cloudinit.analyze.__main__ import _get_events
+        with open(self.log) as stream:
+            events = list(iter_events(stream))
+        dump_file = self.tmp_path('dump.json')
+        write_file(dump_file, util.json_dumps(events))
+        with open(dump_file) as stream:
+            self.assertEqual(events, _get_events(stream, last=1))
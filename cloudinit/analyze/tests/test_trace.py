@@ -0,0 +1,151 @@
+# This file is part of cloud-init. See LICENSE file for license information.
+
+from textwrap import dedent
+
+from cloudinit.analyze import trace
+from cloudinit.analyze.__main__ import analyze_trace, get_parser
+from cloudinit.analyze.dump import iter_events
+from cloudinit.tests.helpers import CiTestCase
+from cloudinit.util import load_json, load_file, write_file
+
+SAMPLE_LOG = dedent("""\
+2017-05-22 18:02:01,000 - util.py[DEBUG]: Cloud-init v. 0.7.9 running\
+ 'init-local' at Mon, 22 May 2017 18:02:01 +0000. Up 2.0 seconds.
+2017-05-22 18:02:01,100 - handlers.py[DEBUG]: start:\
+ init-local/search-NoCloud: searching for local data from DataSourceNoCloud
+2017-05-22 18:02:01,500 - handlers.py[DEBUG]: finish:\
+ init-local/search-NoCloud: SUCCESS: found local data from DataSourceNoCloud
+2017-05-22 18:02:01,900 - handlers.py[DEBUG]: finish: init-local: SUCCESS:\
+ searching for local datasources
+2017-05-22 18:02:03,000 - util.py[DEBUG]: Cloud-init v. 0.7.9 running\
+ 'modules:config' at Mon, 22 May 2017 18:02:03 +0000. Up 4.0 seconds.
+2017-05-22 18:02:03,100 - handlers.py[DEBUG]: start:\
+ modules-config/config-ntp: running config-ntp
+2017-05-22 18:02:03,150 - handlers.py[DEBUG]: start:\
+ modules-config/config-ssh: running config-ssh
+2017-05-22 18:02:03,300 - handlers.py[DEBUG]: finish:\
+ modules-config/config-ntp: SUCCESS: config-ntp ran successfully
+2017-05-22 18:02:03,700 - handlers.py[DEBUG]: finish:\
+ modules-config/config-ssh: SUCCESS: config-ssh ran successfully
+2017-05-22 18:02:03,800 - handlers.py[DEBUG]: finish: modules-config:\
+ SUCCESS: running modules for config
+""")
+
+
+def _events(log=SAMPLE_LOG):
+    return list(iter_events(log.splitlines()))
+
+
+class TestBuildEventTrees(CiTestCase):
+
+    def test_events_are_nested_under_their_stage(self):
+        """Start and finish events are paired into a tree per stage."""
+        [boot] = trace.build_event_trees(_events())
+        self.assertEqual(
+            ['init-local', 'modules-config'],
+            [stage['name'] for stage in boot['children']])
+        local, config = boot['children']
+        self.assertEqual(
+            ['init-local/search-NoCloud'],
+            [child['name'] for child in local['children']])
+        self.assertEqual(
+            ['modules-config/config-ntp', 'modules-config/config-ssh'],
+            [child['name'] for child in config['children']])
+        self.assertEqual('SUCCESS', config['children'][0]['result'])
+
+    def test_repeated_stage_starts_a_new_boot(self):
+        """Each time a stage runs again a new boot tree is started."""
+        boots = trace.build_event_trees(_events(SAMPLE_LOG * 3))
+        self.assertEqual(
+            ['Boot Record 01', 'Boot Record 02', 'Boot Record 03'],
+            [boot['name'] for boot in boots])
+
+    def test_self_time_excludes_overlapping_children(self):
+        """Concurrent children only count once towards child time."""
+        [boot] = trace.build_event_trees(_events())
+        config = boot['children'][1]
+        self.assertAlmostEqual(0.6, config['child_time'], places=5)
+        self.assertAlmostEqual(0.2, config['self_time'], places=5)
+
+    def test_unfinished_events_end_with_their_children(self):
+        """An event without a finish event lasts until its children end."""
+        log = '\n'.join(SAMPLE_LOG.splitlines()[:-1])
+        [boot] = trace.build_event_trees(_events(log))
+        config = boot['children'][1]
+        self.assertIsNone(config['result'])
+        self.assertEqual(config['children'][1]['end'], config['end'])
+
+
+class TestCriticalPath(CiTestCase):
+
+    def test_critical_path_follows_last_finishing_events(self):
+        """The critical path skips events which finished before others."""
+        [boot] = trace.build_event_trees(_events())
+        self.assertEqual(
+            [(0, 'init-local'), (1, 'init-local/search-NoCloud'),
+             (0, 'modules-config'), (1, 'modules-config/config-ssh')],
+            [(depth, node['name'])
+             for depth, node in trace.critical_path(boot)])
+
+
+class TestChromeTrace(CiTestCase):
+
+    def test_chrome_trace_has_complete_events(self):
+        """Events are complete events relative to the start of the boot."""
+        chrome = trace.to_chrome_trace(trace.build_event_trees(_events()))
+        events = dict((e['name'], e) for e in chrome['traceEvents'])
+        self.assertEqual(
+            {'name': 'process_name', 'ph': 'M', 'pid': 1,
+             'args': {'name': 'Boot Record 01'}},
+            events['process_name'])
+        local = events['init-local']
+        self.assertEqual(
+            ('X', 0, 900000), (local['ph'], local['ts'], local['dur']))
+        self.assertTrue(local['args']['critical_path'])
+        self.assertNotIn(
+            'critical_path', events['modules-config/config-ntp']['args'])
+
+    def test_concurrent_events_are_on_separate_threads(self):
+        """Overlapping siblings are placed on different thread ids."""
+        chrome = trace.to_chrome_trace(trace.build_event_trees(_events()))
+        tids = dict((e['name'], e.get('tid')) for e in chrome['traceEvents'])
+        self.assertEqual(0, tids['modules-config'])
+        self.assertEqual(0, tids['modules-config/config-ntp'])
+        self.assertEqual(1, tids['modules-config/config-ssh'])
+
+
+class TestAnalyzeTrace(CiTestCase):
+
+    def test_analyze_trace_writes_chrome_json(self):
+        """analyze trace --format chrome writes a trace-event JSON file."""
+        infile = self.tmp_path('cloud-init.log')
+        outfile = self.tmp_path('trace.json')
+        write_file(infile, SAMPLE_LOG * 2)
+        args = get_parser().parse_args(
+            ['trace', '-i', infile, '-o', outfile, '--format', 'chrome'])
+        analyze_trace('trace', args)
+        chrome = load_json(load_file(outfile))
+        self.assertEqual(
+            [1, 2], sorted(set(e['pid'] for e in chrome['traceEvents'])))
+
+    def test_analyze_trace_reports_critical_path(self):
+        """analyze trace reports the critical path and stage times."""
+        infile = self.tmp_path('cloud-init.log')
+        outfile = self.tmp_path('trace.txt')
+        write_file(infile, SAMPLE_LOG)
+        args = get_parser().parse_args(['trace', '-i', infile, '-o', outfile])
+        analyze_trace('trace', args)
+        self.assertEqual(dedent("""\
+            -- Boot Record 01 --
+            Critical path: 02.80000 seconds
+            init-local @00.00000s +00.90000s
+            |`->init-local/search-NoCloud @00.10000s +00.40000s
+            modules-config @02.00000s +00.80000s
+            |`->modules-config/config-ssh @02.15000s +00.55000s
+
+            Stage times (total, self, children):
+              init-local: 00.90000s 00.50000s 00.40000s
+              modules-config: 00.80000s 00.20000s 00.60000s
+
+            1 boot records analyzed
+            """), load_file(outfile))
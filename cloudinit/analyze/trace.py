@@ -0,0 +1,192 @@
+# This file is part of cloud-init. See LICENSE file for license information.
+
+"""Build event trees of each boot to find the critical path through it.
+
+Each ReportEventStack emits a start and a finish event named after its
+parents, such as 'init-network/config-ssh'. Pairing these gives the tree of
+events of each boot, which is used to report the chain of events which
+determined when a boot finished, the time each stage spent in itself versus
+in its children, and to export the boot in Chrome trace-event format.
+"""
+
+from . import show
+
+# Trace-event timestamps and durations are in microseconds
+CHROME_TIME_SCALE = 1000000.0
+
+
+def _new_node(name, start, description='', result=None):
+    return {'name': name, 'description': description, 'result': result,
+            'start': start, 'end': None, 'children': []}
+
+
+def _open_parent(open_nodes, name):
+    """Return the innermost open event which name is nested under."""
+    while '/' in name:
+        name = name.rsplit('/', 1)[0]
+        if open_nodes.get(name):
+            return open_nodes[name][-1]
+    return None
+
+
+def _finalize(node):
+    """Set end times of unfinished events and time spent in children."""
+    for child in node['children']:
+        _finalize(child)
+    if node['end'] is None:
+        # The event never finished, so it lasted as long as its children
+        node['end'] = max(
+            [node['start']] + [c['end'] for c in node['children']])
+    covered = 0.0
+    cursor = node['start']
+    for child in sorted(node['children'], key=lambda c: c['start']):
+        start = max(child['start'], cursor)
+        end = min(child['end'], node['end'])
+        if end > start:
+            covered += end - start
+            cursor = end
+    node['child_time'] = covered
+    node['self_time'] = (node['end'] - node['start']) - covered
+
+
+def build_event_trees(events):
+    """Return a tree of events for each boot found in events.
+
+    A boot starts with a top level stage event, such as 'init-local', which
+    already ran in the current boot. Each tree is rooted at a node spanning
+    the whole boot. Nodes are dicts with name, description, result, start,
+    end, children, self_time and child_time keys.
+    """
+    boots = []
+    boot = None
+    stages_seen = set()
+    open_nodes = {}
+    for event in events:
+        name = show.event_name(event)
+        timestamp = show.event_timestamp(event)
+        if show.event_type(event) == 'start':
+            is_stage = '/' not in name
+            if boot is None or (is_stage and name in stages_seen):
+                boot = _new_node('Boot Record %02d' % (len(boots) + 1),
+                                 timestamp)
+                boots.append(boot)
+                stages_seen = set()
+                open_nodes = {}
+            if is_stage:
+                stages_seen.add(name)
+            node = _new_node(name, timestamp, event.get('description', ''))
+            parent = _open_parent(open_nodes, name) or boot
+            parent['children'].append(node)
+            open_nodes.setdefault(name, []).append(node)
+        elif open_nodes.get(name):
+            node = open_nodes[name].pop()
+            node['end'] = max(timestamp, node['start'])
+            node['result'] = event.get('result')
+    for boot in boots:
+        _finalize(boot)
+    return boots
+
+
+def critical_children(node):
+    """Return the chain of children of node which ended last, in order.
+
+    Starting from the end of node, the child which ended last is on the
+    critical path, followed by the child which ended last before it
+    started, and so on.
+    """
+    path = []
+    cursor = node['end']
+    by_end = sorted(node['children'], key=lambda c: (c['end'], c['start']))
+    for child in reversed(by_end):
+        if child['end'] <= cursor:
+            path.append(child)
+            cursor = child['start']
+    path.reverse()
+    return path
+
+
+def critical_path(node, depth=0):
+    """Return (depth, event) tuples of the critical path through node."""
+    path = []
+    for child in critical_children(node):
+        path.append((depth, child))
+        path.extend(critical_path(child, depth + 1))
+    return path
+
+
+def format_trace(boot):
+    """Return the critical path and stage time report lines of a boot."""
+    duration = boot['end'] - boot['start']
+    lines = ['Critical path: %08.5f seconds' % duration]
+    for depth, node in critical_path(boot):
+        indent = '|' + ' ' * (depth - 1) + '`->' if depth else ''
+        lines.append('%s%s @%08.5fs +%08.5fs' % (
+            indent, node['name'], node['start'] - boot['start'],
+            node['end'] - node['start']))
+    lines.append('')
+    lines.append('Stage times (total, self, children):')
+    for stage in boot['children']:
+        lines.append('  %s: %08.5fs %08.5fs %08.5fs' % (
+            stage['name'], stage['end'] - stage['start'],
+            stage['self_time'], stage['child_time']))
+    return lines
+
+
+def _lane_is_free(lane, start, end):
+    """Whether an event nests with or is disjoint from all those in lane."""
+    for other_start, other_end in lane:
+        if start >= other_end or end <= other_start:
+            continue
+        if other_start <= start and end <= other_end:
+            continue
+        if start <= other_start and other_end <= end:
+            continue
+        return False
+    return True
+
+
+def _chrome_events(node, boot, pid, lanes, lane, critical):
+    """Return complete trace events of all descendants of node."""
+    events = []
+    for child in sorted(node['children'], key=lambda c: c['start']):
+        start, end = child['start'], child['end']
+        # Concurrent siblings are moved to other threads, as trace viewers
+        # only render properly nested events on a single thread.
+        tid = lane
+        if not _lane_is_free(lanes[tid], start, end):
+            tid = next((i for i, other in enumerate(lanes)
+                        if _lane_is_free(other, start, end)), len(lanes))
+            if tid == len(lanes):
+                lanes.append([])
+        lanes[tid].append((start, end))
+        args = {'description': child['description'],
+                'self_time': round(child['self_time'], 6)}
+        if child['result']:
+            args['result'] = child['result']
+        if id(child) in critical:
+            args['critical_path'] = True
+        events.append({
+            'name': child['name'], 'cat': 'cloudinit', 'ph': 'X',
+            'ts': round((start - boot['start']) * CHROME_TIME_SCALE),
+            'dur': round((end - start) * CHROME_TIME_SCALE),
+            'pid': pid, 'tid': tid, 'args': args})
+        events.extend(
+            _chrome_events(child, boot, pid, lanes, tid, critical))
+    return events
+
+
+def to_chrome_trace(boots):
+    """Return the Chrome trace-event JSON object of a list of boot trees.
+
+    Each boot is a separate process in the trace, with timestamps relative
+    to the start of that boot.
+    """
+    events = []
+    for pid, boot in enumerate(boots, 1):
+        critical = set(id(node) for _, node in critical_path(boot))
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                       'args': {'name': boot['name']}})
+        events.extend(_chrome_events(boot, boot, pid, [[]], 0, critical))
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+# vi: ts=4 expandtab
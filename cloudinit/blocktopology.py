@@ -0,0 +1,198 @@
+# This file is part of cloud-init. See LICENSE file for license information.
+
+"""Block devices of the system and where they are mounted.
+
+The disk modules (cc_disk_setup, cc_growpart, cc_resizefs and cc_mounts)
+look devices, partitions, filesystems and mounts up in the BlockTopology of
+the stage, Cloud.block_topology, rather than each probing them again. It is
+read with a single lsblk call and mountinfo the first time it is needed, and
+read again after invalidate is called once devices were partitioned,
+formatted, resized or mounted.
+"""
+
+import json
+import os
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+from cloudinit import log as logging
+from cloudinit import subp
+from cloudinit import util
+
+LOG = logging.getLogger(__name__)
+
+LSBLK_CMD = ['lsblk', '--json', '--bytes', '--output-all']
+MOUNTINFO_PATH = '/proc/self/mountinfo'
+
+# The partition number in the kernel name of a partition of parent, such as
+# 1 in sda1, nvme0n1p1 or mpatha-part1
+PARTITION_SUFFIX_RE = re.compile(r'^(?:p|-part)?(?P<partn>[0-9]+)$')
+
+# A block device as listed by lsblk. name is the kernel name, path the
+# device node, parent the kernel name of the device it is on and partn the
+# number of a partition. Empty values are None.
+BlockDevice = namedtuple(
+    'BlockDevice', ['name', 'path', 'type', 'fstype', 'label', 'uuid',
+                    'size', 'parent', 'partn', 'mountpoint'])
+
+
+def _lsblk_value(entry, key):
+    """Return the value of key in an lsblk entry, or None if it is empty.
+
+    Older lsblk print every value as a string, newer ones print numbers
+    and null.
+    """
+    value = entry.get(key)
+    if value is None or value == '':
+        return None
+    return value
+
+
+def _partition_number(entry, parent):
+    """Return the number of the partition entry of parent, or None."""
+    partn = _lsblk_value(entry, 'partn')
+    if partn is not None:
+        return int(partn)
+    if (parent is None or entry.get('type') != 'part' or
+            not entry['kname'].startswith(parent)):
+        return None
+    match = PARTITION_SUFFIX_RE.match(entry['kname'][len(parent):])
+    if not match:
+        return None
+    return int(match.group('partn'))
+
+
+def _device_path(entry):
+    """Return the device node of an lsblk entry.
+
+    Older lsblk do not print it, and name device mapper devices by their
+    name in /dev/mapper.
+    """
+    path = _lsblk_value(entry, 'path')
+    if path is not None:
+        return path
+    if entry['kname'].startswith('dm-') and entry['name'] != entry['kname']:
+        return '/dev/mapper/%s' % entry['name']
+    return '/dev/%s' % entry['name']
+
+
+def parse_lsblk_json(content):
+    """Return the BlockDevices of lsblk --json output by kernel name, and
+    the kernel names of the devices on each device.
+
+    Devices are listed in the order lsblk prints them, a device before the
+    devices on it. A device on several others, such as a RAID array, is
+    listed on the first.
+    """
+    devices = OrderedDict()
+    children = {}
+
+    def add(entries, parent):
+        for entry in entries:
+            name = _lsblk_value(entry, 'kname') or entry['name']
+            entry = dict(entry, kname=name)
+            if parent is not None:
+                children.setdefault(parent, [])
+                if name not in children[parent]:
+                    children[parent].append(name)
+            if name not in devices:
+                size = _lsblk_value(entry, 'size')
+                devices[name] = BlockDevice(
+                    name=name,
+                    path=_device_path(entry),
+                    type=_lsblk_value(entry, 'type'),
+                    fstype=_lsblk_value(entry, 'fstype'),
+                    label=_lsblk_value(entry, 'label'),
+                    uuid=_lsblk_value(entry, 'uuid'),
+                    size=int(size) if size is not None else None,
+                    parent=parent,
+                    partn=_partition_number(entry, parent),
+                    mountpoint=_lsblk_value(entry, 'mountpoint'))
+            add(entry.get('children', []), name)
+
+    add(json.loads(content).get('blockdevices', []), None)
+    return devices, children
+
+
+class BlockTopology(object):
+    """The block devices of the system and where they are mounted.
+
+    Devices are read with lsblk and mounts from mountinfo when first looked
+    up, and kept until invalidate is called. A device lsblk did not list,
+    or any device if lsblk could not be run, is looked up as None so that
+    callers fall back to probing it.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._snapshot = None
+
+    def _read(self):
+        devices, children = OrderedDict(), {}
+        try:
+            out, _err = subp.subp(LSBLK_CMD)
+            devices, children = parse_lsblk_json(out)
+        except subp.ProcessExecutionError as e:
+            LOG.debug("Unable to list block devices: %s", e)
+        except (ValueError, KeyError, TypeError) as e:
+            LOG.warning("Unable to parse lsblk output: %s", e)
+        mountinfo = None
+        if os.path.exists(MOUNTINFO_PATH):
+            mountinfo = util.load_file(MOUNTINFO_PATH).splitlines()
+        LOG.debug("Read %d block devices", len(devices))
+        return devices, children, mountinfo
+
+    def _get(self):
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = self._read()
+            return self._snapshot
+
+    def invalidate(self):
+        """Forget the devices and mounts, to read them again when needed."""
+        with self._lock:
+            self._snapshot = None
+
+    def devices(self):
+        """Return the BlockDevices, each before the devices on it."""
+        devices, _children, _mountinfo = self._get()
+        return list(devices.values())
+
+    def lookup(self, device):
+        """Return the BlockDevice of a path to a device node, or None."""
+        if not device:
+            return None
+        path = os.path.realpath(device)
+        if not path.startswith('/dev/'):
+            return None
+        devices, _children, _mountinfo = self._get()
+        return devices.get(os.path.basename(path))
+
+    def children(self, device):
+        """Return the BlockDevices directly on BlockDevice device."""
+        devices, children, _mountinfo = self._get()
+        return [devices[name] for name in children.get(device.name, [])]
+
+    def descendants(self, device):
+        """Return the BlockDevices on BlockDevice device, depth first."""
+        devices, children, _mountinfo = self._get()
+        found = []
+        pending = list(reversed(children.get(device.name, [])))
+        while pending:
+            name = pending.pop()
+            found.append(devices[name])
+            pending.extend(reversed(children.get(name, [])))
+        return found
+
+    def get_mount_info(self, path, log=LOG, **kwargs):
+        """Return util.get_mount_info for path, from the mountinfo read.
+
+        Without mountinfo, as on BSD, util.get_mount_info is called.
+        """
+        _devices, _children, mountinfo = self._get()
+        if mountinfo is None:
+            return util.get_mount_info(path, log, **kwargs)
+        return util.parse_mount_info(path, mountinfo, log, **kwargs)
+
+# vi: ts=4 expandtab
@@ -7,6 +7,7 @@
 import copy
 import os
 
+from cloudinit import blocktopology
 from cloudinit import log as logging
 from cloudinit.reporting import events
 
@@ -37,6 +38,9 @@ class Cloud(object):
                 description="unnamed-cloud-reporter",
                 reporting_enabled=False)
         self.reporter = reporter
+        # Block devices are read once for the modules run with this cloud,
+        # and again after a module changes them
+        self.block_topology = blocktopology.BlockTopology()
 
     # If a 'user' manipulates logging or logging services
     # it is typically useful to cause the logging to be
@@ -10,7 +10,8 @@ import os
 import shutil
 import sys
 
-from cloudinit.sources import INSTANCE_JSON_SENSITIVE_FILE
+from cloudinit.sources import (
+    INSTANCE_JSON_SENSITIVE_FILE, instance_data_index_path)
 from cloudinit.temp_utils import tempdir
 from cloudinit.subp import (ProcessExecutionError, subp)
 from cloudinit.util import (chdir, copy, ensure_dir, write_file)
@@ -52,7 +53,9 @@ def _copytree_ignore_sensitive_files(curdir, files):
     """Return a list of files to ignore if we are non-root"""
     if os.getuid() == 0:
         return ()
-    return (INSTANCE_JSON_SENSITIVE_FILE,)  # Ignore root-permissioned files
+    # Ignore root-permissioned files
+    return (INSTANCE_JSON_SENSITIVE_FILE,
+            instance_data_index_path(INSTANCE_JSON_SENSITIVE_FILE))
 
 
 def _write_command_output_to_file(cmd, filename, msg, verbosity):
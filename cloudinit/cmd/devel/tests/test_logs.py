@@ -5,7 +5,8 @@ import os
 from io import StringIO
 
 from cloudinit.cmd.devel import logs
-from cloudinit.sources import INSTANCE_JSON_SENSITIVE_FILE
+from cloudinit.sources import (
+    INSTANCE_JSON_SENSITIVE_FILE, instance_data_index_path)
 from cloudinit.tests.helpers import (
     FilesystemMockingTestCase, mock, wrap_and_call)
 from cloudinit.subp import subp
@@ -43,6 +44,9 @@ class TestCollectLogs(FilesystemMockingTestCase):
         write_file(self.tmp_path('results.json', self.run_dir), 'results')
         write_file(self.tmp_path(INSTANCE_JSON_SENSITIVE_FILE, self.run_dir),
                    'sensitive')
+        sensitive_index = instance_data_index_path(
+            INSTANCE_JSON_SENSITIVE_FILE)
+        write_file(self.tmp_path(sensitive_index, self.run_dir), 'sensitive')
         output_tarfile = self.tmp_path('logs.tgz')
 
         date = datetime.utcnow().date().strftime('%Y-%m-%d')
@@ -84,6 +88,11 @@ class TestCollectLogs(FilesystemMockingTestCase):
                 os.path.join(out_logdir, 'run', 'cloud-init',
                              INSTANCE_JSON_SENSITIVE_FILE)),
             'Unexpected file found: %s' % INSTANCE_JSON_SENSITIVE_FILE)
+        self.assertFalse(
+            os.path.exists(
+                os.path.join(out_logdir, 'run', 'cloud-init',
+                             sensitive_index)),
+            'Unexpected file found: %s' % sensitive_index)
         self.assertEqual(
             '0.7fake\n',
             load_file(os.path.join(out_logdir, 'dpkg-version')))
@@ -398,7 +398,8 @@ def main_init(name, args):
     apply_reporting_cfg(init.cfg)
 
     # Stage 8 - re-read and apply relevant cloud-config to include user-data
-    mods = stages.Modules(init, extract_fns(args), reporter=args.reporter)
+    mods = stages.Modules(init, extract_fns(args), reporter=args.reporter,
+                          serial=args.serial)
     # Stage 9
     try:
         outfmt_orig = outfmt
@@ -492,7 +493,8 @@ def main_modules(action_name, args):
             return [(msg)]
     _maybe_persist_instance_data(init)
     # Stage 3
-    mods = stages.Modules(init, extract_fns(args), reporter=args.reporter)
+    mods = stages.Modules(init, extract_fns(args), reporter=args.reporter,
+                          serial=args.serial)
     # Stage 4
     try:
         LOG.debug("Closing stdin")
@@ -665,6 +667,7 @@ def status_wrapper(name, args, data_d=None, link_d=None):
         v1[mode]['errors'] = [str(e)]
 
     v1[mode]['finished'] = time.time()
+    v1[mode]['blkid_runs'] = util.blkid_runs()
     v1['stage'] = None
 
     atomic_helper.write_json(status_path, status)
@@ -751,6 +754,10 @@ def main(sysv_args=None):
     parser_init.add_argument("--local", '-l', action='store_true',
                              help="start in local mode (default: %(default)s)",
                              default=False)
+    parser_init.add_argument("--serial", action='store_true',
+                             help=("run modules one at a time"
+                                   " (default: %(default)s)"),
+                             default=False)
     # This is used so that we can know which action is selected +
     # the functor to use to run this subcommand
     parser_init.set_defaults(action=('init', main_init))
@@ -764,6 +771,10 @@ def main(sysv_args=None):
                                   "to use (default: %(default)s)"),
                             default='config',
                             choices=('init', 'config', 'final'))
+    parser_mod.add_argument("--serial", action='store_true',
+                            help=("run modules one at a time"
+                                  " (default: %(default)s)"),
+                            default=False)
     parser_mod.set_defaults(action=('modules', main_modules))
 
     # This subcommand allows you to run a single module
@@ -887,9 +898,12 @@ def main(sysv_args=None):
         rname, rdesc, reporting_enabled=report_on)
 
     with args.reporter:
-        retval = util.log_time(
-            logfunc=LOG.debug, msg="cloud-init mode '%s'" % name,
-            get_uptime=True, func=functor, args=(name, args))
+        try:
+            retval = util.log_time(
+                logfunc=LOG.debug, msg="cloud-init mode '%s'" % name,
+                get_uptime=True, func=functor, args=(name, args))
+        finally:
+            url_helper.close_connection_pool()
         reporting.flush_events()
         return retval
 
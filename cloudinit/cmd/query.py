@@ -15,7 +15,9 @@ output; if this fails, they are treated as binary.
 
 import argparse
 from errno import EACCES
+import json
 import os
+import re
 import sys
 
 from cloudinit.handlers.jinja_template import (
@@ -23,7 +25,8 @@ from cloudinit.handlers.jinja_template import (
 from cloudinit.cmd.devel import addLogHandlerCLI, read_cfg_paths
 from cloudinit import log
 from cloudinit.sources import (
-    INSTANCE_JSON_FILE, INSTANCE_JSON_SENSITIVE_FILE, REDACT_SENSITIVE_VALUE)
+    INSTANCE_JSON_FILE, INSTANCE_JSON_SENSITIVE_FILE, REDACT_SENSITIVE_VALUE,
+    instance_data_index_path)
 from cloudinit import util
 
 NAME = 'query'
@@ -93,6 +96,116 @@ def load_userdata(ud_file_path):
         return util.decomp_gzip(bdata, quiet=False, decode=True)
 
 
+def _references_key(key, args):
+    """Return whether the output asked for by args uses top-level key."""
+    if args.format:
+        return key in args.format
+    if args.varname:
+        return args.varname.split('.')[0] == key
+    return not args.list_keys
+
+
+def _load_instance_data_index(instance_data_fn):
+    """Return the index of instance_data_fn, or None if missing or stale."""
+    try:
+        index = util.load_json(
+            util.load_file(instance_data_index_path(instance_data_fn)))
+        stat = os.stat(instance_data_fn)
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(index, dict) or not isinstance(index.get('keys'), dict):
+        return None
+    if (index.get('size'), index.get('mtime_ns')) != (
+            stat.st_size, stat.st_mtime_ns):
+        LOG.debug('Ignoring stale index of %s', instance_data_fn)
+        return None
+    return index
+
+
+def _convert_index_keys(keys, values=None):
+    """Return index keys as convert_jinja_instance_data names their values.
+
+    @param values: Optional dict of values set at this level, which are
+        named as their key and override indexed values.
+    @returns: Dict of index nodes, or None when the aliases of a versioned
+        key are not indexed.
+    """
+    items = dict(keys)
+    if values:
+        items.update(values)
+    result = {}
+    for key, node in sorted(items.items()):
+        if '-' in key:
+            key = key.replace('-', '_')
+        result[key] = node
+        if key[:1] == 'v' and _is_indexed_object(node) and re.match(
+                r'v\d+', key):
+            # Top-level aliases of the values in versioned keys
+            if node[2] is None:
+                return None
+            aliases = _convert_index_keys(node[2])
+            if aliases is None:
+                return None
+            result.update(aliases)
+    return result
+
+
+def _is_indexed_object(node):
+    """Return whether an index node is a JSON object."""
+    return isinstance(node, list) and len(node) > 2
+
+
+def _read_indexed_value(instance_data_fn, node, values):
+    """Read and parse the value of an index node from instance_data_fn.
+
+    The root node, which has no end, is read with values set in it.
+    """
+    start, end = node[:2]
+    with open(instance_data_fn, 'rb') as stream:
+        stream.seek(start)
+        if end is None:
+            value = util.load_json(stream.read())
+            for key, key_value in values.items():
+                value[key] = key_value() if callable(key_value) else key_value
+        else:
+            value = json.loads(stream.read(end - start).decode('utf-8'))
+    if isinstance(value, dict):
+        value = convert_jinja_instance_data(value)
+    return value
+
+
+def _lookup_index(index, varname, list_keys, values):
+    """Return the index node of varname, and the parts of varname below it.
+
+    The keys of values are set at the top-level, as handle_args sets
+    userdata and vendordata, and may be callables returning the value.
+    When list_keys is set for a dict whose keys are indexed, a dict of its
+    keys without values is returned as the node, so nothing is read.
+
+    @raises KeyError: When varname is not defined.
+    """
+    node = [0, None, index['keys']]
+    keys = _convert_index_keys(index['keys'], values)
+    parts = varname.split('.') if varname else []
+    while parts and keys is not None:
+        node = keys[parts.pop(0)]
+        keys = None
+        if _is_indexed_object(node) and node[2] is not None:
+            keys = _convert_index_keys(node[2])
+    if keys is not None and list_keys:
+        return dict.fromkeys(keys), []
+    return node, parts
+
+
+def _query_indexed_instance_data(instance_data_fn, node, values):
+    """Return the value of an index node, reading only what it points to."""
+    if isinstance(node, list):
+        return _read_indexed_value(instance_data_fn, node, values)
+    elif callable(node):
+        return node()
+    return node
+
+
 def handle_args(name, args):
     """Handle calls to 'cloud-init query' as a subcommand."""
     paths = None
@@ -133,49 +246,70 @@ def handle_args(name, args):
     else:
         vendor_data_fn = os.path.join(paths.instance_link, 'vendor-data.txt')
 
-    try:
-        instance_json = util.load_file(instance_data_fn)
-    except (IOError, OSError) as e:
-        if e.errno == EACCES:
-            LOG.error("No read permission on '%s'. Try sudo", instance_data_fn)
+    # user-data and vendor-data are only loaded when the output uses them
+    data_values = {}
+    for key, data_fn in (('userdata', user_data_fn),
+                         ('vendordata', vendor_data_fn)):
+        if uid != 0:
+            data_values[key] = '<%s> file:%s' % (
+                REDACT_SENSITIVE_VALUE, data_fn)
+        elif _references_key(key, args):
+            data_values[key] = (
+                lambda data_fn=data_fn: load_userdata(data_fn))
         else:
-            LOG.error('Missing instance-data file: %s', instance_data_fn)
-        return 1
+            data_values[key] = None
 
-    instance_data = util.load_json(instance_json)
-    if uid != 0:
-        instance_data['userdata'] = (
-            '<%s> file:%s' % (REDACT_SENSITIVE_VALUE, user_data_fn))
-        instance_data['vendordata'] = (
-            '<%s> file:%s' % (REDACT_SENSITIVE_VALUE, vendor_data_fn))
-    else:
-        instance_data['userdata'] = load_userdata(user_data_fn)
-        instance_data['vendordata'] = load_userdata(vendor_data_fn)
-    if args.format:
-        payload = '## template: jinja\n{fmt}'.format(fmt=args.format)
-        rendered_payload = render_jinja_payload(
-            payload=payload, payload_fn='query commandline',
-            instance_data=instance_data,
-            debug=True if args.debug else False)
-        if rendered_payload:
-            print(rendered_payload)
-            return 0
-        return 1
-
-    response = convert_jinja_instance_data(instance_data)
-    if args.varname:
+    index = None
+    if (args.varname or args.list_keys) and not args.format:
+        index = _load_instance_data_index(instance_data_fn)
+    parts = args.varname.split('.') if args.varname else []
+    if index and os.access(instance_data_fn, os.R_OK):
         try:
-            for var in args.varname.split('.'):
-                response = response[var]
+            (node, parts) = _lookup_index(
+                index, args.varname, args.list_keys, data_values)
         except KeyError:
             LOG.error('Undefined instance-data key %s', args.varname)
             return 1
-        if args.list_keys:
-            if not isinstance(response, dict):
-                LOG.error("--list-keys provided but '%s' is not a dict", var)
-                return 1
-            response = '\n'.join(sorted(response.keys()))
-    elif args.list_keys:
+        response = _query_indexed_instance_data(
+            instance_data_fn, node, data_values)
+    else:
+        try:
+            instance_json = util.load_file(instance_data_fn)
+        except (IOError, OSError) as e:
+            if e.errno == EACCES:
+                LOG.error("No read permission on '%s'. Try sudo",
+                          instance_data_fn)
+            else:
+                LOG.error('Missing instance-data file: %s',
+                          instance_data_fn)
+            return 1
+
+        instance_data = util.load_json(instance_json)
+        for key, value in data_values.items():
+            instance_data[key] = value() if callable(value) else value
+        if args.format:
+            payload = '## template: jinja\n{fmt}'.format(fmt=args.format)
+            rendered_payload = render_jinja_payload(
+                payload=payload, payload_fn='query commandline',
+                instance_data=instance_data,
+                debug=True if args.debug else False)
+            if rendered_payload:
+                print(rendered_payload)
+                return 0
+            return 1
+
+        response = convert_jinja_instance_data(instance_data)
+    try:
+        for var in parts:
+            response = response[var]
+    except KeyError:
+        LOG.error('Undefined instance-data key %s', args.varname)
+        return 1
+    if args.list_keys:
+        if not isinstance(response, dict):
+            LOG.error("--list-keys provided but '%s' is not a dict",
+                      args.varname.split('.')[-1])
+            return 1
         response = '\n'.join(sorted(response.keys()))
     if not isinstance(response, str):
         response = util.json_dumps(response)
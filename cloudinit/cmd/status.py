@@ -5,16 +5,48 @@
 """Define 'status' utility and handler as part of cloud-init commandline."""
 
 import argparse
+import ctypes
+import errno
+import json
 import os
+import select
+import struct
 import sys
-from time import gmtime, strftime, sleep
+from time import gmtime, monotonic, strftime, sleep
 
+from cloudinit import helpers
+from cloudinit import log as logging
 from cloudinit.distros import uses_systemd
-from cloudinit.stages import Init
-from cloudinit.util import get_cmdline, load_file, load_json
+from cloudinit.settings import CLOUD_CONFIG, RUN_CLOUD_CONFIG
+from cloudinit.util import (
+    get_cfg_by_path, get_cmdline, load_file, load_json, read_conf,
+    read_conf_from_cmdline, read_conf_with_confd)
+
+LOG = logging.getLogger(__name__)
 
 CLOUDINIT_DISABLED_FILE = '/etc/cloud/cloud-init.disabled'
 
+# Files in run_dir which are written as cloud-init runs its stages
+STATUS_FILES = ('status.json', 'result.json')
+
+# Seconds between polls of run_dir when it cannot be watched
+POLL_INTERVAL = 0.25
+# Seconds after which a watched run_dir is read even without events
+WATCH_RECHECK = 10
+
+# inotify(7) events and flags
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
 # customer visible status messages
 STATUS_ENABLED_NOT_RUN = 'not run'
 STATUS_RUNNING = 'running'
@@ -43,23 +75,31 @@ def get_parser(parser=None):
     parser.add_argument(
         '-w', '--wait', action='store_true', default=False,
         help='Block waiting on cloud-init to complete')
+    parser.add_argument(
+        '--format', choices=['text', 'json'], default='text',
+        help=('Output format. json prints a JSON object per line, for each'
+              ' change of status when waiting. Default: text'))
     return parser
 
 
 def handle_status_args(name, args):
     """Handle calls to 'cloud-init status' as a subcommand."""
-    # Read configured paths
-    init = Init(ds_deps=[])
-    init.read_cfg()
+    paths = _read_status_paths()
+    if args.format == 'json':
+        # Print the status initially and at each change while waiting
+        if args.wait:
+            status_details = _wait_for_status(paths, _print_json_status)
+        else:
+            status_details = _get_status_details(paths)
+            _print_json_status(status_details)
+        return 1 if status_details[0] == STATUS_ERROR else 0
 
-    status, status_detail, time = _get_status_details(init.paths)
     if args.wait:
-        while status in (STATUS_ENABLED_NOT_RUN, STATUS_RUNNING):
-            sys.stdout.write('.')
-            sys.stdout.flush()
-            status, status_detail, time = _get_status_details(init.paths)
-            sleep(0.25)
+        status_details = _wait_for_status(paths, tick=_print_wait_progress)
         sys.stdout.write('\n')
+    else:
+        status_details = _get_status_details(paths)
+    status, status_detail, time, _stage = status_details
     if args.long:
         print('status: {0}'.format(status))
         if time:
@@ -70,6 +110,146 @@ def handle_status_args(name, args):
     return 1 if status == STATUS_ERROR else 0
 
 
+def _print_wait_progress():
+    """Print a dot for each read of the status while waiting."""
+    sys.stdout.write('.')
+    sys.stdout.flush()
+
+
+def _print_json_status(status_details):
+    """Print status_details as a line of JSON."""
+    status, status_detail, time, stage = status_details
+    print(json.dumps(
+        {'status': status, 'detail': status_detail, 'time': time,
+         'stage': stage}, sort_keys=True))
+    sys.stdout.flush()
+
+
+def _read_status_paths():
+    """Return a Paths object for reading the status of cloud-init.
+
+    Only run_dir is needed, so rather than merging the full config as
+    Init.read_cfg does, system_info's paths are taken from the first of the
+    kernel command line, the runtime config and the system config to
+    configure run_dir. Instance cloud-config is not read.
+    """
+    for cfg in (read_conf_from_cmdline(), read_conf(RUN_CLOUD_CONFIG),
+                read_conf_with_confd(CLOUD_CONFIG)):
+        path_cfgs = get_cfg_by_path(cfg or {}, ('system_info', 'paths'))
+        if isinstance(path_cfgs, dict) and path_cfgs.get('run_dir'):
+            return helpers.Paths(path_cfgs)
+    return helpers.Paths({})
+
+
+class RunDirWatch(object):
+    """Watch run_dir with inotify(7) for changes to the status files."""
+
+    _libc = None
+
+    def __init__(self, run_dir):
+        if RunDirWatch._libc is None:
+            RunDirWatch._libc = ctypes.CDLL(None, use_errno=True)
+        try:
+            inotify_init1 = self._libc.inotify_init1
+            inotify_add_watch = self._libc.inotify_add_watch
+        except AttributeError:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.fd = inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+        if inotify_add_watch(self.fd, os.fsencode(run_dir), mask) < 0:
+            err = ctypes.get_errno()
+            self.close()
+            raise OSError(err, 'Cannot watch %s' % run_dir)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def wait(self, timeout):
+        """Block until a status file changes or timeout seconds pass.
+
+        @returns: True when a status file changed or run_dir went away,
+            closing the watch in the latter case. False on timeout.
+        """
+        deadline = monotonic() + timeout
+        while self.fd is not None:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return False
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if not ready:
+                return False
+            changed = False
+            buf = os.read(self.fd, 64 * 1024)
+            offset = 0
+            while offset < len(buf):
+                _wd, mask, _cookie, length = INOTIFY_EVENT.unpack_from(
+                    buf, offset)
+                offset += INOTIFY_EVENT.size
+                name = buf[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    self.close()
+                    return True
+                if os.fsdecode(name) in STATUS_FILES:
+                    changed = True
+            if changed:
+                return True
+        return True
+
+
+def _wait_for_status(paths, report=None, tick=None):
+    """Block until cloud-init is no longer waiting to run or running.
+
+    run_dir is watched with inotify, so the status is only read again when
+    a status file changes. When run_dir cannot be watched, as before
+    cloud-init creates it or without inotify, it is polled instead.
+
+    @param paths: An initialized cloudinit.helpers.paths object.
+    @param report: Optional callable called with the status details read
+        initially and whenever they change.
+    @param tick: Optional callable called without arguments each time the
+        status is read, whether on a change, a WATCH_RECHECK timeout or a
+        poll.
+    @returns: The status details once cloud-init is done, errored or
+        disabled.
+    """
+    watch = None
+    status_details = None
+    try:
+        while True:
+            if watch is None:
+                try:
+                    watch = RunDirWatch(paths.run_dir)
+                except OSError as e:
+                    LOG.debug('Polling for status: %s', e)
+            # Read after the watch is added so no change is missed
+            latest = _get_status_details(paths)
+            if tick:
+                tick()
+            if latest != status_details:
+                status_details = latest
+                if report:
+                    report(status_details)
+            if status_details[0] not in (STATUS_ENABLED_NOT_RUN,
+                                         STATUS_RUNNING):
+                return status_details
+            if watch is None:
+                sleep(POLL_INTERVAL)
+                continue
+            watch.wait(WATCH_RECHECK)
+            if watch.fd is None:
+                # run_dir went away, so watch it again once it exists
+                watch = None
+    finally:
+        if watch is not None:
+            watch.close()
+
+
 def _is_cloudinit_disabled(disable_file, paths):
     """Report whether cloud-init is disabled.
 
@@ -99,7 +279,8 @@ def _is_cloudinit_disabled(disable_file, paths):
 
 
 def _get_status_details(paths):
-    """Return a 3-tuple of status, status_details and time of last event.
+    """Return a 4-tuple of status, status_details, time of last event and the
+    running stage.
 
     @param paths: An initialized cloudinit.helpers.paths object.
 
@@ -123,9 +304,11 @@ def _get_status_details(paths):
         status_v1 = load_json(load_file(status_file)).get('v1', {})
     errors = []
     latest_event = 0
+    stage = None
     for key, value in sorted(status_v1.items()):
         if key == 'stage':
             if value:
+                stage = value
                 status = STATUS_RUNNING
                 status_detail = 'Running in stage: {0}'.format(value)
         elif key == 'datasource':
@@ -148,7 +331,7 @@ def _get_status_details(paths):
         time = strftime('%a, %d %b %Y %H:%M:%S %z', gmtime(latest_event))
     else:
         time = ''
-    return status, status_detail, time
+    return status, status_detail, time, stage
 
 
 def main():
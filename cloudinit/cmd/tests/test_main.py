@@ -13,7 +13,8 @@ from cloudinit.tests.helpers import (
     FilesystemMockingTestCase, wrap_and_call)
 
 mypaths = namedtuple('MyPaths', 'run_dir')
-myargs = namedtuple('MyArgs', 'debug files force local reporter subcommand')
+myargs = namedtuple(
+    'MyArgs', 'debug files force local reporter serial subcommand')
 
 
 class TestMain(FilesystemMockingTestCase):
@@ -54,7 +55,7 @@ class TestMain(FilesystemMockingTestCase):
         write_file(stop_file, '')
         cmdargs = myargs(
             debug=False, files=None, force=False, local=False, reporter=None,
-            subcommand='init')
+            serial=False, subcommand='init')
         (_item1, item2) = wrap_and_call(
             'cloudinit.cmd.main',
             {'util.close_stdin': True,
@@ -83,7 +84,7 @@ class TestMain(FilesystemMockingTestCase):
         """Modules like write_files are run in 'net' mode."""
         cmdargs = myargs(
             debug=False, files=None, force=False, local=False, reporter=None,
-            subcommand='init')
+            serial=False, subcommand='init')
         (_item1, item2) = wrap_and_call(
             'cloudinit.cmd.main',
             {'util.close_stdin': True,
@@ -116,7 +117,7 @@ class TestMain(FilesystemMockingTestCase):
         write_file(self.cloud_cfg_file, cloud_cfg)
         cmdargs = myargs(
             debug=False, files=None, force=False, local=False, reporter=None,
-            subcommand='init')
+            serial=False, subcommand='init')
 
         def set_hostname(name, cfg, cloud, log, args):
             self.assertEqual('set-hostname', name)
@@ -2,6 +2,8 @@
 
 import errno
 import gzip
+import logging
+import os
 from io import BytesIO
 import json
 from textwrap import dedent
@@ -11,12 +13,24 @@ import pytest
 from collections import namedtuple
 from cloudinit.cmd import query
 from cloudinit.helpers import Paths
+from cloudinit.atomic_helper import write_json
 from cloudinit.sources import (
-    REDACT_SENSITIVE_VALUE, INSTANCE_JSON_FILE, INSTANCE_JSON_SENSITIVE_FILE)
+    REDACT_SENSITIVE_VALUE, INSTANCE_JSON_FILE, INSTANCE_JSON_SENSITIVE_FILE,
+    instance_data_index_path, write_instance_data_index)
 from cloudinit.tests.helpers import mock
 
 from cloudinit.util import b64e, write_file
 
+INDEXED_INSTANCE_DATA = {
+    'v1': {'region': 'us-east-1', 'cloud-name': 'aws',
+           'nested': {'deep': {'deeper': {'deepest': [1, 2]}}}},
+    'v2': {'region': 'overrides-v1'},
+    'ds': {'meta-data': {'instance-id': 'i-1', 'v3': {'alias': 'nested'},
+                         'placement': {'availability-zone': 'az1'}}},
+    'top': 'gun',
+    'empty': {},
+}
+
 
 def _gzip_data(data):
     with BytesIO() as iobuf:
@@ -338,4 +352,127 @@ class TestQuery:
             assert 1 == query.handle_args('anyname', args)
         assert expected_error in caplog.text
 
+    def _write_indexed_instance_data(self, tmpdir):
+        instance_data = tmpdir.join(INSTANCE_JSON_FILE)
+        write_json(instance_data.strpath, INDEXED_INSTANCE_DATA)
+        assert write_instance_data_index(instance_data.strpath)
+        return instance_data
+
+    @pytest.mark.parametrize(
+        'varname,list_keys', (
+            (None, True), ('v1', True), ('v1', False), ('region', False),
+            ('v1.region', False), ('cloud_name', False), ('top', False),
+            ('ds.meta_data.instance_id', False), ('ds.meta_data', True),
+            ('ds.meta_data.alias', False), ('empty', True),
+            ('v1.nested.deep.deeper', True), ('nested.deep.deeper', False),
+            ('v1.nested.deep.deeper.deepest', False), ('userdata', False),
+            ('top', True), ('v1.missing', False), ('v1.nested.missing', True),
+        )
+    )
+    def test_handle_args_indexed_matches_full_instance_data(
+        self, varname, list_keys, capsys, caplog, tmpdir
+    ):
+        """Queries using the index print what loading all instance-data does.
+        """
+        instance_data = self._write_indexed_instance_data(tmpdir)
+        args = self.args(
+            debug=False, dump_all=False, format=None,
+            instance_data=instance_data.strpath, list_keys=list_keys,
+            user_data='ud', vendor_data='vd', varname=varname)
+        outputs = []
+        for indexed in (True, False):
+            if not indexed:
+                tmpdir.join('instance-data-index.json').remove()
+            with mock.patch('os.getuid', return_value=100):
+                with mock.patch(
+                    'cloudinit.cmd.query._lookup_index',
+                    wraps=query._lookup_index
+                ) as m_indexed:
+                    retcode = query.handle_args('anyname', args)
+            assert indexed == m_indexed.called
+            out, _err = capsys.readouterr()
+            errors = [record.getMessage() for record in caplog.records
+                      if record.levelno >= logging.WARNING]
+            outputs.append((retcode, out, errors))
+            caplog.clear()
+        assert outputs[0] == outputs[1]
+
+    @pytest.mark.parametrize('indexed', (True, False))
+    def test_handle_args_key_errors_loading_values_are_raised(
+        self, indexed, caplog, tmpdir
+    ):
+        """Only undefined varnames are reported as undefined keys."""
+        instance_data = self._write_indexed_instance_data(tmpdir)
+        if not indexed:
+            tmpdir.join('instance-data-index.json').remove()
+        args = self.args(
+            debug=False, dump_all=False, format=None,
+            instance_data=instance_data.strpath, list_keys=False,
+            user_data='ud', vendor_data='vd', varname='userdata')
+        with mock.patch('os.getuid', return_value=0):
+            with mock.patch('cloudinit.cmd.query.load_userdata',
+                            side_effect=KeyError('boom')):
+                with pytest.raises(KeyError):
+                    query.handle_args('anyname', args)
+        assert 'Undefined instance-data key' not in caplog.text
+
+    def test_handle_args_indexed_reads_only_the_value(self, capsys, tmpdir):
+        """A varname found in the index does not load all instance-data."""
+        instance_data = self._write_indexed_instance_data(tmpdir)
+        args = self.args(
+            debug=False, dump_all=False, format=None,
+            instance_data=instance_data.strpath, list_keys=False,
+            user_data='ud', vendor_data='vd', varname='v1.region')
+        with mock.patch('os.getuid', return_value=100):
+            with mock.patch(
+                'cloudinit.cmd.query.convert_jinja_instance_data'
+            ) as m_convert:
+                assert 0 == query.handle_args('anyname', args)
+        assert 0 == m_convert.call_count
+        out, _err = capsys.readouterr()
+        assert 'us-east-1\n' == out
+
+    def test_handle_args_ignores_stale_index(self, capsys, tmpdir):
+        """An index written before instance-data changed is not used."""
+        instance_data = self._write_indexed_instance_data(tmpdir)
+        instance_data.write('{"v1": {"region": "changed"}}')
+        assert os.path.exists(
+            instance_data_index_path(instance_data.strpath))
+        args = self.args(
+            debug=False, dump_all=False, format=None,
+            instance_data=instance_data.strpath, list_keys=False,
+            user_data='ud', vendor_data='vd', varname='v1.region')
+        with mock.patch('os.getuid', return_value=100):
+            assert 0 == query.handle_args('anyname', args)
+        out, _err = capsys.readouterr()
+        assert 'changed\n' == out
+
+    @pytest.mark.parametrize(
+        'varname,fmt,loaded', (
+            ('v1.region', None, []),
+            ('userdata', None, ['ud']),
+            (None, '{{ v1.region }}', []),
+            (None, '{{ vendordata }} {{ v1.region }}', ['vd']),
+        )
+    )
+    def test_handle_args_root_loads_user_data_only_when_referenced(
+        self, varname, fmt, loaded, capsys, tmpdir
+    ):
+        """As root, user-data and vendor-data are loaded only when used."""
+        instance_data = self._write_indexed_instance_data(tmpdir)
+        args = self.args(
+            debug=False, dump_all=False, format=fmt,
+            instance_data=instance_data.strpath, list_keys=False,
+            user_data='ud', vendor_data='vd', varname=varname)
+        with mock.patch('os.getuid', return_value=0):
+            with mock.patch(
+                'cloudinit.cmd.query.load_userdata',
+                side_effect=lambda path: path + '-content'
+            ) as m_load:
+                assert 0 == query.handle_args('anyname', args)
+        assert loaded == [call[0][0] for call in m_load.call_args_list]
+        out, _err = capsys.readouterr()
+        if loaded:
+            assert loaded[0] + '-content' in out
+
 # vi: ts=4 expandtab
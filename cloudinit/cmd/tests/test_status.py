@@ -1,6 +1,7 @@
 # This file is part of cloud-init. See LICENSE file for license information.
 
 from collections import namedtuple
+import json
 import os
 from io import StringIO
 from textwrap import dedent
@@ -8,10 +9,16 @@ from textwrap import dedent
 from cloudinit.atomic_helper import write_json
 from cloudinit.cmd import status
 from cloudinit.util import ensure_file
-from cloudinit.tests.helpers import CiTestCase, wrap_and_call, mock
+from cloudinit.tests.helpers import CiTestCase, wrap_and_call, mock, skipIf
 
 mypaths = namedtuple('MyPaths', 'run_dir')
-myargs = namedtuple('MyArgs', 'long wait')
+myargs = namedtuple('MyArgs', 'long wait format')
+
+try:
+    status.RunDirWatch(os.path.dirname(__file__)).close()
+    HAS_INOTIFY = True
+except OSError:
+    HAS_INOTIFY = False
 
 
 class TestStatus(CiTestCase):
@@ -23,17 +30,6 @@ class TestStatus(CiTestCase):
         self.disable_file = self.tmp_path('cloudinit-disable', self.new_root)
         self.paths = mypaths(run_dir=self.new_root)
 
-        class FakeInit(object):
-            paths = self.paths
-
-            def __init__(self, ds_deps):
-                pass
-
-            def read_cfg(self):
-                pass
-
-        self.init_class = FakeInit
-
     def test__is_cloudinit_disabled_false_on_sysvinit(self):
         '''When not in an environment using systemd, return False.'''
         ensure_file(self.disable_file)  # Create the ignored disable file
@@ -112,12 +108,12 @@ class TestStatus(CiTestCase):
         '''When status.json does not exist yet, return 'not run'.'''
         self.assertFalse(
             os.path.exists(self.status_file), 'Unexpected status.json found')
-        cmdargs = myargs(long=False, wait=False)
+        cmdargs = myargs(long=False, wait=False, format='text')
         with mock.patch('sys.stdout', new_callable=StringIO) as m_stdout:
             retcode = wrap_and_call(
                 'cloudinit.cmd.status',
                 {'_is_cloudinit_disabled': (False, ''),
-                 'Init': {'side_effect': self.init_class}},
+                 '_read_status_paths': self.paths},
                 status.handle_status_args, 'ignored', cmdargs)
         self.assertEqual(0, retcode)
         self.assertEqual('status: not run\n', m_stdout.getvalue())
@@ -132,13 +128,13 @@ class TestStatus(CiTestCase):
             status_file = os.path.join(self.paths.run_dir, 'status.json')
             return bool(not filepath == status_file)
 
-        cmdargs = myargs(long=True, wait=False)
+        cmdargs = myargs(long=True, wait=False, format='text')
         with mock.patch('sys.stdout', new_callable=StringIO) as m_stdout:
             retcode = wrap_and_call(
                 'cloudinit.cmd.status',
                 {'os.path.exists': {'side_effect': fakeexists},
                  '_is_cloudinit_disabled': (True, 'disabled for some reason'),
-                 'Init': {'side_effect': self.init_class}},
+                 '_read_status_paths': self.paths},
                 status.handle_status_args, 'ignored', cmdargs)
         self.assertEqual(0, retcode)
         self.assertEqual(
@@ -157,12 +153,12 @@ class TestStatus(CiTestCase):
         write_json(self.status_file, {})
         self.assertFalse(
             os.path.exists(result_file), 'Unexpected result.json found')
-        cmdargs = myargs(long=False, wait=False)
+        cmdargs = myargs(long=False, wait=False, format='text')
         with mock.patch('sys.stdout', new_callable=StringIO) as m_stdout:
             retcode = wrap_and_call(
                 'cloudinit.cmd.status',
                 {'_is_cloudinit_disabled': (False, ''),
-                 'Init': {'side_effect': self.init_class}},
+                 '_read_status_paths': self.paths},
                 status.handle_status_args, 'ignored', cmdargs)
         self.assertEqual(0, retcode)
         self.assertEqual('status: running\n', m_stdout.getvalue())
@@ -172,12 +168,12 @@ class TestStatus(CiTestCase):
         ensure_file(self.tmp_path('result.json', self.new_root))
         write_json(self.status_file,
                    {'v1': {'init': {'start': 1, 'finished': None}}})
-        cmdargs = myargs(long=False, wait=False)
+        cmdargs = myargs(long=False, wait=False, format='text')
         with mock.patch('sys.stdout', new_callable=StringIO) as m_stdout:
             retcode = wrap_and_call(
                 'cloudinit.cmd.status',
                 {'_is_cloudinit_disabled': (False, ''),
-                 'Init': {'side_effect': self.init_class}},
+                 '_read_status_paths': self.paths},
                 status.handle_status_args, 'ignored', cmdargs)
         self.assertEqual(0, retcode)
         self.assertEqual('status: running\n', m_stdout.getvalue())
@@ -195,12 +191,12 @@ class TestStatus(CiTestCase):
                     'init': {'errors': [], 'start': 124.567,
                              'finished': 125.678},
                     'init-local': {'start': 123.45, 'finished': 123.46}}})
-        cmdargs = myargs(long=False, wait=False)
+        cmdargs = myargs(long=False, wait=False, format='text')
         with mock.patch('sys.stdout', new_callable=StringIO) as m_stdout:
             retcode = wrap_and_call(
                 'cloudinit.cmd.status',
                 {'_is_cloudinit_disabled': (False, ''),
-                 'Init': {'side_effect': self.init_class}},
+                 '_read_status_paths': self.paths},
                 status.handle_status_args, 'ignored', cmdargs)
         self.assertEqual(0, retcode)
         self.assertEqual('status: done\n', m_stdout.getvalue())
@@ -216,12 +212,12 @@ class TestStatus(CiTestCase):
                         '[dsmode=net]'),
                     'init': {'start': 124.567, 'finished': 125.678},
                     'init-local': {'start': 123.45, 'finished': 123.46}}})
-        cmdargs = myargs(long=True, wait=False)
+        cmdargs = myargs(long=True, wait=False, format='text')
         with mock.patch('sys.stdout', new_callable=StringIO) as m_stdout:
             retcode = wrap_and_call(
                 'cloudinit.cmd.status',
                 {'_is_cloudinit_disabled': (False, ''),
-                 'Init': {'side_effect': self.init_class}},
+                 '_read_status_paths': self.paths},
                 status.handle_status_args, 'ignored', cmdargs)
         self.assertEqual(0, retcode)
         expected = dedent('''\
@@ -241,12 +237,12 @@ class TestStatus(CiTestCase):
                     'init': {'errors': ['error1'], 'start': 124.567,
                              'finished': 125.678},
                     'init-local': {'start': 123.45, 'finished': 123.46}}})
-        cmdargs = myargs(long=False, wait=False)
+        cmdargs = myargs(long=False, wait=False, format='text')
         with mock.patch('sys.stdout', new_callable=StringIO) as m_stdout:
             retcode = wrap_and_call(
                 'cloudinit.cmd.status',
                 {'_is_cloudinit_disabled': (False, ''),
-                 'Init': {'side_effect': self.init_class}},
+                 '_read_status_paths': self.paths},
                 status.handle_status_args, 'ignored', cmdargs)
         self.assertEqual(1, retcode)
         self.assertEqual('status: error\n', m_stdout.getvalue())
@@ -263,12 +259,12 @@ class TestStatus(CiTestCase):
                              'finished': 125.678},
                     'init-local': {'errors': ['error2', 'error3'],
                                    'start': 123.45, 'finished': 123.46}}})
-        cmdargs = myargs(long=True, wait=False)
+        cmdargs = myargs(long=True, wait=False, format='text')
         with mock.patch('sys.stdout', new_callable=StringIO) as m_stdout:
             retcode = wrap_and_call(
                 'cloudinit.cmd.status',
                 {'_is_cloudinit_disabled': (False, ''),
-                 'Init': {'side_effect': self.init_class}},
+                 '_read_status_paths': self.paths},
                 status.handle_status_args, 'ignored', cmdargs)
         self.assertEqual(1, retcode)
         expected = dedent('''\
@@ -288,12 +284,12 @@ class TestStatus(CiTestCase):
             {'v1': {'stage': 'init',
                     'init': {'start': 124.456, 'finished': None},
                     'init-local': {'start': 123.45, 'finished': 123.46}}})
-        cmdargs = myargs(long=True, wait=False)
+        cmdargs = myargs(long=True, wait=False, format='text')
         with mock.patch('sys.stdout', new_callable=StringIO) as m_stdout:
             retcode = wrap_and_call(
                 'cloudinit.cmd.status',
                 {'_is_cloudinit_disabled': (False, ''),
-                 'Init': {'side_effect': self.init_class}},
+                 '_read_status_paths': self.paths},
                 status.handle_status_args, 'ignored', cmdargs)
         self.assertEqual(0, retcode)
         expected = dedent('''\
@@ -305,7 +301,7 @@ class TestStatus(CiTestCase):
         self.assertEqual(expected, m_stdout.getvalue())
 
     def test_status_wait_blocks_until_done(self):
-        '''Specifying wait will poll every 1/4 second until done state.'''
+        '''Without a run_dir watch, wait polls every 1/4 second until done.'''
         running_json = {
             'v1': {'stage': 'init',
                    'init': {'start': 124.456, 'finished': None},
@@ -327,20 +323,22 @@ class TestStatus(CiTestCase):
                 result_file = self.tmp_path('result.json', self.new_root)
                 ensure_file(result_file)
 
-        cmdargs = myargs(long=False, wait=True)
+        cmdargs = myargs(long=False, wait=True, format='text')
         with mock.patch('sys.stdout', new_callable=StringIO) as m_stdout:
             retcode = wrap_and_call(
                 'cloudinit.cmd.status',
                 {'sleep': {'side_effect': fake_sleep},
+                 'RunDirWatch': {'side_effect': OSError('no inotify')},
                  '_is_cloudinit_disabled': (False, ''),
-                 'Init': {'side_effect': self.init_class}},
+                 '_read_status_paths': self.paths},
                 status.handle_status_args, 'ignored', cmdargs)
         self.assertEqual(0, retcode)
-        self.assertEqual(4, self.sleep_calls)
+        self.assertEqual(3, self.sleep_calls)
+        # A dot is printed for each read of the status
         self.assertEqual('....\nstatus: done\n', m_stdout.getvalue())
 
     def test_status_wait_blocks_until_error(self):
-        '''Specifying wait will poll every 1/4 second until error state.'''
+        '''Without a run_dir watch, wait polls every 1/4 second until error.'''
         running_json = {
             'v1': {'stage': 'init',
                    'init': {'start': 124.456, 'finished': None},
@@ -361,16 +359,17 @@ class TestStatus(CiTestCase):
             elif self.sleep_calls == 3:
                 write_json(self.status_file, error_json)
 
-        cmdargs = myargs(long=False, wait=True)
+        cmdargs = myargs(long=False, wait=True, format='text')
         with mock.patch('sys.stdout', new_callable=StringIO) as m_stdout:
             retcode = wrap_and_call(
                 'cloudinit.cmd.status',
                 {'sleep': {'side_effect': fake_sleep},
+                 'RunDirWatch': {'side_effect': OSError('no inotify')},
                  '_is_cloudinit_disabled': (False, ''),
-                 'Init': {'side_effect': self.init_class}},
+                 '_read_status_paths': self.paths},
                 status.handle_status_args, 'ignored', cmdargs)
         self.assertEqual(1, retcode)
-        self.assertEqual(4, self.sleep_calls)
+        self.assertEqual(3, self.sleep_calls)
         self.assertEqual('....\nstatus: error\n', m_stdout.getvalue())
 
     def test_status_main(self):
@@ -383,9 +382,178 @@ class TestStatus(CiTestCase):
                     'cloudinit.cmd.status',
                     {'sys.argv': {'new': ['status']},
                      '_is_cloudinit_disabled': (False, ''),
-                     'Init': {'side_effect': self.init_class}},
+                     '_read_status_paths': self.paths},
                     status.main)
         self.assertEqual(0, context_manager.exception.code)
         self.assertEqual('status: running\n', m_stdout.getvalue())
 
+    def test_status_json_format(self):
+        '''--format json prints the status details as a JSON object.'''
+        write_json(self.status_file,
+                   {'v1': {'stage': 'init',
+                           'init': {'start': 124.456, 'finished': None}}})
+        cmdargs = myargs(long=False, wait=False, format='json')
+        with mock.patch('sys.stdout', new_callable=StringIO) as m_stdout:
+            retcode = wrap_and_call(
+                'cloudinit.cmd.status',
+                {'_is_cloudinit_disabled': (False, ''),
+                 '_read_status_paths': self.paths},
+                status.handle_status_args, 'ignored', cmdargs)
+        self.assertEqual(0, retcode)
+        self.assertEqual(
+            {'status': 'running', 'detail': 'Running in stage: init',
+             'time': 'Thu, 01 Jan 1970 00:02:04 +0000', 'stage': 'init'},
+            json.loads(m_stdout.getvalue()))
+
+    def test_status_wait_json_streams_stage_transitions(self):
+        '''Waiting with --format json prints each change of status.'''
+        status_jsons = [
+            {'v1': {'stage': 'init-local',
+                    'init-local': {'start': 123.45, 'finished': None}}},
+            {'v1': {'stage': 'init-local',
+                    'init-local': {'start': 123.45, 'finished': None}}},
+            {'v1': {'stage': 'init',
+                    'init': {'start': 124.456, 'finished': None},
+                    'init-local': {'start': 123.45, 'finished': 123.46}}},
+            {'v1': {'stage': None,
+                    'init': {'start': 124.456, 'finished': 125.678},
+                    'init-local': {'start': 123.45, 'finished': 123.46}}},
+        ]
+        result_file = self.tmp_path('result.json', self.new_root)
+        watches = []
+
+        class FakeWatch(object):
+            def __init__(watch, run_dir):
+                self.assertEqual(self.new_root, run_dir)
+                watch.fd = 1
+                watches.append(watch)
+
+            def wait(watch, timeout):
+                self.assertEqual(status.WATCH_RECHECK, timeout)
+                write_json(self.status_file, status_jsons.pop(0))
+                if not status_jsons:
+                    ensure_file(result_file)
+                return True
+
+            def close(watch):
+                watch.fd = None
+
+        cmdargs = myargs(long=False, wait=True, format='json')
+        with mock.patch('sys.stdout', new_callable=StringIO) as m_stdout:
+            retcode = wrap_and_call(
+                'cloudinit.cmd.status',
+                {'RunDirWatch': {'side_effect': FakeWatch},
+                 'sleep': {'side_effect': AssertionError('polled')},
+                 '_is_cloudinit_disabled': (False, ''),
+                 '_read_status_paths': self.paths},
+                status.handle_status_args, 'ignored', cmdargs)
+        self.assertEqual(0, retcode)
+        self.assertEqual(1, len(watches))
+        self.assertIsNone(watches[0].fd)
+        lines = [json.loads(line) for line in m_stdout.getvalue().splitlines()]
+        self.assertEqual(
+            [('not run', None), ('running', 'init-local'),
+             ('running', 'init'), ('done', None)],
+            [(line['status'], line['stage']) for line in lines])
+
+    def test_status_wait_text_prints_dot_on_each_recheck(self):
+        '''Waiting in text format prints a dot even when nothing changed.'''
+        running_json = {
+            'v1': {'stage': 'init',
+                   'init': {'start': 124.456, 'finished': None},
+                   'init-local': {'start': 123.45, 'finished': 123.46}}}
+        done_json = {
+            'v1': {'stage': None,
+                   'init': {'start': 124.456, 'finished': 125.678},
+                   'init-local': {'start': 123.45, 'finished': 123.46}}}
+        write_json(self.status_file, running_json)
+        result_file = self.tmp_path('result.json', self.new_root)
+        self.wait_calls = 0
+
+        class FakeWatch(object):
+            def __init__(watch, run_dir):
+                watch.fd = 1
+
+            def wait(watch, timeout):
+                self.assertEqual(status.WATCH_RECHECK, timeout)
+                self.wait_calls += 1
+                if self.wait_calls < 3:
+                    return False  # WATCH_RECHECK timeout without events
+                write_json(self.status_file, done_json)
+                ensure_file(result_file)
+                return True
+
+            def close(watch):
+                watch.fd = None
+
+        cmdargs = myargs(long=False, wait=True, format='text')
+        with mock.patch('sys.stdout', new_callable=StringIO) as m_stdout:
+            retcode = wrap_and_call(
+                'cloudinit.cmd.status',
+                {'RunDirWatch': {'side_effect': FakeWatch},
+                 'sleep': {'side_effect': AssertionError('polled')},
+                 '_is_cloudinit_disabled': (False, ''),
+                 '_read_status_paths': self.paths},
+                status.handle_status_args, 'ignored', cmdargs)
+        self.assertEqual(0, retcode)
+        self.assertEqual(3, self.wait_calls)
+        self.assertEqual('....\nstatus: done\n', m_stdout.getvalue())
+
+    def test_read_status_paths_without_config_merge(self):
+        '''run_dir is read from the first system config to configure it.'''
+        run_dir = {'system_info': {'paths': {'run_dir': '/run/ci'}}}
+        with mock.patch('cloudinit.cmd.status.read_conf_with_confd',
+                        return_value=run_dir) as m_confd:
+            with mock.patch('cloudinit.cmd.status.read_conf',
+                            return_value={}):
+                with mock.patch(
+                        'cloudinit.cmd.status.read_conf_from_cmdline',
+                        return_value=None):
+                    paths = status._read_status_paths()
+        self.assertEqual('/run/ci', paths.run_dir)
+        m_confd.assert_called_once_with(status.CLOUD_CONFIG)
+        with mock.patch('cloudinit.cmd.status.read_conf_with_confd',
+                        return_value={}) as m_confd:
+            with mock.patch('cloudinit.cmd.status.read_conf',
+                            return_value={}):
+                with mock.patch(
+                        'cloudinit.cmd.status.read_conf_from_cmdline',
+                        return_value=None):
+                    paths = status._read_status_paths()
+        self.assertEqual('/run/cloud-init', paths.run_dir)
+
+
+@skipIf(not HAS_INOTIFY, 'inotify is not available')
+class TestRunDirWatch(CiTestCase):
+
+    def setUp(self):
+        super(TestRunDirWatch, self).setUp()
+        self.run_dir = self.tmp_path('run', self.tmp_dir())
+        os.mkdir(self.run_dir)
+        self.watch = status.RunDirWatch(self.run_dir)
+        self.addCleanup(self.watch.close)
+
+    def test_wait_returns_on_status_file_changes(self):
+        '''wait returns True once status.json or result.json change.'''
+        for name in status.STATUS_FILES:
+            write_json(os.path.join(self.run_dir, name), {})
+            self.assertTrue(self.watch.wait(5))
+            self.assertIsNotNone(self.watch.fd)
+
+    def test_wait_ignores_other_files(self):
+        '''Changes to other files in run_dir time out.'''
+        ensure_file(os.path.join(self.run_dir, 'enabled'))
+        self.assertFalse(self.watch.wait(0.05))
+
+    def test_wait_closes_watch_when_run_dir_removed(self):
+        '''The watch is closed when run_dir is removed.'''
+        os.rmdir(self.run_dir)
+        self.assertTrue(self.watch.wait(5))
+        self.assertIsNone(self.watch.fd)
+
+    def test_missing_run_dir_raises(self):
+        '''A run_dir which does not exist cannot be watched.'''
+        with self.assertRaises(OSError):
+            status.RunDirWatch(self.tmp_path('missing', self.run_dir))
+
 # vi: ts=4 expandtab syntax=python
@@ -42,6 +42,27 @@ def fixup_module(mod, def_freq=PER_INSTANCE):
         setattr(mod, 'distros', [])
     if not hasattr(mod, 'osfamilies'):
         setattr(mod, 'osfamilies', [])
+    # Modules which do not declare the resources they write may touch
+    # anything, and so are never run concurrently with another module
+    if not hasattr(mod, 'resources_written'):
+        setattr(mod, 'resources_written', None)
+    if not hasattr(mod, 'resources_read'):
+        setattr(mod, 'resources_read', [])
     return mod
 
+
+def modules_conflict(mod, other):
+    """Return whether two fixed up modules can not run concurrently.
+
+    Modules conflict when either does not declare ``resources_written``, or
+    when one writes a resource which the other reads or writes.
+    """
+    if mod.resources_written is None or other.resources_written is None:
+        return True
+    written = set(mod.resources_written)
+    other_written = set(other.resources_written)
+    return bool(
+        written & (other_written | set(other.resources_read)) or
+        other_written & set(mod.resources_read))
+
 # vi: ts=4 expandtab
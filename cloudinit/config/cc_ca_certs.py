@@ -63,6 +63,8 @@ DISTRO_OVERRIDES = {
 
 
 distros = ['alpine', 'debian', 'ubuntu', 'rhel']
+# debconf-set-selections shares the package manager's debconf database
+resources_written = ['ca-certs', 'packages']
 
 
 def _distro_ca_certs_configs(distro_name):
@@ -71,6 +71,13 @@ specified using ``filesystem``.
 .. note::
     ``replace_fs`` is ignored unless ``partition`` is ``auto`` or ``any``.
 
+Different disks are partitioned at the same time, and then their filesystems
+are created at the same time. Entries for the same disk, such as filesystems
+on its partitions, are handled one after another in the order given. The time
+taken by each entry is reported in a ``partition-<device>`` or
+``filesystem-<n>-<device>`` event, named by the device name without its
+path, such as ``partition-sdb``.
+
 **Internal name:** ``cc_disk_setup``
 
 **Module frequency:** per instance
@@ -97,12 +104,16 @@ specified using ``filesystem``.
           replace_fs: <filesystem type>
 """
 
+from cloudinit.reporting import events
 from cloudinit.settings import PER_INSTANCE
 from cloudinit import util
 from cloudinit import subp
+from collections import OrderedDict, namedtuple
+from concurrent import futures
 import logging
 import os
 import shlex
+import time
 
 frequency = PER_INSTANCE
 
@@ -117,14 +128,23 @@ WIPEFS_CMD = subp.which("wipefs")
 
 LANG_C_ENV = {'LANG': 'C'}
 
+# Disks partitioned or formatted at the same time
+DISK_SETUP_MAX_WORKERS = 16
+
 LOG = logging.getLogger(__name__)
 
+# A partitioning or filesystem operation on device, run as
+# func(*args, settle=..., topology=...)
+DeviceOperation = namedtuple(
+    'DeviceOperation', ['device', 'name', 'msg', 'error_msg', 'func', 'args'])
+
 
 def handle(_name, cfg, cloud, log, _args):
     """
     See doc/examples/cloud-config-disk-setup.txt for documentation on the
     format.
     """
+    partitions = []
     disk_setup = cfg.get("disk_setup")
     if isinstance(disk_setup, dict):
         update_disk_setup_devices(disk_setup, cloud.device_name_to_device)
@@ -133,15 +153,13 @@ def handle(_name, cfg, cloud, log, _args):
             if not isinstance(definition, dict):
                 log.warning("Invalid disk definition for %s" % disk)
                 continue
+            partitions.append(DeviceOperation(
+                device=disk, name="partition-%s" % event_device_name(disk),
+                msg="Creating partition on %s" % disk,
+                error_msg="Failed partitioning operation",
+                func=mkpart, args=(disk, definition)))
 
-            try:
-                log.debug("Creating new partition table/disk")
-                util.log_time(logfunc=LOG.debug,
-                              msg="Creating partition on %s" % disk,
-                              func=mkpart, args=(disk, definition))
-            except Exception as e:
-                util.logexc(LOG, "Failed partitioning operation\n%s" % e)
-
+    filesystems = []
     fs_setup = cfg.get("fs_setup")
     if isinstance(fs_setup, list):
         log.debug("setting up filesystems: %s", str(fs_setup))
@@ -150,15 +168,105 @@ def handle(_name, cfg, cloud, log, _args):
             if not isinstance(definition, dict):
                 log.warning("Invalid file system definition: %s" % definition)
                 continue
+            device = definition.get('device')
+            filesystems.append(DeviceOperation(
+                device=device,
+                name="filesystem-%d-%s" % (
+                    len(filesystems), event_device_name(device)),
+                msg="Creating fs for %s" % device,
+                error_msg="Failed during filesystem operation",
+                func=mkfs, args=(definition,)))
+
+    topology = cloud.block_topology
+    if partitions or filesystems:
+        # Let udev finish with the devices before looking at them, once for
+        # all of them
+        util.udevadm_settle()
+        topology.invalidate()
+    if partitions:
+        log.debug("Creating new partition tables/disks")
+        run_device_operations(partitions, cloud.reporter, topology)
+    if filesystems:
+        log.debug("Creating new filesystems.")
+        run_device_operations(filesystems, cloud.reporter, topology)
 
-            try:
-                log.debug("Creating new filesystem.")
-                device = definition.get('device')
-                util.log_time(logfunc=LOG.debug,
-                              msg="Creating fs for %s" % device,
-                              func=mkfs, args=(definition,))
-            except Exception as e:
-                util.logexc(LOG, "Failed during filesystem operation\n%s" % e)
+
+def event_device_name(device):
+    """Return the name of device for a reporting event name.
+
+    Event names are separated by '/', so device paths cannot be used.
+    """
+    return os.path.basename(device) if device else device
+
+
+def get_physical_device(device):
+    """Return the disk holding device, a partition or a disk, or device.
+
+    Symbolic links are resolved, and partitions are looked up in sysfs.
+    """
+    if not device:
+        return device
+    device = os.path.realpath(device)
+    sys_block = os.path.join("/sys/class/block", os.path.basename(device))
+    if os.path.exists(os.path.join(sys_block, "partition")):
+        return os.path.join("/dev", os.path.basename(
+            os.path.dirname(os.path.realpath(sys_block))))
+    return device
+
+
+def plan_device_operations(operations):
+    """Group operations by the disk they are on, keeping their order.
+
+    Operations on different disks are independent of each other. Those on
+    the same disk, such as filesystems on its partitions, are not.
+    """
+    groups = OrderedDict()
+    for operation in operations:
+        groups.setdefault(
+            get_physical_device(operation.device), []).append(operation)
+    return list(groups.values())
+
+
+def run_device_operation(operation, reporter, settle, topology=None):
+    """Run operation, reporting an event with the time it took."""
+    with events.ReportEventStack(
+            name=operation.name, description=operation.msg,
+            parent=reporter) as myrep:
+        start = time.time()
+        try:
+            util.log_time(logfunc=LOG.debug, msg=operation.msg,
+                          func=operation.func, args=operation.args,
+                          kwargs={'settle': settle, 'topology': topology})
+        except Exception as e:
+            util.logexc(LOG, "%s\n%s" % (operation.error_msg, e))
+            myrep.result = events.status.FAIL
+            myrep.message = "%s after %.3f seconds: %s" % (
+                operation.error_msg, time.time() - start, e)
+        else:
+            myrep.message = "%s took %.3f seconds" % (
+                operation.msg, time.time() - start)
+
+
+def run_device_operations(operations, reporter, topology=None):
+    """Run operations on different disks at the same time.
+
+    The operations on a disk run in order, each after the first one
+    settling udev for the previous one. udev is settled once all are done,
+    and the block topology read again when next looked up.
+    """
+    groups = plan_device_operations(operations)
+
+    def run_group(group):
+        for index, operation in enumerate(group):
+            run_device_operation(operation, reporter, settle=index > 0,
+                                 topology=topology)
+
+    max_workers = min(len(groups), DISK_SETUP_MAX_WORKERS)
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(run_group, groups))
+    util.udevadm_settle()
+    if topology is not None:
+        topology.invalidate()
 
 
 def update_disk_setup_devices(disk_setup, tformer):
@@ -226,13 +334,14 @@ def value_splitter(values, start=None):
         yield key, value
 
 
-def enumerate_disk(device, nodeps=False):
+def enumerate_disk(device, nodeps=False, topology=None):
     """
     Enumerate the elements of a child device.
 
     Parameters:
         device: the kernel device name
         nodeps <BOOL>: don't enumerate children devices
+        topology: BlockTopology to look device up in before running lsblk
 
     Return a dict describing the disk:
         type: the entry type, i.e disk or part
@@ -240,6 +349,20 @@ def enumerate_disk(device, nodeps=False):
         label: file system label, if it exists
         name: the device name, i.e. sda
     """
+    blockdev = topology.lookup(device) if topology is not None else None
+    if blockdev is not None:
+        devices = [blockdev]
+        if not nodeps:
+            devices.extend(topology.descendants(blockdev))
+        for d in devices:
+            # Empty values are printed as '' by lsblk --pairs
+            yield {
+                'name': os.path.basename(d.path),
+                'type': d.type or '',
+                'fstype': d.fstype or '',
+                'label': d.label or '',
+            }
+        return
 
     lsblk_cmd = [LSBLK_CMD, '--pairs', '--output', 'NAME,TYPE,FSTYPE,LABEL',
                  device]
@@ -271,24 +394,24 @@ def enumerate_disk(device, nodeps=False):
         yield d
 
 
-def device_type(device):
+def device_type(device, topology=None):
     """
     Return the device type of the device by calling lsblk.
     """
 
-    for d in enumerate_disk(device, nodeps=True):
+    for d in enumerate_disk(device, nodeps=True, topology=topology):
         if "type" in d:
             return d["type"].lower()
     return None
 
 
-def is_device_valid(name, partition=False):
+def is_device_valid(name, partition=False, topology=None):
     """
     Check if the device is a valid device.
     """
     d_type = ""
     try:
-        d_type = device_type(name)
+        d_type = device_type(name, topology=topology)
     except Exception:
         LOG.warning("Query against device %s failed", name)
         return False
@@ -308,6 +431,9 @@ def check_fs(device):
     /dev/sda: LABEL="Backup500G" UUID="..." TYPE="ext4"
 
     Return values are device, label, type, uuid
+
+    The device is always probed, rather than looked up in the udev data of
+    a BlockTopology, as it decides whether the device is overwritten.
     """
     out, label, fs_type, uuid = None, None, None, None
 
@@ -341,7 +467,7 @@ def is_filesystem(device):
 
 
 def find_device_node(device, fs_type=None, label=None, valid_targets=None,
-                     label_match=True, replace_fs=None):
+                     label_match=True, replace_fs=None, topology=None):
     """
     Find a device that is either matches the spec, or the first
 
@@ -359,7 +485,7 @@ def find_device_node(device, fs_type=None, label=None, valid_targets=None,
         valid_targets = ['disk', 'part']
 
     raw_device_used = False
-    for d in enumerate_disk(device):
+    for d in enumerate_disk(device, topology=topology):
 
         if d['fstype'] == replace_fs and label_match is False:
             # We found a device where we want to replace the FS
@@ -389,7 +515,7 @@ def find_device_node(device, fs_type=None, label=None, valid_targets=None,
     return (None, False)
 
 
-def is_disk_used(device):
+def is_disk_used(device, topology=None):
     """
     Check if the device is currently used. Returns true if the device
     has either a file system or a partition entry
@@ -398,7 +524,7 @@ def is_disk_used(device):
 
     # If the child count is higher 1, then there are child nodes
     # such as partition or device mapper nodes
-    if len(list(enumerate_disk(device))) > 1:
+    if len(list(enumerate_disk(device, topology=topology))) > 1:
         return True
 
     # If we see a file system, then its used
@@ -636,7 +762,7 @@ def get_partition_gpt_layout(size, layout):
     return partition_specs
 
 
-def purge_disk_ptable(device):
+def purge_disk_ptable(device, settle=True):
     # wipe the first and last megabyte of a disk (or file)
     # gpt stores partition table both at front and at end.
     null = '\0'
@@ -648,16 +774,16 @@ def purge_disk_ptable(device):
         fp.write(null * end_len)
         fp.flush()
 
-    read_parttbl(device)
+    read_parttbl(device, settle=settle)
 
 
-def purge_disk(device):
+def purge_disk(device, settle=True, topology=None):
     """
     Remove parition table entries
     """
 
     # wipe any file systems first
-    for d in enumerate_disk(device):
+    for d in enumerate_disk(device, topology=topology):
         if d['type'] not in ["disk", "crypt"]:
             wipefs_cmd = [WIPEFS_CMD, "--all", "/dev/%s" % d['name']]
             try:
@@ -668,7 +794,7 @@ def purge_disk(device):
                     "Failed FS purge of /dev/%s" % d['name']
                 ) from e
 
-    purge_disk_ptable(device)
+    purge_disk_ptable(device, settle=settle)
 
 
 def get_partition_layout(table_type, size, layout):
@@ -683,25 +809,30 @@ def get_partition_layout(table_type, size, layout):
     return get_dyn_func("get_partition_%s_layout", table_type, size, layout)
 
 
-def read_parttbl(device):
+def read_parttbl(device, settle=True):
     """
     `Partprobe` is preferred over `blkdev` since it is more reliably
     able to probe the partition table.
+
+    With settle False, udev is not settled before and after, the caller
+    settling once it is done with all devices.
     """
     if PARTPROBE_CMD is not None:
         probe_cmd = [PARTPROBE_CMD, device]
     else:
         probe_cmd = [BLKDEV_CMD, '--rereadpt', device]
-    util.udevadm_settle()
+    if settle:
+        util.udevadm_settle()
     try:
         subp.subp(probe_cmd)
     except Exception as e:
         util.logexc(LOG, "Failed reading the partition table %s" % e)
 
-    util.udevadm_settle()
+    if settle:
+        util.udevadm_settle()
 
 
-def exec_mkpart_mbr(device, layout):
+def exec_mkpart_mbr(device, layout, settle=True):
     """
     Break out of mbr partition to allow for future partition
     types, i.e. gpt
@@ -715,10 +846,10 @@ def exec_mkpart_mbr(device, layout):
             "Failed to partition device %s\n%s" % (device, e)
         ) from e
 
-    read_parttbl(device)
+    read_parttbl(device, settle=settle)
 
 
-def exec_mkpart_gpt(device, layout):
+def exec_mkpart_gpt(device, layout, settle=True):
     try:
         subp.subp([SGDISK_CMD, '-Z', device])
         for index, (partition_type, (start, end)) in enumerate(layout):
@@ -735,10 +866,10 @@ def exec_mkpart_gpt(device, layout):
         LOG.warning("Failed to partition device %s", device)
         raise
 
-    read_parttbl(device)
+    read_parttbl(device, settle=settle)
 
 
-def exec_mkpart(table_type, device, layout):
+def exec_mkpart(table_type, device, layout, settle=True):
     """
     Fetches the function for creating the table type.
     This allows to dynamically find which function to call.
@@ -747,12 +878,17 @@ def exec_mkpart(table_type, device, layout):
         table_type: type of partition table to use
         device: the device to work on
         layout: layout definition specific to partition table
+        settle: whether to settle udev once the table is read again
     """
-    return get_dyn_func("exec_mkpart_%s", table_type, device, layout)
+    return get_dyn_func("exec_mkpart_%s", table_type, device, layout, settle)
 
 
-def assert_and_settle_device(device):
-    """Assert that device exists and settle so it is fully recognized."""
+def assert_and_settle_device(device, settle=True):
+    """Assert that device exists and settle so it is fully recognized.
+
+    With settle False, udev is only settled if device does not exist, the
+    caller having settled already.
+    """
     if not os.path.exists(device):
         util.udevadm_settle()
         if not os.path.exists(device):
@@ -762,10 +898,11 @@ def assert_and_settle_device(device):
     # Whether or not the device existed above, it is possible that udev
     # events that would populate udev database (for reading by lsdname) have
     # not yet finished. So settle again.
-    util.udevadm_settle()
+    if settle:
+        util.udevadm_settle()
 
 
-def mkpart(device, definition):
+def mkpart(device, definition, settle=True, topology=None):
     """
     Creates the partition table.
 
@@ -778,9 +915,15 @@ def mkpart(device, definition):
                 layout: the layout of the partition table
                 table_type: Which partition table to use, defaults to MBR
                 device: the device to work on.
+        settle: whether to settle udev for the device, False if the caller
+            settles for all devices.
+        topology: BlockTopology to look the device up in, read again once
+            partitioned.
     """
     # ensure that we get a real device rather than a symbolic link
-    assert_and_settle_device(device)
+    assert_and_settle_device(device, settle=settle)
+    if settle and topology is not None:
+        topology.invalidate()
     device = os.path.realpath(device)
 
     LOG.debug("Checking values for %s definition", device)
@@ -797,14 +940,18 @@ def mkpart(device, definition):
 
     # This prevents you from overwriting the device
     LOG.debug("Checking if device %s is a valid device", device)
-    if not is_device_valid(device):
+    if not is_device_valid(device, topology=topology):
         raise Exception(
             'Device {device} is not a disk device!'.format(device=device))
 
     # Remove the partition table entries
     if isinstance(layout, str) and layout.lower() == "remove":
         LOG.debug("Instructed to remove partition table entries")
-        purge_disk(device)
+        try:
+            purge_disk(device, settle=settle, topology=topology)
+        finally:
+            if topology is not None:
+                topology.invalidate()
         return
 
     LOG.debug("Checking if device layout matches")
@@ -813,7 +960,8 @@ def mkpart(device, definition):
         return True
 
     LOG.debug("Checking if device is safe to partition")
-    if not overwrite and (is_disk_used(device) or is_filesystem(device)):
+    if not overwrite and (is_disk_used(device, topology=topology) or
+                          is_filesystem(device)):
         LOG.debug("Skipping partitioning on configured device %s", device)
         return
 
@@ -825,7 +973,11 @@ def mkpart(device, definition):
     LOG.debug("   Layout is: %s", part_definition)
 
     LOG.debug("Creating partition table on %s", device)
-    exec_mkpart(table_type, device, part_definition)
+    try:
+        exec_mkpart(table_type, device, part_definition, settle=settle)
+    finally:
+        if topology is not None:
+            topology.invalidate()
 
     LOG.debug("Partition table created for %s", device)
 
@@ -852,7 +1004,7 @@ def lookup_force_flag(fs):
     return ''
 
 
-def mkfs(fs_cfg):
+def mkfs(fs_cfg, settle=True, topology=None):
     """
     Create a file system on the device.
 
@@ -872,6 +1024,10 @@ def mkfs(fs_cfg):
                             on the device.
 
             When 'cmd' is provided then no other parameter is required.
+        settle: whether to settle udev for the device, False if the caller
+            settles for all devices.
+        topology: BlockTopology to look the device up in, read again once
+            the filesystem is created.
     """
     label = fs_cfg.get('label')
     device = fs_cfg.get('device')
@@ -883,7 +1039,9 @@ def mkfs(fs_cfg):
     overwrite = fs_cfg.get('overwrite', False)
 
     # ensure that we get a real device rather than a symbolic link
-    assert_and_settle_device(device)
+    assert_and_settle_device(device, settle=settle)
+    if settle and topology is not None:
+        topology.invalidate()
     device = os.path.realpath(device)
 
     # This allows you to define the default ephemeral or swap
@@ -926,7 +1084,8 @@ def mkfs(fs_cfg):
 
         device, reuse = find_device_node(device, fs_type=fs_type, label=label,
                                          label_match=label_match,
-                                         replace_fs=fs_replace)
+                                         replace_fs=fs_replace,
+                                         topology=topology)
         LOG.debug("Automatic device for %s identified as %s", odevice, device)
 
         if reuse:
@@ -996,7 +1155,7 @@ def mkfs(fs_cfg):
             fs_cmd.extend(["-L", label])
 
         # File systems that support the -F flag
-        if overwrite or device_type(device) == "disk":
+        if overwrite or device_type(device, topology=topology) == "disk":
             force_flag = lookup_force_flag(fs_type)
             if force_flag:
                 fs_cmd.append(force_flag)
@@ -1011,5 +1170,9 @@ def mkfs(fs_cfg):
         subp.subp(fs_cmd, shell=shell)
     except Exception as e:
         raise Exception("Failed to exec of '%s':\n%s" % (fs_cmd, e)) from e
+    finally:
+        util.invalidate_blkid_inventory()
+        if topology is not None:
+            topology.invalidate()
 
 # vi: ts=4 expandtab
@@ -208,9 +208,16 @@ def get_size(filename):
         os.close(fd)
 
 
-def device_part_info(devpath):
+def device_part_info(devpath, topology=None):
     # convert an entry in /dev/ to parent disk and partition number
 
+    # a device listed in the block topology needs no sysfs lookups
+    blockdev = topology.lookup(devpath) if topology is not None else None
+    if blockdev is not None and blockdev.partn is not None:
+        disk = topology.lookup('/dev/%s' % blockdev.parent)
+        if disk is not None:
+            return (disk.path, str(blockdev.partn))
+
     # input of /dev/vdb or /dev/disk/by-label/foo
     # rpath is hopefully a real-ish path in /dev (vda, sdb..)
     rpath = os.path.realpath(devpath)
@@ -247,11 +254,14 @@ def device_part_info(devpath):
     return (diskdevpath, ptnum)
 
 
-def devent2dev(devent):
+def devent2dev(devent, topology=None):
     if devent.startswith("/dev/"):
         return devent
     else:
-        result = util.get_mount_info(devent)
+        if topology is not None:
+            result = topology.get_mount_info(devent)
+        else:
+            result = util.get_mount_info(devent)
         if not result:
             raise ValueError("Could not determine device of '%s' % dev_ent")
         dev = result[0]
@@ -270,12 +280,13 @@ def devent2dev(devent):
     return dev
 
 
-def resize_devices(resizer, devices):
+def resize_devices(resizer, devices, topology=None):
     # returns a tuple of tuples containing (entry-in-devices, action, message)
+    # topology, a BlockTopology, is read again once a partition is resized
     info = []
     for devent in devices:
         try:
-            blockdev = devent2dev(devent)
+            blockdev = devent2dev(devent, topology=topology)
         except ValueError as e:
             info.append((devent, RESIZE.SKIPPED,
                          "unable to convert to device: %s" % e,))
@@ -295,7 +306,7 @@ def resize_devices(resizer, devices):
             continue
 
         try:
-            (disk, ptnum) = device_part_info(blockdev)
+            (disk, ptnum) = device_part_info(blockdev, topology=topology)
         except (TypeError, ValueError) as e:
             info.append((devent, RESIZE.SKIPPED,
                          "device_part_info(%s) failed: %s" % (blockdev, e),))
@@ -310,6 +321,8 @@ def resize_devices(resizer, devices):
                 info.append((devent, RESIZE.CHANGED,
                              "changed (%s, %s) from %s to %s" %
                              (disk, ptnum, old, new),))
+                if topology is not None:
+                    topology.invalidate()
 
         except ResizeFailedException as e:
             info.append((devent, RESIZE.FAILED,
@@ -319,7 +332,7 @@ def resize_devices(resizer, devices):
     return info
 
 
-def handle(_name, cfg, _cloud, log, _args):
+def handle(_name, cfg, cloud, log, _args):
     if 'growpart' not in cfg:
         log.debug("No 'growpart' entry in cfg.  Using default: %s" %
                   DEFAULT_CONFIG)
@@ -355,7 +368,8 @@ def handle(_name, cfg, _cloud, log, _args):
         return
 
     resized = util.log_time(logfunc=log.debug, msg="resize_devices",
-                            func=resize_devices, args=(resizer, devices))
+                            func=resize_devices,
+                            args=(resizer, devices, cloud.block_topology))
     for (entry, action, msg) in resized:
         if action == RESIZE.CHANGED:
             log.info("'%s' resized: %s" % (entry, msg))
@@ -43,6 +43,8 @@ from cloudinit import subp
 from cloudinit import util
 
 frequency = PER_INSTANCE
+resources_read = ['ssh']
+resources_written = ['console']
 
 # This is a tool that cloud init provides
 HELPER_TOOL_TPL = '%s/cloud-init/write-ssh-key-fingerprints'
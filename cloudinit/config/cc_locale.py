@@ -17,6 +17,7 @@ from cloudinit.settings import PER_INSTANCE
 
 frequency = PER_INSTANCE
 distros = ['all']
+resources_written = ['locale']
 schema = {
     'id': 'cc_locale',
     'name': 'Locale',
@@ -114,7 +114,17 @@ def _get_nth_partition_for_device(device_path, partition_number):
     return None
 
 
-def _is_block_device(device_path, partition_path=None):
+def _is_block_device(device_path, partition_path=None, topology=None):
+    device = topology.lookup(device_path) if topology is not None else None
+    if device is not None:
+        # As in /sys/block, a disk and the partitions on it
+        if partition_path is None:
+            return device.type != 'part'
+        partition = topology.lookup(partition_path)
+        if partition is not None:
+            return (device.type != 'part' and
+                    partition.parent == device.name)
+
     device_name = os.path.realpath(device_path).split('/')[-1]
     sys_path = os.path.join('/sys/block/', device_name)
     if partition_path is not None:
@@ -123,7 +133,7 @@ def _is_block_device(device_path, partition_path=None):
     return os.path.exists(sys_path)
 
 
-def sanitize_devname(startname, transformer, log):
+def sanitize_devname(startname, transformer, log, topology=None):
     log.debug("Attempting to determine the real name of %s", startname)
 
     # workaround, allow user to specify 'ephemeral'
@@ -159,7 +169,7 @@ def sanitize_devname(startname, transformer, log):
         if partition_path is None:
             return None
 
-    if _is_block_device(device_path, partition_path):
+    if _is_block_device(device_path, partition_path, topology=topology):
         if partition_path is not None:
             return partition_path
         return device_path
@@ -359,6 +369,7 @@ def handle_swapcfg(swapcfg):
 
 def handle(_name, cfg, cloud, log, _args):
     # fs_spec, fs_file, fs_vfstype, fs_mntops, fs-freq, fs_passno
+    topology = cloud.block_topology
     def_mnt_opts = "defaults,nobootwait"
     uses_systemd = cloud.distro.uses_systemd()
     if uses_systemd:
@@ -402,7 +413,8 @@ def handle(_name, cfg, cloud, log, _args):
             continue
 
         start = str(cfgmnt[i][0])
-        sanitized = sanitize_devname(start, cloud.device_name_to_device, log)
+        sanitized = sanitize_devname(start, cloud.device_name_to_device, log,
+                                     topology=topology)
         if sanitized != start:
             log.debug("changed %s => %s" % (start, sanitized))
 
@@ -444,7 +456,8 @@ def handle(_name, cfg, cloud, log, _args):
     # entry has the same device name
     for defmnt in defmnts:
         start = defmnt[0]
-        sanitized = sanitize_devname(start, cloud.device_name_to_device, log)
+        sanitized = sanitize_devname(start, cloud.device_name_to_device, log,
+                                     topology=topology)
         if sanitized != start:
             log.debug("changed default device %s => %s" % (start, sanitized))
 
@@ -547,5 +560,7 @@ def handle(_name, cfg, cloud, log, _args):
         except subp.ProcessExecutionError:
             log.warning(fmt, "FAIL")
             util.logexc(log, fmt, "FAIL")
+    if activate_cmds:
+        topology.invalidate()
 
 # vi: ts=4 expandtab
@@ -22,6 +22,8 @@ from cloudinit.settings import PER_INSTANCE
 LOG = logging.getLogger(__name__)
 
 frequency = PER_INSTANCE
+resources_read = ['resolv-conf']
+resources_written = ['ntp', 'packages']
 NTP_CONF = '/etc/ntp.conf'
 NR_POOL_SERVERS = 4
 distros = ['almalinux', 'alpine', 'centos', 'debian', 'fedora', 'opensuse',
@@ -191,7 +191,7 @@ def maybe_get_writable_device_path(devpath, info, log):
     return devpath  # The writable block devpath
 
 
-def handle(name, cfg, _cloud, log, args):
+def handle(name, cfg, cloud, log, args):
     if len(args) != 0:
         resize_root = args[0]
     else:
@@ -203,7 +203,8 @@ def handle(name, cfg, _cloud, log, args):
 
     # TODO(harlowja): allow what is to be resized to be configurable??
     resize_what = "/"
-    result = util.get_mount_info(resize_what, log)
+    topology = cloud.block_topology
+    result = topology.get_mount_info(resize_what, log)
     if not result:
         log.warning("Could not determine filesystem type of %s", resize_what)
         return
@@ -259,6 +260,7 @@ def handle(name, cfg, _cloud, log, args):
     else:
         util.log_time(logfunc=log.debug, msg="Resizing",
                       func=do_resize, args=(resize_cmd, log))
+    topology.invalidate()
 
     action = 'Resized'
     if resize_root == NOBLOCK:
@@ -57,6 +57,8 @@ frequency = PER_INSTANCE
 
 distros = ['alpine', 'fedora', 'opensuse', 'rhel', 'sles']
 
+resources_written = ['resolv-conf']
+
 
 def generate_resolv_conf(template_fn, params, target_fname="/etc/resolv.conf"):
     flags = []
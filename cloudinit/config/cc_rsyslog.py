@@ -185,6 +185,8 @@ from cloudinit import log as logging
 from cloudinit import subp
 from cloudinit import util
 
+resources_written = ['rsyslog']
+
 DEF_FILENAME = "20-cloud-config.conf"
 DEF_DIR = "/etc/rsyslog.d"
 DEF_RELOAD = "auto"
@@ -89,6 +89,9 @@ from string import ascii_letters, digits
 
 LOG = logging.getLogger(__name__)
 
+# Updates sshd_config PasswordAuthentication and restarts sshd
+resources_written = ['users', 'ssh', 'console']
+
 # We are removing certain 'painful' letters/numbers
 PW_SET = (''.join([x for x in ascii_letters + digits
                    if x not in 'loLOI01']))
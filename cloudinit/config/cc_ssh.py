@@ -156,13 +156,18 @@ config flags are:
 import glob
 import os
 import sys
+from concurrent import futures
 
 from cloudinit.distros import ug_util
+from cloudinit.reporting import events
 from cloudinit import ssh_util
 from cloudinit import subp
 from cloudinit import util
 
 
+resources_read = ['users']
+resources_written = ['ssh']
+
 GENERATE_KEY_NAMES = ['rsa', 'dsa', 'ecdsa', 'ed25519']
 KEY_FILE_TPL = '/etc/ssh/ssh_host_%s_key'
 PUBLISH_HOST_KEYS = True
@@ -183,6 +188,33 @@ for k in GENERATE_KEY_NAMES:
 KEY_GEN_TPL = 'o=$(ssh-keygen -yf "%s") && echo "$o" root@localhost > "%s"'
 
 
+def _generate_hostkey(keytype, env, reporter, log):
+    """Run ssh-keygen for keytype, returning its decoded stdout or None."""
+    keyfile = KEY_FILE_TPL % (keytype)
+    cmd = ['ssh-keygen', '-t', keytype, '-N', '', '-f', keyfile]
+    with events.ReportEventStack(
+            name="ssh-keygen-%s" % keytype,
+            description="generating %s host key" % keytype,
+            parent=reporter) as myrep:
+        try:
+            out, _err = util.log_time(
+                logfunc=log.debug, msg="Generating %s host key" % keytype,
+                func=subp.subp, args=[cmd],
+                kwargs={'capture': True, 'env': env})
+            return util.decode_binary(out)
+        except subp.ProcessExecutionError as e:
+            err = util.decode_binary(e.stderr).lower()
+            if (e.exit_code == 1 and
+                    err.lower().startswith("unknown key")):
+                log.debug("ssh-keygen: unknown key type '%s'", keytype)
+                myrep.message = "unknown key type %s" % keytype
+            else:
+                util.logexc(log, "Failed generating key type %s to "
+                            "file %s", keytype, keyfile)
+                myrep.result = events.status.FAIL
+    return None
+
+
 def handle(_name, cfg, cloud, log, _args):
 
     # remove the static keys from the pristine image
@@ -228,26 +260,29 @@ def handle(_name, cfg, cloud, log, _args):
                                            GENERATE_KEY_NAMES)
         lang_c = os.environ.copy()
         lang_c['LANG'] = 'C'
+        keytypes = []
         for keytype in genkeys:
             keyfile = KEY_FILE_TPL % (keytype)
             if os.path.exists(keyfile):
                 continue
             util.ensure_dir(os.path.dirname(keyfile))
-            cmd = ['ssh-keygen', '-t', keytype, '-N', '', '-f', keyfile]
+            keytypes.append(keytype)
 
+        if keytypes:
+            # Key types are generated concurrently, relabelling /etc/ssh once
+            # all of them are done.
             # TODO(harlowja): Is this guard needed?
             with util.SeLinuxGuard("/etc/ssh", recursive=True):
-                try:
-                    out, err = subp.subp(cmd, capture=True, env=lang_c)
-                    sys.stdout.write(util.decode_binary(out))
-                except subp.ProcessExecutionError as e:
-                    err = util.decode_binary(e.stderr).lower()
-                    if (e.exit_code == 1 and
-                            err.lower().startswith("unknown key")):
-                        log.debug("ssh-keygen: unknown key type '%s'", keytype)
-                    else:
-                        util.logexc(log, "Failed generating key type %s to "
-                                    "file %s", keytype, keyfile)
+                with futures.ThreadPoolExecutor(
+                        max_workers=len(keytypes)) as executor:
+                    outputs = list(executor.map(
+                        lambda keytype: _generate_hostkey(
+                            keytype, lang_c, cloud.reporter, log),
+                        keytypes))
+            # Write fingerprints in ssh_genkeytypes order
+            for out in outputs:
+                if out:
+                    sys.stdout.write(out)
 
     if "ssh_publish_hostkeys" in cfg:
         host_key_blacklist = util.get_cfg_option_list(
@@ -34,6 +34,9 @@ from cloudinit.distros import ug_util
 from cloudinit import ssh_util
 from cloudinit import util
 
+resources_read = ['ssh', 'users']
+resources_written = ['console']
+
 
 def _split_hash(bin_hash):
     split_up = []
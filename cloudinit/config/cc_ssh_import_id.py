@@ -37,6 +37,8 @@ import pwd
 
 # https://launchpad.net/ssh-import-id
 distros = ['ubuntu', 'debian']
+resources_read = ['resolv-conf', 'users']
+resources_written = ['ssh']
 
 
 def handle(_name, cfg, cloud, log, args):
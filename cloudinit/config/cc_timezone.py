@@ -31,6 +31,7 @@ from cloudinit import util
 from cloudinit.settings import PER_INSTANCE
 
 frequency = PER_INSTANCE
+resources_written = ['timezone']
 
 
 def handle(name, cfg, cloud, log, args):
@@ -8,10 +8,12 @@ from cloudinit.util import find_modules, load_file
 import argparse
 from collections import defaultdict
 from copy import deepcopy
+import json
 import logging
 import os
 import re
 import sys
+import threading
 import yaml
 
 _YAML_MAP = {True: 'true', False: 'false', None: 'null'}
@@ -39,6 +41,16 @@ SCHEMA_LIST_ITEM_TMPL = (
     '{prefix}Each item in **{prop_name}** list supports the following keys:')
 SCHEMA_EXAMPLES_HEADER = '\n**Examples**::\n\n'
 SCHEMA_EXAMPLES_SPACER_TEMPLATE = '\n    # --- Example{0} ---'
+# The schema of all cc_* modules, written by setup.py when building
+SCHEMA_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'cloud-config-schema.json')
+# Keywords of module schemas which do not constrain the config
+SCHEMA_ANNOTATIONS = (
+    'id', 'name', 'title', 'description', 'distros', 'examples', 'frequency')
+
+_VALIDATOR_CLASS = None
+_VALIDATORS = {}
+_VALIDATORS_LOCK = threading.Lock()
 
 
 class SchemaValidationError(ValueError):
@@ -72,26 +84,13 @@ def is_schema_byte_string(checker, instance):
             isinstance(instance, (bytes,)))
 
 
-def validate_cloudconfig_schema(config, schema, strict=False):
-    """Validate provided config meets the schema definition.
-
-    @param config: Dict of cloud configuration settings validated against
-        schema.
-    @param schema: jsonschema dict describing the supported schema definition
-       for the cloud config module (config.cc_*).
-    @param strict: Boolean, when True raise SchemaValidationErrors instead of
-       logging warnings.
-
-    @raises: SchemaValidationError when provided config does not validate
-        against the provided schema.
-    """
-    try:
-        from jsonschema import Draft4Validator, FormatChecker
-        from jsonschema.validators import create, extend
-    except ImportError:
-        logging.debug(
-            'Ignoring schema validation. python-jsonschema is not present')
-        return
+def _get_validator_class():
+    """Return the Draft4 validator class accepting bytes as strings."""
+    global _VALIDATOR_CLASS
+    if _VALIDATOR_CLASS is not None:
+        return _VALIDATOR_CLASS
+    from jsonschema import Draft4Validator
+    from jsonschema.validators import create, extend
 
     # Allow for bytes to be presented as an acceptable valid value for string
     # type jsonschema attributes in cloud-init's schema.
@@ -111,9 +110,70 @@ def validate_cloudconfig_schema(config, schema, strict=False):
             validators=Draft4Validator.VALIDATORS,
             version="draft4",
             default_types=types)
-    validator = cloudinitValidator(schema, format_checker=FormatChecker())
+    _VALIDATOR_CLASS = cloudinitValidator
+    return cloudinitValidator
+
+
+def get_validator(schema):
+    """Return the validator of schema, created once for each schema dict.
+
+    @param schema: jsonschema dict describing the supported schema definition.
+    """
+    from jsonschema import FormatChecker
+    with _VALIDATORS_LOCK:
+        # The schema is kept with its validator so its id is not reused.
+        cached = _VALIDATORS.get(id(schema))
+        if cached is None or cached[0] is not schema:
+            validator = _get_validator_class()(
+                schema, format_checker=FormatChecker())
+            cached = _VALIDATORS[id(schema)] = (schema, validator)
+    return cached[1]
+
+
+def _configured_schemas(config, schema):
+    """Return the subschemas of schema which may reject config.
+
+    Module schemas listed in the allOf of the full schema only constrain
+    their own properties, so those of modules not configured are skipped.
+    """
+    if not isinstance(config, dict) or set(schema).difference(
+            ('$schema', 'id', 'allOf')):
+        return [schema]
+    subschemas = []
+    for subschema in schema['allOf']:
+        constraints = set(subschema).difference(SCHEMA_ANNOTATIONS)
+        if (constraints.difference(('properties', 'type')) or
+                subschema.get('type', 'object') != 'object' or
+                set(subschema.get('properties', {})).intersection(config)):
+            subschemas.append(subschema)
+    return subschemas
+
+
+def validate_cloudconfig_schema(config, schema, strict=False):
+    """Validate provided config meets the schema definition.
+
+    @param config: Dict of cloud configuration settings validated against
+        schema.
+    @param schema: jsonschema dict describing the supported schema definition
+       for the cloud config module (config.cc_*).
+    @param strict: Boolean, when True raise SchemaValidationErrors instead of
+       logging warnings.
+
+    @raises: SchemaValidationError when provided config does not validate
+        against the provided schema.
+    """
+    try:
+        from jsonschema import Draft4Validator, FormatChecker  # noqa: F401
+    except ImportError:
+        logging.debug(
+            'Ignoring schema validation. python-jsonschema is not present')
+        return
+
+    schema_errors = []
+    for subschema in _configured_schemas(config, schema):
+        schema_errors.extend(get_validator(subschema).iter_errors(config))
     errors = ()
-    for error in sorted(validator.iter_errors(config), key=lambda e: e.path):
+    for error in sorted(schema_errors, key=lambda e: e.path):
         path = '.'.join([str(p) for p in error.path])
         errors += ((path, error.message),)
     if errors:
@@ -408,11 +468,16 @@ def get_schema_doc(schema):
 FULL_SCHEMA = None
 
 
-def get_schema():
-    """Return jsonschema coalesced from all cc_* cloud-config module."""
-    global FULL_SCHEMA
-    if FULL_SCHEMA:
-        return FULL_SCHEMA
+def load_schema_file(schema_file):
+    """Return the schema written to schema_file, or None if unreadable."""
+    try:
+        return json.loads(load_file(schema_file))
+    except (IOError, ValueError):
+        return None
+
+
+def import_schema():
+    """Return jsonschema coalesced by importing all cc_* config modules."""
     full_schema = {
         '$schema': 'http://json-schema.org/draft-04/schema#',
         'id': 'cloud-config-schema', 'allOf': []}
@@ -425,6 +490,28 @@ def get_schema():
         if mod_locs:
             mod = importer.import_module(mod_locs[0])
             full_schema['allOf'].append(mod.schema)
+    return full_schema
+
+
+def write_schema_file(schema_file):
+    """Write the schema of all cc_* config modules to schema_file as JSON."""
+    with open(schema_file, 'w') as stream:
+        json.dump(import_schema(), stream, indent=1, sort_keys=True)
+        stream.write('\n')
+
+
+def get_schema():
+    """Return jsonschema coalesced from all cc_* cloud-config module.
+
+    The schema is read from SCHEMA_FILE when it was written at build time,
+    sparing the import of every config module, else it is imported.
+    """
+    global FULL_SCHEMA
+    if FULL_SCHEMA:
+        return FULL_SCHEMA
+    full_schema = load_schema_file(SCHEMA_FILE)
+    if full_schema is None:
+        full_schema = import_schema()
     FULL_SCHEMA = full_schema
     return full_schema
 
@@ -1,9 +1,12 @@
 # This file is part of cloud-init. See LICENSE file for license information.
 
+import io
 import os.path
+import threading
 
 from cloudinit.config import cc_ssh
 from cloudinit import ssh_util
+from cloudinit import subp
 from cloudinit.tests.helpers import CiTestCase, mock
 import logging
 
@@ -403,3 +406,39 @@ class TestHandleSsh(CiTestCase):
         # Check that all expected output has been done.
         for call_ in expected_calls:
             self.assertIn(call_, m_write_file.call_args_list)
+
+    @mock.patch(MODPATH + "util.SeLinuxGuard")
+    @mock.patch(MODPATH + "subp.subp")
+    @mock.patch(MODPATH + "util.ensure_dir")
+    @mock.patch(MODPATH + "glob.glob")
+    @mock.patch(MODPATH + "ug_util.normalize_users_groups")
+    @mock.patch(MODPATH + "os.path.exists")
+    def test_handle_generates_missing_keys_concurrently(
+            self, m_path_exists, m_nug, m_glob, m_ensure_dir, m_subp,
+            m_guard, m_setup_keys):
+        """Missing host keys are generated concurrently, relabelled once."""
+        both_running = threading.Barrier(2, timeout=5)
+
+        def fake_keygen(cmd, capture, env):
+            keytype = cmd[2]
+            if keytype == 'dsa':
+                raise subp.ProcessExecutionError(
+                    stderr='unknown key type dsa', exit_code=1)
+            # Fails unless rsa and ecdsa are generated at the same time
+            both_running.wait()
+            return ('%s fingerprint\n' % keytype).encode(), b''
+
+        m_glob.return_value = []
+        m_path_exists.return_value = False
+        m_nug.return_value = ([], {})
+        m_subp.side_effect = fake_keygen
+        cfg = {'ssh_genkeytypes': ['rsa', 'dsa', 'ecdsa'],
+               'ssh_publish_hostkeys': {'enabled': False}}
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as m_stdout:
+            cc_ssh.handle(
+                "name", cfg, self.tmp_cloud(distro='ubuntu'), LOG, None)
+        self.assertEqual(
+            'rsa fingerprint\necdsa fingerprint\n', m_stdout.getvalue())
+        self.assertEqual(3, m_subp.call_count)
+        self.assertEqual(
+            [mock.call("/etc/ssh", recursive=True)], m_guard.call_args_list)
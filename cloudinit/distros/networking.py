@@ -169,6 +169,7 @@ class Networking(metaclass=abc.ABCMeta):
                 )
 
             # update present_macs after settles
+            net.invalidate_net_snapshot()
             present_macs = self.get_interfaces_by_mac().keys()
 
         msg = "Not all expected physical devices present: %s" % missing
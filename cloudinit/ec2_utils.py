@@ -8,6 +8,7 @@
 
 import functools
 import json
+from concurrent import futures
 
 from cloudinit import log as logging
 from cloudinit import url_helper
@@ -16,6 +17,10 @@ from cloudinit import util
 LOG = logging.getLogger(__name__)
 SKIP_USERDATA_CODES = frozenset([url_helper.NOT_FOUND])
 
+# Number of concurrent requests used when crawling a metadata tree.
+# A value of 1 crawls the tree serially, depth-first.
+DEFAULT_CRAWL_WORKERS = 1
+
 
 class MetadataLeafDecoder(object):
     """Decodes a leaf blob into something meaningful."""
@@ -50,7 +55,16 @@ class MetadataLeafDecoder(object):
 # See: http://docs.aws.amazon.com/AWSEC2/latest/UserGuide/
 #         ec2-instance-metadata.html
 class MetadataMaterializer(object):
-    def __init__(self, blob, base_url, caller, leaf_decoder=None):
+    """Walk a metadata tree and materialize it into a dictionary.
+
+    When max_workers is greater than 1, the tree is crawled breadth-first:
+    every directory listing and leaf found at one depth of the tree is
+    fetched concurrently, bounded by max_workers, before descending into the
+    next depth. The resulting dictionary is identical to the serial crawl.
+    """
+
+    def __init__(self, blob, base_url, caller, leaf_decoder=None,
+                 max_workers=DEFAULT_CRAWL_WORKERS):
         self._blob = blob
         self._md = None
         self._base_url = base_url
@@ -59,6 +73,7 @@ class MetadataMaterializer(object):
             self._leaf_decoder = MetadataLeafDecoder()
         else:
             self._leaf_decoder = leaf_decoder
+        self._max_workers = max(1, int(max_workers or 1))
 
     def _parse(self, blob):
         leaves = {}
@@ -106,9 +121,24 @@ class MetadataMaterializer(object):
     def materialize(self):
         if self._md is not None:
             return self._md
-        self._md = self._materialize(self._blob, self._base_url)
+        if self._max_workers > 1:
+            self._md = self._materialize_concurrently(
+                self._blob, self._base_url)
+        else:
+            self._md = self._materialize(self._blob, self._base_url)
         return self._md
 
+    def _join(self, base_url, child_contents, leaf_contents):
+        joined = {}
+        joined.update(child_contents)
+        for field in leaf_contents.keys():
+            if field in joined:
+                LOG.warning("Duplicate key found in results from %s",
+                            base_url)
+            else:
+                joined[field] = leaf_contents[field]
+        return joined
+
     def _materialize(self, blob, base_url):
         (leaves, children) = self._parse(blob)
         child_contents = {}
@@ -123,15 +153,65 @@ class MetadataMaterializer(object):
             leaf_url = url_helper.combine_url(base_url, resource)
             leaf_blob = self._caller(leaf_url)
             leaf_contents[field] = self._leaf_decoder(field, leaf_blob)
-        joined = {}
-        joined.update(child_contents)
-        for field in leaf_contents.keys():
-            if field in joined:
-                LOG.warning("Duplicate key found in results from %s",
-                            base_url)
-            else:
-                joined[field] = leaf_contents[field]
-        return joined
+        return self._join(base_url, child_contents, leaf_contents)
+
+    def _materialize_concurrently(self, blob, base_url):
+        """Crawl the tree one depth at a time using a bounded thread pool.
+
+        Each node is a dict holding its url and fetched blob. Parsing a node
+        records its children and leaves, whose blobs are all fetched before
+        moving to the next depth. Nodes are joined bottom-up into 'md' once
+        the whole tree has been crawled.
+        """
+        root = {'blob': blob, 'url': base_url}
+        level = [root]
+        fetched = []
+        with futures.ThreadPoolExecutor(
+                max_workers=self._max_workers) as executor:
+            while level:
+                pending = []
+                for node in level:
+                    (leaves, children) = self._parse(node['blob'])
+                    node['children'] = []
+                    node['leaves'] = []
+                    for c in children:
+                        child_url = url_helper.combine_url(node['url'], c)
+                        if not child_url.endswith("/"):
+                            child_url += "/"
+                        child = {'url': child_url}
+                        node['children'].append((c, child))
+                        pending.append(
+                            (child, 'blob',
+                             executor.submit(self._caller, child_url)))
+                    for (field, resource) in leaves.items():
+                        leaf_url = url_helper.combine_url(
+                            node['url'], resource)
+                        leaf = {}
+                        node['leaves'].append((field, leaf))
+                        pending.append(
+                            (leaf, 'blob',
+                             executor.submit(self._caller, leaf_url)))
+                    fetched.append(node)
+                try:
+                    for (target, key, future) in pending:
+                        target[key] = future.result()
+                except Exception:
+                    for (_target, _key, future) in pending:
+                        future.cancel()
+                    raise
+                level = [child for node in level
+                         for (_name, child) in node['children']]
+        # Children always come after their parent in fetched, so walking it
+        # in reverse joins every subtree before the node which contains it.
+        for node in reversed(fetched):
+            child_contents = dict(
+                (name, child['md']) for (name, child) in node['children'])
+            leaf_contents = dict(
+                (field, self._leaf_decoder(field, leaf['blob']))
+                for (field, leaf) in node['leaves'])
+            node['md'] = self._join(
+                node['url'], child_contents, leaf_contents)
+        return root['md']
 
 
 def skip_retry_on_codes(status_codes, _request_args, cause):
@@ -172,7 +252,8 @@ def _get_instance_metadata(tree, api_version='latest',
                            ssl_details=None, timeout=5, retries=5,
                            leaf_decoder=None, headers_cb=None,
                            headers_redact=None,
-                           exception_cb=None):
+                           exception_cb=None,
+                           max_workers=DEFAULT_CRAWL_WORKERS):
     md_url = url_helper.combine_url(metadata_address, api_version, tree)
     caller = functools.partial(
         url_helper.read_file_or_url, ssl_details=ssl_details,
@@ -187,7 +268,8 @@ def _get_instance_metadata(tree, api_version='latest',
         response = caller(md_url)
         materializer = MetadataMaterializer(response.contents,
                                             md_url, mcaller,
-                                            leaf_decoder=leaf_decoder)
+                                            leaf_decoder=leaf_decoder,
+                                            max_workers=max_workers)
         md = materializer.materialize()
         if not isinstance(md, (dict)):
             md = {}
@@ -202,7 +284,8 @@ def get_instance_metadata(api_version='latest',
                           ssl_details=None, timeout=5, retries=5,
                           leaf_decoder=None, headers_cb=None,
                           headers_redact=None,
-                          exception_cb=None):
+                          exception_cb=None,
+                          max_workers=DEFAULT_CRAWL_WORKERS):
     # Note, 'meta-data' explicitly has trailing /.
     # this is required for CloudStack (LP: #1356855)
     return _get_instance_metadata(tree='meta-data/', api_version=api_version,
@@ -211,7 +294,8 @@ def get_instance_metadata(api_version='latest',
                                   retries=retries, leaf_decoder=leaf_decoder,
                                   headers_redact=headers_redact,
                                   headers_cb=headers_cb,
-                                  exception_cb=exception_cb)
+                                  exception_cb=exception_cb,
+                                  max_workers=max_workers)
 
 
 def get_instance_identity(api_version='latest',
@@ -219,7 +303,8 @@ def get_instance_identity(api_version='latest',
                           ssl_details=None, timeout=5, retries=5,
                           leaf_decoder=None, headers_cb=None,
                           headers_redact=None,
-                          exception_cb=None):
+                          exception_cb=None,
+                          max_workers=DEFAULT_CRAWL_WORKERS):
     return _get_instance_metadata(tree='dynamic/instance-identity',
                                   api_version=api_version,
                                   metadata_address=metadata_address,
@@ -227,5 +312,6 @@ def get_instance_identity(api_version='latest',
                                   retries=retries, leaf_decoder=leaf_decoder,
                                   headers_redact=headers_redact,
                                   headers_cb=headers_cb,
-                                  exception_cb=exception_cb)
+                                  exception_cb=exception_cb,
+                                  max_workers=max_workers)
 # vi: ts=4 expandtab
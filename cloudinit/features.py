@@ -49,6 +49,21 @@ mirrors via :py:mod:`apt: <cloudinit.config.cc_apt_configure>`
 directives in cloud-config.
 """
 
+EPHEMERAL_DHCP_BUILTIN_CLIENT = False
+"""
+When datasources obtain an ephemeral DHCP lease to reach their metadata
+service, and ``EPHEMERAL_DHCP_BUILTIN_CLIENT`` is ``True``, cloud-init
+obtains the lease with its own DHCPv4 client instead of running
+``dhclient``. This avoids starting, waiting for and killing a ``dhclient``
+process during each boot, and allows images without ``dhclient``. If the
+builtin client can not be used on an interface, ``dhclient`` is used.
+
+As of 21.1, ``EPHEMERAL_DHCP_BUILTIN_CLIENT`` is ``False``.
+
+(This flag can be removed once the builtin client is the default on all
+supported platforms.)
+"""
+
 try:
     # pylint: disable=wildcard-import
     from cloudinit.feature_overrides import *  # noqa
@@ -0,0 +1,663 @@
+# This file is part of cloud-init. See LICENSE file for license information.
+"""Read the files of ISO9660 and FAT filesystem images without mounting them.
+
+Config drives and seed disks are small, read-only ISO9660 or FAT filesystems.
+open_image returns a FilesystemView of the files of such a device, read
+directly from it, which datasources can read from instead of the directory
+the device was mounted on.
+
+Names are presented and looked up as Linux does when mounting with its
+default options: Rock Ridge names are used where present, otherwise Joliet
+names, otherwise ISO9660 names lowercased and without their ';1' version.
+FAT long names are used where present, otherwise short names in the case
+they were stored in. Lookups ignore case on FAT and Joliet filesystems.
+"""
+
+import errno
+import os
+import posixpath
+import struct
+from collections.abc import Mapping
+
+from cloudinit import log as logging
+
+LOG = logging.getLogger(__name__)
+
+ISO9660_TYPES = ('iso9660', 'cd9660')
+FAT_TYPES = ('vfat', 'msdos', 'msdosfs', 'fat')
+# Filesystem types, as passed to mount, which allow any filesystem
+ANY_TYPES = ('auto', '')
+
+ISO_SECTOR_SIZE = 2048
+ISO_FIRST_DESCRIPTOR = 16
+ISO_MAX_DESCRIPTORS = 32
+ISO_DESCRIPTOR_PRIMARY = 1
+ISO_DESCRIPTOR_SUPPLEMENTARY = 2
+ISO_DESCRIPTOR_TERMINATOR = 255
+ISO_JOLIET_ESCAPES = (b'%/@', b'%/C', b'%/E')
+ISO_FLAG_HIDDEN = 0x01
+ISO_FLAG_DIRECTORY = 0x02
+ISO_FLAG_ASSOCIATED = 0x04
+ISO_FLAG_MULTI_EXTENT = 0x80
+# Rock Ridge continuation areas followed for a single directory record
+ISO_MAX_CONTINUATIONS = 32
+
+FAT_DIR_ENTRY_SIZE = 32
+FAT_ATTR_VOLUME_ID = 0x08
+FAT_ATTR_DIRECTORY = 0x10
+FAT_ATTR_LONG_NAME = 0x0F
+FAT_LONG_NAME_LAST = 0x40
+FAT_DELETED = 0xE5
+FAT_LOWER_BASE = 0x08
+FAT_LOWER_EXT = 0x10
+FAT_CLUSTER_BITS = ((4085, 12), (65525, 16), (None, 32))
+FAT_BAD_CLUSTER = {12: 0xFF7, 16: 0xFFF7, 32: 0x0FFFFFF7}
+
+
+class ImageError(Exception):
+    """The device does not hold a filesystem image which can be read."""
+
+
+class _Entry(object):
+    """A file or directory of a filesystem image."""
+
+    __slots__ = ('name', 'is_dir', 'location', 'size', 'extents', 'children',
+                 'folded')
+
+    def __init__(self, name, is_dir, location, size, extents=None):
+        self.name = name
+        self.is_dir = is_dir
+        # Where the reader finds the content: the first cluster on FAT
+        self.location = location
+        self.size = size
+        # (offset, length) byte ranges of the content, in order
+        self.extents = extents
+        self.children = None
+        self.folded = None
+
+
+class _ImageReader(object):
+    """Read the directories and files of a filesystem image."""
+
+    fstype = None
+    casefold = False
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self.root = None
+
+    def close(self):
+        self._fileobj.close()
+
+    def _pread(self, offset, length):
+        self._fileobj.seek(offset)
+        data = self._fileobj.read(length)
+        if len(data) != length:
+            raise ImageError(
+                'Short read of %d bytes at offset %d' % (length, offset))
+        return data
+
+    def _extents(self, entry):
+        return entry.extents
+
+    def _read_dir(self, entry):
+        raise NotImplementedError()
+
+    def read(self, entry):
+        """Return the content of file entry."""
+        chunks = []
+        remaining = entry.size
+        for offset, length in self._extents(entry):
+            if remaining <= 0:
+                break
+            length = min(length, remaining)
+            chunks.append(self._pread(offset, length))
+            remaining -= length
+        if remaining > 0:
+            raise ImageError('%s is truncated' % entry.name)
+        return b''.join(chunks)
+
+    def children(self, entry):
+        """Return a dict of the entries of directory entry, by name."""
+        if entry.children is None:
+            entry.children = self._read_dir(entry)
+        return entry.children
+
+    def lookup(self, entry, name):
+        """Return the entry named name in directory entry, or None."""
+        children = self.children(entry)
+        if not self.casefold:
+            return children.get(name)
+        if entry.folded is None:
+            entry.folded = {}
+            for child_name, child in children.items():
+                entry.folded.setdefault(child_name.lower(), child)
+        return entry.folded.get(name.lower())
+
+
+def _iso_name(name):
+    """Translate an ISO9660 name as Linux does with map=normal."""
+    name = name.decode('latin-1').lower()
+    if name.endswith('.;1'):
+        name = name[:-3]
+    elif name.endswith(';1'):
+        name = name[:-2]
+    return name.replace(';', '.').replace('/', '.')
+
+
+def _joliet_name(name):
+    name = name.decode('utf-16-be', 'replace')
+    if name.endswith(';1'):
+        name = name[:-2]
+    while len(name) >= 2 and name.endswith('.'):
+        name = name[:-1]
+    return name
+
+
+class Iso9660Reader(_ImageReader):
+    """Read an ISO9660 image, with its Rock Ridge or Joliet names."""
+
+    fstype = 'iso9660'
+
+    def __init__(self, fileobj):
+        super(Iso9660Reader, self).__init__(fileobj)
+        primary = joliet = None
+        for index in range(ISO_FIRST_DESCRIPTOR,
+                           ISO_FIRST_DESCRIPTOR + ISO_MAX_DESCRIPTORS):
+            desc = self._pread(index * ISO_SECTOR_SIZE, ISO_SECTOR_SIZE)
+            if desc[1:6] != b'CD001':
+                raise ImageError(
+                    'No ISO9660 volume descriptor at sector %d' % index)
+            if desc[0] == ISO_DESCRIPTOR_TERMINATOR:
+                break
+            if desc[0] == ISO_DESCRIPTOR_PRIMARY and primary is None:
+                primary = desc
+            elif (desc[0] == ISO_DESCRIPTOR_SUPPLEMENTARY and
+                    desc[88:91] in ISO_JOLIET_ESCAPES and joliet is None):
+                joliet = desc
+        if primary is None:
+            raise ImageError('No ISO9660 primary volume descriptor')
+        self._block_size = struct.unpack_from('<H', primary, 128)[0]
+        if self._block_size not in (512, 1024, 2048):
+            raise ImageError(
+                'Unsupported ISO9660 block size %d' % self._block_size)
+
+        self.joliet = False
+        self.root = self._root_entry(primary)
+        self._susp_skip = self._find_rock_ridge(self.root)
+        self.rock_ridge = self._susp_skip is not None
+        if not self.rock_ridge and joliet is not None:
+            self.joliet = True
+            self.root = self._root_entry(joliet)
+        # Only Joliet names are matched in any case, as Linux defaults to
+        # check=relaxed for Joliet and to check=strict otherwise
+        self.casefold = self.joliet
+
+    def _root_entry(self, desc):
+        record = desc[156:190]
+        (_name, flags, location, size, _system_use) = self._parse_record(
+            record)
+        if not flags & ISO_FLAG_DIRECTORY:
+            raise ImageError('ISO9660 root is not a directory')
+        return self._dir_entry('', location, size)
+
+    def _dir_entry(self, name, location, size):
+        return _Entry(name, True, location, size,
+                      [(location * self._block_size, size)])
+
+    def _parse_record(self, record):
+        if len(record) < 34 or record[0] < 34 or record[0] > len(record):
+            raise ImageError('Invalid ISO9660 directory record')
+        record = record[:record[0]]
+        ext_attr_length = record[1]
+        location = struct.unpack_from('<I', record, 2)[0] + ext_attr_length
+        size = struct.unpack_from('<I', record, 10)[0]
+        flags = record[25]
+        name_length = record[32]
+        if 33 + name_length > len(record):
+            raise ImageError('Invalid ISO9660 directory record name')
+        name = record[33:33 + name_length]
+        system_use = record[33 + name_length + (1 - name_length % 2):]
+        return name, flags, location, size, system_use
+
+    def _records(self, data):
+        """Yield the directory records of a directory's content."""
+        pos = 0
+        while pos < len(data):
+            length = data[pos]
+            if length == 0:
+                # Records do not span sectors, the rest of this one is unused
+                pos = (pos // ISO_SECTOR_SIZE + 1) * ISO_SECTOR_SIZE
+                continue
+            yield data[pos:pos + length]
+            pos += length
+
+    def _find_rock_ridge(self, root):
+        """Return the bytes skipped in System Use areas if Rock Ridge is used.
+
+        The SUSP 'SP' entry of the first record of the root directory marks
+        the use of Rock Ridge.
+        """
+        data = self._pread(root.extents[0][0], min(root.size, 256))
+        record = next(self._records(data), b'')
+        (_name, _flags, _location, _size, system_use) = self._parse_record(
+            record)
+        if (system_use[:2] == b'SP' and len(system_use) >= 7 and
+                system_use[4:6] == b'\xbe\xef'):
+            return system_use[6]
+        return None
+
+    def _susp_entries(self, system_use):
+        """Yield the SUSP entries of a System Use area and its continuations.
+        """
+        area = system_use[self._susp_skip:]
+        for _ in range(ISO_MAX_CONTINUATIONS):
+            continuation = None
+            pos = 0
+            while pos + 4 <= len(area):
+                signature = area[pos:pos + 2]
+                length = area[pos + 2]
+                if length < 4 or pos + length > len(area):
+                    break
+                entry = area[pos:pos + length]
+                pos += length
+                if signature == b'ST':
+                    break
+                elif signature == b'CE' and length >= 28:
+                    continuation = struct.unpack_from('<I', entry, 4)[0], \
+                        struct.unpack_from('<I', entry, 12)[0], \
+                        struct.unpack_from('<I', entry, 20)[0]
+                else:
+                    yield signature, entry
+            if continuation is None:
+                return
+            block, offset, length = continuation
+            area = self._pread(block * self._block_size + offset, length)
+        raise ImageError('Too many Rock Ridge continuation areas')
+
+    def _rock_ridge_entry(self, iso_name, flags, location, size,
+                          system_use):
+        """Return the Rock Ridge name, flags and location of a record.
+
+        The name is None for records which are hidden, relocated
+        directories and symbolic links.
+        """
+        name = b''
+        has_name = False
+        for signature, entry in self._susp_entries(system_use):
+            if signature == b'NM' and len(entry) >= 5:
+                if entry[4] & 0x06:
+                    # The current or parent directory
+                    return None, flags, location, size
+                name += entry[5:]
+                has_name = True
+            elif signature == b'RE' or signature == b'SL':
+                # Relocated directories are listed where their CL link is;
+                # symbolic links are not followed
+                return None, flags, location, size
+            elif signature == b'CL' and len(entry) >= 12:
+                location = struct.unpack_from('<I', entry, 4)[0]
+                data = self._pread(location * self._block_size, 256)
+                (_name, _flags, _loc, size, _su) = self._parse_record(
+                    next(self._records(data), b''))
+                flags |= ISO_FLAG_DIRECTORY
+        if has_name:
+            return os.fsdecode(name), flags, location, size
+        return _iso_name(iso_name), flags, location, size
+
+    def _read_dir(self, entry):
+        children = {}
+        pending = None
+        for record in self._records(self.read(entry)):
+            (iso_name, flags, location, size, system_use) = \
+                self._parse_record(record)
+            if iso_name in (b'\x00', b'\x01'):
+                continue
+            if self.rock_ridge:
+                (name, flags, location, size) = self._rock_ridge_entry(
+                    iso_name, flags, location, size, system_use)
+            elif self.joliet:
+                name = _joliet_name(iso_name)
+            else:
+                name = _iso_name(iso_name)
+            if pending is not None:
+                # A later part of a file spanning multiple extents
+                pending.extents.append((location * self._block_size, size))
+                pending.size += size
+                if not flags & ISO_FLAG_MULTI_EXTENT:
+                    pending = None
+                continue
+            if name is None or flags & ISO_FLAG_ASSOCIATED:
+                continue
+            if flags & ISO_FLAG_DIRECTORY:
+                child = self._dir_entry(name, location, size)
+            else:
+                child = _Entry(name, False, location, size,
+                               [(location * self._block_size, size)])
+                if flags & ISO_FLAG_MULTI_EXTENT:
+                    pending = child
+            children.setdefault(name, child)
+        return children
+
+
+def _fat_short_name(short, case_flags):
+    if short[0] == 0x05:
+        short = b'\xe5' + short[1:]
+    base = short[:8].rstrip(b' ').decode('cp437')
+    ext = short[8:].rstrip(b' ').decode('cp437')
+    if case_flags & FAT_LOWER_BASE:
+        base = base.lower()
+    if case_flags & FAT_LOWER_EXT:
+        ext = ext.lower()
+    return base + '.' + ext if ext else base
+
+
+def _fat_checksum(short):
+    total = 0
+    for byte in short:
+        total = (((total & 1) << 7) + (total >> 1) + byte) & 0xFF
+    return total
+
+
+class FatReader(_ImageReader):
+    """Read a FAT12, FAT16 or FAT32 image, with its long names."""
+
+    fstype = 'vfat'
+    casefold = True
+
+    def __init__(self, fileobj):
+        super(FatReader, self).__init__(fileobj)
+        boot = self._pread(0, 512)
+        if boot[510:512] != b'\x55\xaa' or boot[0] not in (0xEB, 0xE9):
+            raise ImageError('No FAT boot sector')
+        if boot[54:57] != b'FAT' and boot[82:87] != b'FAT32':
+            raise ImageError('No FAT filesystem type in boot sector')
+        (bytes_per_sector, sectors_per_cluster, reserved, fats, root_entries,
+         total_sectors, _media, fat_size) = struct.unpack_from(
+             '<HBHBHHBH', boot, 11)
+        if not total_sectors:
+            total_sectors = struct.unpack_from('<I', boot, 32)[0]
+        if not fat_size:
+            fat_size = struct.unpack_from('<I', boot, 36)[0]
+        if (bytes_per_sector not in (512, 1024, 2048, 4096) or
+                sectors_per_cluster not in (1, 2, 4, 8, 16, 32, 64, 128) or
+                not reserved or not fats or not fat_size):
+            raise ImageError('Invalid FAT boot sector parameters')
+
+        root_sectors = ((root_entries * FAT_DIR_ENTRY_SIZE +
+                         bytes_per_sector - 1) // bytes_per_sector)
+        first_data_sector = reserved + fats * fat_size + root_sectors
+        if total_sectors <= first_data_sector:
+            raise ImageError('FAT filesystem has no data region')
+        self._clusters = (
+            (total_sectors - first_data_sector) // sectors_per_cluster)
+        for limit, bits in FAT_CLUSTER_BITS:
+            if limit is None or self._clusters < limit:
+                self.fat_bits = bits
+                break
+        self._bytes_per_sector = bytes_per_sector
+        self._cluster_size = bytes_per_sector * sectors_per_cluster
+        self._fat_offset = reserved * bytes_per_sector
+        self._data_offset = first_data_sector * bytes_per_sector
+        self._fat_sectors = {}
+
+        if self.fat_bits == 32:
+            root_cluster = struct.unpack_from('<I', boot, 44)[0]
+            self.root = _Entry('', True, root_cluster, None)
+        else:
+            if not root_entries:
+                raise ImageError('FAT%d filesystem has no root directory' %
+                                 self.fat_bits)
+            root_offset = (reserved + fats * fat_size) * bytes_per_sector
+            root_size = root_entries * FAT_DIR_ENTRY_SIZE
+            self.root = _Entry('', True, None, root_size,
+                               [(root_offset, root_size)])
+
+    def _fat_sector(self, sector):
+        if sector not in self._fat_sectors:
+            self._fat_sectors[sector] = self._pread(
+                self._fat_offset + sector * self._bytes_per_sector,
+                self._bytes_per_sector)
+        return self._fat_sectors[sector]
+
+    def _next_cluster(self, cluster):
+        if self.fat_bits == 12:
+            offset, length = cluster + cluster // 2, 2
+        else:
+            offset, length = cluster * self.fat_bits // 8, self.fat_bits // 8
+        sector, start = divmod(offset, self._bytes_per_sector)
+        data = self._fat_sector(sector)
+        if start + length > len(data):
+            data += self._fat_sector(sector + 1)
+        value = int.from_bytes(data[start:start + length], 'little')
+        if self.fat_bits == 12:
+            return value >> 4 if cluster & 1 else value & 0xFFF
+        elif self.fat_bits == 32:
+            return value & 0x0FFFFFFF
+        return value
+
+    def _extents(self, entry):
+        if entry.extents is None:
+            extents = []
+            cluster = entry.location
+            for _ in range(self._clusters):
+                if not 2 <= cluster < FAT_BAD_CLUSTER[self.fat_bits]:
+                    break
+                if cluster >= self._clusters + 2:
+                    raise ImageError('%s has cluster %d out of range' %
+                                     (entry.name, cluster))
+                offset = self._data_offset + (cluster - 2) * self._cluster_size
+                if extents and sum(extents[-1]) == offset:
+                    extents[-1] = (extents[-1][0],
+                                   extents[-1][1] + self._cluster_size)
+                else:
+                    extents.append((offset, self._cluster_size))
+                cluster = self._next_cluster(cluster)
+            else:
+                raise ImageError('%s has a cluster chain loop' % entry.name)
+            entry.extents = extents
+            if entry.size is None:
+                entry.size = sum(length for _offset, length in extents)
+        return entry.extents
+
+    def _read_dir(self, entry):
+        self._extents(entry)
+        data = self.read(entry)
+        children = {}
+        long_parts = []
+        long_checksum = None
+        for pos in range(0, len(data) - FAT_DIR_ENTRY_SIZE + 1,
+                         FAT_DIR_ENTRY_SIZE):
+            record = data[pos:pos + FAT_DIR_ENTRY_SIZE]
+            if record[0] == 0:
+                break
+            attr = record[11]
+            if record[0] == FAT_DELETED:
+                long_parts = []
+                continue
+            if attr & 0x3F == FAT_ATTR_LONG_NAME:
+                order = record[0]
+                if order & FAT_LONG_NAME_LAST:
+                    long_parts = []
+                    long_checksum = record[13]
+                elif (not long_parts or record[13] != long_checksum or
+                        order != (long_parts[-1][0] & 0x1F) - 1):
+                    long_parts = []
+                    continue
+                long_parts.append(
+                    (order, record[1:11] + record[14:26] + record[28:32]))
+                continue
+            if attr & FAT_ATTR_VOLUME_ID:
+                long_parts = []
+                continue
+            short = record[:11]
+            name = None
+            if (long_parts and long_checksum == _fat_checksum(short) and
+                    long_parts[-1][0] & 0x1F == 1):
+                raw = b''.join(part for _order, part in reversed(long_parts))
+                name = raw.decode('utf-16-le', 'replace').split('\x00')[0]
+            long_parts = []
+            if not name:
+                name = _fat_short_name(short, record[12])
+            if name in ('.', '..'):
+                continue
+            cluster = struct.unpack_from('<H', record, 26)[0]
+            if self.fat_bits == 32:
+                cluster |= struct.unpack_from('<H', record, 20)[0] << 16
+            if attr & FAT_ATTR_DIRECTORY:
+                child = _Entry(name, True, cluster, None)
+            else:
+                size = struct.unpack_from('<I', record, 28)[0]
+                child = _Entry(name, False, cluster, size,
+                               [] if not size else None)
+            children.setdefault(name, child)
+        return children
+
+
+class FilesystemView(Mapping):
+    """A read-only view of the files of a filesystem image, by path.
+
+    Paths are relative to the root of the filesystem, such as
+    'openstack/latest/meta_data.json', and files are read when looked up.
+    The methods named as in os and os.path take such paths too.
+    """
+
+    def __init__(self, name, reader):
+        self.name = name
+        self.fstype = reader.fstype
+        self._reader = reader
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return '%s(%r, %s)' % (self.__class__.__name__, self.name,
+                               self.fstype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._reader.close()
+
+    def _lookup(self, path):
+        entry = self._reader.root
+        for name in posixpath.normpath('/' + path).split('/'):
+            if not name:
+                continue
+            if not entry.is_dir:
+                return None
+            entry = self._reader.lookup(entry, name)
+            if entry is None:
+                return None
+        return entry
+
+    def _walk(self, entry, prefix, ancestors=()):
+        # Locations of the directories above, to stop at a corrupt image
+        # with a directory inside itself
+        ancestors += (entry.location,)
+        for name, child in self._reader.children(entry).items():
+            path = prefix + name
+            if child.is_dir:
+                if child.location in ancestors:
+                    raise ImageError('Directory %s contains itself' % path)
+                yield from self._walk(child, path + '/', ancestors)
+            else:
+                yield path
+
+    def __getitem__(self, path):
+        entry = self._lookup(path)
+        if entry is None or entry.is_dir:
+            raise KeyError(path)
+        return self._reader.read(entry)
+
+    def __iter__(self):
+        return self._walk(self._reader.root, '')
+
+    def __len__(self):
+        return sum(1 for _path in self)
+
+    def exists(self, path):
+        return self._lookup(path) is not None
+
+    def isfile(self, path):
+        entry = self._lookup(path)
+        return entry is not None and not entry.is_dir
+
+    def isdir(self, path):
+        entry = self._lookup(path)
+        return entry is not None and entry.is_dir
+
+    def listdir(self, path=''):
+        entry = self._lookup(path)
+        if entry is None:
+            raise FileNotFoundError(
+                errno.ENOENT, os.strerror(errno.ENOENT), path)
+        if not entry.is_dir:
+            raise NotADirectoryError(
+                errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+        return list(self._reader.children(entry))
+
+    def read(self, path, decode=True):
+        """Return the content of file path, as util.load_file does.
+
+        IOError is raised if it does not exist, as for a missing file of a
+        mounted filesystem.
+        """
+        entry = self._lookup(path)
+        if entry is None:
+            raise FileNotFoundError(
+                errno.ENOENT, os.strerror(errno.ENOENT), path)
+        if entry.is_dir:
+            raise IsADirectoryError(
+                errno.EISDIR, os.strerror(errno.EISDIR), path)
+        content = self._reader.read(entry)
+        LOG.debug("Read %s bytes from %s of %s", len(content), path,
+                  self.name)
+        if decode:
+            return content.decode('utf-8')
+        return content
+
+
+def _allows(mtypes, fstypes):
+    if not mtypes:
+        return True
+    return any(mtype in ANY_TYPES or mtype in fstypes for mtype in mtypes)
+
+
+def open_image(device, mtypes=None):
+    """Return a FilesystemView of the ISO9660 or FAT filesystem of device.
+
+    @param device: Path of the block device or image file to read.
+    @param mtypes: Optional list of filesystem types, as passed to mount, the
+        device is read as. 'auto' allows any filesystem.
+
+    @raises ImageError: If the device holds no filesystem of mtypes which
+        can be read. OSError is raised if the device cannot be opened.
+    """
+    readers = []
+    if _allows(mtypes, ISO9660_TYPES):
+        readers.append(Iso9660Reader)
+    if _allows(mtypes, FAT_TYPES):
+        readers.append(FatReader)
+    if not readers:
+        raise ImageError('Filesystem types %s cannot be read' % (mtypes,))
+
+    fileobj = open(device, 'rb')
+    errors = []
+    for reader in readers:
+        try:
+            return FilesystemView(device, reader(fileobj))
+        except ImageError as e:
+            errors.append(str(e))
+        except Exception:
+            fileobj.close()
+            raise
+    fileobj.close()
+    raise ImageError('%s holds no readable filesystem: %s' %
+                     (device, '; '.join(errors)))
+
+# vi: ts=4 expandtab
@@ -162,9 +162,8 @@ class Runners(object):
             sem_path = self.paths.get_cpath("sem")
         if not sem_path:
             return None
-        if sem_path not in self.sems:
-            self.sems[sem_path] = FileSemaphores(sem_path)
-        return self.sems[sem_path]
+        # setdefault keeps a single instance when modules run concurrently
+        return self.sems.setdefault(sem_path, FileSemaphores(sem_path))
 
     def run(self, name, functor, args, freq=None, clear_on_fail=False):
         sem = self._get_sem(freq)
@@ -342,6 +341,7 @@ class Paths(persistence.CloudInitPickleMixin):
             "userdata_raw": "user-data.txt",
             "userdata": "user-data.txt.i",
             "obj_pkl": "obj.pkl",
+            "obj_cache": "obj.cache",
             "cloud_config": "cloud-config.txt",
             "vendor_cloud_config": "vendor-cloud-config.txt",
             "vendor2_cloud_config": "vendor2-cloud-config.txt",
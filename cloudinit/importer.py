@@ -8,8 +8,20 @@
 #
 # This file is part of cloud-init. See LICENSE file for license information.
 
+import json
+import os
 import sys
 
+# Index of the config modules and datasources shipped, written by setup.py
+# when building
+MODULE_INDEX_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'module-index.json')
+# Dependencies of each datasource class are checked against these, as well
+# as the dependencies the module declares.
+INDEX_DEPENDS = ((), ('FILESYSTEM',), ('FILESYSTEM', 'NETWORK'))
+
+_MODULE_INDEX = None
+
 
 def import_module(module_name):
     __import__(module_name)
@@ -45,4 +57,107 @@ def find_module(base_name, search_paths, required_attrs=None):
             found_paths.append(full_path)
     return (found_paths, lookup_paths)
 
+
+def _index_config_module(mod):
+    from cloudinit import config
+
+    # Attributes as config.fixup_module would set them, without changing mod
+    return {'module': mod.__name__,
+            'frequency': getattr(mod, 'frequency', config.PER_INSTANCE),
+            'distros': list(getattr(mod, 'distros', []))}
+
+
+def _index_datasource_module(mod):
+    """Return the index entry of a DataSource* module.
+
+    The (class name, dependencies) pairs of its datasources list are kept
+    when its get_datasource_list returns the classes of that list whose
+    dependencies match, else they are None and the module must be imported
+    to list its datasources.
+    """
+    from cloudinit import sources
+
+    entry = {'module': mod.__name__, 'datasources': None}
+    datasources = getattr(mod, 'datasources', None)
+    if not isinstance(datasources, (list, tuple)):
+        return entry
+    depends = set(INDEX_DEPENDS)
+    depends.update(tuple(sorted(deps)) for _cls, deps in datasources)
+    for deps in depends:
+        expected = sources.list_from_depends(deps, datasources)
+        if mod.get_datasource_list(list(deps)) != expected:
+            return entry
+    entry['datasources'] = [
+        (cls.__name__, sorted(deps)) for cls, deps in datasources]
+    return entry
+
+
+def build_module_index():
+    """Return the index of the config modules and datasources shipped.
+
+    Config modules are indexed by name with their module path, frequency
+    and distros, datasource modules with their module path and the
+    dependencies of their datasources. Modules which can not be imported
+    are not indexed.
+    """
+    from cloudinit import config
+    from cloudinit import sources
+    from cloudinit import util
+
+    index = {'modules': {}, 'datasources': {}}
+    for kind, pkg, prefix, required_attr, indexer in (
+            ('modules', config, config.MOD_PREFIX, 'handle',
+             _index_config_module),
+            ('datasources', sources, sources.DS_PREFIX,
+             'get_datasource_list', _index_datasource_module)):
+        pkg_dir = os.path.dirname(os.path.abspath(pkg.__file__))
+        for mod_name in sorted(util.find_modules(pkg_dir).values()):
+            if not mod_name.startswith(prefix):
+                continue
+            try:
+                mod = import_module('%s.%s' % (pkg.__name__, mod_name))
+            except ImportError:
+                continue
+            if hasattr(mod, required_attr):
+                index[kind][mod_name] = indexer(mod)
+    return index
+
+
+def write_module_index(index_file):
+    """Write the index of the config modules and datasources to index_file.
+    """
+    with open(index_file, 'w') as stream:
+        json.dump(build_module_index(), stream, indent=1, sort_keys=True)
+        stream.write('\n')
+
+
+def get_module_index():
+    """Return the index written to MODULE_INDEX_FILE, empty if unreadable."""
+    global _MODULE_INDEX
+    if _MODULE_INDEX is None:
+        try:
+            with open(MODULE_INDEX_FILE) as stream:
+                _MODULE_INDEX = json.load(stream)
+        except (IOError, ValueError):
+            _MODULE_INDEX = {}
+    return _MODULE_INDEX
+
+
+def find_indexed_module(kind, base_name, search_paths):
+    """Return the index entry of base_name, or None if not indexed.
+
+    Indexed modules are imported from the module path of their entry
+    rather than by trying to import base_name in each of search_paths.
+
+    @param kind: 'modules' or 'datasources'.
+    @param base_name: Name of the module, such as cc_ntp or DataSourceEc2.
+    @param search_paths: Packages base_name is looked up in, as passed to
+        find_module. The entry is only returned when its module is in one
+        of them.
+    """
+    entry = get_module_index().get(kind, {}).get(base_name)
+    if entry and entry['module'].rpartition('.')[0] in search_paths:
+        return entry
+    return None
+
 # vi: ts=4 expandtab
@@ -16,7 +16,15 @@ MERGER_PREFIX = 'm_'
 MERGER_ATTR = 'Merger'
 
 
+# Merger roots constructed for each distinct list of parsed mergers
+_CONSTRUCTED = {}
+
+
 class UnknownMerger(object):
+    def __init__(self):
+        # Method merging values of each type, found on first use
+        self._type_methods = {}
+
     # Named differently so auto-method finding
     # doesn't pick this up if there is ever a type
     # named "unknown"
@@ -31,17 +39,20 @@ class UnknownMerger(object):
     # If not found the merge will be given to a '_handle_unknown'
     # function which can decide what to do wit the 2 values.
     def merge(self, source, merge_with):
-        type_name = type_utils.obj_name(source)
-        type_name = type_name.lower()
-        method_name = "_on_%s" % (type_name)
-        meth = None
-        args = [source, merge_with]
-        if hasattr(self, method_name):
-            meth = getattr(self, method_name)
+        source_type = type(source)
+        try:
+            (meth, method_name) = self._type_methods[source_type]
+        except KeyError:
+            type_name = type_utils.obj_name(source)
+            type_name = type_name.lower()
+            method_name = "_on_%s" % (type_name)
+            meth = None
+            if hasattr(self, method_name):
+                meth = getattr(self, method_name)
+            self._type_methods[source_type] = (meth, method_name)
         if not meth:
-            meth = self._handle_unknown
-            args.insert(0, method_name)
-        return meth(*args)
+            return self._handle_unknown(method_name, source, merge_with)
+        return meth(source, merge_with)
 
 
 class LookupMerger(UnknownMerger):
@@ -51,6 +62,8 @@ class LookupMerger(UnknownMerger):
             self._lookups = []
         else:
             self._lookups = lookups
+        self._found_methods = {}
+        self._found_count = 0
 
     def __str__(self):
         return 'LookupMerger: (%s)' % (len(self._lookups))
@@ -60,14 +73,24 @@ class LookupMerger(UnknownMerger):
     # find which one of those objects can perform the merge. If
     # any of the contained objects have the needed method, they
     # will be called to perform the merge.
-    def _handle_unknown(self, meth_wanted, value, merge_with):
-        meth = None
+    def _find_method(self, meth_wanted):
         for merger in self._lookups:
             if hasattr(merger, meth_wanted):
                 # First one that has that method/attr gets to be
                 # the one that will be called
-                meth = getattr(merger, meth_wanted)
-                break
+                return getattr(merger, meth_wanted)
+        return None
+
+    def _handle_unknown(self, meth_wanted, value, merge_with):
+        # Found methods are kept until mergers are added to the lookups
+        if self._found_count != len(self._lookups):
+            self._found_methods = {}
+            self._found_count = len(self._lookups)
+        try:
+            meth = self._found_methods[meth_wanted]
+        except KeyError:
+            meth = self._found_methods[meth_wanted] = self._find_method(
+                meth_wanted)
         if not meth:
             return UnknownMerger._handle_unknown(self, meth_wanted,
                                                  value, merge_with)
@@ -125,6 +148,23 @@ def default_mergers():
 
 
 def construct(parsed_mergers):
+    """Return the root merger of parsed_mergers.
+
+    Mergers keep no state between merges, so the root merger of each
+    distinct list of parsed mergers is only constructed once.
+    """
+    try:
+        key = tuple((m_name, tuple(m_ops)) for (m_name, m_ops)
+                    in parsed_mergers)
+        hash(key)
+    except TypeError:
+        return _construct(parsed_mergers)
+    if key not in _CONSTRUCTED:
+        _CONSTRUCTED[key] = _construct(parsed_mergers)
+    return _CONSTRUCTED[key]
+
+
+def _construct(parsed_mergers):
     mergers_to_be = []
     for (m_name, m_ops) in parsed_mergers:
         if not m_name.startswith(MERGER_PREFIX):
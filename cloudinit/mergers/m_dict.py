@@ -43,32 +43,42 @@ class Merger(object):
         def merge_same_key(old_v, new_v):
             if do_replace:
                 return new_v
+            # Nested dicts are checked first as they are the most common
+            if isinstance(new_v, (dict)) and self._recurse_dict:
+                return self._merger.merge(old_v, new_v)
             if isinstance(new_v, (list, tuple)) and self._recurse_array:
                 return self._merger.merge(old_v, new_v)
             if isinstance(new_v, str) and self._recurse_str:
                 return self._merger.merge(old_v, new_v)
-            if isinstance(new_v, (dict)) and self._recurse_dict:
-                return self._merger.merge(old_v, new_v)
             # Otherwise leave it be...
             return old_v
 
+        # Copy on write: value is only copied once a key of it changes, so
+        # dicts which the merge leaves as they were are not copied.
+        merged = value
         for (k, v) in merge_with.items():
-            if k in value:
+            if k in merged:
                 if v is None and self._allow_delete:
-                    value.pop(k)
-                else:
-                    value[k] = merge_same_key(value[k], v)
-            else:
-                value[k] = v
-        return value
+                    if merged is value:
+                        merged = dict(value)
+                    merged.pop(k)
+                    continue
+                old_v = merged[k]
+                v = merge_same_key(old_v, v)
+                if v is old_v:
+                    continue
+            if merged is value:
+                merged = dict(value)
+            merged[k] = v
+        return merged
 
     def _on_dict(self, value, merge_with):
         if not isinstance(merge_with, (dict)):
             return value
         if self._method == 'replace':
-            merged = self._do_dict_replace(dict(value), merge_with, True)
+            merged = self._do_dict_replace(value, merge_with, True)
         elif self._method == 'no_replace':
-            merged = self._do_dict_replace(dict(value), merge_with, False)
+            merged = self._do_dict_replace(value, merge_with, False)
         else:
             raise NotImplementedError("Unknown merge type %s" % (self._method))
         return merged
@@ -11,11 +11,13 @@ import ipaddress
 import logging
 import os
 import re
+import types
+from collections import OrderedDict, namedtuple
 
 from cloudinit import subp
 from cloudinit import util
 from cloudinit.net.network_state import mask_to_net_prefix
-from cloudinit.url_helper import UrlError, readurl
+from cloudinit.url_helper import UrlError, get_connection_pool, readurl
 
 LOG = logging.getLogger(__name__)
 SYS_CLASS_NET = "/sys/class/net/"
@@ -364,6 +366,199 @@ def get_devicelist():
     return devs
 
 
+NetDevice = namedtuple('NetDevice', [
+    'name', 'address', 'perm_hwaddr', 'addr_assign_type', 'name_assign_type',
+    'carrier', 'dormant', 'operstate', 'type', 'devtype', 'driver',
+    'device_id', 'features', 'master', 'is_bridge', 'is_bond',
+    'is_bonding_slave', 'has_ovs_upper'])
+
+
+def _read_sys_attr(dev_path, attr):
+    """Return the stripped contents of a sysfs attribute, or None."""
+    try:
+        with open(os.path.join(dev_path, attr)) as stream:
+            return stream.read().strip()
+    except (OSError, IOError, UnicodeDecodeError):
+        return None
+
+
+def _read_sys_attr_int(dev_path, attr):
+    value = _read_sys_attr(dev_path, attr)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_net_device(devname):
+    """Return a NetDevice of all sysfs attributes of the device devname.
+
+    Missing or unreadable attributes are None, as are the device/features of
+    devices not using the virtio_net driver, which netfailover checks only
+    need for those devices.
+    """
+    dev_path = sys_dev_path(devname)
+    driver = None
+    driver_path = os.path.join(dev_path, 'device/driver')
+    if os.path.islink(driver_path):
+        driver = os.path.basename(os.readlink(driver_path))
+    master = None
+    master_path = os.path.join(dev_path, 'master')
+    if os.path.exists(master_path):
+        master = os.path.basename(os.path.realpath(master_path))
+    is_bonding_slave = os.path.isdir(os.path.join(dev_path, 'bonding_slave'))
+    devtype = None
+    for line in (_read_sys_attr(dev_path, 'uevent') or '').splitlines():
+        if line.startswith('DEVTYPE='):
+            devtype = line[len('DEVTYPE='):]
+    return NetDevice(
+        name=devname,
+        address=_read_sys_attr(dev_path, 'address'),
+        perm_hwaddr=(_read_sys_attr(dev_path, 'bonding_slave/perm_hwaddr')
+                     if is_bonding_slave else None),
+        addr_assign_type=_read_sys_attr_int(dev_path, 'addr_assign_type'),
+        name_assign_type=_read_sys_attr(dev_path, 'name_assign_type'),
+        carrier=_read_sys_attr_int(dev_path, 'carrier'),
+        dormant=_read_sys_attr_int(dev_path, 'dormant'),
+        operstate=_read_sys_attr(dev_path, 'operstate'),
+        type=_read_sys_attr(dev_path, 'type'),
+        devtype=devtype,
+        driver=driver,
+        device_id=_read_sys_attr(dev_path, 'device/device'),
+        features=(_read_sys_attr(dev_path, 'device/features')
+                  if driver == 'virtio_net' else None),
+        master=master,
+        is_bridge=os.path.exists(os.path.join(dev_path, 'bridge')),
+        is_bond=os.path.exists(os.path.join(dev_path, 'bonding')),
+        is_bonding_slave=is_bonding_slave,
+        has_ovs_upper=os.path.exists(
+            os.path.join(dev_path, 'upper_ovs-system')))
+
+
+class NetDeviceSnapshot(object):
+    """An immutable view of the network devices in sysfs.
+
+    All attributes the interface discovery helpers need are read in a single
+    pass over SYS_CLASS_NET when the snapshot is taken, instead of one file
+    at a time whenever a helper is called. Use get_net_snapshot() for the
+    snapshot shared by callers, and invalidate_net_snapshot() once devices
+    were renamed, added or their link state changed.
+    """
+
+    def __init__(self, devices, source=None):
+        self._devices = types.MappingProxyType(
+            OrderedDict((device.name, device) for device in devices))
+        self.source = source
+
+    @classmethod
+    def from_sysfs(cls):
+        """Take a snapshot of the devices in get_devicelist()."""
+        names = tuple(get_devicelist())
+        return cls([read_net_device(name) for name in names],
+                   source=(sys_dev_path(''), names))
+
+    @property
+    def devices(self):
+        """A read-only mapping of device names to NetDevice tuples."""
+        return self._devices
+
+    def __iter__(self):
+        return iter(self._devices)
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __contains__(self, name):
+        return name in self._devices
+
+    def __getitem__(self, name):
+        return self._devices[name]
+
+    def get(self, name, default=None):
+        return self._devices.get(name, default)
+
+    def interface_mac(self, name):
+        """Return the MAC of name, the permanent one for bond slaves."""
+        device = self._devices[name]
+        if device.is_bonding_slave:
+            return device.perm_hwaddr
+        return device.address
+
+    def ib_interface_hwaddr(self, name, ethernet_format):
+        """As get_ib_interface_hwaddr, for a device in the snapshot."""
+        # Type 32 is Infiniband.
+        if self._devices[name].type == '32':
+            mac = self.interface_mac(name)
+            if mac and ethernet_format:
+                # Use bytes 13-15 and 18-20 of the hardware address.
+                mac = mac[36:-14] + mac[51:]
+            return mac
+
+    def has_own_mac(self, name):
+        """As interface_has_own_mac, for a device in the snapshot."""
+        assign_type = self._devices[name].addr_assign_type
+        return assign_type is None or assign_type in (0, 1, 3)
+
+    def is_up(self, name):
+        """As is_up, for a device in the snapshot."""
+        return self._devices[name].operstate in ('up', 'unknown')
+
+    def is_renamed(self, name):
+        """As is_renamed, for a device in the snapshot."""
+        return self._devices[name].name_assign_type in ('3', '4')
+
+    def master_is_bridge_or_bond(self, name):
+        """As master_is_bridge_or_bond, for a device in the snapshot."""
+        master = self.get(self._devices[name].master)
+        return master is not None and (master.is_bridge or master.is_bond)
+
+    def _has_netfail_standby_feature(self, device):
+        features = device.features
+        if not features or len(features) < 64:
+            return False
+        return features[62] == "1"
+
+    def is_netfailover(self, name):
+        """As is_netfailover, for a device in the snapshot."""
+        device = self._devices[name]
+        if device.master is None:
+            return False
+        if device.driver == 'virtio_net':
+            # netfail standby
+            return self._has_netfail_standby_feature(device)
+        # netfail primary
+        master = self.get(device.master)
+        return (master is not None and master.driver == 'virtio_net' and
+                self._has_netfail_standby_feature(master))
+
+
+_net_snapshot = None
+
+
+def get_net_snapshot():
+    """Return the shared NetDeviceSnapshot, taking it if needed.
+
+    A new snapshot is also taken when devices were added or removed since.
+    """
+    global _net_snapshot
+    snapshot = _net_snapshot
+    if (snapshot is None or
+            snapshot.source != (sys_dev_path(''), tuple(get_devicelist()))):
+        snapshot = NetDeviceSnapshot.from_sysfs()
+        _net_snapshot = snapshot
+    return snapshot
+
+
+def invalidate_net_snapshot():
+    """Discard the shared NetDeviceSnapshot, so the next one is read anew.
+
+    Call this after renaming devices, changing their link state or when a
+    netlink event reports that a device changed.
+    """
+    global _net_snapshot
+    _net_snapshot = None
+
+
 class ParserError(Exception):
     """Raised when a parser has issue parsing a file/content."""
 
@@ -418,21 +613,27 @@ def find_fallback_nic_on_linux(blacklist_drivers=None):
     if not blacklist_drivers:
         blacklist_drivers = []
 
+    # The carrier, dormant and operstate of devices are read again, as their
+    # link may have come up since the shared snapshot was taken.
+    invalidate_net_snapshot()
     if 'net.ifnames=0' in util.get_cmdline():
         LOG.debug('Stable ifnames disabled by net.ifnames=0 in /proc/cmdline')
     else:
-        unstable = [device for device in get_devicelist()
-                    if device != 'lo' and not is_renamed(device)]
+        snapshot = get_net_snapshot()
+        unstable = [device for device in snapshot
+                    if device != 'lo' and not snapshot.is_renamed(device)]
         if len(unstable):
             LOG.debug('Found unstable nic names: %s; calling udevadm settle',
                       unstable)
             msg = 'Waiting for udev events to settle'
             util.log_time(LOG.debug, msg, func=util.udevadm_settle)
+            invalidate_net_snapshot()
 
     # get list of interfaces that could have connections
+    snapshot = get_net_snapshot()
     invalid_interfaces = set(['lo'])
-    potential_interfaces = set([device for device in get_devicelist()
-                                if device_driver(device) not in
+    potential_interfaces = set([device for device in snapshot
+                                if snapshot[device].driver not in
                                 blacklist_drivers])
     potential_interfaces = potential_interfaces.difference(invalid_interfaces)
     # sort into interfaces with carrier, interfaces which could have carrier,
@@ -440,30 +641,29 @@ def find_fallback_nic_on_linux(blacklist_drivers=None):
     connected = []
     possibly_connected = []
     for interface in potential_interfaces:
+        device = snapshot[interface]
         if interface.startswith("veth"):
             continue
-        if is_bridge(interface):
+        if device.is_bridge:
             # skip any bridges
             continue
-        if is_bond(interface):
+        if device.is_bond:
             # skip any bonds
             continue
-        if is_netfailover(interface):
+        if snapshot.is_netfailover(interface):
             # ignore netfailover primary/standby interfaces
             continue
-        carrier = read_sys_net_int(interface, 'carrier')
-        if carrier:
+        if device.carrier:
             connected.append(interface)
             continue
         # check if nic is dormant or down, as this may make a nick appear to
         # not have a carrier even though it could acquire one when brought
         # online by dhclient
-        dormant = read_sys_net_int(interface, 'dormant')
-        if dormant:
+        if device.dormant:
             possibly_connected.append(interface)
             continue
-        operstate = read_sys_net_safe(interface, 'operstate')
-        if operstate in ['dormant', 'down', 'lowerlayerdown', 'unknown']:
+        if device.operstate in ['dormant', 'down', 'lowerlayerdown',
+                                'unknown']:
             possibly_connected.append(interface)
             continue
 
@@ -483,7 +683,7 @@ def find_fallback_nic_on_linux(blacklist_drivers=None):
 
     # pick the first that has a mac-address
     for name in names:
-        if read_sys_net_safe(name, 'address'):
+        if snapshot[name].address:
             return name
     return None
 
@@ -616,6 +816,7 @@ def _get_current_rename_info(check_downable=True):
          }}
     """
     cur_info = {}
+    snapshot = get_net_snapshot()
     for (name, mac, driver, device_id) in get_interfaces():
         cur_info[name] = {
             'downable': None,
@@ -623,7 +824,7 @@ def _get_current_rename_info(check_downable=True):
             'driver': driver,
             'mac': mac.lower(),
             'name': name,
-            'up': is_up(name),
+            'up': snapshot.is_up(name),
         }
 
     if check_downable:
@@ -779,13 +980,16 @@ def _rename_interfaces(renames, strict_present=True, strict_busy=True,
     else:
         LOG.debug("achieving renaming of %s with ops %s", renames, ops + ups)
 
-        for op, mac, new_name, params in ops + ups:
-            try:
-                opmap.get(op)(*params)
-            except Exception as e:
-                errors.append(
-                    "[unknown] Error performing %s%s for %s, %s: %s" %
-                    (op, params, mac, new_name, e))
+        try:
+            for op, mac, new_name, params in ops + ups:
+                try:
+                    opmap.get(op)(*params)
+                except Exception as e:
+                    errors.append(
+                        "[unknown] Error performing %s%s for %s, %s: %s" %
+                        (op, params, mac, new_name, e))
+        finally:
+            invalidate_net_snapshot()
 
     if len(errors):
         raise Exception('\n'.join(errors))
@@ -893,6 +1097,7 @@ def get_interfaces_by_mac_on_linux(blacklist_drivers=None) -> dict:
 
     Bridges and any devices that have a 'stolen' mac are excluded."""
     ret = {}
+    snapshot = get_net_snapshot()
     for name, mac, _driver, _devid in get_interfaces(
             blacklist_drivers=blacklist_drivers):
         if mac in ret:
@@ -902,7 +1107,7 @@ def get_interfaces_by_mac_on_linux(blacklist_drivers=None) -> dict:
         ret[mac] = name
         # Try to get an Infiniband hardware address (in 6 byte Ethernet format)
         # for the interface.
-        ib_mac = get_ib_interface_hwaddr(name, True)
+        ib_mac = snapshot.ib_interface_hwaddr(name, True)
         if ib_mac:
             if ib_mac in ret:
                 raise RuntimeError(
@@ -919,25 +1124,26 @@ def get_interfaces(blacklist_drivers=None) -> list:
     ret = []
     if blacklist_drivers is None:
         blacklist_drivers = []
-    devs = get_devicelist()
+    snapshot = get_net_snapshot()
     # 16 somewhat arbitrarily chosen.  Normally a mac is 6 '00:' tokens.
     zero_mac = ':'.join(('00',) * 16)
-    for name in devs:
-        if not interface_has_own_mac(name):
+    for name in snapshot:
+        device = snapshot[name]
+        if not snapshot.has_own_mac(name):
             continue
-        if is_bridge(name):
+        if device.is_bridge:
             continue
-        if is_vlan(name):
+        if device.devtype == 'vlan':
             continue
-        if is_bond(name):
+        if device.is_bond:
             continue
-        if get_master(name) is not None:
-            if (not master_is_bridge_or_bond(name) and
-                    not master_is_openvswitch(name)):
+        if device.master is not None:
+            if (not snapshot.master_is_bridge_or_bond(name) and
+                    not device.has_ovs_upper):
                 continue
-        if is_netfailover(name):
+        if snapshot.is_netfailover(name):
             continue
-        mac = get_interface_mac(name)
+        mac = snapshot.interface_mac(name)
         # some devices may not have a mac (tun0)
         if not mac:
             continue
@@ -947,10 +1153,10 @@ def get_interfaces(blacklist_drivers=None) -> list:
         if is_openvswitch_internal_interface(name):
             continue
         # skip nics that have drivers blacklisted
-        driver = device_driver(name)
+        driver = device.driver
         if driver in blacklist_drivers:
             continue
-        ret.append((name, mac, driver, device_devid(name)))
+        ret.append((name, mac, driver, device.device_id))
     return ret
 
 
@@ -958,8 +1164,9 @@ def get_ib_hwaddrs_by_interface():
     """Build a dictionary mapping Infiniband interface names to their hardware
     address."""
     ret = {}
+    snapshot = get_net_snapshot()
     for name, _, _, _ in get_interfaces():
-        ib_mac = get_ib_interface_hwaddr(name, False)
+        ib_mac = snapshot.ib_interface_hwaddr(name, False)
         if ib_mac:
             if ib_mac in ret:
                 raise RuntimeError(
@@ -1091,8 +1298,14 @@ class EphemeralIPv4Network(object):
 
     def __exit__(self, excp_type, excp_value, excp_traceback):
         """Teardown anything we set up."""
-        for cmd in self.cleanup_cmds:
-            subp.subp(cmd, capture=True)
+        try:
+            for cmd in self.cleanup_cmds:
+                subp.subp(cmd, capture=True)
+        finally:
+            if self.cleanup_cmds:
+                invalidate_net_snapshot()
+                # Pooled connections may be bound to the removed address
+                get_connection_pool().close()
 
     def _delete_address(self, address, prefix):
         """Perform the ip command to remove the specified address."""
@@ -1123,6 +1336,7 @@ class EphemeralIPv4Network(object):
             subp.subp(
                 ['ip', '-family', 'inet', 'link', 'set', 'dev', self.interface,
                  'up'], capture=True)
+            invalidate_net_snapshot()
             self.cleanup_cmds.append(
                 ['ip', '-family', 'inet', 'link', 'set', 'dev', self.interface,
                  'down'])
@@ -14,8 +14,10 @@ from io import StringIO
 
 from cloudinit.net import (
     EphemeralIPv4Network, find_fallback_nic, get_devicelist,
-    has_url_connectivity)
+    get_interface_mac, has_url_connectivity, invalidate_net_snapshot)
+from cloudinit.net import dhcp_client
 from cloudinit.net.network_state import mask_and_ipv4_to_bcast_addr as bcip
+from cloudinit import features
 from cloudinit import temp_utils
 from cloudinit import subp
 from cloudinit import util
@@ -135,7 +137,9 @@ def maybe_perform_dhcp_discovery(nic=None, dhcp_log_func=None):
     """Perform dhcp discovery if nic valid and dhclient command exists.
 
     If the nic is invalid or undiscoverable or dhclient command is not found,
-    skip dhcp_discovery and return an empty dict.
+    skip dhcp_discovery and return an empty dict. When the
+    EPHEMERAL_DHCP_BUILTIN_CLIENT feature is enabled, the builtin client is
+    tried before dhclient.
 
     @param nic: Name of the network interface we want to run dhclient on.
     @param dhcp_log_func: A callable accepting the dhclient output and error
@@ -153,6 +157,10 @@ def maybe_perform_dhcp_discovery(nic=None, dhcp_log_func=None):
         LOG.debug(
             'Skip dhcp_discovery: nic %s not found in get_devicelist.', nic)
         return []
+    if features.EPHEMERAL_DHCP_BUILTIN_CLIENT:
+        leases = builtin_dhcp_discovery(nic, dhcp_log_func)
+        if leases is not None:
+            return leases
     dhclient_path = subp.which('dhclient')
     if not dhclient_path:
         LOG.debug('Skip dhclient configuration: No dhclient command found.')
@@ -231,6 +239,7 @@ def dhcp_discovery(dhclient_cmd_path, interface, cleandir, dhcp_log_func=None):
     # link up before attempting discovery. Since we are using -sf /bin/true,
     # we need to do that "link up" ourselves first.
     subp.subp(['ip', 'link', 'set', 'dev', interface, 'up'], capture=True)
+    invalidate_net_snapshot()
     cmd = [sandbox_dhclient_cmd, '-1', '-v', '-lf', lease_file,
            '-pf', pid_file, interface, '-sf', '/bin/true']
     out, err = subp.subp(cmd, capture=True)
@@ -276,6 +285,37 @@ def dhcp_discovery(dhclient_cmd_path, interface, cleandir, dhcp_log_func=None):
     return parse_dhcp_lease_file(lease_file)
 
 
+def builtin_dhcp_discovery(interface, dhcp_log_func=None):
+    """Obtain a lease on the interface with the builtin DHCPv4 client.
+
+    @param interface: Name of the network interface to obtain a lease on.
+    @param dhcp_log_func: A callable accepting the output and error streams
+        of the client, which are empty and the progress of the exchange.
+
+    @return: A list holding the dict of the lease obtained, as parsed by
+        parse_dhcp_lease_file, or an empty list if no lease was obtained.
+        None if the builtin client can not be used on the interface.
+    """
+    mac = get_interface_mac(interface)
+    if not mac or len(mac.split(':')) != 6:
+        LOG.debug('Skip builtin dhcp client: %s has no ethernet address %s',
+                  interface, mac)
+        return None
+    LOG.debug('Performing a builtin dhcp discovery on %s', interface)
+    subp.subp(['ip', 'link', 'set', 'dev', interface, 'up'], capture=True)
+    invalidate_net_snapshot()
+    client = dhcp_client.DHCPv4Client(interface, mac)
+    try:
+        lease = client.request_lease()
+    except OSError as e:
+        LOG.warning('Builtin dhcp client failed on %s, using dhclient: %s',
+                    interface, e)
+        return None
+    if dhcp_log_func is not None:
+        dhcp_log_func('', '\n'.join(client.messages))
+    return [lease] if lease else []
+
+
 def networkd_parse_lease(content):
     """Parse a systemd lease file content as in /run/systemd/netif/leases/
 
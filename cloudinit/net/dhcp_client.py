@@ -0,0 +1,363 @@
+# This file is part of cloud-init. See LICENSE file for license information.
+
+"""A minimal DHCPv4 client to obtain ephemeral leases without dhclient.
+
+DHCPv4Client runs a single DISCOVER, OFFER, REQUEST, ACK exchange over a
+UDP socket bound to the interface, asking the server to broadcast its
+replies as the interface has no address yet. The lease is returned as the
+dict parse_dhcp_lease_file would return for the lease file dhclient writes,
+so it can be used wherever dhclient leases are.
+"""
+
+import logging
+import random
+import select
+import socket
+import struct
+import time
+from collections import namedtuple
+
+LOG = logging.getLogger(__name__)
+
+SERVER_PORT = 67
+CLIENT_PORT = 68
+BROADCAST_ADDRESS = '255.255.255.255'
+DHCP_TIMEOUT = 60
+RETRANSMIT_INTERVAL = 1
+MAX_RETRANSMIT_INTERVAL = 8
+MAX_PACKET_SIZE = 4096
+# Packets shorter than a BOOTP packet are dropped by some servers
+MIN_PACKET_SIZE = 300
+INFINITE_LEASE_TIME = 0xffffffff
+
+# https://tools.ietf.org/html/rfc2131#section-2
+BOOTREQUEST = 1
+BOOTREPLY = 2
+HTYPE_ETHER = 1
+BROADCAST_FLAG = 0x8000
+BOOTP_FMT = '!BBBBIHH4s4s4s4s16s64s128s'
+BOOTP_SIZE = struct.calcsize(BOOTP_FMT)
+MAGIC_COOKIE = b'\x63\x82\x53\x63'
+
+DHCPDISCOVER = 1
+DHCPOFFER = 2
+DHCPREQUEST = 3
+DHCPACK = 5
+DHCPNAK = 6
+
+# https://tools.ietf.org/html/rfc2132
+OPT_PAD = 0
+OPT_SUBNET_MASK = 1
+OPT_ROUTERS = 3
+OPT_DOMAIN_NAME_SERVERS = 6
+OPT_HOST_NAME = 12
+OPT_DOMAIN_NAME = 15
+OPT_INTERFACE_MTU = 26
+OPT_BROADCAST_ADDRESS = 28
+OPT_NTP_SERVERS = 42
+OPT_REQUESTED_ADDRESS = 50
+OPT_LEASE_TIME = 51
+OPT_OVERLOAD = 52
+OPT_MESSAGE_TYPE = 53
+OPT_SERVER_ID = 54
+OPT_PARAMETER_REQUEST_LIST = 55
+OPT_RENEWAL_TIME = 58
+OPT_REBINDING_TIME = 59
+OPT_CLASSLESS_STATIC_ROUTES = 121
+OPT_AZURE_ENDPOINT = 245
+OPT_END = 255
+
+# Names and value formats of options, as written to dhclient lease files.
+# Other options are written as unknown-<code>.
+LEASE_OPTIONS = {
+    OPT_SUBNET_MASK: ('subnet-mask', 'ip'),
+    OPT_ROUTERS: ('routers', 'ips'),
+    OPT_DOMAIN_NAME_SERVERS: ('domain-name-servers', 'ips'),
+    OPT_HOST_NAME: ('host-name', 'text'),
+    OPT_DOMAIN_NAME: ('domain-name', 'text'),
+    OPT_INTERFACE_MTU: ('interface-mtu', 'uint16'),
+    OPT_BROADCAST_ADDRESS: ('broadcast-address', 'ip'),
+    OPT_NTP_SERVERS: ('ntp-servers', 'ips'),
+    OPT_LEASE_TIME: ('dhcp-lease-time', 'uint32'),
+    OPT_MESSAGE_TYPE: ('dhcp-message-type', 'uint8'),
+    OPT_SERVER_ID: ('dhcp-server-identifier', 'ip'),
+    OPT_RENEWAL_TIME: ('dhcp-renewal-time', 'uint32'),
+    OPT_REBINDING_TIME: ('dhcp-rebinding-time', 'uint32'),
+    OPT_CLASSLESS_STATIC_ROUTES: ('rfc3442-classless-static-routes', 'bytes'),
+}
+REQUESTED_OPTIONS = (
+    OPT_SUBNET_MASK, OPT_BROADCAST_ADDRESS, OPT_ROUTERS, OPT_DOMAIN_NAME,
+    OPT_DOMAIN_NAME_SERVERS, OPT_HOST_NAME, OPT_INTERFACE_MTU,
+    OPT_CLASSLESS_STATIC_ROUTES, OPT_NTP_SERVERS, OPT_AZURE_ENDPOINT)
+
+DHCPPacket = namedtuple(
+    'DHCPPacket', ['op', 'xid', 'flags', 'ciaddr', 'yiaddr', 'siaddr',
+                   'chaddr', 'sname', 'file', 'options'])
+
+
+def encode_packet(op, xid, chaddr, options, yiaddr='0.0.0.0',
+                  siaddr='0.0.0.0', flags=BROADCAST_FLAG):
+    """Return the bytes of a DHCP packet.
+
+    @param op: BOOTREQUEST or BOOTREPLY.
+    @param xid: Transaction id of the exchange.
+    @param chaddr: Hardware address of the client as bytes.
+    @param options: List of (code, bytes) options, in order.
+    """
+    header = struct.pack(
+        BOOTP_FMT, op, HTYPE_ETHER, len(chaddr), 0, xid, 0, flags,
+        socket.inet_aton('0.0.0.0'), socket.inet_aton(yiaddr),
+        socket.inet_aton(siaddr), socket.inet_aton('0.0.0.0'), chaddr,
+        b'', b'')
+    data = header + MAGIC_COOKIE
+    for code, value in options:
+        data += struct.pack('BB', code, len(value)) + value
+    data += struct.pack('B', OPT_END)
+    return data.ljust(MIN_PACKET_SIZE, b'\0')
+
+
+def _decode_options(data, options):
+    """Add the options in data to options, joining repeated options."""
+    offset = 0
+    while offset < len(data):
+        code = data[offset]
+        if code == OPT_END:
+            break
+        if code == OPT_PAD:
+            offset += 1
+            continue
+        if offset + 1 >= len(data):
+            break
+        length = data[offset + 1]
+        value = data[offset + 2:offset + 2 + length]
+        # Long options are split over repeated codes, see RFC 3396
+        options[code] = options.get(code, b'') + value
+        offset += 2 + length
+
+
+def decode_packet(data):
+    """Return the DHCPPacket in data, or None if data is not one."""
+    if len(data) < BOOTP_SIZE + len(MAGIC_COOKIE):
+        return None
+    if data[BOOTP_SIZE:BOOTP_SIZE + len(MAGIC_COOKIE)] != MAGIC_COOKIE:
+        return None
+    (op, _htype, hlen, _hops, xid, _secs, flags, ciaddr, yiaddr, siaddr,
+     _giaddr, chaddr, sname, bootfile) = struct.unpack_from(BOOTP_FMT, data)
+    options = {}
+    _decode_options(data[BOOTP_SIZE + len(MAGIC_COOKIE):], options)
+    overload = (options.pop(OPT_OVERLOAD, b'') or b'\0')[0]
+    if overload & 1:
+        _decode_options(bootfile, options)
+        bootfile = b''
+    if overload & 2:
+        _decode_options(sname, options)
+        sname = b''
+    return DHCPPacket(
+        op, xid, flags, socket.inet_ntoa(ciaddr), socket.inet_ntoa(yiaddr),
+        socket.inet_ntoa(siaddr), chaddr[:hlen], sname.split(b'\0')[0],
+        bootfile.split(b'\0')[0], options)
+
+
+def message_type(packet):
+    """Return the DHCP message type of packet, or None if it has none."""
+    value = packet.options.get(OPT_MESSAGE_TYPE)
+    return value[0] if value else None
+
+
+def _format_text(value):
+    return value.rstrip(b'\0').decode('ascii', errors='replace')
+
+
+def format_lease_option(code, value):
+    """Return the name and value of an option as dhclient writes them."""
+    name, value_format = LEASE_OPTIONS.get(code, (None, None))
+    if value_format == 'ip' and len(value) == 4:
+        return name, socket.inet_ntoa(value)
+    if value_format == 'ips' and value and len(value) % 4 == 0:
+        return name, ','.join(
+            socket.inet_ntoa(value[i:i + 4]) for i in range(0, len(value), 4))
+    if value_format == 'text':
+        return name, _format_text(value)
+    if value_format == 'uint8' and len(value) == 1:
+        return name, str(value[0])
+    if value_format == 'uint16' and len(value) == 2:
+        return name, str(struct.unpack('!H', value)[0])
+    if value_format == 'uint32' and len(value) == 4:
+        return name, str(struct.unpack('!I', value)[0])
+    if value_format == 'bytes':
+        return name, ','.join(str(b) for b in value)
+    # Options dhclient does not know are printed as text when printable and
+    # as colon separated hex bytes otherwise, such as unknown-245 a8:3f:81:10
+    name = 'unknown-%d' % code
+    text = value.rstrip(b'\0')
+    if text and all(32 <= b < 127 for b in text):
+        return name, text.decode('ascii')
+    return name, ':'.join('%x' % b for b in value)
+
+
+def _format_lease_time(timestamp):
+    """Return timestamp as dhclient writes renew, rebind and expire times."""
+    if timestamp is None:
+        return 'never'
+    tm = time.gmtime(timestamp)
+    return '%d %s' % ((tm.tm_wday + 1) % 7,
+                      time.strftime('%Y/%m/%d %H:%M:%S', tm))
+
+
+def packet_to_lease(interface, packet, now=None):
+    """Return the lease of a DHCPACK in the format of parse_dhcp_lease_file.
+
+    @param interface: Name of the interface the lease was obtained on.
+    @param packet: DHCPPacket of the DHCPACK.
+    @param now: Time the lease was obtained at, defaults to the current time.
+    """
+    if now is None:
+        now = int(time.time())
+    lease = {'interface': interface, 'fixed-address': packet.yiaddr}
+    if packet.file:
+        lease['filename'] = _format_text(packet.file)
+    if packet.sname:
+        lease['server-name'] = _format_text(packet.sname)
+    for code, value in sorted(packet.options.items()):
+        name, formatted = format_lease_option(code, value)
+        lease[name] = formatted
+    lease_time = packet.options.get(OPT_LEASE_TIME)
+    if lease_time and len(lease_time) == 4:
+        lease_time = struct.unpack('!I', lease_time)[0]
+        renew = lease_time // 2
+        rebind = lease_time * 7 // 8
+        for code, default, key in ((OPT_RENEWAL_TIME, renew, 'renew'),
+                                   (OPT_REBINDING_TIME, rebind, 'rebind'),
+                                   (None, lease_time, 'expire')):
+            value = packet.options.get(code)
+            seconds = default
+            if value and len(value) == 4:
+                seconds = struct.unpack('!I', value)[0]
+            if lease_time == INFINITE_LEASE_TIME:
+                lease[key] = _format_lease_time(None)
+            else:
+                lease[key] = _format_lease_time(now + seconds)
+    return lease
+
+
+class DHCPv4Client(object):
+    """Obtain a single DHCPv4 lease on an interface.
+
+    @param interface: Name of the interface to obtain a lease on. The
+        interface must be up.
+    @param mac: Hardware address of the interface, such as 'aa:bb:cc:dd:ee:ff'.
+    @param timeout: Seconds to wait for a lease in total.
+    @param client_address: Address to bind the client socket to, defaults to
+        all addresses on CLIENT_PORT.
+    @param server_address: Address requests are sent to, defaults to the
+        broadcast address on SERVER_PORT.
+    """
+
+    def __init__(self, interface, mac, timeout=DHCP_TIMEOUT,
+                 client_address=None, server_address=None):
+        self.interface = interface
+        self.mac = bytes(int(octet, 16) for octet in mac.split(':'))
+        self.timeout = timeout
+        self.client_address = client_address or ('', CLIENT_PORT)
+        self.server_address = server_address or (
+            BROADCAST_ADDRESS, SERVER_PORT)
+        self.xid = random.getrandbits(32)
+        self.messages = []
+
+    def _log(self, msg, *args):
+        """Log msg and keep it, as dhclient prints its progress."""
+        LOG.debug(msg, *args)
+        self.messages.append(msg % args)
+
+    def _open_socket(self):
+        sock = socket.socket(
+            socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            if self.server_address[0] == BROADCAST_ADDRESS:
+                # The interface has no address to route replies by yet
+                sock.setsockopt(
+                    socket.SOL_SOCKET,
+                    getattr(socket, 'SO_BINDTODEVICE', 25),
+                    self.interface.encode() + b'\0')
+            sock.bind(self.client_address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _build(self, msg_type, options=()):
+        options = [(OPT_MESSAGE_TYPE, bytes([msg_type]))] + list(options)
+        options.append((OPT_PARAMETER_REQUEST_LIST, bytes(REQUESTED_OPTIONS)))
+        return encode_packet(BOOTREQUEST, self.xid, self.mac, options)
+
+    def _exchange(self, sock, packet, reply_types, deadline):
+        """Send packet until a reply of one of reply_types arrives.
+
+        @return: The DHCPPacket of the reply, or None at deadline.
+        """
+        interval = RETRANSMIT_INTERVAL
+        while time.monotonic() < deadline:
+            sock.sendto(packet, self.server_address)
+            wait_until = min(time.monotonic() + interval, deadline)
+            while True:
+                remaining = wait_until - time.monotonic()
+                if remaining <= 0:
+                    break
+                ready, _, _ = select.select([sock], [], [], remaining)
+                if not ready:
+                    break
+                data, _source = sock.recvfrom(MAX_PACKET_SIZE)
+                reply = decode_packet(data)
+                if (reply is None or reply.op != BOOTREPLY or
+                        reply.xid != self.xid or reply.chaddr != self.mac):
+                    continue
+                if message_type(reply) in reply_types:
+                    return reply
+            interval = min(interval * 2, MAX_RETRANSMIT_INTERVAL)
+        return None
+
+    def request_lease(self):
+        """Run a DHCP exchange and return the lease obtained.
+
+        @return: Dict of the lease in the format of parse_dhcp_lease_file, or
+            None if no lease was obtained before the timeout.
+        @raises: OSError if the client socket can not be opened or used.
+        """
+        deadline = time.monotonic() + self.timeout
+        with self._open_socket() as sock:
+            self._log('DHCPDISCOVER on %s to %s port %d', self.interface,
+                      *self.server_address)
+            offer = self._exchange(
+                sock, self._build(DHCPDISCOVER), (DHCPOFFER,), deadline)
+            if offer is None:
+                self._log('No DHCPOFFERS received.')
+                return None
+            server_id = offer.options.get(OPT_SERVER_ID, b'')
+            self._log('DHCPOFFER of %s from %s', offer.yiaddr,
+                      socket.inet_ntoa(server_id) if len(server_id) == 4
+                      else offer.siaddr)
+            self._log('DHCPREQUEST for %s on %s to %s port %d', offer.yiaddr,
+                      self.interface, *self.server_address)
+            request = self._build(DHCPREQUEST, [
+                (OPT_REQUESTED_ADDRESS, socket.inet_aton(offer.yiaddr)),
+                (OPT_SERVER_ID, server_id)])
+            ack = self._exchange(sock, request, (DHCPACK, DHCPNAK), deadline)
+            if ack is None:
+                self._log('No DHCPACK received.')
+                return None
+            if message_type(ack) == DHCPNAK:
+                self._log('DHCPNAK from %s', offer.siaddr)
+                return None
+            lease = packet_to_lease(self.interface, ack)
+            self._log('DHCPACK of %s from %s', ack.yiaddr,
+                      lease.get('dhcp-server-identifier', ack.siaddr))
+            renewal = lease.get('dhcp-renewal-time')
+            if renewal is None and 'dhcp-lease-time' in lease:
+                renewal = int(lease['dhcp-lease-time']) // 2
+            self._log('bound to %s -- renewal in %s seconds.', ack.yiaddr,
+                      renewal)
+            return lease
+
+# vi: ts=4 expandtab
@@ -7,7 +7,8 @@ from textwrap import dedent
 
 import cloudinit.net as net
 from cloudinit.net.dhcp import (
-    InvalidDHCPLeaseFileError, maybe_perform_dhcp_discovery,
+    InvalidDHCPLeaseFileError, builtin_dhcp_discovery,
+    maybe_perform_dhcp_discovery,
     parse_dhcp_lease_file, dhcp_discovery, networkd_load_leases,
     parse_static_routes)
 from cloudinit.util import ensure_file, write_file
@@ -282,6 +283,66 @@ class TestDHCPDiscoveryClean(CiTestCase):
             'Skip dhclient configuration: No dhclient command found.',
             self.logs.getvalue())
 
+    @mock.patch('cloudinit.net.dhcp.builtin_dhcp_discovery')
+    @mock.patch('cloudinit.net.dhcp.subp.which')
+    @mock.patch('cloudinit.net.dhcp.find_fallback_nic')
+    def test_builtin_client_feature(self, m_fallback, m_which, m_builtin):
+        """The builtin client is only used when its feature is enabled."""
+        m_fallback.return_value = 'eth9'
+        m_which.return_value = None
+        m_builtin.return_value = [{'fixed-address': '192.168.2.2'}]
+        with mock.patch('cloudinit.net.dhcp.features.'
+                        'EPHEMERAL_DHCP_BUILTIN_CLIENT', False):
+            self.assertEqual([], maybe_perform_dhcp_discovery())
+        m_builtin.assert_not_called()
+        m_which.reset_mock()
+        with mock.patch('cloudinit.net.dhcp.features.'
+                        'EPHEMERAL_DHCP_BUILTIN_CLIENT', True):
+            self.assertEqual(
+                [{'fixed-address': '192.168.2.2'}],
+                maybe_perform_dhcp_discovery(dhcp_log_func=print))
+            m_builtin.assert_called_once_with('eth9', print)
+            m_which.assert_not_called()
+            # dhclient is used when the builtin client can not be
+            m_builtin.return_value = None
+            self.assertEqual([], maybe_perform_dhcp_discovery())
+            m_which.assert_called_once_with('dhclient')
+
+    @mock.patch('cloudinit.net.dhcp.dhcp_client.DHCPv4Client')
+    @mock.patch('cloudinit.net.dhcp.subp.subp')
+    @mock.patch('cloudinit.net.dhcp.get_interface_mac')
+    def test_builtin_dhcp_discovery(self, m_mac, m_subp, m_client):
+        """The builtin client brings the link up and logs its exchange."""
+        m_mac.return_value = '00:16:3e:aa:bb:cc'
+        client = m_client.return_value
+        client.request_lease.return_value = {'fixed-address': '10.0.0.4'}
+        client.messages = ['DHCPDISCOVER on eth9', 'DHCPOFFER of 10.0.0.4']
+        m_log = mock.Mock()
+        self.assertEqual([{'fixed-address': '10.0.0.4'}],
+                         builtin_dhcp_discovery('eth9', m_log))
+        m_subp.assert_called_once_with(
+            ['ip', 'link', 'set', 'dev', 'eth9', 'up'], capture=True)
+        m_client.assert_called_once_with('eth9', '00:16:3e:aa:bb:cc')
+        m_log.assert_called_once_with(
+            '', 'DHCPDISCOVER on eth9\nDHCPOFFER of 10.0.0.4')
+        client.request_lease.return_value = None
+        self.assertEqual([], builtin_dhcp_discovery('eth9'))
+
+    @mock.patch('cloudinit.net.dhcp.dhcp_client.DHCPv4Client')
+    @mock.patch('cloudinit.net.dhcp.subp.subp')
+    @mock.patch('cloudinit.net.dhcp.get_interface_mac')
+    def test_builtin_dhcp_discovery_unusable(self, m_mac, m_subp, m_client):
+        """None is returned when the builtin client can not be used."""
+        m_mac.return_value = '80:00:02:08:fe:80:00:00:00:00:00:00'
+        self.assertIsNone(builtin_dhcp_discovery('ib0'))
+        m_client.assert_not_called()
+        m_mac.return_value = '00:16:3e:aa:bb:cc'
+        m_client.return_value.request_lease.side_effect = OSError(
+            'Address already in use')
+        self.assertIsNone(builtin_dhcp_discovery('eth9'))
+        self.assertIn('Builtin dhcp client failed on eth9, using dhclient: '
+                      'Address already in use', self.logs.getvalue())
+
     @mock.patch('cloudinit.temp_utils.os.getuid')
     @mock.patch('cloudinit.net.dhcp.dhcp_discovery')
     @mock.patch('cloudinit.net.dhcp.subp.which')
@@ -636,4 +697,20 @@ class TestEphemeralDhcpNoNetworkSetup(HttprettyTestCase):
         # Ensure that dhcp discovery occurs
         m_dhcp.called_once_with()
 
+    @mock.patch('cloudinit.net.get_connection_pool')
+    @mock.patch('cloudinit.net.dhcp.subp.subp')
+    @mock.patch('cloudinit.net.dhcp.maybe_perform_dhcp_discovery')
+    def test_ephemeral_dhcp_clean_network_closes_connections(
+            self, m_dhcp, m_subp, m_pool):
+        """Pooled connections are closed when the lease is torn down."""
+        m_dhcp.return_value = [{
+            'interface': 'eth9', 'fixed-address': '192.168.2.2',
+            'subnet-mask': '255.255.0.0'}]
+        m_subp.return_value = ('', '')
+        eph = net.dhcp.EphemeralDHCPv4()
+        eph.obtain_lease()
+        self.assertEqual(0, m_pool.return_value.close.call_count)
+        eph.clean_network()
+        m_pool.return_value.close.assert_called_once_with()
+
 # vi: ts=4 expandtab
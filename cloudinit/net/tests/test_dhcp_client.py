@@ -0,0 +1,256 @@
+# This file is part of cloud-init. See LICENSE file for license information.
+
+import socket
+import struct
+import threading
+from textwrap import dedent
+
+from cloudinit.net import dhcp_client
+from cloudinit.net.dhcp import parse_dhcp_lease_file, parse_static_routes
+from cloudinit.net.dhcp_client import (
+    BOOTREPLY, BOOTREQUEST, DHCPACK, DHCPDISCOVER, DHCPNAK, DHCPOFFER,
+    DHCPREQUEST, DHCPv4Client, decode_packet, encode_packet,
+    format_lease_option, message_type, packet_to_lease)
+from cloudinit.tests.helpers import CiTestCase, mock
+from cloudinit.util import write_file
+
+MAC = '00:16:3e:aa:bb:cc'
+CHADDR = bytes.fromhex('00163eaabbcc')
+# 2017-07-27 06:02:30 UTC, a Thursday
+NOW = 1501135350
+
+ACK_OPTIONS = [
+    (dhcp_client.OPT_MESSAGE_TYPE, bytes([DHCPACK])),
+    (dhcp_client.OPT_SERVER_ID, socket.inet_aton('168.63.129.16')),
+    (dhcp_client.OPT_LEASE_TIME, struct.pack('!I', 86400)),
+    (dhcp_client.OPT_SUBNET_MASK, socket.inet_aton('255.255.255.0')),
+    (dhcp_client.OPT_ROUTERS, socket.inet_aton('10.0.0.1')),
+    (dhcp_client.OPT_DOMAIN_NAME_SERVERS,
+     socket.inet_aton('168.63.129.16') + socket.inet_aton('10.0.0.2')),
+    (dhcp_client.OPT_DOMAIN_NAME, b'example.internal'),
+    (dhcp_client.OPT_CLASSLESS_STATIC_ROUTES,
+     bytes([32, 169, 254, 169, 254, 10, 0, 0, 1, 0, 10, 0, 0, 1])),
+    (dhcp_client.OPT_AZURE_ENDPOINT, bytes([0xa8, 0x3f, 0x81, 0x10])),
+]
+
+
+class TestPacketCoding(CiTestCase):
+
+    def test_encode_decode_round_trip(self):
+        """Packets decode to the fields and options they were encoded with."""
+        data = encode_packet(BOOTREPLY, 42, CHADDR, ACK_OPTIONS,
+                             yiaddr='10.0.0.4', siaddr='10.0.0.1')
+        self.assertLessEqual(dhcp_client.MIN_PACKET_SIZE, len(data))
+        packet = decode_packet(data)
+        self.assertEqual(
+            (BOOTREPLY, 42, dhcp_client.BROADCAST_FLAG, '0.0.0.0', '10.0.0.4',
+             '10.0.0.1', CHADDR, b'', b''),
+            packet[:-1])
+        self.assertEqual(dict(ACK_OPTIONS), packet.options)
+        self.assertEqual(DHCPACK, message_type(packet))
+
+    def test_decode_joins_split_and_overloaded_options(self):
+        """Options split over codes, file and sname fields are joined."""
+        data = bytearray(encode_packet(BOOTREPLY, 1, CHADDR, [
+            (dhcp_client.OPT_DOMAIN_NAME, b'exam'),
+            (dhcp_client.OPT_OVERLOAD, b'\x01'),
+            (dhcp_client.OPT_DOMAIN_NAME, b'ple.com')]))
+        # The file field starts after the 108 bytes of fixed fields and sname
+        data[108:112] = bytes([dhcp_client.OPT_ROUTERS, 4, 10, 0])
+        data[112:115] = bytes([0, 1, dhcp_client.OPT_END])
+        packet = decode_packet(bytes(data))
+        self.assertEqual(b'example.com',
+                         packet.options[dhcp_client.OPT_DOMAIN_NAME])
+        self.assertEqual(socket.inet_aton('10.0.0.1'),
+                         packet.options[dhcp_client.OPT_ROUTERS])
+        self.assertEqual(b'', packet.file)
+
+    def test_decode_rejects_non_dhcp_data(self):
+        """Short packets and packets without the magic cookie are ignored."""
+        self.assertIsNone(decode_packet(b'\0' * 100))
+        self.assertIsNone(decode_packet(b'\0' * 300))
+
+
+class TestLeaseFormat(CiTestCase):
+
+    def test_unknown_options_formatted_as_dhclient(self):
+        """Unknown options are text when printable and hex bytes if not."""
+        self.assertEqual(
+            ('unknown-245', 'a8:3f:81:10'),
+            format_lease_option(245, bytes([0xa8, 0x3f, 0x81, 0x10])))
+        self.assertEqual(
+            ('unknown-245', 'a:0:0:5'),
+            format_lease_option(245, bytes([10, 0, 0, 5])))
+        self.assertEqual(
+            ('unknown-224', 'hello'), format_lease_option(224, b'hello\0'))
+
+    def test_packet_to_lease_matches_dhclient_lease_file(self):
+        """Leases match those parsed from the lease file dhclient writes."""
+        packet = decode_packet(encode_packet(
+            BOOTREPLY, 1, CHADDR, ACK_OPTIONS, yiaddr='10.0.0.4'))
+        lease_file = self.tmp_path('dhcp.leases')
+        write_file(lease_file, dedent("""\
+            lease {
+              interface "eth0";
+              fixed-address 10.0.0.4;
+              option subnet-mask 255.255.255.0;
+              option routers 10.0.0.1;
+              option dhcp-lease-time 86400;
+              option dhcp-message-type 5;
+              option domain-name-servers 168.63.129.16,10.0.0.2;
+              option dhcp-server-identifier 168.63.129.16;
+              option domain-name "example.internal";
+              option rfc3442-classless-static-routes 32,169,254,169,254,10,0,0,1,0,10,0,0,1;
+              option unknown-245 a8:3f:81:10;
+              renew 4 2017/07/27 18:02:30;
+              rebind 5 2017/07/28 03:02:30;
+              expire 5 2017/07/28 06:02:30;
+            }
+            """))  # noqa: E501
+        self.assertEqual(parse_dhcp_lease_file(lease_file),
+                         [packet_to_lease('eth0', packet, now=NOW)])
+
+    def test_static_routes_parse_from_lease(self):
+        """Classless static routes are in the format parse_static_routes
+        reads."""
+        packet = decode_packet(encode_packet(
+            BOOTREPLY, 1, CHADDR, ACK_OPTIONS, yiaddr='10.0.0.4'))
+        lease = packet_to_lease('eth0', packet, now=NOW)
+        self.assertEqual(
+            [('169.254.169.254/32', '10.0.0.1'), ('0.0.0.0/0', '10.0.0.1')],
+            parse_static_routes(lease['rfc3442-classless-static-routes']))
+
+    def test_infinite_lease_never_expires(self):
+        """Leases with an infinite lease time never expire."""
+        packet = decode_packet(encode_packet(BOOTREPLY, 1, CHADDR, [
+            (dhcp_client.OPT_LEASE_TIME, b'\xff\xff\xff\xff')]))
+        self.assertEqual(
+            'never', packet_to_lease('eth0', packet, now=NOW)['expire'])
+
+
+class FakeDHCPServer(object):
+    """Answer DHCP requests on a local UDP port.
+
+    @param ack_type: DHCPACK or DHCPNAK answered to requests.
+    @param drop: Number of requests of each type to leave unanswered.
+    """
+
+    def __init__(self, ack_type=DHCPACK, drop=0, offer=True):
+        self.ack_type = ack_type
+        self.drop = drop
+        self.offer = offer
+        self.received = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(0.1)
+        self.address = self.sock.getsockname()
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+    def serve(self):
+        while self.running:
+            try:
+                data, client = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            request = decode_packet(data)
+            if request is None or request.op != BOOTREQUEST:
+                continue
+            msg_type = message_type(request)
+            self.received.append(msg_type)
+            if self.received.count(msg_type) <= self.drop:
+                continue
+            if msg_type == DHCPDISCOVER and self.offer:
+                options = [(dhcp_client.OPT_MESSAGE_TYPE, bytes([DHCPOFFER])),
+                           ACK_OPTIONS[1]]
+            elif msg_type == DHCPREQUEST:
+                options = [(dhcp_client.OPT_MESSAGE_TYPE,
+                            bytes([self.ack_type]))] + ACK_OPTIONS[1:]
+            else:
+                continue
+            # Reply to a stale transaction first, which must be ignored
+            self.sock.sendto(encode_packet(
+                BOOTREPLY, request.xid + 1, request.chaddr, options,
+                yiaddr='10.0.0.99'), client)
+            self.sock.sendto(encode_packet(
+                BOOTREPLY, request.xid, request.chaddr, options,
+                yiaddr='10.0.0.4'), client)
+
+
+class TestDHCPv4Client(CiTestCase):
+
+    with_logs = True
+
+    def _client(self, server, timeout=5):
+        return DHCPv4Client('eth0', MAC, timeout=timeout,
+                            client_address=('127.0.0.1', 0),
+                            server_address=server.address)
+
+    def _server(self, **kwargs):
+        server = FakeDHCPServer(**kwargs)
+        self.addCleanup(server.stop)
+        return server
+
+    def test_request_lease(self):
+        """A lease is obtained by a DISCOVER, OFFER, REQUEST, ACK exchange."""
+        server = self._server()
+        client = self._client(server)
+        lease = client.request_lease()
+        self.assertEqual([DHCPDISCOVER, DHCPREQUEST], server.received)
+        self.assertEqual('10.0.0.4', lease['fixed-address'])
+        self.assertEqual('eth0', lease['interface'])
+        self.assertEqual('a8:3f:81:10', lease['unknown-245'])
+        self.assertEqual(
+            ['DHCPDISCOVER on eth0 to 127.0.0.1 port %d' % server.address[1],
+             'DHCPOFFER of 10.0.0.4 from 168.63.129.16',
+             'DHCPREQUEST for 10.0.0.4 on eth0 to 127.0.0.1 port %d' %
+             server.address[1],
+             'DHCPACK of 10.0.0.4 from 168.63.129.16',
+             'bound to 10.0.0.4 -- renewal in 43200 seconds.'],
+            client.messages)
+
+    @mock.patch('cloudinit.net.dhcp_client.RETRANSMIT_INTERVAL', 0.05)
+    def test_request_lease_retransmits(self):
+        """Unanswered requests are sent again."""
+        server = self._server(drop=2)
+        lease = self._client(server).request_lease()
+        self.assertEqual('10.0.0.4', lease['fixed-address'])
+        self.assertEqual([DHCPDISCOVER] * 3 + [DHCPREQUEST] * 3,
+                         server.received)
+
+    def test_request_lease_nak(self):
+        """No lease is returned when the server refuses the request."""
+        client = self._client(self._server(ack_type=DHCPNAK))
+        self.assertIsNone(client.request_lease())
+        self.assertEqual('DHCPNAK from 0.0.0.0', client.messages[-1])
+
+    @mock.patch('cloudinit.net.dhcp_client.RETRANSMIT_INTERVAL', 0.05)
+    def test_request_lease_timeout(self):
+        """No lease is returned when no server offers one in time."""
+        server = self._server(offer=False)
+        client = self._client(server, timeout=0.3)
+        self.assertIsNone(client.request_lease())
+        self.assertEqual('No DHCPOFFERS received.', client.messages[-1])
+        self.assertLess(1, len(server.received))
+
+    @mock.patch('cloudinit.net.dhcp_client.socket.socket')
+    def test_broadcast_socket_bound_to_interface(self, m_socket):
+        """Broadcast requests are sent from a socket bound to the interface.
+        """
+        m_socket.return_value.bind.side_effect = OSError('in use')
+        with self.assertRaises(OSError):
+            DHCPv4Client('eth0', MAC).request_lease()
+        sock = m_socket.return_value
+        sock.setsockopt.assert_any_call(
+            socket.SOL_SOCKET, getattr(socket, 'SO_BINDTODEVICE', 25),
+            b'eth0\0')
+        sock.bind.assert_called_once_with(('', dhcp_client.CLIENT_PORT))
+        sock.close.assert_called_once_with()
+
+# vi: ts=4 expandtab
@@ -18,6 +18,24 @@ from cloudinit.subp import ProcessExecutionError
 from cloudinit.util import ensure_file, write_file
 
 
+def _write_netfailover_devs(sysdir, mac):
+    """Write sysfs of netfailover master ens3, its standby and primary."""
+    standby = '0' * 62 + '1' + '0'
+    for iface, driver in (('ens3', 'virtio_net'), ('ens3sby', 'virtio_net'),
+                          ('enP0s1f3', 'mlx5_core')):
+        write_file(os.path.join(sysdir, iface, 'carrier'), '1')
+        write_file(os.path.join(sysdir, iface, 'addr_assign_type'), '0')
+        write_file(os.path.join(sysdir, iface, 'address'), mac)
+        os.makedirs(os.path.join(sysdir, iface, 'device'))
+        os.symlink('../../../bus/drivers/' + driver,
+                   os.path.join(sysdir, iface, 'device', 'driver'))
+        if driver == 'virtio_net':
+            write_file(
+                os.path.join(sysdir, iface, 'device', 'features'), standby)
+        if iface != 'ens3':
+            os.symlink('../ens3', os.path.join(sysdir, iface, 'master'))
+
+
 class TestSysDevPath(CiTestCase):
 
     def test_sys_dev_path(self):
@@ -233,8 +251,6 @@ class TestGenerateFallbackConfig(CiTestCase):
         self.add_patch('cloudinit.net.util.is_container', 'm_is_container',
                        return_value=False)
         self.add_patch('cloudinit.net.util.udevadm_settle', 'm_settle')
-        self.add_patch('cloudinit.net.is_netfailover', 'm_netfail',
-                       return_value=False)
         self.add_patch('cloudinit.net.is_netfail_master', 'm_netfail_master',
                        return_value=False)
 
@@ -304,19 +320,7 @@ class TestGenerateFallbackConfig(CiTestCase):
     def test_generate_fallback_config_skips_netfail_devs(self):
         """gen_fallback_config ignores netfail primary,sby no mac on master."""
         mac = 'aa:bb:cc:aa:bb:cc'  # netfailover devs share the same mac
-        for iface in ['ens3', 'ens3sby', 'enP0s1f3']:
-            write_file(os.path.join(self.sysdir, iface, 'carrier'), '1')
-            write_file(
-                os.path.join(self.sysdir, iface, 'addr_assign_type'), '0')
-            write_file(
-                os.path.join(self.sysdir, iface, 'address'), mac)
-
-        def is_netfail(iface, _driver=None):
-            # ens3 is the master
-            if iface == 'ens3':
-                return False
-            return True
-        self.m_netfail.side_effect = is_netfail
+        _write_netfailover_devs(self.sysdir, mac)
 
         def is_netfail_master(iface, _driver=None):
             # ens3 is the master
@@ -354,6 +358,16 @@ class TestNetFindFallBackNic(CiTestCase):
         write_file(os.path.join(self.sysdir, 'eth1', 'address'), mac)
         self.assertEqual('eth1', net.find_fallback_nic())
 
+    def test_find_fallback_nic_reads_link_state_again(self):
+        """find_fallback_nic sees a carrier acquired since the snapshot."""
+        mac = 'aa:bb:cc:aa:bb:cc'
+        write_file(os.path.join(self.sysdir, 'eth0', 'name_assign_type'), '4')
+        write_file(os.path.join(self.sysdir, 'eth0', 'operstate'), 'noworky')
+        write_file(os.path.join(self.sysdir, 'eth0', 'address'), mac)
+        self.assertIsNone(net.find_fallback_nic())
+        write_file(os.path.join(self.sysdir, 'eth0', 'carrier'), '1')
+        self.assertEqual('eth0', net.find_fallback_nic())
+
 
 class TestGetDeviceList(CiTestCase):
 
@@ -395,6 +409,84 @@ class TestGetDeviceList(CiTestCase):
     "cloudinit.net.is_openvswitch_internal_interface",
     mock.Mock(return_value=False),
 )
+class TestNetDeviceSnapshot(CiTestCase):
+
+    def setUp(self):
+        super(TestNetDeviceSnapshot, self).setUp()
+        sys_mock = mock.patch('cloudinit.net.get_sys_class_path')
+        self.m_sys_path = sys_mock.start()
+        self.sysdir = self.tmp_dir() + '/'
+        self.m_sys_path.return_value = self.sysdir
+        self.addCleanup(sys_mock.stop)
+
+    def test_snapshot_reads_all_device_attributes(self):
+        """All attributes of each device are read when taking a snapshot."""
+        attrs = {'address': 'aa:bb:cc:aa:bb:cc', 'addr_assign_type': '0',
+                 'name_assign_type': '4', 'carrier': '1', 'dormant': '0',
+                 'operstate': 'up', 'type': '1',
+                 'uevent': 'DEVTYPE=vlan\nINTERFACE=eth0.101',
+                 'device/device': '0x1000'}
+        for attr, value in attrs.items():
+            write_file(os.path.join(self.sysdir, 'eth0.101', attr), value)
+        os.symlink('../../bus/pci/drivers/e1000',
+                   os.path.join(self.sysdir, 'eth0.101', 'device', 'driver'))
+        os.makedirs(os.path.join(self.sysdir, 'br0', 'bridge'))
+        os.symlink('../br0', os.path.join(self.sysdir, 'eth0.101', 'master'))
+        snapshot = net.NetDeviceSnapshot.from_sysfs()
+        self.assertEqual(['br0', 'eth0.101'], sorted(snapshot))
+        self.assertEqual(
+            net.NetDevice(
+                name='eth0.101', address='aa:bb:cc:aa:bb:cc', perm_hwaddr=None,
+                addr_assign_type=0, name_assign_type='4', carrier=1,
+                dormant=0, operstate='up', type='1', devtype='vlan',
+                driver='e1000', device_id='0x1000', features=None,
+                master='br0', is_bridge=False, is_bond=False,
+                is_bonding_slave=False, has_ovs_upper=False),
+            snapshot['eth0.101'])
+        self.assertTrue(snapshot['br0'].is_bridge)
+        self.assertTrue(snapshot.master_is_bridge_or_bond('eth0.101'))
+
+    def test_snapshot_is_immutable(self):
+        """The devices of a snapshot can not be changed."""
+        write_file(os.path.join(self.sysdir, 'eth0', 'address'), 'aa')
+        snapshot = net.NetDeviceSnapshot.from_sysfs()
+        with self.assertRaises(TypeError):
+            snapshot.devices['eth1'] = snapshot['eth0']
+        with self.assertRaises(AttributeError):
+            snapshot['eth0'].address = 'bb'
+
+    @mock.patch('cloudinit.net.read_net_device', wraps=net.read_net_device)
+    def test_get_net_snapshot_is_shared_until_invalidated(self, m_read):
+        """Devices are only read again after invalidate_net_snapshot."""
+        write_file(os.path.join(self.sysdir, 'eth0', 'operstate'), 'down')
+        snapshot = net.get_net_snapshot()
+        write_file(os.path.join(self.sysdir, 'eth0', 'operstate'), 'up')
+        self.assertIs(snapshot, net.get_net_snapshot())
+        self.assertEqual(1, m_read.call_count)
+        net.invalidate_net_snapshot()
+        self.assertEqual('up', net.get_net_snapshot()['eth0'].operstate)
+        self.assertEqual(2, m_read.call_count)
+
+    def test_get_net_snapshot_sees_added_devices(self):
+        """A new snapshot is taken when devices are added or removed."""
+        write_file(os.path.join(self.sysdir, 'eth0', 'address'), 'aa')
+        self.assertEqual(['eth0'], list(net.get_net_snapshot()))
+        write_file(os.path.join(self.sysdir, 'eth1', 'address'), 'bb')
+        self.assertEqual(
+            ['eth0', 'eth1'], sorted(net.get_net_snapshot()))
+
+    @mock.patch('cloudinit.net.subp.subp')
+    def test_rename_interfaces_invalidates_snapshot(self, m_subp):
+        """Renaming devices discards the shared snapshot."""
+        write_file(os.path.join(self.sysdir, 'eth0', 'address'), 'aa')
+        snapshot = net.get_net_snapshot()
+        current_info = {'eth0': {'mac': 'aa', 'name': 'eth0', 'up': False,
+                                 'driver': None, 'device_id': None}}
+        net._rename_interfaces([['aa', 'ens3', None, None]],
+                               current_info=current_info)
+        self.assertIsNot(snapshot, net.get_net_snapshot())
+
+
 class TestGetInterfaceMAC(CiTestCase):
 
     def setUp(self):
@@ -466,24 +558,11 @@ class TestGetInterfaceMAC(CiTestCase):
         expected = [('eth2', mac2, None, None)]
         self.assertEqual(expected, net.get_interfaces())
 
-    @mock.patch('cloudinit.net.is_netfailover')
-    def test_get_interfaces_by_mac_skips_netfailvoer(self, m_netfail):
+    def test_get_interfaces_by_mac_skips_netfailvoer(self):
         """Ignore interfaces if netfailover primary or standby."""
         mac = 'aa:bb:cc:aa:bb:cc'  # netfailover devs share the same mac
-        for iface in ['ens3', 'ens3sby', 'enP0s1f3']:
-            write_file(
-                os.path.join(self.sysdir, iface, 'addr_assign_type'), '0')
-            write_file(
-                os.path.join(self.sysdir, iface, 'address'), mac)
-
-        def is_netfail(iface, _driver=None):
-            # ens3 is the master
-            if iface == 'ens3':
-                return False
-            else:
-                return True
-        m_netfail.side_effect = is_netfail
-        expected = [('ens3', mac, None, None)]
+        _write_netfailover_devs(self.sysdir, mac)
+        expected = [('ens3', mac, 'virtio_net', None)]
         self.assertEqual(expected, net.get_interfaces())
 
     def test_get_interfaces_does_not_skip_phys_members_of_bridges_and_bonds(
@@ -614,6 +693,23 @@ class TestEphemeralIPV4Network(CiTestCase):
             self.assertEqual(expected_setup_calls, m_subp.call_args_list)
         m_subp.assert_has_calls(expected_teardown_calls)
 
+    @mock.patch('cloudinit.net.get_connection_pool')
+    def test_ephemeral_ipv4_network_teardown_closes_connections(
+            self, m_pool, m_subp):
+        """Pooled connections opened over the ephemeral address are closed
+        with it, even when its teardown fails."""
+        params = {
+            'interface': 'eth0', 'ip': '192.168.2.2',
+            'prefix_or_mask': '255.255.255.0', 'broadcast': '192.168.2.255'}
+        with net.EphemeralIPv4Network(**params):
+            self.assertEqual(0, m_pool.return_value.close.call_count)
+        m_pool.return_value.close.assert_called_once_with()
+        m_pool.reset_mock()
+        with self.assertRaises(ProcessExecutionError):
+            with net.EphemeralIPv4Network(**params):
+                m_subp.side_effect = ProcessExecutionError()
+        m_pool.return_value.close.assert_called_once_with()
+
     @mock.patch('cloudinit.net.readurl')
     def test_ephemeral_ipv4_no_network_if_url_connectivity(
             self, m_readurl, m_subp):
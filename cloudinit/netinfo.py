@@ -10,11 +10,14 @@
 
 from copy import copy, deepcopy
 import re
+import socket
+import struct
 
 from cloudinit import log as logging
 from cloudinit.net.network_state import net_prefix_to_ipv4_mask
 from cloudinit import subp
 from cloudinit import util
+from cloudinit.sources.helpers import netlink
 
 from cloudinit.simpletable import SimpleTable
 
@@ -28,6 +31,74 @@ DEFAULT_NETDEV_INFO = {
     "up": False
 }
 
+# Values from linux/if.h, linux/if_arp.h and linux/rtnetlink.h
+IFF_UP = 0x1
+IFF_LOWER_UP = 0x10000
+ARPHRD_ETHER = 1
+RTN_UNICAST = 1
+RT_TABLE_MAIN = 254
+# Names of scopes as printed by iproute2, from /etc/iproute2/rt_scopes
+RT_SCOPE_NAMES = {0: 'global', 200: 'site', 253: 'link', 254: 'host',
+                  255: 'nowhere'}
+
+
+def _netlink_links():
+    """Return a dict of (name, flags, type, hwaddr) keyed by link index."""
+    links = {}
+    request = struct.pack(netlink.IFINFOMSG_FMT, socket.AF_UNSPEC, 0, 0, 0, 0)
+    for msg in netlink.dump_netlink_messages(netlink.RTM_GETLINK, request):
+        _family, link_type, index, flags, _change = struct.unpack(
+            netlink.IFINFOMSG_FMT, msg.body)
+        name = msg.attrs.get(netlink.IFLA_IFNAME, b'').rstrip(b'\0')
+        hwaddr = ':'.join(
+            '%02x' % b for b in msg.attrs.get(netlink.IFLA_ADDRESS, b''))
+        links[index] = (util.decode_binary(name), flags, link_type, hwaddr)
+    return links
+
+
+def _netdev_info_netlink():
+    """
+    Get network device dicts from a netlink dump of links and addresses.
+
+    @returns: A dict of device info keyed by network device name, as
+              returned by _netdev_info_iproute for 'ip addr show'.
+    @raise: NetlinkCreateSocketError or NetlinkDumpError if the kernel
+            can not be asked for its links and addresses.
+    """
+    devs = {}
+    names = {}
+    for index, (name, flags, link_type, hwaddr) in _netlink_links().items():
+        names[index] = name.lower()
+        devs[names[index]] = {
+            'ipv4': [], 'ipv6': [],
+            'hwaddr': hwaddr if link_type == ARPHRD_ETHER else '',
+            'up': bool(flags & IFF_UP and flags & IFF_LOWER_UP),
+        }
+    request = struct.pack(netlink.IFADDRMSG_FMT, socket.AF_UNSPEC, 0, 0, 0, 0)
+    for msg in netlink.dump_netlink_messages(netlink.RTM_GETADDR, request):
+        family, prefix, _flags, scope, index = struct.unpack(
+            netlink.IFADDRMSG_FMT, msg.body)
+        if index not in names:
+            continue
+        attrs = msg.attrs
+        packed = attrs.get(netlink.IFA_LOCAL, attrs.get(netlink.IFA_ADDRESS))
+        if packed is None:
+            continue
+        scope = RT_SCOPE_NAMES.get(scope, str(scope))
+        dev = devs[names[index]]
+        if family == socket.AF_INET:
+            bcast = attrs.get(netlink.IFA_BROADCAST)
+            dev['ipv4'].append({
+                'ip': socket.inet_ntop(family, packed),
+                'bcast': socket.inet_ntop(family, bcast) if bcast else '',
+                'mask': net_prefix_to_ipv4_mask(prefix),
+                'scope': scope})
+        elif family == socket.AF_INET6:
+            dev['ipv6'].append({
+                'ip': '%s/%d' % (socket.inet_ntop(family, packed), prefix),
+                'scope6': scope})
+    return devs
+
 
 def _netdev_info_iproute(ipaddr_out):
     """
@@ -195,9 +266,24 @@ def _netdev_info_ifconfig(ifconfig_data):
     return devs
 
 
+def _try_netlink(func):
+    """Return the result of func, or None if netlink can not be used."""
+    if not util.is_Linux():
+        return None
+    try:
+        return func()
+    except (netlink.NetlinkCreateSocketError,
+            netlink.NetlinkDumpError) as e:
+        LOG.debug("Netlink is not available, using commands instead: %s", e)
+        return None
+
+
 def netdev_info(empty=""):
     devs = {}
-    if util.is_NetBSD():
+    netlink_devs = _try_netlink(_netdev_info_netlink)
+    if netlink_devs is not None:
+        devs = netlink_devs
+    elif util.is_NetBSD():
         (ifcfg_out, _err) = subp.subp(["ifconfig", "-a"], rcs=[0, 1])
         devs = _netdev_info_ifconfig_netbsd(ifcfg_out)
     elif subp.which('ip'):
@@ -319,6 +405,101 @@ def _netdev_route_info_iproute(iproute_data):
     return routes
 
 
+def _netlink_route_nexthop(attrs):
+    """Return the gateway and output interface index of a route."""
+    gateway = attrs.get(netlink.RTA_GATEWAY)
+    oif = attrs.get(netlink.RTA_OIF)
+    multipath = attrs.get(netlink.RTA_MULTIPATH)
+    if oif is None and multipath and len(multipath) >= netlink.RTNH_SIZE:
+        # Report the first of multiple nexthops
+        length, _flags, _hops, ifindex = struct.unpack_from(
+            netlink.RTNH_FMT, multipath)
+        nexthop_attrs = netlink.unpack_rta_attrs(
+            multipath, netlink.RTNH_SIZE, min(length, len(multipath)))
+        return nexthop_attrs.get(netlink.RTA_GATEWAY), ifindex
+    if oif is not None:
+        oif = struct.unpack('I', oif)[0]
+    return gateway, oif
+
+
+def _netdev_route_info_netlink():
+    """
+    Get network route dicts from a netlink dump of routes.
+
+    IPv4 routes come from the main table and IPv6 routes from all tables,
+    as reported by 'ip -o route list' and 'ip -6 route list table all'.
+    Only unicast routes are reported.
+
+    @returns: A dict containing ipv4 and ipv6 route entries as lists, as
+              returned by _netdev_route_info_iproute.
+    @raise: NetlinkCreateSocketError or NetlinkDumpError if the kernel
+            can not be asked for its routes.
+    """
+    routes = {'ipv4': [], 'ipv6': []}
+    names = dict((index, link[0]) for index, link in _netlink_links().items())
+    request = struct.pack(
+        netlink.RTMSG_FMT, socket.AF_UNSPEC, 0, 0, 0, 0, 0, 0, 0, 0)
+    for msg in netlink.dump_netlink_messages(netlink.RTM_GETROUTE, request):
+        (family, dst_len, _src_len, _tos, table, _protocol, _scope,
+         rtm_type, _flags) = struct.unpack(netlink.RTMSG_FMT, msg.body)
+        if rtm_type != RTN_UNICAST:
+            continue
+        attrs = msg.attrs
+        if netlink.RTA_TABLE in attrs:
+            table = struct.unpack('I', attrs[netlink.RTA_TABLE])[0]
+        dst = attrs.get(netlink.RTA_DST)
+        gateway, oif = _netlink_route_nexthop(attrs)
+        metric = attrs.get(netlink.RTA_PRIORITY)
+        metric = str(struct.unpack('I', metric)[0]) if metric else ''
+        if family == socket.AF_INET:
+            if table != RT_TABLE_MAIN:
+                continue
+            entry = {
+                'destination': '0.0.0.0', 'flags': '', 'gateway': '',
+                'genmask': '0.0.0.0', 'iface': '', 'metric': metric}
+            flags = ['U']
+            if dst is not None:
+                entry['destination'] = socket.inet_ntop(family, dst)
+                entry['genmask'] = net_prefix_to_ipv4_mask(dst_len)
+                entry['gateway'] = '0.0.0.0'
+                if dst_len == 32:
+                    flags.append('H')
+            if gateway:
+                entry['gateway'] = socket.inet_ntop(family, gateway)
+                flags.insert(1, 'G')
+            if oif in names:
+                entry['iface'] = names[oif]
+            entry['flags'] = ''.join(flags)
+            routes['ipv4'].append(entry)
+        elif family == socket.AF_INET6:
+            entry = {}
+            if dst is None:
+                entry['destination'] = '::/0'
+                entry['flags'] = 'UG'
+            else:
+                entry['destination'] = socket.inet_ntop(family, dst)
+                if dst_len != 128:
+                    entry['destination'] += '/%d' % dst_len
+                entry['gateway'] = '::'
+                entry['flags'] = 'U'
+            if gateway:
+                entry['gateway'] = socket.inet_ntop(family, gateway)
+                entry['flags'] = 'UG'
+            if oif in names:
+                entry['iface'] = names[oif]
+            if metric:
+                entry['metric'] = metric
+            cacheinfo = attrs.get(netlink.RTA_CACHEINFO)
+            if cacheinfo and len(cacheinfo) >= struct.calcsize(
+                    netlink.RTA_CACHEINFO_FMT):
+                expires = struct.unpack_from(
+                    netlink.RTA_CACHEINFO_FMT, cacheinfo)[2]
+                if expires:
+                    entry['flags'] += 'e'
+            routes['ipv6'].append(entry)
+    return routes
+
+
 def _netdev_route_info_netstat(route_data):
     routes = {}
     routes['ipv4'] = []
@@ -394,7 +575,10 @@ def _netdev_route_info_netstat(route_data):
 
 def route_info():
     routes = {}
-    if subp.which('ip'):
+    netlink_routes = _try_netlink(_netdev_route_info_netlink)
+    if netlink_routes is not None:
+        routes = netlink_routes
+    elif subp.which('ip'):
         # Try iproute first of all
         (iproute_out, _err) = subp.subp(["ip", "-o", "route", "list"])
         routes = _netdev_route_info_iproute(iproute_out)
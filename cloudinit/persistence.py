@@ -4,6 +4,22 @@
 #
 # This file is part of cloud-init. See LICENSE file for license information.
 
+import importlib
+import json
+import pickle
+import struct
+
+# Leading bytes of every cache written by CloudInitCacheMixin.to_cache
+CACHE_MAGIC = b'CICACHE'
+# Version of the container layout, bumped on incompatible layout changes
+CACHE_FORMAT_VERSION = 1
+# Format version (unsigned short) and header length (unsigned int)
+_CACHE_PREAMBLE = struct.Struct('>HI')
+
+
+class CacheFormatError(Exception):
+    """Raised when a cache blob can not be read by this cloud-init."""
+
 
 class CloudInitPickleMixin:
     """Scaffolding for versioning of pickles.
@@ -64,4 +80,171 @@ class CloudInitPickleMixin:
         """
 
 
+class CloudInitCacheMixin(CloudInitPickleMixin):
+    """Versioned, per-attribute cache of an object's state.
+
+    ``to_cache`` serializes each attribute of ``self.__dict__`` separately
+    into a container holding a small JSON header followed by one blob per
+    attribute. Bytes and strings are stored as-is; other values are pickled
+    on their own. The object itself, and the objects named in
+    ``_cache_excluded_attrs``, are never pickled.
+
+    Attributes named in ``_cache_excluded_attrs`` are not stored; they must
+    be provided to ``load_cache`` when restoring. Attributes named in
+    ``_cache_lazy_attrs`` are only decoded on first access, so reading a
+    small attribute does not pay for deserializing large ones.
+
+    The stored class version, ``_ci_pkl_version``, is passed to
+    ``self._unpickle`` on restore exactly as for a pickle.
+    """
+
+    _cache_excluded_attrs = ()
+    _cache_lazy_attrs = ()
+
+    def __getattr__(self, name):
+        # Only called when normal attribute lookup fails
+        loaders = self.__dict__.get('_cache_loaders')
+        if loaders and name in loaders:
+            value = loaders.pop(name)()
+            setattr(self, name, value)
+            return value
+        raise AttributeError(
+            "'%s' object has no attribute '%s'" % (type(self).__name__, name))
+
+    def __getstate__(self):
+        self._load_cached_attrs()
+        return super().__getstate__()
+
+    def _has_state(self, name):
+        """Return whether name is set on the instance, without loading it."""
+        return (name in self.__dict__ or
+                name in (self.__dict__.get('_cache_loaders') or ()))
+
+    def _load_cached_attrs(self):
+        """Decode every lazily restored attribute which is still pending."""
+        for name in list(self.__dict__.get('_cache_loaders') or ()):
+            getattr(self, name)
+        self.__dict__.pop('_cache_loaders', None)
+
+    def to_cache(self) -> bytes:
+        """Return the cache blob representing this object's state."""
+        self._load_cached_attrs()
+        fields = {}
+        blobs = []
+        offset = 0
+        for name, value in self.__dict__.items():
+            if name in self._cache_excluded_attrs:
+                continue
+            codec, blob = _encode_cache_value(value)
+            fields[name] = [offset, len(blob), codec]
+            blobs.append(blob)
+            offset += len(blob)
+        cls = type(self)
+        header = json.dumps({
+            'class': '%s:%s' % (cls.__module__, cls.__qualname__),
+            'version': cls._ci_pkl_version,
+            'fields': fields,
+        }, sort_keys=True).encode('utf-8')
+        return b''.join(
+            [CACHE_MAGIC,
+             _CACHE_PREAMBLE.pack(CACHE_FORMAT_VERSION, len(header)),
+             header] + blobs)
+
+
+def _encode_cache_value(value):
+    """Return a tuple of (codec, bytes) which round-trips value."""
+    if type(value) is bytes:
+        return 'bytes', value
+    if type(value) is str:
+        return 'str', value.encode('utf-8', 'surrogatepass')
+    return 'pickle', pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _decode_cache_value(codec, blob):
+    if codec == 'bytes':
+        return bytes(blob)
+    elif codec == 'str':
+        return bytes(blob).decode('utf-8', 'surrogatepass')
+    elif codec == 'pickle':
+        return pickle.loads(blob)
+    raise CacheFormatError('Unknown cache codec %s' % codec)
+
+
+class CacheReader:
+    """Parse the header of a cache blob and decode fields on demand."""
+
+    def __init__(self, blob: bytes):
+        start = len(CACHE_MAGIC)
+        data_start = start + _CACHE_PREAMBLE.size
+        if blob[:start] != CACHE_MAGIC or len(blob) < data_start:
+            raise CacheFormatError('Not a cloud-init cache')
+        version, header_len = _CACHE_PREAMBLE.unpack(blob[start:data_start])
+        if version != CACHE_FORMAT_VERSION:
+            raise CacheFormatError(
+                'Unsupported cache format version %s' % version)
+        try:
+            header = json.loads(
+                blob[data_start:data_start + header_len].decode('utf-8'))
+        except ValueError as e:
+            raise CacheFormatError('Invalid cache header: %s' % e) from e
+        self.cls_name = header['class']
+        self.version = header['version']
+        self.fields = header['fields']
+        self._data = memoryview(blob)[data_start + header_len:]
+
+    def load(self, name):
+        """Decode and return the value of the stored field name."""
+        offset, length, codec = self.fields[name]
+        return _decode_cache_value(
+            codec, self._data[offset:offset + length])
+
+    def load_class(self):
+        """Import and return the class whose state is cached."""
+        module_name, _, qualname = self.cls_name.partition(':')
+        try:
+            obj = importlib.import_module(module_name)
+            for attr in qualname.split('.'):
+                obj = getattr(obj, attr)
+        except (ImportError, AttributeError) as e:
+            raise CacheFormatError(
+                'Cached class %s is unavailable: %s' % (self.cls_name, e)
+            ) from e
+        return obj
+
+
+def load_cache(blob: bytes, base_cls=CloudInitCacheMixin, **attrs):
+    """Restore an object from a blob written by CloudInitCacheMixin.
+
+    :param blob: The bytes returned by ``to_cache``.
+    :param base_cls: The stored class must be a subclass of base_cls.
+    :param attrs: Values for the attributes excluded from the cache.
+
+    :raises CacheFormatError: if the blob can not be restored.
+    """
+    reader = CacheReader(blob)
+    cls = reader.load_class()
+    if not (isinstance(cls, type) and issubclass(cls, base_cls)):
+        raise CacheFormatError(
+            'Cached class %s is not a %s' % (reader.cls_name,
+                                             base_cls.__name__))
+    obj = cls.__new__(cls)
+    loaders = {}
+    for name in reader.fields:
+        if name in cls._cache_lazy_attrs and not hasattr(cls, name):
+            loaders[name] = _field_loader(reader, name)
+        else:
+            obj.__dict__[name] = reader.load(name)
+    obj.__dict__.update(attrs)
+    if loaders:
+        obj.__dict__['_cache_loaders'] = loaders
+    obj._unpickle(reader.version)
+    return obj
+
+
+def _field_loader(reader, name):
+    def loader():
+        return reader.load(name)
+    return loader
+
+
 # vi: ts=4 expandtab
@@ -1,8 +1,10 @@
 # This file is part of cloud-init. See LICENSE file for license information.
 
 import abc
+import contextlib
 import fcntl
 import json
+import mmap
 import os
 import queue
 import struct
@@ -97,6 +99,200 @@ class WebHookHandler(ReportingHandler):
             LOG.warning("failed posting event: %s", event.as_string())
 
 
+class HyperVKvpStore(object):
+    """Fixed size key/value records in a Hyper-V KVP pool file.
+
+    The pool file is kept open for the lifetime of the store. Keys are
+    indexed through an mmap of the file, grouped by the cloud-init
+    incarnation encoded in the key (None for other keys). The index is
+    caught up with records appended by this or other processes whenever it
+    is queried. All records of a batch are appended with a single write
+    under flock.
+    """
+
+    # Records read per pread when iterating the pool file
+    READ_CHUNK_RECORDS = 256
+
+    def __init__(self, path, key_size, value_size, event_prefix):
+        self.path = path
+        self.key_size = key_size
+        self.record_size = key_size + value_size
+        self.event_prefix = event_prefix
+        self._fd = None
+        self._ino = None
+        # Byte offset up to which records are indexed, and the key of the
+        # last indexed record to spot files rewritten behind our back
+        self._indexed_size = 0
+        self._last_key = None
+        # {incarnation: {key: [record number, ...]}}
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+            self._fd = None
+            self._reset_index()
+
+    def _reset_index(self):
+        self._indexed_size = 0
+        self._last_key = None
+        self._index = {}
+
+    def _open(self):
+        """Return an fd for the pool file, reopening if it was replaced."""
+        if self._fd is not None:
+            try:
+                if os.stat(self.path).st_ino == self._ino:
+                    return self._fd
+            except OSError:
+                pass
+            os.close(self._fd)
+            self._fd = None
+            self._reset_index()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT,
+                           0o644)
+        self._ino = os.fstat(self._fd).st_ino
+        return self._fd
+
+    def _incarnation(self, key):
+        parts = key.split('|', 2)
+        if len(parts) > 2 and parts[0] == self.event_prefix:
+            try:
+                return int(parts[1])
+            except ValueError:
+                pass
+        return None
+
+    def _decode_key(self, record):
+        # Other writers' keys need not be UTF-8, those are still indexed
+        return bytes(record[:self.key_size]).strip(b'\x00').decode(
+            'utf-8', errors='replace')
+
+    def _add_to_index(self, keys, first_record):
+        for record_no, key in enumerate(keys, first_record):
+            by_key = self._index.setdefault(self._incarnation(key), {})
+            by_key.setdefault(key, []).append(record_no)
+            self._last_key = key
+
+    def _refresh(self, fd):
+        """Index records appended since the last refresh. Hold flock."""
+        size = os.fstat(fd).st_size
+        size -= size % self.record_size
+        if size < self._indexed_size:
+            self._reset_index()
+        elif self._indexed_size and self._last_key is not None:
+            last = os.pread(fd, self.key_size,
+                            self._indexed_size - self.record_size)
+            if self._decode_key(last) != self._last_key:
+                self._reset_index()
+        if size == self._indexed_size:
+            return
+        with mmap.mmap(fd, size, prot=mmap.PROT_READ) as m:
+            keys = [
+                self._decode_key(m[offset:offset + self.key_size])
+                for offset in range(
+                    self._indexed_size, size, self.record_size)]
+        self._add_to_index(keys, self._indexed_size // self.record_size)
+        self._indexed_size = size
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Yield the pool file fd under flock with the index caught up."""
+        with self._lock:
+            fd = self._open()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                self._refresh(fd)
+                yield fd
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _write(self, fd, data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+
+    def iter_records(self, offset=0):
+        """Yield each complete record in the pool file from offset on."""
+        with self._lock:
+            fd = self._open()
+            # Appends happen under flock, so the size is of whole batches
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            size = os.fstat(fd).st_size
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            # The store fd may be closed or reopened once the lock is
+            # released, so read from a duplicate of it.
+            fd = os.dup(fd)
+        # Read in chunks without holding the lock so callers may append
+        # while iterating. pread, unlike the mmap, is safe should another
+        # process compact the file meanwhile.
+        try:
+            chunk_size = self.record_size * self.READ_CHUNK_RECORDS
+            while offset + self.record_size <= size:
+                chunk = os.pread(fd, min(chunk_size, size - offset), offset)
+                end = len(chunk) - len(chunk) % self.record_size
+                if not end:
+                    return
+                for start in range(0, end, self.record_size):
+                    yield chunk[start:start + self.record_size]
+                offset += end
+        finally:
+            os.close(fd)
+
+    def keys(self, incarnation=None):
+        """Return the keys stored for incarnation, in file order."""
+        with self._locked():
+            by_key = self._index.get(incarnation, {})
+            return sorted(by_key, key=lambda key: by_key[key][0])
+
+    def incarnations(self):
+        """Return the set of incarnations with records in the pool file."""
+        with self._locked():
+            return set(self._index)
+
+    def append(self, records):
+        """Append encoded records to the pool file in a single write."""
+        if not records:
+            return
+        data = b''.join(records)
+        with self._lock:
+            fd = self._open()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                # Records are indexed on the next read
+                self._write(fd, data)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def compact(self, is_stale):
+        """Drop records of the incarnations for which is_stale is True.
+
+        Records whose key carries no incarnation are always kept. Returns
+        the number of records dropped.
+        """
+        with self._locked() as fd:
+            dropped = set()
+            for incarnation, by_key in self._index.items():
+                if incarnation is not None and is_stale(incarnation):
+                    for record_nos in by_key.values():
+                        dropped.update(record_nos)
+            if not dropped:
+                return 0
+            size = self._indexed_size
+            with mmap.mmap(fd, size, prot=mmap.PROT_READ) as m:
+                kept = b''.join(
+                    m[start:start + self.record_size]
+                    for start in range(0, size, self.record_size)
+                    if start // self.record_size not in dropped)
+            os.ftruncate(fd, 0)
+            self._write(fd, kept)
+            self._reset_index()
+            self._refresh(fd)
+            return len(dropped)
+
+
 class HyperVKvpReportingHandler(ReportingHandler):
     """
     Reports events to a Hyper-V host using Key-Value-Pair exchange protocol
@@ -124,21 +320,32 @@ class HyperVKvpReportingHandler(ReportingHandler):
     DESC_IDX_KEY = 'msg_i'
     JSON_SEPARATORS = (',', ':')
     KVP_POOL_FILE_GUEST = '/var/lib/hyperv/.kvp_pool_1'
+    # Incarnations are derived from uptime, so processes of the same boot
+    # may disagree by a second or two. Compaction keeps incarnations within
+    # this many seconds of the current one.
+    KVP_INCARNATION_SLACK = 10
     _already_truncated_pool_file = False
+    _already_compacted_pool_file = False
 
     def __init__(self,
                  kvp_file_path=KVP_POOL_FILE_GUEST,
-                 event_types=None):
+                 event_types=None,
+                 compact_pool=False):
         super(HyperVKvpReportingHandler, self).__init__()
         self._kvp_file_path = kvp_file_path
         HyperVKvpReportingHandler._truncate_guest_pool_file(
             self._kvp_file_path)
+        self._kvp_store = HyperVKvpStore(
+            self._kvp_file_path, self.HV_KVP_EXCHANGE_MAX_KEY_SIZE,
+            self.HV_KVP_EXCHANGE_MAX_VALUE_SIZE, self.EVENT_PREFIX)
 
         self._event_types = event_types
         self.q = queue.Queue()
         self.incarnation_no = self._get_incarnation_no()
         self.event_key_prefix = u"{0}|{1}".format(self.EVENT_PREFIX,
                                                   self.incarnation_no)
+        if compact_pool:
+            self._compact_guest_pool_file()
         self.publish_thread = threading.Thread(
             target=self._publish_event_routine
         )
@@ -169,6 +376,27 @@ class HyperVKvpReportingHandler(ReportingHandler):
         finally:
             cls._already_truncated_pool_file = True
 
+    def _compact_guest_pool_file(self):
+        """
+        Drop the records of previous incarnations from the pool file, once
+        per boot. Unlike truncation this also cleans up pool files modified
+        since boot, keeping records which were not written by cloud-init.
+        """
+        cls = HyperVKvpReportingHandler
+        if cls._already_compacted_pool_file:
+            return
+        cls._already_compacted_pool_file = True
+        try:
+            dropped = self._kvp_store.compact(
+                lambda incarnation: (self.incarnation_no - incarnation >
+                                     self.KVP_INCARNATION_SLACK))
+        except (OSError, IOError) as e:
+            LOG.warning("failed to compact kvp pool file, %s", e)
+        else:
+            if dropped:
+                LOG.debug("Dropped %d stale records from kvp pool file",
+                          dropped)
+
     def _get_incarnation_no(self):
         """
         use the time passed as the incarnation number.
@@ -184,15 +412,8 @@ class HyperVKvpReportingHandler(ReportingHandler):
 
     def _iterate_kvps(self, offset):
         """iterate the kvp file from the current offset."""
-        with open(self._kvp_file_path, 'rb') as f:
-            fcntl.flock(f, fcntl.LOCK_EX)
-            f.seek(offset)
-            record_data = f.read(self.HV_KVP_RECORD_SIZE)
-            while len(record_data) == self.HV_KVP_RECORD_SIZE:
-                kvp_item = self._decode_kvp_item(record_data)
-                yield kvp_item
-                record_data = f.read(self.HV_KVP_RECORD_SIZE)
-            fcntl.flock(f, fcntl.LOCK_UN)
+        for record_data in self._kvp_store.iter_records(offset):
+            yield self._decode_kvp_item(record_data)
 
     def _event_key(self, event):
         """
@@ -222,22 +443,19 @@ class HyperVKvpReportingHandler(ReportingHandler):
             raise ReportException(
                 "record_data len not correct {0} {1}."
                 .format(record_data_len, self.HV_KVP_RECORD_SIZE))
-        k = (record_data[0:self.HV_KVP_EXCHANGE_MAX_KEY_SIZE].decode('utf-8')
-                                                             .strip('\x00'))
+        # Strip the NUL padding before decoding, NUL is never part of a
+        # multibyte UTF-8 sequence
+        k = (record_data[0:self.HV_KVP_EXCHANGE_MAX_KEY_SIZE].strip(b'\x00')
+                                                             .decode('utf-8'))
         v = (
             record_data[
                 self.HV_KVP_EXCHANGE_MAX_KEY_SIZE:self.HV_KVP_RECORD_SIZE
-            ].decode('utf-8').strip('\x00'))
+            ].strip(b'\x00').decode('utf-8'))
 
         return {'key': k, 'value': v}
 
     def _append_kvp_item(self, record_data):
-        with open(self._kvp_file_path, 'ab') as f:
-            fcntl.flock(f, fcntl.LOCK_EX)
-            for data in record_data:
-                f.write(data)
-            f.flush()
-            fcntl.flock(f, fcntl.LOCK_UN)
+        self._kvp_store.append(record_data)
 
     def _break_down(self, key, meta_data, description):
         del meta_data[self.MSG_KEY]
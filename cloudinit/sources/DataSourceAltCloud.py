@@ -50,22 +50,22 @@ def read_user_data_callback(mount_dir):
         drop deltacloud from the file name.
 
     Input:
-        mount_dir - Mount directory
+        mount_dir - Mount directory, or a fsimage.FilesystemView of the
+                    device
 
     Returns:
         User Data
 
     '''
 
-    deltacloud_user_data_file = mount_dir + '/deltacloud-user-data.txt'
-    user_data_file = mount_dir + '/user-data.txt'
-
     # First try deltacloud_user_data_file. On failure try user_data_file.
     try:
-        user_data = util.load_file(deltacloud_user_data_file).strip()
+        user_data = util.load_seed_file(
+            mount_dir, 'deltacloud-user-data.txt').strip()
     except IOError:
         try:
-            user_data = util.load_file(user_data_file).strip()
+            user_data = util.load_seed_file(
+                mount_dir, 'user-data.txt').strip()
         except IOError:
             util.logexc(LOG, 'Failed accessing user data file.')
             return None
@@ -207,7 +207,8 @@ class DataSourceAltCloud(sources.DataSource):
             return False
 
         try:
-            return_str = util.mount_cb(floppy_dev, read_user_data_callback)
+            return_str = util.mount_cb(floppy_dev, read_user_data_callback,
+                                       read_image=True)
         except OSError as err:
             if err.errno != errno.ENOENT:
                 raise
@@ -241,7 +242,8 @@ class DataSourceAltCloud(sources.DataSource):
         cdrom_list = util.find_devs_with('LABEL=CDROM')
         for cdrom_dev in cdrom_list:
             try:
-                return_str = util.mount_cb(cdrom_dev, read_user_data_callback)
+                return_str = util.mount_cb(cdrom_dev, read_user_data_callback,
+                                           read_image=True)
                 if return_str:
                     self.source = cdrom_dev
                     break
@@ -459,7 +459,8 @@ class DataSourceAzure(sources.DataSource):
                         ret = util.mount_cb(cdev, load_azure_ds_dir,
                                             mtype="udf")
                     else:
-                        ret = util.mount_cb(cdev, load_azure_ds_dir)
+                        ret = util.mount_cb(cdev, load_azure_ds_dir,
+                                            read_image=True)
                 else:
                     ret = load_azure_ds_dir(cdev)
 
@@ -2095,13 +2096,10 @@ def list_possible_azure_ds_devs():
 
 @azure_ds_telemetry_reporter
 def load_azure_ds_dir(source_dir):
-    ovf_file = os.path.join(source_dir, "ovf-env.xml")
-
-    if not os.path.isfile(ovf_file):
+    if not util.is_seed_file(source_dir, "ovf-env.xml"):
         raise NonAzureDataSource("No ovf-env file found")
 
-    with open(ovf_file, "rb") as fp:
-        contents = fp.read()
+    contents = util.load_seed_file(source_dir, "ovf-env.xml", decode=False)
 
     md, ud, cfg = read_azure_ovf(contents)
     return (md, ud, cfg, {'ovf-env.xml': contents})
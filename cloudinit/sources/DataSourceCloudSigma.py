@@ -45,6 +45,9 @@ class DataSourceCloudSigma(sources.DataSource):
         LOG.debug("detected hypervisor as %s", sys_product_name)
         return 'cloudsigma' in sys_product_name.lower()
 
+    def _is_platform_viable(self):
+        return self.is_running_in_cloudsigma()
+
     def _get_data(self):
         """
         Metadata is the whole server context and /meta/cloud-config is used
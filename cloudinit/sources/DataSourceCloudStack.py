@@ -96,7 +96,8 @@ class DataSourceCloudStack(sources.DataSource):
         start_time = time.time()
         url, _response = uhelp.wait_for_url(
             urls=urls, max_wait=url_params.max_wait_seconds,
-            timeout=url_params.timeout_seconds, status_cb=LOG.warning)
+            timeout=url_params.timeout_seconds, status_cb=LOG.warning,
+            race=self.get_url_race())
 
         if url:
             LOG.debug("Using metadata source: '%s'", url)
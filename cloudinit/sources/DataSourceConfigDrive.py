@@ -78,7 +78,7 @@ class DataSourceConfigDrive(openstack.SourceMixin, sources.DataSource):
                         mtype = "cd9660"
                 try:
                     results = util.mount_cb(dev, read_config_drive,
-                                            mtype=mtype)
+                                            mtype=mtype, read_image=True)
                     found = dev
                 except openstack.NonReadable:
                     pass
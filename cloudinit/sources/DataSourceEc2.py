@@ -9,6 +9,7 @@
 # This file is part of cloud-init. See LICENSE file for license information.
 
 import os
+import threading
 import time
 
 from cloudinit import dmi
@@ -69,7 +70,12 @@ class DataSourceEc2(sources.DataSource):
     url_max_wait = 120
     url_timeout = 50
 
+    # Maximum concurrent requests when crawling the meta-data tree.
+    url_crawl_workers = 8
+
     _api_token = None  # API token for accessing the metadata service
+    # Serializes token refresh between concurrent metadata crawler threads
+    _api_token_lock = threading.Lock()
     _network_config = sources.UNSET  # Used to cache calculated network cfg v1
 
     # Whether we want to get network configuration from the metadata service.
@@ -83,7 +89,7 @@ class DataSourceEc2(sources.DataSource):
         """Return the cloud name as identified during _get_data."""
         return identify_platform()
 
-    def _get_data(self):
+    def _is_platform_viable(self):
         strict_mode, _sleep = read_strict_mode(
             util.get_cfg_by_path(self.sys_cfg, STRICT_ID_PATH,
                                  STRICT_ID_DEFAULT), ("warn", None))
@@ -94,6 +100,11 @@ class DataSourceEc2(sources.DataSource):
             return False
         elif self.cloud_name == CloudNames.NO_EC2_METADATA:
             return False
+        return True
+
+    def _get_data(self):
+        if not self._is_platform_viable():
+            return False
 
         if self.perform_dhcp_setup:  # Setup networking in init-local stage.
             if util.is_FreeBSD():
@@ -224,7 +235,8 @@ class DataSourceEc2(sources.DataSource):
                 headers_cb=self._get_headers,
                 exception_cb=self._imds_exception_cb,
                 request_method=request_method,
-                headers_redact=AWS_TOKEN_REDACT)
+                headers_redact=AWS_TOKEN_REDACT,
+                race=self.get_url_race())
         except uhelp.UrlError:
             # We use the raised exception to interupt the retry loop.
             # Nothing else to do here.
@@ -282,7 +294,7 @@ class DataSourceEc2(sources.DataSource):
                 urls=urls, max_wait=url_params.max_wait_seconds,
                 timeout=url_params.timeout_seconds, status_cb=LOG.warning,
                 headers_redact=AWS_TOKEN_REDACT, headers_cb=self._get_headers,
-                request_method=request_method)
+                request_method=request_method, race=self.get_url_race())
 
             if url:
                 metadata_address = url2base[url]
@@ -456,6 +468,7 @@ class DataSourceEc2(sources.DataSource):
             return {}
         api_version = self.get_metadata_api_version()
         redact = AWS_TOKEN_REDACT
+        max_workers = self.get_crawl_workers()
         crawled_metadata = {}
         if self.cloud_name == CloudNames.AWS:
             exc_cb = self._refresh_stale_aws_token_cb
@@ -470,12 +483,12 @@ class DataSourceEc2(sources.DataSource):
             crawled_metadata['meta-data'] = ec2.get_instance_metadata(
                 api_version, self.metadata_address,
                 headers_cb=self._get_headers, headers_redact=redact,
-                exception_cb=exc_cb)
+                exception_cb=exc_cb, max_workers=max_workers)
             if self.cloud_name == CloudNames.AWS:
                 identity = ec2.get_instance_identity(
                     api_version, self.metadata_address,
                     headers_cb=self._get_headers, headers_redact=redact,
-                    exception_cb=exc_cb)
+                    exception_cb=exc_cb, max_workers=max_workers)
                 crawled_metadata['dynamic'] = {'instance-identity': identity}
         except Exception:
             util.logexc(
@@ -485,6 +498,17 @@ class DataSourceEc2(sources.DataSource):
         crawled_metadata['_metadata_api_version'] = api_version
         return crawled_metadata
 
+    def get_crawl_workers(self):
+        """Return the number of concurrent requests used to crawl IMDS."""
+        try:
+            return max(1, int(self.ds_cfg.get(
+                "max_crawl_workers", self.url_crawl_workers)))
+        except (ValueError, TypeError):
+            LOG.warning(
+                "Config max_crawl_workers '%s' is not an int, using %d",
+                self.ds_cfg.get("max_crawl_workers"), self.url_crawl_workers)
+            return self.url_crawl_workers
+
     def _refresh_api_token(self, seconds=AWS_TOKEN_TTL_SECONDS):
         """Request new metadata API token.
         @param seconds: The lifetime of the token in seconds
@@ -560,14 +584,15 @@ class DataSourceEc2(sources.DataSource):
         request_token_header = {AWS_TOKEN_REQ_HEADER: AWS_TOKEN_TTL_SECONDS}
         if API_TOKEN_ROUTE in url:
             return request_token_header
-        if not self._api_token:
-            # If we don't yet have an API token, get one via a PUT against
-            # API_TOKEN_ROUTE. This _api_token may get unset by a 403 due
-            # to an invalid or expired token
-            self._api_token = self._refresh_api_token()
+        with self._api_token_lock:
             if not self._api_token:
-                return {}
-        return {AWS_TOKEN_PUT_HEADER: self._api_token}
+                # If we don't yet have an API token, get one via a PUT against
+                # API_TOKEN_ROUTE. This _api_token may get unset by a 403 due
+                # to an invalid or expired token
+                self._api_token = self._refresh_api_token()
+                if not self._api_token:
+                    return {}
+            return {AWS_TOKEN_PUT_HEADER: self._api_token}
 
 
 class DataSourceEc2Local(DataSourceEc2):
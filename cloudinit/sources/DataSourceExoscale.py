@@ -66,7 +66,8 @@ class DataSourceExoscale(sources.DataSource):
             urls=[metadata_url],
             max_wait=self.url_max_wait,
             timeout=self.url_timeout,
-            status_cb=LOG.critical)
+            status_cb=LOG.critical,
+            race=self.get_url_race())
 
         return bool(url)
 
@@ -47,6 +47,9 @@ class DataSourceHetzner(sources.DataSource):
         self._network_config = None
         self.dsmode = sources.DSMODE_NETWORK
 
+    def _is_platform_viable(self):
+        return get_hcloud_data()[0]
+
     def _get_data(self):
         (on_hetzner, serial) = get_hcloud_data()
 
@@ -299,7 +299,8 @@ def read_md():
         if os.path.isdir(path):
             results = metadata_from_dir(path)
         else:
-            results = util.mount_cb(path, metadata_from_dir)
+            results = util.mount_cb(path, metadata_from_dir,
+                                    read_image=True)
     except sources.BrokenMetadata as e:
         raise RuntimeError(
             "Failed reading IBM config disk (platform=%s path=%s): %s" %
@@ -341,12 +342,12 @@ def metadata_from_dir(source_dir):
 
     results = {}
     for (name, path, transl) in files:
-        fpath = os.path.join(source_dir, path)
         raw = None
         try:
-            raw = util.load_file(fpath, decode=False)
+            raw = util.load_seed_file(source_dir, path, decode=False)
         except IOError as e:
-            LOG.debug("Failed reading path '%s': %s", fpath, e)
+            LOG.debug("Failed reading path '%s' of %s: %s", path,
+                      source_dir, e)
 
         if raw is None or transl is None:
             data = raw
@@ -118,7 +118,7 @@ class DataSourceNoCloud(sources.DataSource):
 
                     try:
                         seeded = util.mount_cb(dev, _pp2d_callback,
-                                               pp2d_kwargs)
+                                               pp2d_kwargs, read_image=True)
                     except ValueError:
                         LOG.warning("device %s with label=%s not a "
                                     "valid seed.", dev, label)
@@ -519,13 +519,13 @@ def read_ovf_environment(contents):
 def get_ovf_env(dirname):
     env_names = ("ovf-env.xml", "ovf_env.xml", "OVF_ENV.XML", "OVF-ENV.XML")
     for fname in env_names:
-        full_fn = os.path.join(dirname, fname)
-        if os.path.isfile(full_fn):
+        if util.is_seed_file(dirname, fname):
             try:
-                contents = util.load_file(full_fn)
+                contents = util.load_seed_file(dirname, fname)
                 return (fname, contents)
             except Exception:
-                util.logexc(LOG, "Failed loading ovf file %s", full_fn)
+                util.logexc(LOG, "Failed loading ovf file %s from %s",
+                            fname, dirname)
     return (None, False)
 
 
@@ -596,7 +596,8 @@ def transport_iso9660(require_iso=True):
             if maybe_cdrom_device(dev)]
     for dev in devs:
         try:
-            (_fname, contents) = util.mount_cb(dev, get_ovf_env, mtype=mtype)
+            (_fname, contents) = util.mount_cb(dev, get_ovf_env, mtype=mtype,
+                                               read_image=True)
         except util.MountFailedError:
             LOG.debug("%s not mountable as iso9660", dev)
             continue
@@ -73,7 +73,8 @@ class DataSourceOpenNebula(sources.DataSource):
                         asuser=parseuser,
                         distro=self.distro,
                     )
-                    results = util.mount_cb(cdev, partially_applied_func)
+                    results = util.mount_cb(cdev, partially_applied_func,
+                                            read_image=True)
             except NonContextDiskDir:
                 continue
             except BrokenContextDiskDir as exc:
@@ -386,9 +387,8 @@ def read_context_disk_dir(source_dir, distro, asuser=None):
     """
     found = {}
     for af in CONTEXT_DISK_FILES:
-        fn = os.path.join(source_dir, af)
-        if os.path.isfile(fn):
-            found[af] = fn
+        if util.is_seed_file(source_dir, af):
+            found[af] = af
 
     if not found:
         raise NonContextDiskDir("%s: %s" % (source_dir, "no files found"))
@@ -406,8 +406,7 @@ def read_context_disk_dir(source_dir, distro, asuser=None):
                         user=asuser)
                 ) from e
         try:
-            path = os.path.join(source_dir, 'context.sh')
-            content = util.load_file(path)
+            content = util.load_seed_file(source_dir, 'context.sh')
             context = parse_shell_config(content, asuser=asuser)
         except subp.ProcessExecutionError as e:
             raise BrokenContextDiskDir(
@@ -46,6 +46,9 @@ class DataSourceOpenStack(openstack.SourceMixin, sources.DataSource):
     # Whether we want to get network configuration from the metadata service.
     perform_dhcp_setup = False
 
+    # Seconds crawling the metadata service may take, no limit if <= 0
+    crawl_max_wait = -1
+
     def __init__(self, sys_cfg, distro, paths):
         super(DataSourceOpenStack, self).__init__(sys_cfg, distro, paths)
         self.metadata_address = None
@@ -83,7 +86,7 @@ class DataSourceOpenStack(openstack.SourceMixin, sources.DataSource):
         start_time = time.time()
         avail_url, _response = url_helper.wait_for_url(
             urls=md_urls, max_wait=url_params.max_wait_seconds,
-            timeout=url_params.timeout_seconds)
+            timeout=url_params.timeout_seconds, race=self.get_url_race())
         if avail_url:
             LOG.debug("Using metadata source: '%s'", url2base[avail_url])
         else:
@@ -93,6 +96,21 @@ class DataSourceOpenStack(openstack.SourceMixin, sources.DataSource):
         self.metadata_address = url2base.get(avail_url)
         return bool(avail_url)
 
+    def get_crawl_max_wait(self):
+        """Return the seconds crawling the metadata service may take.
+
+        The datasource config option crawl_max_wait overrides crawl_max_wait.
+        """
+        max_wait = self.crawl_max_wait
+        try:
+            max_wait = float(
+                self.ds_cfg.get("crawl_max_wait", self.crawl_max_wait))
+        except (TypeError, ValueError):
+            util.logexc(
+                LOG, "Config crawl_max_wait '%s' is not a number, using"
+                " default '%s'", self.ds_cfg.get("crawl_max_wait"), max_wait)
+        return max_wait
+
     def check_instance_id(self, sys_cfg):
         # quickly (local check only) if self.instance_id is still valid
         return sources.instance_id_matches_system_uuid(self.get_instance_id())
@@ -120,6 +138,10 @@ class DataSourceOpenStack(openstack.SourceMixin, sources.DataSource):
             self.network_json, known_macs=None)
         return self._network_config
 
+    def _is_platform_viable(self):
+        oracle_considered = 'Oracle' in self.sys_cfg.get('datasource_list')
+        return detect_openstack(accept_oracle=not oracle_considered)
+
     def _get_data(self):
         """Crawl metadata, parse and persist that data for this instance.
 
@@ -127,8 +149,7 @@ class DataSourceOpenStack(openstack.SourceMixin, sources.DataSource):
             False when unable to contact metadata service or when metadata
             format is invalid or disabled.
         """
-        oracle_considered = 'Oracle' in self.sys_cfg.get('datasource_list')
-        if not detect_openstack(accept_oracle=not oracle_considered):
+        if not self._is_platform_viable():
             return False
 
         if self.perform_dhcp_setup:  # Setup networking in init-local stage.
@@ -201,7 +222,8 @@ class DataSourceOpenStack(openstack.SourceMixin, sources.DataSource):
                 read_metadata_service, args=[self.metadata_address],
                 kwargs={'ssl_details': self.ssl_details,
                         'retries': url_params.num_retries,
-                        'timeout': url_params.timeout_seconds})
+                        'timeout': url_params.timeout_seconds,
+                        'max_wait': self.get_crawl_max_wait()})
         except openstack.NonReadable as e:
             raise sources.InvalidMetaDataException(str(e))
         except (openstack.BrokenMetadata, IOError) as e:
@@ -224,9 +246,10 @@ class DataSourceOpenStackLocal(DataSourceOpenStack):
 
 
 def read_metadata_service(base_url, ssl_details=None,
-                          timeout=5, retries=5):
+                          timeout=5, retries=5, max_wait=None):
     reader = openstack.MetadataReader(base_url, ssl_details=ssl_details,
-                                      timeout=timeout, retries=retries)
+                                      timeout=timeout, retries=retries,
+                                      max_wait=max_wait)
     return reader.read_v2()
 
 
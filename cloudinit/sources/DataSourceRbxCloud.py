@@ -10,8 +10,6 @@ This file contains code used to gather the user data passed to an
 instance on rootbox / hyperone cloud platforms
 """
 import errno
-import os
-import os.path
 
 from cloudinit import log as logging
 from cloudinit import sources
@@ -83,7 +81,8 @@ def get_md():
             rbx_data = util.mount_cb(
                 device=device,
                 callback=read_user_data_callback,
-                mtype=['vfat', 'fat', 'msdosfs']
+                mtype=['vfat', 'fat', 'msdosfs'],
+                read_image=True
             )
             if rbx_data:
                 return rbx_data
@@ -134,20 +133,14 @@ def read_user_data_callback(mount_dir):
     drive.
 
     @param mount_dir: String representing path of directory where mounted drive
-    is available
+    is available, or a fsimage.FilesystemView of the drive
 
     @returns: A dict containing userdata, metadata and cfg based on metadata.
     """
     meta_data = util.load_json(
-        text=util.load_file(
-            fname=os.path.join(mount_dir, 'cloud.json'),
-            decode=False
-        )
-    )
-    user_data = util.load_file(
-        fname=os.path.join(mount_dir, 'user.data'),
-        quiet=True
+        text=util.load_seed_file(mount_dir, 'cloud.json', decode=False)
     )
+    user_data = util.load_seed_file(mount_dir, 'user.data', quiet=True)
     if 'vm' not in meta_data or 'netadp' not in meta_data:
         util.logexc(LOG, "Failed to load metadata. Invalid format.")
         return None
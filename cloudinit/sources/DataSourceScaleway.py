@@ -206,6 +206,9 @@ class DataSourceScaleway(sources.DataSource):
             self.retries, self.timeout
         )
 
+    def _is_platform_viable(self):
+        return on_scaleway()
+
     def _get_data(self):
         if not on_scaleway():
             return False
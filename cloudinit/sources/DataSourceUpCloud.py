@@ -59,6 +59,9 @@ class DataSourceUpCloud(sources.DataSource):
             retries=self.retries,
         )
 
+    def _is_platform_viable(self):
+        return self._get_sysinfo()[0]
+
     def _get_data(self):
         (is_upcloud, server_uuid) = self._get_sysinfo()
 
@@ -31,6 +31,9 @@ class DataSourceVultr(sources.DataSource):
             BUILTIN_DS_CONFIG])
 
     # Initiate data and check if Vultr
+    def _is_platform_viable(self):
+        return vultr.is_vultr()
+
     def _get_data(self):
         LOG.debug("Detecting if machine is a Vultr instance")
         if not vultr.is_vultr():
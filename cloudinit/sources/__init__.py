@@ -12,7 +12,9 @@ import abc
 import copy
 import json
 import os
+import re
 from collections import namedtuple
+from concurrent import futures
 
 from cloudinit import dmi
 from cloudinit import importer
@@ -24,7 +26,7 @@ from cloudinit import util
 from cloudinit.atomic_helper import write_json
 from cloudinit.event import EventType
 from cloudinit.filters import launch_index
-from cloudinit.persistence import CloudInitPickleMixin
+from cloudinit.persistence import CloudInitCacheMixin
 from cloudinit.reporting import events
 
 DSMODE_DISABLED = "disabled"
@@ -49,6 +51,11 @@ INSTANCE_JSON_FILE = 'instance-data.json'
 # security-sensitive key values are present in this root-readable file
 INSTANCE_JSON_SENSITIVE_FILE = 'instance-data-sensitive.json'
 REDACT_SENSITIVE_VALUE = 'redacted for non-root user'
+# Each instance-data file is written with an index of where its values are,
+# named as the file with this suffix in place of .json
+INSTANCE_JSON_INDEX_SUFFIX = '-index.json'
+# Levels of nested keys whose values are located by the index
+INSTANCE_JSON_INDEX_DEPTH = 3
 
 # Key which can be provide a cloud's official product name to cloud-init
 METADATA_CLOUD_NAME_KEY = 'cloud-name'
@@ -56,6 +63,9 @@ METADATA_CLOUD_NAME_KEY = 'cloud-name'
 UNSET = "_unset"
 METADATA_UNKNOWN = 'unknown'
 
+# System config key enabling concurrent platform checks in find_source
+PARALLEL_PROBE_KEY = 'datasource_parallel_probe'
+
 LOG = logging.getLogger(__name__)
 
 # CLOUD_ID_REGION_PREFIX_MAP format is:
@@ -131,11 +141,77 @@ def redact_sensitive_keys(metadata, redact_value=REDACT_SENSITIVE_VALUE):
     return md_copy
 
 
+def instance_data_index_path(instance_data_fn):
+    """Return the path of the index of the instance-data file."""
+    base, ext = os.path.splitext(instance_data_fn)
+    if ext != '.json':
+        base = instance_data_fn
+    return base + INSTANCE_JSON_INDEX_SUFFIX
+
+
+_JSON_DECODER = json.JSONDecoder()
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def _index_json_object(content, pos, depth):
+    """Return the index of the JSON object at content[pos] and its end.
+
+    Each key of the object is indexed as a [start, end] list of the offsets
+    of its value in content. Objects are [start, end, index] with the index
+    of their own keys, or None once nested depth levels deep.
+    """
+    index = {}
+    pos = _JSON_WHITESPACE.match(content, pos + 1).end()
+    if content[pos] == '}':
+        return index, pos + 1
+    while True:
+        key, pos = json.decoder.scanstring(content, pos + 1)
+        pos = _JSON_WHITESPACE.match(content, pos).end()
+        start = _JSON_WHITESPACE.match(content, pos + 1).end()
+        if content[start] == '{' and depth > 1:
+            key_index, pos = _index_json_object(content, start, depth - 1)
+            index[key] = [start, pos, key_index]
+        else:
+            pos = _JSON_DECODER.raw_decode(content, start)[1]
+            if content[start] == '{':
+                index[key] = [start, pos, None]
+            else:
+                index[key] = [start, pos]
+        pos = _JSON_WHITESPACE.match(content, pos).end()
+        if content[pos] == '}':
+            return index, pos + 1
+        pos = _JSON_WHITESPACE.match(content, pos + 1).end()
+
+
+def write_instance_data_index(instance_data_fn, mode=0o644):
+    """Write the index of the keys of an instance-data file.
+
+    The index holds the offsets of the value of each key in the file, so
+    cloud-init query can read and parse only the values it is asked for.
+    It records the size and mtime of the file, and is not used by query once
+    the file changes.
+
+    @return True on successful write, False otherwise.
+    """
+    content = util.load_file(instance_data_fn, decode=False)
+    try:
+        keys = _index_json_object(
+            content.decode('ascii'), 0, INSTANCE_JSON_INDEX_DEPTH)[0]
+    except (IndexError, UnicodeDecodeError, ValueError) as e:
+        LOG.warning('Error indexing %s: %s', instance_data_fn, e)
+        return False
+    stat = os.stat(instance_data_fn)
+    index = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'keys': keys}
+    util.write_file(instance_data_index_path(instance_data_fn),
+                    json.dumps(index, separators=(',', ':')), mode=mode)
+    return True
+
+
 URLParams = namedtuple(
     'URLParms', ['max_wait_seconds', 'timeout_seconds', 'num_retries'])
 
 
-class DataSource(CloudInitPickleMixin, metaclass=abc.ABCMeta):
+class DataSource(CloudInitCacheMixin, metaclass=abc.ABCMeta):
 
     dsmode = DSMODE_NETWORK
     default_locale = 'en_US.UTF-8'
@@ -172,6 +248,7 @@ class DataSource(CloudInitPickleMixin, metaclass=abc.ABCMeta):
     url_max_wait = -1   # max_wait < 0 means do not wait
     url_timeout = 10    # timeout for each metadata url read attempt
     url_retries = 5     # number of times to retry url upon 404
+    url_race = False    # request all metadata urls at once when waiting
 
     # The datasource defines a set of supported EventTypes during which
     # the datasource can react to changes in metadata and regenerate
@@ -199,6 +276,16 @@ class DataSource(CloudInitPickleMixin, metaclass=abc.ABCMeta):
 
     _ci_pkl_version = 1
 
+    # Attributes which are not stored in the obj.cache datasource cache.
+    # They are provided by the caller when the cache is restored.
+    _cache_excluded_attrs = ('sys_cfg', 'distro', 'paths', 'ud_proc')
+
+    # Attributes which are only deserialized from obj.cache on first access
+    _cache_lazy_attrs = (
+        'userdata', 'userdata_raw', 'vendordata', 'vendordata_raw',
+        'vendordata2', 'vendordata2_raw', 'ec2_metadata', 'network_json',
+        '_crawled_metadata')
+
     def __init__(self, sys_cfg, distro, paths, ud_proc=None):
         self.sys_cfg = sys_cfg
         self.distro = distro
@@ -223,9 +310,9 @@ class DataSource(CloudInitPickleMixin, metaclass=abc.ABCMeta):
 
     def _unpickle(self, ci_pkl_version: int) -> None:
         """Perform deserialization fixes for Paths."""
-        if not hasattr(self, 'vendordata2'):
+        if not self._has_state('vendordata2'):
             self.vendordata2 = None
-        if not hasattr(self, 'vendordata2_raw'):
+        if not self._has_state('vendordata2_raw'):
             self.vendordata2_raw = None
 
     def __str__(self):
@@ -346,9 +433,11 @@ class DataSource(CloudInitPickleMixin, metaclass=abc.ABCMeta):
         json_sensitive_file = os.path.join(self.paths.run_dir,
                                            INSTANCE_JSON_SENSITIVE_FILE)
         write_json(json_sensitive_file, processed_data, mode=0o600)
+        write_instance_data_index(json_sensitive_file, mode=0o600)
         json_file = os.path.join(self.paths.run_dir, INSTANCE_JSON_FILE)
         # World readable
         write_json(json_file, redact_sensitive_keys(processed_data))
+        write_instance_data_index(json_file)
         return True
 
     def _get_data(self):
@@ -393,6 +482,25 @@ class DataSource(CloudInitPickleMixin, metaclass=abc.ABCMeta):
 
         return URLParams(max_wait, timeout, retries)
 
+    def _is_platform_viable(self):
+        """Return False when this platform can not host the datasource.
+
+        This must be a cheap local check (DMI, sysfs or files on disk) which
+        does not touch the network. It may run concurrently with the checks
+        of other datasources. Returning True only means the datasource could
+        not be ruled out.
+        """
+        return True
+
+    def get_url_race(self):
+        """Return True when metadata urls should be raced in wait_for_url.
+
+        Subclasses may override url_race. The datasource config option
+        race_metadata_urls overrides both.
+        """
+        return util.translate_bool(
+            self.ds_cfg.get("race_metadata_urls", self.url_race))
+
     def get_userdata(self, apply_filter=False):
         if self.userdata is None:
             self.userdata = self.ud_proc.process(self.get_userdata_raw())
@@ -773,13 +881,65 @@ def normalize_pubkey_data(pubkey_data):
     return keys
 
 
+def _probe_platforms(sources, mode, reporter):
+    """Run _is_platform_viable concurrently for (name, cls, ds) sources.
+
+    Each check is timed in its own probe-<name> reporting event. Checks which
+    raise an exception can not rule their datasource out.
+
+    @return: The list of (name, cls, ds) sources which may be viable, in
+        their original priority order.
+    """
+
+    def probe(name, ds):
+        myrep = events.ReportEventStack(
+            name="probe-%s" % name.replace("DataSource", ""),
+            description="checking platform for %s data from %s" % (
+                mode, name),
+            parent=reporter)
+        with myrep:
+            try:
+                viable = ds._is_platform_viable()
+            except Exception:
+                util.logexc(LOG, "Checking platform for %s failed", name)
+                viable = True
+            myrep.message = "platform %s %s" % (
+                "may be viable for" if viable else "not viable for", name)
+        return viable
+
+    if not sources:
+        return []
+    with futures.ThreadPoolExecutor(max_workers=len(sources)) as executor:
+        checks = [executor.submit(probe, name, ds)
+                  for name, _cls, ds in sources]
+        viable = [check.result() for check in checks]
+    for (name, _cls, _ds), is_viable in zip(sources, viable):
+        if not is_viable:
+            LOG.debug("Skipping %s: platform is not viable", name)
+    return [source for source, is_viable in zip(sources, viable)
+            if is_viable]
+
+
 def find_source(sys_cfg, distro, paths, ds_deps, cfg_list, pkg_list, reporter):
     ds_list = list_sources(cfg_list, ds_deps, pkg_list)
     ds_names = [type_utils.obj_name(f) for f in ds_list]
     mode = "network" if DEP_NETWORK in ds_deps else "local"
     LOG.debug("Searching for %s data source in: %s", mode, ds_names)
 
-    for name, cls in zip(ds_names, ds_list):
+    parallel = util.translate_bool(sys_cfg.get(PARALLEL_PROBE_KEY, False))
+    if parallel:
+        candidates = []
+        for name, cls in zip(ds_names, ds_list):
+            try:
+                candidates.append((name, cls, cls(sys_cfg, distro, paths)))
+            except Exception:
+                util.logexc(LOG, "Getting data from %s failed", cls)
+        candidates = _probe_platforms(candidates, mode, reporter)
+    else:
+        candidates = [
+            (name, cls, None) for name, cls in zip(ds_names, ds_list)]
+
+    for name, cls, s in candidates:
         myrep = events.ReportEventStack(
             name="search-%s" % name.replace("DataSource", ""),
             description="searching for %s data from %s" % (mode, name),
@@ -788,7 +948,8 @@ def find_source(sys_cfg, distro, paths, ds_deps, cfg_list, pkg_list, reporter):
         try:
             with myrep:
                 LOG.debug("Seeing if we can get any data from %s", cls)
-                s = cls(sys_cfg, distro, paths)
+                if s is None:
+                    s = cls(sys_cfg, distro, paths)
                 if s.update_metadata([EventType.BOOT_NEW_INSTANCE]):
                     myrep.message = "found %s data from %s" % (mode, name)
                     return (s, type_utils.obj_name(cls))
@@ -812,9 +973,16 @@ def list_sources(cfg_list, depends, pkg_list):
     for ds_name in cfg_list:
         if not ds_name.startswith(DS_PREFIX):
             ds_name = '%s%s' % (DS_PREFIX, ds_name)
-        m_locs, _looked_locs = importer.find_module(ds_name,
-                                                    pkg_list,
-                                                    ['get_datasource_list'])
+        entry = importer.find_indexed_module('datasources', ds_name, pkg_list)
+        if entry:
+            # Modules without datasources matching depends are not imported
+            if (entry['datasources'] is not None and
+                    not list_from_depends(depends, entry['datasources'])):
+                continue
+            m_locs = [entry['module']]
+        else:
+            m_locs, _looked_locs = importer.find_module(
+                ds_name, pkg_list, ['get_datasource_list'])
         for m_loc in m_locs:
             mod = importer.import_module(m_loc)
             lister = getattr(mod, "get_datasource_list")
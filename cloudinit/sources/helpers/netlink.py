@@ -3,6 +3,7 @@
 # This file is part of cloud-init. See LICENSE file for license information.
 
 from cloudinit import log as logging
+from cloudinit import net
 from cloudinit import util
 from collections import namedtuple
 
@@ -22,22 +23,51 @@ RTM_NEWLINK = 16
 RTM_DELLINK = 17
 RTM_GETLINK = 18
 RTM_SETLINK = 19
+RTM_NEWADDR = 20
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_GETROUTE = 26
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
 MAX_SIZE = 65535
 RTA_DATA_OFFSET = 32
 MSG_TYPE_OFFSET = 16
 SELECT_TIMEOUT = 60
+DUMP_TIMEOUT = 5
 
 NLMSGHDR_FMT = "IHHII"
 IFINFOMSG_FMT = "BHiII"
+IFADDRMSG_FMT = "BBBBI"
+RTMSG_FMT = "BBBBBBBBI"
+RTATTR_FMT = "HH"
 NLMSGHDR_SIZE = struct.calcsize(NLMSGHDR_FMT)
 IFINFOMSG_SIZE = struct.calcsize(IFINFOMSG_FMT)
+IFADDRMSG_SIZE = struct.calcsize(IFADDRMSG_FMT)
+RTMSG_SIZE = struct.calcsize(RTMSG_FMT)
+RTATTR_SIZE = struct.calcsize(RTATTR_FMT)
 RTATTR_START_OFFSET = NLMSGHDR_SIZE + IFINFOMSG_SIZE
 RTA_DATA_START_OFFSET = 4
 PAD_ALIGNMENT = 4
 
+IFLA_ADDRESS = 1
 IFLA_IFNAME = 3
 IFLA_OPERSTATE = 16
 
+# http://man7.org/linux/man-pages/man7/rtnetlink.7.html
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_BROADCAST = 4
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PRIORITY = 6
+RTA_MULTIPATH = 9
+RTA_CACHEINFO = 12
+RTA_TABLE = 15
+RTNH_FMT = "HBBi"
+RTNH_SIZE = struct.calcsize(RTNH_FMT)
+RTA_CACHEINFO_FMT = "IIiIIIII"
+
 # https://www.kernel.org/doc/Documentation/networking/operstates.txt
 OPER_UNKNOWN = 0
 OPER_NOTPRESENT = 1
@@ -51,12 +81,17 @@ RTAAttr = namedtuple('RTAAttr', ['length', 'rta_type', 'data'])
 InterfaceOperstate = namedtuple('InterfaceOperstate', ['ifname', 'operstate'])
 NetlinkHeader = namedtuple('NetlinkHeader', ['length', 'type', 'flags', 'seq',
                                              'pid'])
+NetlinkMessage = namedtuple('NetlinkMessage', ['header', 'body', 'attrs'])
 
 
 class NetlinkCreateSocketError(RuntimeError):
     '''Raised if netlink socket fails during create or bind.'''
 
 
+class NetlinkDumpError(RuntimeError):
+    '''Raised if the kernel fails or does not finish a netlink dump.'''
+
+
 def create_bound_netlink_socket():
     '''Creates netlink socket and bind on netlink group to catch interface
     down/up events. The socket will bound only on RTMGRP_LINK (which only
@@ -303,6 +338,9 @@ def read_netlink_messages(netlink_socket,
             padlen = (nlheader.length+PAD_ALIGNMENT-1) & ~(PAD_ALIGNMENT-1)
             offset = offset + padlen
             LOG.debug('offset to next netlink message: %d', offset)
+            if nlheader.type in (RTM_NEWLINK, RTM_DELLINK):
+                # Devices changed, so sysfs must be read again
+                net.invalidate_net_snapshot()
             # Continue if we are not interested in this message.
             if nlheader.type not in rtm_types:
                 continue
@@ -326,4 +364,100 @@ def read_netlink_messages(netlink_socket,
                 return
         data = data[offset:]
 
+
+def unpack_rta_attrs(data, offset, end=None):
+    '''Unpack all rta attributes from offset up to end of data.
+
+    :param: data: bytes of a single netlink message or nested attribute
+    :param: offset: starting offset of the first RTA Attribute
+    :param: end: offset at which attributes end, defaults to len(data)
+    :returns: dict of attribute data keyed by rta type. Attributes repeated
+              in data keep the data of the first one.
+    '''
+    if end is None:
+        end = len(data)
+    attrs = {}
+    while offset + RTATTR_SIZE <= end:
+        length, rta_type = struct.unpack_from(RTATTR_FMT, data, offset)
+        if length < RTATTR_SIZE or offset + length > end:
+            break
+        attrs.setdefault(rta_type, data[offset + RTATTR_SIZE:offset + length])
+        offset += (length + PAD_ALIGNMENT - 1) & ~(PAD_ALIGNMENT - 1)
+    return attrs
+
+
+def dump_netlink_messages(msg_type, payload, timeout=DUMP_TIMEOUT):
+    '''Request a dump of routing objects and return all replies.
+
+    A NETLINK_ROUTE socket is opened for the request only, so dumps do not
+    interfere with sockets bound to receive link events.
+
+    :param: msg_type: Type of the dump request, such as RTM_GETLINK.
+    :param: payload: Packed family header of the request, such as an
+            ifinfomsg for RTM_GETLINK.
+    :param: timeout: Seconds to wait for each reply from the kernel.
+    :returns: List of NetlinkMessage with the header, the packed family
+              header and the rta attributes of each reply.
+    :raises: NetlinkCreateSocketError if the socket can not be created and
+             NetlinkDumpError if the kernel reports an error or times out.
+    '''
+    try:
+        netlink_socket = socket.socket(socket.AF_NETLINK,
+                                       socket.SOCK_RAW,
+                                       socket.NETLINK_ROUTE)
+    except (socket.error, AttributeError) as e:
+        msg = "Exception during netlink socket create: %s" % e
+        raise NetlinkCreateSocketError(msg) from e
+    seq = 1
+    body_size = len(payload)
+    messages = []
+    with netlink_socket:
+        try:
+            netlink_socket.settimeout(timeout)
+            netlink_socket.bind((0, 0))
+            netlink_socket.send(struct.pack(
+                NLMSGHDR_FMT, NLMSGHDR_SIZE + body_size, msg_type,
+                NLM_F_REQUEST | NLM_F_DUMP, seq, 0) + payload)
+            while True:
+                data = netlink_socket.recv(MAX_SIZE)
+                if not data:
+                    raise NetlinkDumpError(
+                        "Netlink dump of type %d ended early" % msg_type)
+                offset = 0
+                while offset + NLMSGHDR_SIZE <= len(data):
+                    header = NetlinkHeader(*struct.unpack_from(
+                        NLMSGHDR_FMT, data, offset))
+                    if header.length < NLMSGHDR_SIZE:
+                        raise NetlinkDumpError(
+                            "Invalid netlink message length %d" %
+                            header.length)
+                    start = offset
+                    end = offset + header.length
+                    offset += ((header.length + PAD_ALIGNMENT - 1) &
+                               ~(PAD_ALIGNMENT - 1))
+                    if header.seq != seq:
+                        continue
+                    if header.type == NLMSG_DONE:
+                        return messages
+                    if header.type == NLMSG_ERROR:
+                        errno = struct.unpack_from(
+                            "i", data, start + NLMSGHDR_SIZE)[0]
+                        if errno:
+                            raise NetlinkDumpError(
+                                "Netlink dump of type %d failed: %s" % (
+                                    msg_type, os.strerror(-errno)))
+                        continue
+                    body_start = start + NLMSGHDR_SIZE
+                    messages.append(NetlinkMessage(
+                        header, data[body_start:body_start + body_size],
+                        unpack_rta_attrs(data, body_start + body_size, end)))
+        except socket.timeout as e:
+            raise NetlinkDumpError(
+                "Timed out reading netlink dump of type %d" % msg_type
+            ) from e
+        except socket.error as e:
+            raise NetlinkDumpError(
+                "Exception during netlink dump of type %d: %s" % (
+                    msg_type, e)) from e
+
 # vi: ts=4 expandtab
@@ -11,8 +11,11 @@ import base64
 import copy
 import functools
 import os
+import time
+from concurrent import futures
 
 from cloudinit import ec2_utils
+from cloudinit import fsimage
 from cloudinit import log as logging
 from cloudinit import net
 from cloudinit import sources
@@ -37,6 +40,9 @@ KEY_COPIES = (
     ('instance-id', 'uuid', True),
 )
 
+# Documents of the metadata service read at the same time
+METADATA_MAX_WORKERS = 8
+
 # Versions and names taken from nova source nova/api/metadata/base.py
 OS_LATEST = 'latest'
 OS_FOLSOM = '2012-08-10'
@@ -215,6 +221,17 @@ class BaseReader(metaclass=abc.ABCMeta):
         path = self._path_join(self.base_path, "openstack", *path_pieces)
         return self._path_read(path, decode=decode)
 
+    def _read_all(self, reads, required=()):
+        """Return a list of callables returning the results of reads.
+
+        Each callable returns what the read returned or raises what it
+        raised. Reads are made in order when their callable is called;
+        readers of slow sources may make them concurrently instead, in
+        which case reads may be skipped, raising NonReadable, once one of
+        the reads at the indexes in required has failed.
+        """
+        return reads
+
     def read_v2(self):
         """Reads a version 2 formatted location.
 
@@ -264,12 +281,23 @@ class BaseReader(metaclass=abc.ABCMeta):
             'version': 2,
         }
         data = datafiles(self._find_working_version())
-        for (name, (path, required, translator)) in data.items():
-            path = self._path_join(self.base_path, path)
-            data = None
+        paths = [(name, self._path_join(self.base_path, path), required,
+                  translator)
+                 for (name, (path, required, translator)) in data.items()]
+        # The ec2 metadata is independent of the openstack metadata, so it is
+        # read along with it, though processed last as before
+        reads = self._read_all(
+            [functools.partial(self._path_read, path)
+             for (_name, path, _required, _translator) in paths] +
+            [self._read_ec2_metadata],
+            required=[index for (index, (_name, _path, required, _translator))
+                      in enumerate(paths) if required])
+        read_ec2_metadata = reads.pop()
+        for ((name, path, required, translator), read) in zip(paths, reads):
+            content = None
             found = False
             try:
-                data = self._path_read(path)
+                content = read()
             except IOError as e:
                 if not required:
                     LOG.debug("Failed reading optional path %s due"
@@ -283,13 +311,13 @@ class BaseReader(metaclass=abc.ABCMeta):
                 raise NonReadable("Missing mandatory path: %s" % path)
             if found and translator:
                 try:
-                    data = translator(data)
+                    content = translator(content)
                 except Exception as e:
                     raise BrokenMetadata(
                         "Failed to process path %s: %s" % (path, e)
                     ) from e
             if found:
-                results[name] = data
+                results[name] = content
 
         metadata = results['metadata']
         if 'random_seed' in metadata:
@@ -301,28 +329,33 @@ class BaseReader(metaclass=abc.ABCMeta):
                     "Badly formatted metadata random_seed entry: %s" % e
                 ) from e
 
-        # load any files that were provided
+        # load any files that were provided, and the network config
+        items = [item for item in metadata.get('files', []) if 'path' in item]
+        # The 'network_config' item in metadata is a content pointer
+        # to the network config that should be applied. It is just a
+        # ubuntu/debian '/etc/network/interfaces' file.
+        net_item = metadata.get("network_config", None)
+        content_reads = (
+            [functools.partial(self._read_content_path, item)
+             for item in items] +
+            ([functools.partial(self._read_content_path, net_item,
+                                decode=True)] if net_item else []))
+        reads = self._read_all(content_reads,
+                               required=range(len(content_reads)))
         files = {}
-        metadata_files = metadata.get('files', [])
-        for item in metadata_files:
-            if 'path' not in item:
-                continue
+        for (item, read) in zip(items, reads):
             path = item['path']
             try:
-                files[path] = self._read_content_path(item)
+                files[path] = read()
             except Exception as e:
                 raise BrokenMetadata(
                     "Failed to read provided file %s: %s" % (path, e)
                 ) from e
         results['files'] = files
 
-        # The 'network_config' item in metadata is a content pointer
-        # to the network config that should be applied. It is just a
-        # ubuntu/debian '/etc/network/interfaces' file.
-        net_item = metadata.get("network_config", None)
         if net_item:
             try:
-                content = self._read_content_path(net_item, decode=True)
+                content = reads[-1]()
                 results['network_config'] = content
             except IOError as e:
                 raise BrokenMetadata(
@@ -339,7 +372,7 @@ class BaseReader(metaclass=abc.ABCMeta):
             pass
 
         # Read any ec2-metadata (if applicable)
-        results['ec2-metadata'] = self._read_ec2_metadata()
+        results['ec2-metadata'] = read_ec2_metadata()
 
         # Perform some misc. metadata key renames...
         for (target_key, source_key, is_required) in KEY_COPIES:
@@ -351,29 +384,57 @@ class BaseReader(metaclass=abc.ABCMeta):
 
 
 class ConfigDriveReader(BaseReader):
+    """Read a config drive mounted on the directory base_path.
+
+    base_path may also be a fsimage.FilesystemView of the config drive, in
+    which case paths are relative to the root of its filesystem.
+    """
+
     def __init__(self, base_path):
         super(ConfigDriveReader, self).__init__(base_path)
         self._versions = None
+        self._image = None
+        if isinstance(base_path, fsimage.FilesystemView):
+            self._image = base_path
 
     def _path_join(self, base, *add_ons):
         components = [base] + list(add_ons)
+        if base is self._image:
+            components = list(add_ons)
         return os.path.join(*components)
 
     def _path_read(self, path, decode=False):
+        if self._image is not None:
+            return self._image.read(path, decode=decode)
         return util.load_file(path, decode=decode)
 
+    def _path_exists(self, path):
+        if self._image is not None:
+            return self._image.exists(path)
+        return os.path.exists(path)
+
+    def _path_isdir(self, path):
+        if self._image is not None:
+            return self._image.isdir(path)
+        return os.path.isdir(path)
+
+    def _listdir(self, path):
+        if self._image is not None:
+            return self._image.listdir(path)
+        return os.listdir(path)
+
     def _fetch_available_versions(self):
         if self._versions is None:
             path = self._path_join(self.base_path, 'openstack')
-            found = [d for d in os.listdir(path)
-                     if os.path.isdir(os.path.join(path))]
+            found = [d for d in self._listdir(path)
+                     if self._path_isdir(os.path.join(path))]
             self._versions = sorted(found)
         return self._versions
 
     def _read_ec2_metadata(self):
         path = self._path_join(self.base_path,
                                'ec2', 'latest', 'meta-data.json')
-        if not os.path.exists(path):
+        if not self._path_exists(path):
             return {}
         else:
             try:
@@ -394,7 +455,7 @@ class ConfigDriveReader(BaseReader):
         found = {}
         for name in FILES_V1.keys():
             path = self._path_join(self.base_path, name)
-            if os.path.exists(path):
+            if self._path_exists(path):
                 found[name] = path
         if len(found) == 0:
             raise NonReadable("%s: no files found" % (self.base_path))
@@ -458,12 +519,75 @@ class ConfigDriveReader(BaseReader):
 
 
 class MetadataReader(BaseReader):
-    def __init__(self, base_url, ssl_details=None, timeout=5, retries=5):
+    """Read the metadata service at base_url.
+
+    Independent documents are read concurrently, with up to max_workers
+    requests at a time. If max_wait is greater than zero, read_v2 takes
+    about max_wait seconds at most: each request times out by then, and no
+    request is made or retried once it has passed.
+    """
+
+    def __init__(self, base_url, ssl_details=None, timeout=5, retries=5,
+                 max_wait=None, max_workers=METADATA_MAX_WORKERS):
         super(MetadataReader, self).__init__(base_url)
         self.ssl_details = ssl_details
         self.timeout = float(timeout)
         self.retries = int(retries)
+        self.max_wait = max_wait
+        self.max_workers = max_workers
         self._versions = None
+        self._deadline = None
+
+    def read_v2(self):
+        if self.max_wait is not None and self.max_wait > 0:
+            self._deadline = time.time() + self.max_wait
+        try:
+            return super(MetadataReader, self).read_v2()
+        finally:
+            self._deadline = None
+
+    def _read_all(self, reads, required=()):
+        if self.max_workers < 2 or len(reads) < 2:
+            return reads
+        max_workers = min(len(reads), self.max_workers)
+        executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        pending = [executor.submit(read) for read in reads]
+        done, _ = futures.wait([pending[index] for index in required],
+                               return_when=futures.FIRST_EXCEPTION)
+        failed = any(future.exception() for future in done)
+        if failed:
+            # read_v2 fails whatever the other reads return, so do not wait
+            # for them
+            for future in pending:
+                future.cancel()
+        executor.shutdown(wait=not failed)
+
+        def result(future):
+            if failed and (future.cancelled() or not future.done()):
+                raise NonReadable("Skipped as a required read failed")
+            return future.result()
+
+        return [functools.partial(result, future) for future in pending]
+
+    def _request_timeout(self, url):
+        """Return the timeout of a request of url made now.
+
+        @raises UrlError: if max_wait has passed.
+        """
+        if self._deadline is None:
+            return self.timeout
+        remaining = self._deadline - time.time()
+        if remaining <= 0:
+            raise url_helper.UrlError(
+                "Reading %s exceeded max_wait of %ss" % (
+                    self.base_path, self.max_wait), url=url)
+        if self.timeout > 0:
+            return min(self.timeout, remaining)
+        return remaining
+
+    def _before_deadline(self, _request_args, _cause):
+        # readurl sleeps a second before retrying
+        return self._deadline is None or time.time() + 1 < self._deadline
 
     def _fetch_available_versions(self):
         # <baseurl>/openstack/ returns a newline separated list of versions
@@ -482,7 +606,7 @@ class MetadataReader(BaseReader):
 
     def _path_read(self, path, decode=False):
 
-        def should_retry_cb(_request_args, cause):
+        def should_retry_cb(request_args, cause):
             try:
                 code = int(cause.code)
                 if code >= 400:
@@ -490,12 +614,12 @@ class MetadataReader(BaseReader):
             except (TypeError, ValueError):
                 # Older versions of requests didn't have a code.
                 pass
-            return True
+            return self._before_deadline(request_args, cause)
 
         response = url_helper.readurl(path,
                                       retries=self.retries,
                                       ssl_details=self.ssl_details,
-                                      timeout=self.timeout,
+                                      timeout=self._request_timeout(path),
                                       exception_cb=should_retry_cb)
         if decode:
             return response.contents.decode()
@@ -506,9 +630,15 @@ class MetadataReader(BaseReader):
         return url_helper.combine_url(base, *add_ons)
 
     def _read_ec2_metadata(self):
-        return ec2_utils.get_instance_metadata(ssl_details=self.ssl_details,
-                                               timeout=self.timeout,
-                                               retries=self.retries)
+        try:
+            timeout = self._request_timeout(self.base_path)
+        except url_helper.UrlError as e:
+            # As get_instance_metadata does for any failure
+            LOG.debug("Not reading ec2 metadata: %s", e)
+            return {}
+        return ec2_utils.get_instance_metadata(
+            ssl_details=self.ssl_details, timeout=timeout,
+            retries=self.retries, exception_cb=self._before_deadline)
 
 
 # Convert OpenStack ConfigDrive NetworkData json to network_config yaml
@@ -7,12 +7,14 @@ import socket
 import struct
 import codecs
 from cloudinit.sources.helpers.netlink import (
-    NetlinkCreateSocketError, create_bound_netlink_socket, read_netlink_socket,
-    read_rta_oper_state, unpack_rta_attr, wait_for_media_disconnect_connect,
+    NetlinkCreateSocketError, NetlinkDumpError, create_bound_netlink_socket,
+    dump_netlink_messages, read_netlink_socket, read_rta_oper_state,
+    unpack_rta_attr, unpack_rta_attrs, wait_for_media_disconnect_connect,
     wait_for_nic_attach_event, wait_for_nic_detach_event,
     OPER_DOWN, OPER_UP, OPER_DORMANT, OPER_LOWERLAYERDOWN, OPER_NOTPRESENT,
     OPER_TESTING, OPER_UNKNOWN, RTATTR_START_OFFSET, RTM_NEWLINK, RTM_DELLINK,
-    RTM_SETLINK, RTM_GETLINK, MAX_SIZE)
+    RTM_SETLINK, RTM_GETLINK, MAX_SIZE, IFINFOMSG_FMT, IFLA_ADDRESS,
+    IFLA_IFNAME, NLMSG_DONE, NLMSG_ERROR, NLM_F_DUMP, NLM_F_REQUEST)
 
 
 def int_to_bytes(i):
@@ -193,6 +195,15 @@ class TestNicAttachDetach(CiTestCase):
         self.assertEqual(m_read_netlink_socket.call_count, 1)
         self.assertEqual("eth0", ifread)
 
+    @mock.patch('cloudinit.net.invalidate_net_snapshot')
+    def test_nic_attach_invalidates_net_snapshot(
+            self, m_invalidate, m_read_netlink_socket, m_socket):
+        """Link events discard the cached snapshot of net devices."""
+        data = self._media_switch_data("eth0", RTM_NEWLINK, OPER_DOWN)
+        m_read_netlink_socket.side_effect = [data]
+        wait_for_nic_attach_event(m_socket, [])
+        self.assertEqual(1, m_invalidate.call_count)
+
     def test_nic_detached(self, m_read_netlink_socket, m_socket):
         '''Test for an existing nic detached'''
         ifname = "eth0"
@@ -478,3 +489,81 @@ class TestWaitForMediaDisconnectConnect(CiTestCase):
         m_read_netlink_socket.side_effect = [data1, data2]
         wait_for_media_disconnect_connect(m_socket, ifname)
         self.assertEqual(m_read_netlink_socket.call_count, 2)
+
+
+def _rta(rta_type, data):
+    length = 4 + len(data)
+    return struct.pack('HH', length, rta_type) + data + b'\0' * (
+        (4 - length % 4) % 4)
+
+
+def _nlmsg(msg_type, body, seq=1):
+    return struct.pack(
+        'IHHII', 16 + len(body), msg_type, 0, seq, 0) + body
+
+
+class TestUnpackRtaAttrs(CiTestCase):
+
+    def test_unpack_padded_attributes(self):
+        '''All attributes are returned, skipping their padding'''
+        data = b'hdr\0' + _rta(IFLA_IFNAME, b'eth0\0') + _rta(
+            IFLA_ADDRESS, b'\x01\x02\x03\x04\x05\x06')
+        self.assertEqual(
+            {IFLA_IFNAME: b'eth0\0',
+             IFLA_ADDRESS: b'\x01\x02\x03\x04\x05\x06'},
+            unpack_rta_attrs(data, 4))
+
+    def test_unpack_stops_at_truncated_attribute(self):
+        '''Attributes overrunning end are not returned'''
+        data = _rta(IFLA_IFNAME, b'eth0\0') + _rta(IFLA_ADDRESS, b'12345678')
+        self.assertEqual(
+            {IFLA_IFNAME: b'eth0\0'}, unpack_rta_attrs(data, 0, 20))
+
+
+@mock.patch('cloudinit.sources.helpers.netlink.socket.socket')
+class TestDumpNetlinkMessages(CiTestCase):
+
+    body = struct.pack(IFINFOMSG_FMT, 0, 1, 2, 0, 0)
+
+    def test_dump_reads_until_done(self, m_socket):
+        '''Replies of several datagrams are returned until NLMSG_DONE'''
+        sock = m_socket.return_value
+        sock.recv.side_effect = [
+            _nlmsg(RTM_NEWLINK, self.body + _rta(IFLA_IFNAME, b'lo\0')) +
+            _nlmsg(RTM_NEWLINK, self.body, seq=7),
+            _nlmsg(RTM_NEWLINK, self.body + _rta(IFLA_IFNAME, b'eth0\0')),
+            _nlmsg(NLMSG_DONE, struct.pack('i', 0))]
+        messages = dump_netlink_messages(RTM_GETLINK, self.body)
+        self.assertEqual(
+            [{IFLA_IFNAME: b'lo\0'}, {IFLA_IFNAME: b'eth0\0'}],
+            [msg.attrs for msg in messages])
+        self.assertEqual([self.body, self.body], [m.body for m in messages])
+        sock.bind.assert_called_once_with((0, 0))
+        sock.send.assert_called_once_with(struct.pack(
+            'IHHII', 32, RTM_GETLINK, NLM_F_REQUEST | NLM_F_DUMP, 1, 0) +
+            self.body)
+
+    def test_dump_raises_kernel_errors(self, m_socket):
+        '''NetlinkDumpError is raised when the kernel rejects the dump'''
+        sock = m_socket.return_value
+        sock.recv.return_value = _nlmsg(
+            NLMSG_ERROR, struct.pack('i', -1) + b'\0' * 16)
+        with self.assertRaises(NetlinkDumpError) as ctx_mgr:
+            dump_netlink_messages(RTM_GETLINK, self.body)
+        self.assertEqual(
+            'Netlink dump of type 18 failed: Operation not permitted',
+            str(ctx_mgr.exception))
+
+    def test_dump_raises_on_timeout(self, m_socket):
+        '''NetlinkDumpError is raised when the kernel does not reply'''
+        sock = m_socket.return_value
+        sock.recv.side_effect = socket.timeout('timed out')
+        with self.assertRaises(NetlinkDumpError):
+            dump_netlink_messages(RTM_GETLINK, self.body, timeout=1)
+        sock.settimeout.assert_called_once_with(1)
+
+    def test_dump_raises_on_socket_create_error(self, m_socket):
+        '''NetlinkCreateSocketError is raised when socket creation fails'''
+        m_socket.side_effect = socket.error("Fake socket failure")
+        with self.assertRaises(NetlinkCreateSocketError):
+            dump_netlink_messages(RTM_GETLINK, self.body)
@@ -2,8 +2,10 @@
 
 import copy
 import inspect
+import json
 import os
 import stat
+import threading
 
 from cloudinit.event import EventType
 from cloudinit.helpers import Paths
@@ -11,7 +13,9 @@ from cloudinit import importer
 from cloudinit.sources import (
     EXPERIMENTAL_TEXT, INSTANCE_JSON_FILE, INSTANCE_JSON_SENSITIVE_FILE,
     METADATA_UNKNOWN, REDACT_SENSITIVE_VALUE, UNSET, DataSource,
-    canonical_cloud_id, redact_sensitive_keys)
+    DataSourceNotFoundException, canonical_cloud_id, find_source,
+    instance_data_index_path, redact_sensitive_keys,
+    write_instance_data_index)
 from cloudinit.tests.helpers import CiTestCase, mock
 from cloudinit.user_data import UserDataProcessor
 from cloudinit import util
@@ -125,6 +129,15 @@ class TestDataSource(CiTestCase):
             url_params)
         self.assertEqual(expected, url_params)
 
+    def test_datasource_get_url_race(self):
+        """race_metadata_urls datasource config overrides url_race."""
+        self.assertFalse(self.datasource.get_url_race())
+        sys_cfg = {
+            'datasource': {'MyTestSubclass': {'race_metadata_urls': 'true'}}}
+        datasource = DataSourceTestSubclassNet(
+            sys_cfg, self.distro, self.paths)
+        self.assertTrue(datasource.get_url_race())
+
     def test_datasource_get_url_params_is_zero_or_greater(self):
         """get_url_params ignores timeouts with a value below 0."""
         # Set an override that is below 0 which gets ignored.
@@ -500,6 +513,67 @@ class TestDataSource(CiTestCase):
         self.assertEqual(
             expected_metadata, instance_json['ds']['meta_data'])
 
+    def test_persist_instance_data_writes_indexes(self):
+        """Both instance-data files are written with an index of values."""
+        tmp = self.tmp_dir()
+        datasource = DataSourceTestSubclassNet(
+            self.sys_cfg, self.distro, Paths({'run_dir': tmp}),
+            custom_metadata={'availability_zone': 'myaz',
+                             'local-hostname': 'test-subclass-hostname',
+                             'region': 'myregion'})
+        datasource.get_data()
+        for json_fn, mode in ((INSTANCE_JSON_FILE, 0o644),
+                              (INSTANCE_JSON_SENSITIVE_FILE, 0o600)):
+            json_file = self.tmp_path(json_fn, tmp)
+            index_file = instance_data_index_path(json_file)
+            self.assertEqual(
+                mode, stat.S_IMODE(os.stat(index_file).st_mode))
+            index = util.load_json(util.load_file(index_file))
+            json_stat = os.stat(json_file)
+            self.assertEqual(json_stat.st_size, index['size'])
+            self.assertEqual(json_stat.st_mtime_ns, index['mtime_ns'])
+            content = util.load_file(json_file, decode=False)
+            start, end, v1_keys = index['keys']['v1']
+            self.assertEqual(
+                util.load_json(content)['v1'],
+                util.load_json(content[start:end]))
+            start, end = v1_keys['region']
+            self.assertEqual(b'"myregion"', content[start:end])
+
+    def test_write_instance_data_index_nests_to_depth(self):
+        """Objects are indexed to INSTANCE_JSON_INDEX_DEPTH levels."""
+        tmp = self.tmp_dir()
+        json_file = self.tmp_path('custom.json', tmp)
+        data = {'a': {'b': {'c': {'d': 'e'}, 'f': [1, {'g': 'h'}]}},
+                'quote"d': None, 'i': {}}
+        util.write_file(json_file, util.json_dumps(data))
+        self.assertTrue(write_instance_data_index(json_file))
+        index = util.load_json(util.load_file(
+            self.tmp_path('custom-index.json', tmp)))
+        content = util.load_file(json_file)
+
+        def assert_indexed(node, value, depth):
+            self.assertEqual(value, json.loads(content[node[0]:node[1]]))
+            if not isinstance(value, dict):
+                self.assertEqual(2, len(node))
+            elif depth > 0:
+                self.assertCountEqual(value, node[2])
+                for key, subnode in node[2].items():
+                    assert_indexed(subnode, value[key], depth - 1)
+            else:
+                self.assertIsNone(node[2])
+
+        assert_indexed([0, len(content), index['keys']], data, 3)
+
+    def test_write_instance_data_index_warns_on_invalid_json(self):
+        """No index is written for files which are not a JSON object."""
+        tmp = self.tmp_dir()
+        json_file = self.tmp_path(INSTANCE_JSON_FILE, tmp)
+        util.write_file(json_file, '["not", "an object"]')
+        self.assertFalse(write_instance_data_index(json_file))
+        self.assertIn('Error indexing', self.logs.getvalue())
+        self.assertFalse(os.path.exists(instance_data_index_path(json_file)))
+
     def test_persist_instance_data_writes_ec2_metadata_when_set(self):
         """When ec2_metadata class attribute is set, persist to json."""
         tmp = self.tmp_dir()
@@ -653,6 +727,116 @@ class TestDataSource(CiTestCase):
             self.logs.getvalue())
 
 
+class _ProbedDataSource(DataSourceTestSubclassNet):
+    """Datasource recording calls to _is_platform_viable and _get_data."""
+
+    viable = True
+    calls = None
+
+    def _is_platform_viable(self):
+        self.calls.append(('probe', self.dsname))
+        return self.viable
+
+    def _get_data(self):
+        self.calls.append(('get_data', self.dsname))
+        return super(_ProbedDataSource, self)._get_data()
+
+
+class TestFindSource(CiTestCase):
+
+    with_logs = True
+
+    def setUp(self):
+        super(TestFindSource, self).setUp()
+        self.paths = Paths({'cloud_dir': self.tmp_dir(),
+                            'run_dir': self.tmp_dir()})
+        self.calls = []
+
+    def _ds_class(self, name, viable=True, **attrs):
+        attrs.update({'dsname': name, 'viable': viable, 'calls': self.calls})
+        return type('DataSource' + name, (_ProbedDataSource,), attrs)
+
+    def _find_source(self, ds_list, sys_cfg):
+        reporter = mock.MagicMock(fullname='init-local', children={})
+        with mock.patch('cloudinit.sources.list_sources',
+                        return_value=ds_list):
+            return find_source(sys_cfg, None, self.paths, [], [], [],
+                               reporter)
+
+    def test_serial_find_source_does_not_probe(self):
+        """Without datasource_parallel_probe, no platform checks run."""
+        ds_list = [self._ds_class('One', viable=False)]
+        (ds, dsname) = self._find_source(ds_list, {})
+        self.assertEqual('DataSourceOne', dsname)
+        self.assertEqual([('get_data', 'One')], self.calls)
+        self.assertIsInstance(ds, ds_list[0])
+
+    def test_parallel_probe_skips_unviable_datasources(self):
+        """Datasources whose platform check fails are never searched."""
+        ds_list = [self._ds_class('One', viable=False),
+                   self._ds_class('Two')]
+        (_ds, dsname) = self._find_source(
+            ds_list, {'datasource_parallel_probe': True})
+        self.assertEqual('DataSourceTwo', dsname)
+        self.assertNotIn(('get_data', 'One'), self.calls)
+        self.assertIn('Skipping DataSourceOne: platform is not viable',
+                      self.logs.getvalue())
+
+    def test_parallel_probe_keeps_priority_order(self):
+        """The first viable datasource wins even if probed last."""
+        first_probed = threading.Event()
+
+        def slow_probe(ds):
+            # Block until the lower priority probe has finished
+            first_probed.wait(5)
+            ds.calls.append(('probe', ds.dsname))
+            return True
+
+        def fast_probe(ds):
+            ds.calls.append(('probe', ds.dsname))
+            first_probed.set()
+            return True
+
+        ds_list = [
+            self._ds_class('One', _is_platform_viable=slow_probe),
+            self._ds_class('Two', _is_platform_viable=fast_probe)]
+        (_ds, dsname) = self._find_source(
+            ds_list, {'datasource_parallel_probe': True})
+        self.assertEqual('DataSourceOne', dsname)
+        self.assertEqual(
+            [('probe', 'Two'), ('probe', 'One'), ('get_data', 'One')],
+            self.calls)
+
+    def test_parallel_probe_keeps_datasources_whose_probe_errors(self):
+        """A platform check raising an exception does not skip it."""
+        def broken_probe(ds):
+            raise RuntimeError('dmi is broken')
+
+        ds_list = [self._ds_class('One', _is_platform_viable=broken_probe)]
+        (_ds, dsname) = self._find_source(
+            ds_list, {'datasource_parallel_probe': True})
+        self.assertEqual('DataSourceOne', dsname)
+        self.assertIn('Checking platform for DataSourceOne failed',
+                      self.logs.getvalue())
+
+    @mock.patch('cloudinit.sources.events.report_finish_event')
+    @mock.patch('cloudinit.sources.events.report_start_event')
+    def test_parallel_probe_reports_events(self, m_start, m_finish):
+        """Each platform check is reported as a probe-<name> event."""
+        ds_list = [self._ds_class('One', viable=False),
+                   self._ds_class('Two', viable=False)]
+        with self.assertRaises(DataSourceNotFoundException):
+            self._find_source(ds_list, {'datasource_parallel_probe': True})
+        self.assertCountEqual(
+            ['init-local/probe-One', 'init-local/probe-Two'],
+            [c[0][0] for c in m_start.call_args_list])
+        self.assertIn(
+            mock.call('init-local/probe-One',
+                      'platform not viable for DataSourceOne', 'SUCCESS',
+                      post_files=[]),
+            m_finish.call_args_list)
+
+
 class TestRedactSensitiveData(CiTestCase):
 
     def test_redact_sensitive_data_noop_when_no_sensitive_keys_present(self):
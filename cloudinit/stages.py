@@ -8,6 +8,7 @@ import copy
 import os
 import pickle
 import sys
+from concurrent import futures
 
 from cloudinit.settings import (
     FREQUENCIES, CLOUD_CONFIG, PER_INSTANCE, RUN_CLOUD_CONFIG)
@@ -32,9 +33,12 @@ from cloudinit import importer
 from cloudinit import log as logging
 from cloudinit import net
 from cloudinit.net import cmdline
+from cloudinit import persistence
 from cloudinit.reporting import events
 from cloudinit import sources
+from cloudinit import templater
 from cloudinit import type_utils
+from cloudinit import user_data as ud
 from cloudinit import util
 
 LOG = logging.getLogger(__name__)
@@ -42,6 +46,9 @@ LOG = logging.getLogger(__name__)
 NULL_DATA_SOURCE = None
 NO_PREVIOUS_INSTANCE_ID = "NO_PREVIOUS_INSTANCE_ID"
 
+# Default number of non-conflicting modules run at the same time in a stage
+DEFAULT_MODULE_WORKERS = 4
+
 
 class Init(object):
     def __init__(self, ds_deps=None, reporter=None):
@@ -185,6 +192,12 @@ class Init(object):
         # We try to restore from a current link and static path
         # by using the instance link, if purge_cache was called
         # the file wont exist.
+        ds = _ds_cache_load(
+            self.paths.get_ipath_cur('obj_cache'), sys_cfg=self.cfg,
+            distro=self.distro, paths=self.paths)
+        if ds:
+            return ds
+        # Fall back to the pickle written by earlier cloud-init versions
         return _pkl_load(self.paths.get_ipath_cur('obj_pkl'))
 
     def _write_to_cache(self):
@@ -196,7 +209,13 @@ class Init(object):
             util.write_file(
                 self.paths.get_ipath_cur("manual_clean_marker"),
                 omode="w", content="")
-        return _pkl_store(self.datasource, self.paths.get_ipath_cur("obj_pkl"))
+        pkl_fname = self.paths.get_ipath_cur("obj_pkl")
+        if _ds_cache_store(
+                self.datasource, self.paths.get_ipath_cur("obj_cache")):
+            # Never leave a stale pickle behind the current cache
+            util.del_file(pkl_fname)
+            return True
+        return _pkl_store(self.datasource, pkl_fname)
 
     def _get_datasources(self):
         # Any config provided???
@@ -352,7 +371,16 @@ class Init(object):
     def instancify(self):
         return self._reflect_cur_instance()
 
+    def _cache_template_bytecode(self):
+        # Templates rendered by part handlers and modules are compiled once
+        # and their bytecode reused by the following stages and boots.
+        data_dir = self.paths.get_cpath('data')
+        if os.path.isdir(data_dir):
+            templater.set_bytecode_cache_dir(
+                os.path.join(data_dir, 'jinja_cache'))
+
     def cloudify(self):
+        self._cache_template_bytecode()
         # Form the needed options to cloudify our members
         return cloud.Cloud(self.datasource,
                            self.paths, self.cfg,
@@ -754,9 +782,11 @@ class Init(object):
 
 
 class Modules(object):
-    def __init__(self, init, cfg_files=None, reporter=None):
+    def __init__(self, init, cfg_files=None, reporter=None, serial=False):
         self.init = init
         self.cfg_files = cfg_files
+        # Run one module at a time, ignoring max_module_workers
+        self.serial = serial
         # Created on first use
         self._cached_cfg = None
         if reporter is None:
@@ -839,8 +869,14 @@ class Modules(object):
                              " has an unknown frequency %s"), raw_name, freq)
                 # Reset it so when ran it will get set to a known value
                 freq = None
-            mod_locs, looked_locs = importer.find_module(
-                mod_name, ['', type_utils.obj_name(config)], ['handle'])
+            search_paths = ['', type_utils.obj_name(config)]
+            entry = importer.find_indexed_module(
+                'modules', mod_name, search_paths)
+            if entry:
+                mod_locs = [entry['module']]
+            else:
+                mod_locs, looked_locs = importer.find_module(
+                    mod_name, search_paths, ['handle'])
             if not mod_locs:
                 LOG.warning("Could not find module named %s (searched %s)",
                             mod_name, looked_locs)
@@ -855,44 +891,87 @@ class Modules(object):
         # and which ones failed + the exception of why it failed
         failures = []
         which_ran = []
-        for (mod, name, freq, args) in mostly_mods:
-            try:
-                # Try the modules frequency, otherwise fallback to a known one
-                if not freq:
-                    freq = mod.frequency
-                if freq not in FREQUENCIES:
-                    freq = PER_INSTANCE
-                LOG.debug("Running module %s (%s) with frequency %s",
-                          name, mod, freq)
-
-                # Use the configs logger and not our own
-                # TODO(harlowja): possibly check the module
-                # for having a LOG attr and just give it back
-                # its own logger?
-                func_args = [name, self.cfg,
-                             cc, config.LOG, args]
-                # Mark it as having started running
-                which_ran.append(name)
-                # This name will affect the semaphore name created
-                run_name = "config-%s" % (name)
-
-                desc = "running %s with frequency %s" % (run_name, freq)
-                myrep = events.ReportEventStack(
-                    name=run_name, description=desc, parent=self.reporter)
-
-                with myrep:
-                    ran, _r = cc.run(run_name, mod.handle, func_args,
-                                     freq=freq)
-                    if ran:
-                        myrep.message = "%s ran successfully" % run_name
+        max_workers = self._get_max_workers()
+        if max_workers < 2 or len(mostly_mods) < 2:
+            for (mod, name, freq, args) in mostly_mods:
+                self._run_module(cc, mod, name, freq, args, which_ran,
+                                 failures)
+            return (which_ran, failures)
+
+        # Start each module once no earlier module which conflicts with it
+        # is still pending or running, so conflicting modules keep their
+        # configured order.
+        pending = list(mostly_mods)
+        running = {}
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                blocked = []
+                for mostly_mod in list(pending):
+                    mod = mostly_mod[0]
+                    if len(running) < max_workers and not any(
+                            config.modules_conflict(mod, other[0])
+                            for other in blocked + list(running.values())):
+                        pending.remove(mostly_mod)
+                        running[executor.submit(
+                            self._run_module, cc, *mostly_mod,
+                            which_ran=which_ran,
+                            failures=failures)] = mostly_mod
                     else:
-                        myrep.message = "%s previously ran" % run_name
-
-            except Exception as e:
-                util.logexc(LOG, "Running module %s (%s) failed", name, mod)
-                failures.append((name, e))
+                        blocked.append(mostly_mod)
+                done, _ = futures.wait(
+                    running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+        # Report in configured order regardless of completion order
+        order = [name for (_mod, name, _freq, _args) in mostly_mods]
+        which_ran.sort(key=order.index)
+        failures.sort(key=lambda failure: order.index(failure[0]))
         return (which_ran, failures)
 
+    def _get_max_workers(self):
+        """Return the number of modules which may run at the same time."""
+        if self.serial:
+            return 1
+        return util.get_cfg_option_int(
+            self.cfg, 'max_module_workers', DEFAULT_MODULE_WORKERS)
+
+    def _run_module(self, cc, mod, name, freq, args, which_ran, failures):
+        try:
+            # Try the modules frequency, otherwise fallback to a known one
+            if not freq:
+                freq = mod.frequency
+            if freq not in FREQUENCIES:
+                freq = PER_INSTANCE
+            LOG.debug("Running module %s (%s) with frequency %s",
+                      name, mod, freq)
+
+            # Use the configs logger and not our own
+            # TODO(harlowja): possibly check the module
+            # for having a LOG attr and just give it back
+            # its own logger?
+            func_args = [name, self.cfg,
+                         cc, config.LOG, args]
+            # Mark it as having started running
+            which_ran.append(name)
+            # This name will affect the semaphore name created
+            run_name = "config-%s" % (name)
+
+            desc = "running %s with frequency %s" % (run_name, freq)
+            myrep = events.ReportEventStack(
+                name=run_name, description=desc, parent=self.reporter)
+
+            with myrep:
+                ran, _r = cc.run(run_name, mod.handle, func_args,
+                                 freq=freq)
+                if ran:
+                    myrep.message = "%s ran successfully" % run_name
+                else:
+                    myrep.message = "%s previously ran" % run_name
+
+        except Exception as e:
+            util.logexc(LOG, "Running module %s (%s) failed", name, mod)
+            failures.append((name, e))
+
     def run_single(self, mod_name, args=None, freq=None):
         # Form the users module 'specs'
         mod_to_be = {
@@ -962,6 +1041,44 @@ def fetch_base_config():
         ], reverse=True)
 
 
+def _ds_cache_store(ds, fname):
+    if not isinstance(ds, persistence.CloudInitCacheMixin):
+        return False
+    try:
+        contents = ds.to_cache()
+    except Exception:
+        util.logexc(LOG, "Failed caching datasource %s", ds)
+        return False
+    try:
+        util.write_file(fname, contents, omode="wb", mode=0o400)
+    except Exception:
+        util.logexc(LOG, "Failed caching datasource to %s", fname)
+        return False
+    return True
+
+
+def _ds_cache_load(fname, sys_cfg, distro, paths):
+    contents = None
+    try:
+        contents = util.load_file(fname, decode=False)
+    except Exception as e:
+        if os.path.isfile(fname):
+            LOG.warning("failed loading datasource cache in %s: %s", fname, e)
+
+    if not contents:
+        return None
+    try:
+        return persistence.load_cache(
+            contents, sources.DataSource, sys_cfg=sys_cfg, distro=distro,
+            paths=paths, ud_proc=ud.UserDataProcessor(paths))
+    except persistence.CacheFormatError as e:
+        LOG.debug("Ignoring datasource cache in %s: %s", fname, e)
+        return None
+    except Exception:
+        util.logexc(LOG, "Failed loading datasource cache from %s", fname)
+        return None
+
+
 def _pkl_store(obj, fname):
     try:
         pk_contents = pickle.dumps(obj)
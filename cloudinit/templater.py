@@ -11,7 +11,9 @@
 # This file is part of cloud-init. See LICENSE file for license information.
 
 import collections
+import hashlib
 import re
+import threading
 
 
 try:
@@ -21,12 +23,15 @@ except (ImportError, AttributeError):
     CHEETAH_AVAILABLE = False
 
 try:
-    from jinja2 import Template as JTemplate
+    from jinja2 import BaseLoader as JBaseLoader
     from jinja2 import DebugUndefined as JUndefined
+    from jinja2 import Environment as JEnvironment
+    from jinja2 import FileSystemBytecodeCache as JBytecodeCache
+    from jinja2 import TemplateNotFound as JTemplateNotFound
     JINJA_AVAILABLE = True
 except (ImportError, AttributeError):
     JINJA_AVAILABLE = False
-    JUndefined = object
+    JBaseLoader = JBytecodeCache = JUndefined = object
 
 from cloudinit import log as logging
 from cloudinit import type_utils as tu
@@ -38,6 +43,13 @@ TYPE_MATCHER = re.compile(r"##\s*template:(.*)", re.I)
 BASIC_MATCHER = re.compile(r'\$\{([A-Za-z0-9_.]+)\}|\$([A-Za-z0-9_.]+)')
 MISSING_JINJA_PREFIX = u'CI_MISSING_JINJA_VAR/'
 
+# Number of compiled jinja templates kept by the shared environment
+TEMPLATE_CACHE_SIZE = 64
+
+_JINJA_ENV = None
+_JINJA_LOCK = threading.Lock()
+_BYTECODE_CACHE_DIR = None
+
 
 class UndefinedJinjaVariable(JUndefined):
     """Class used to represent any undefined jinja template variable."""
@@ -53,6 +65,80 @@ class UndefinedJinjaVariable(JUndefined):
                 this=self._undefined_name, other=other))
 
 
+class JinjaContentLoader(JBaseLoader):
+    """Load jinja templates named by the sha256 digest of their content.
+
+    Templates are compiled once per distinct content, whichever file or
+    string they were read from, and looked up again in the cache of the
+    environment by their digest.
+    """
+
+    def __init__(self):
+        self.sources = {}
+
+    def get_source(self, environment, template):
+        if template not in self.sources:
+            raise JTemplateNotFound(template)
+        return self.sources[template], None, lambda: True
+
+
+class JinjaBytecodeCache(JBytecodeCache):
+    """A jinja bytecode cache which does not fail rendering on write errors.
+    """
+
+    def dump_bytecode(self, bucket):
+        try:
+            super(JinjaBytecodeCache, self).dump_bytecode(bucket)
+        except (IOError, OSError) as e:
+            LOG.debug("Failed writing jinja bytecode cache: %s", e)
+
+
+def set_bytecode_cache_dir(cache_dir):
+    """Keep the bytecode of compiled jinja templates in cache_dir.
+
+    The bytecode is reused by later processes rendering the same templates,
+    such as each stage of every boot, instead of compiling them again.
+    The directory is created if needed, and must only be writable by root.
+    """
+    global _BYTECODE_CACHE_DIR
+    if cache_dir == _BYTECODE_CACHE_DIR or not JINJA_AVAILABLE:
+        return
+    try:
+        util.ensure_dir(cache_dir, mode=0o700)
+    except OSError as e:
+        LOG.debug("Not caching jinja bytecode in %s: %s", cache_dir, e)
+        return
+    _BYTECODE_CACHE_DIR = cache_dir
+    if _JINJA_ENV is not None:
+        _JINJA_ENV.bytecode_cache = JinjaBytecodeCache(cache_dir)
+
+
+def get_jinja_env():
+    """Return the jinja environment shared by all templates rendered."""
+    global _JINJA_ENV
+    if _JINJA_ENV is None:
+        bytecode_cache = None
+        if _BYTECODE_CACHE_DIR:
+            bytecode_cache = JinjaBytecodeCache(_BYTECODE_CACHE_DIR)
+        _JINJA_ENV = JEnvironment(
+            loader=JinjaContentLoader(), undefined=UndefinedJinjaVariable,
+            trim_blocks=True, cache_size=TEMPLATE_CACHE_SIZE,
+            auto_reload=False, bytecode_cache=bytecode_cache)
+    return _JINJA_ENV
+
+
+def get_jinja_template(content):
+    """Return the compiled jinja template of content."""
+    name = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    with _JINJA_LOCK:
+        env = get_jinja_env()
+        env.loader.sources[name] = content
+        try:
+            return env.get_template(name)
+        finally:
+            del env.loader.sources[name]
+
+
 def basic_render(content, params):
     """This does simple replacement of bash variable like templates.
 
@@ -99,9 +185,7 @@ def detect_template(text):
     def jinja_render(content, params):
         # keep_trailing_newline is in jinja2 2.7+, not 2.6
         add = "\n" if content.endswith("\n") else ""
-        return JTemplate(content,
-                         undefined=UndefinedJinjaVariable,
-                         trim_blocks=True).render(**params) + add
+        return get_jinja_template(content).render(**params) + add
 
     if text.find("\n") != -1:
         ident, rest = text.split("\n", 1)
@@ -8,6 +8,7 @@ import os
 import random
 import shutil
 import string
+import struct
 import sys
 import tempfile
 import time
@@ -18,6 +19,7 @@ from unittest.util import strclass
 
 from cloudinit.config.schema import (
     SchemaValidationError, validate_cloudconfig_schema)
+from cloudinit import blocktopology
 from cloudinit import cloud
 from cloudinit import distros
 from cloudinit import helpers as ch
@@ -470,6 +472,417 @@ def readResource(name, mode='r'):
         return fh.read()
 
 
+class RecordedBlockTopology(blocktopology.BlockTopology):
+    """A BlockTopology read from recorded lsblk --json output and mountinfo
+    in tests/data, counting the times it is read."""
+
+    def __init__(self, lsblk_resource, mountinfo_resource=None):
+        super(RecordedBlockTopology, self).__init__()
+        self.lsblk_resource = lsblk_resource
+        self.mountinfo_resource = mountinfo_resource
+        self.reads = 0
+
+    def _read(self):
+        self.reads += 1
+        devices, children = blocktopology.parse_lsblk_json(
+            readResource(self.lsblk_resource))
+        mountinfo = None
+        if self.mountinfo_resource:
+            mountinfo = readResource(self.mountinfo_resource).splitlines()
+        return devices, children, mountinfo
+
+
+def _both_endian(value, size):
+    fmt = {2: 'H', 4: 'I'}[size]
+    return struct.pack('<' + fmt, value) + struct.pack('>' + fmt, value)
+
+
+def _iso_record(name, location, size, flags, system_use=b''):
+    pad = b'\x00' if len(name) % 2 == 0 else b''
+    if (33 + len(name) + len(pad) + len(system_use)) % 2:
+        system_use += b'\x00'
+    length = 33 + len(name) + len(pad) + len(system_use)
+    return (bytes([length, 0]) + _both_endian(location, 4) +
+            _both_endian(size, 4) + bytes(7) + bytes([flags, 0, 0]) +
+            _both_endian(1, 2) + bytes([len(name)]) + name + pad +
+            system_use)
+
+
+def _rock_ridge_names(name):
+    """Return the Rock Ridge NM entries of name, split in 200 byte parts."""
+    name = name.encode('utf-8')
+    parts = [name[pos:pos + 200] for pos in range(0, len(name), 200)]
+    return b''.join(
+        b'NM' + bytes([5 + len(part), 1, 0x01 if index < len(parts) - 1
+                       else 0]) + part
+        for index, part in enumerate(parts))
+
+
+def make_iso9660_image(path, files, joliet=False, rock_ridge=False,
+                       relocated=(), max_extent=None):
+    """Write an ISO9660 image holding files, {path: content}, to path.
+
+    ISO9660 names are the upper case names, with a ';1' version for files.
+    Joliet and Rock Ridge names are written too when requested, Rock Ridge
+    names longer than 100 bytes in continuation areas. Directories listed in
+    relocated are moved to rr_moved as deep directories are with Rock Ridge.
+    Files larger than max_extent bytes are written in multiple extents.
+    """
+    block = 2048
+
+    class IsoDir(object):
+        def __init__(self, name, parent):
+            self.name = name
+            self.parent = parent if parent else self
+            # (name, IsoDir or file path, kind) where kind is 'dir', 'file',
+            # 'cl' or 're' for links to and from relocated directories
+            self.entries = []
+            self.location = self.size = None
+
+    contents = {}
+    for fpath, content in files.items():
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+        contents[fpath.strip('/')] = content
+    relocated = set(relocated)
+
+    def build_tree(use_relocation):
+        root = IsoDir('', None)
+        dirs = {'': root}
+        moved = None
+        for fpath in sorted(contents):
+            parts = fpath.split('/')
+            for depth in range(1, len(parts)):
+                dpath = '/'.join(parts[:depth])
+                if dpath in dirs:
+                    continue
+                parent = dirs['/'.join(parts[:depth - 1])]
+                dirs[dpath] = IsoDir(parts[depth - 1], parent)
+                if use_relocation and dpath in relocated:
+                    if moved is None:
+                        moved = IsoDir('rr_moved', root)
+                        root.entries.append(('rr_moved', moved, 'dir'))
+                    parent.entries.append((parts[depth - 1], dirs[dpath],
+                                           'cl'))
+                    moved.entries.append((parts[depth - 1], dirs[dpath],
+                                          're'))
+                else:
+                    parent.entries.append((parts[depth - 1], dirs[dpath],
+                                           'dir'))
+            dirs['/'.join(parts[:-1])].entries.append(
+                (parts[-1], fpath, 'file'))
+        ordered = [root]
+        for isodir in ordered:
+            ordered.extend(child for _name, child, kind in isodir.entries
+                           if kind in ('dir', 'cl'))
+        if moved is not None:
+            ordered.append(moved)
+        return root, ordered
+
+    def extents(fpath):
+        content = contents[fpath]
+        size = max_extent or max(len(content), 1)
+        return [content[pos:pos + size]
+                for pos in range(0, max(len(content), 1), size)]
+
+    locations = {}
+    continuations = {}
+
+    def records(isodir, is_joliet):
+        recs = []
+        system_use = b''
+        if rock_ridge and not is_joliet and isodir.parent is isodir:
+            system_use = b'SP\x07\x01\xbe\xef\x00'
+        recs.append(_iso_record(b'\x00', isodir.location or 0,
+                                isodir.size or 0, 2, system_use))
+        recs.append(_iso_record(b'\x01', isodir.parent.location or 0,
+                                isodir.parent.size or 0, 2))
+        for index, (name, child, kind) in enumerate(
+                sorted(isodir.entries, key=lambda e: e[0])):
+            if is_joliet:
+                iso_name = name.encode('utf-16-be')
+            elif rock_ridge:
+                iso_name = ('D%d' % index).encode('ascii')
+            else:
+                iso_name = name.upper().encode('latin-1')
+            system_use = b''
+            if rock_ridge and not is_joliet:
+                names = _rock_ridge_names(name)
+                if len(name) > 100:
+                    continuations.setdefault((id(isodir), name), names)
+                    system_use = (b'CE\x1c\x01' + _both_endian(
+                        locations.get((id(isodir), name), 0), 4) +
+                        _both_endian(0, 4) + _both_endian(len(names), 4))
+                else:
+                    system_use = names
+            if kind == 'file':
+                if not is_joliet and rock_ridge:
+                    iso_name = ('F%d;1' % index).encode('ascii')
+                else:
+                    iso_name += ';1'.encode(
+                        'utf-16-be' if is_joliet else 'ascii')
+                parts = extents(child)
+                for part_index, part in enumerate(parts):
+                    flags = 0x80 if part_index < len(parts) - 1 else 0
+                    recs.append(_iso_record(
+                        iso_name, locations.get((child, part_index), 0),
+                        len(part) if contents[child] else 0, flags,
+                        system_use))
+                continue
+            flags = 2
+            if kind == 'cl':
+                flags = 0
+                system_use += b'CL\x0c\x01' + _both_endian(
+                    child.location or 0, 4)
+            elif kind == 're':
+                system_use += b'RE\x04\x01'
+            recs.append(_iso_record(iso_name, child.location or 0,
+                                    child.size or 0, flags, system_use))
+        return recs
+
+    def pack(recs):
+        data = b''
+        for rec in recs:
+            used = len(data) % block
+            if used + len(rec) > block:
+                data += bytes(block - used)
+            data += rec
+        return data + bytes(-len(data) % block)
+
+    trees = [build_tree(rock_ridge)]
+    if joliet:
+        trees.append(build_tree(False))
+    next_free = 16 + len(trees) + 1
+    for tree_index, (_root, ordered) in enumerate(trees):
+        for isodir in ordered:
+            isodir.size = len(pack(records(isodir, tree_index == 1)))
+            isodir.location = next_free
+            next_free += isodir.size // block
+    for key in sorted(continuations, key=str):
+        locations[key] = next_free
+        next_free += 1
+    for fpath in sorted(contents):
+        for part_index, part in enumerate(extents(fpath)):
+            locations[(fpath, part_index)] = next_free
+            next_free += (len(part) + block - 1) // block
+
+    image = bytearray(next_free * block)
+    for tree_index, (root, ordered) in enumerate(trees):
+        desc = bytearray(block)
+        desc[0] = 2 if tree_index else 1
+        desc[1:7] = b'CD001\x01'
+        desc[80:88] = _both_endian(next_free, 4)
+        if tree_index:
+            desc[88:91] = b'%/E'
+        desc[120:124] = _both_endian(1, 2)
+        desc[124:128] = _both_endian(1, 2)
+        desc[128:132] = _both_endian(block, 2)
+        desc[156:190] = _iso_record(b'\x00', root.location, root.size, 2)
+        desc[881] = 1
+        image[(16 + tree_index) * block:(17 + tree_index) * block] = desc
+        for isodir in ordered:
+            data = pack(records(isodir, tree_index == 1))
+            start = isodir.location * block
+            image[start:start + len(data)] = data
+    terminator = (16 + len(trees)) * block
+    image[terminator:terminator + 7] = b'\xffCD001\x01'
+    for key, names in continuations.items():
+        start = locations[key] * block
+        image[start:start + len(names)] = names
+    for fpath in contents:
+        for part_index, part in enumerate(extents(fpath)):
+            start = locations[(fpath, part_index)] * block
+            image[start:start + len(part)] = part
+    with open(path, 'wb') as fp:
+        fp.write(image)
+
+
+FAT_IMAGE_LAYOUTS = {
+    # fat bits: (total sectors, reserved sectors, root entries)
+    12: (2880, 1, 224),
+    16: (8192, 1, 512),
+    32: (68000, 32, 0),
+}
+FAT_SHORT_CHARS = string.ascii_uppercase + string.digits + "$%'-_@~`!(){}^#&"
+
+
+def _fat_short_entry(name11, attr, cluster, size, case_flags=0):
+    return (name11 + bytes([attr, case_flags]) + bytes(7) +
+            struct.pack('<H', cluster >> 16) + bytes(4) +
+            struct.pack('<HI', cluster & 0xFFFF, size))
+
+
+def _fat_entries(name, attr, cluster, size, long_names, used):
+    """Return the directory entries of name, with its long name entries."""
+    base, _, ext = name.partition('.')
+    is_short = (0 < len(base) <= 8 and len(ext) <= 3 and '.' not in ext and
+                all(c in FAT_SHORT_CHARS for c in (base + ext).upper()))
+    if is_short and name == name.upper():
+        return [_fat_short_entry(
+            base.ljust(8).encode() + ext.ljust(3).encode(), attr, cluster,
+            size)]
+    if is_short and not long_names and (
+            base in (base.lower(), base.upper()) and
+            ext in (ext.lower(), ext.upper())):
+        case_flags = (0x08 if base != base.upper() else 0) | (
+            0x10 if ext != ext.upper() else 0)
+        return [_fat_short_entry(
+            base.upper().ljust(8).encode() + ext.upper().ljust(3).encode(),
+            attr, cluster, size, case_flags)]
+    stem = ''.join(c for c in name.rpartition('.')[0] or name
+                   if c.upper() in FAT_SHORT_CHARS).upper()[:6] or 'X'
+    short_ext = ''.join(c for c in name.rpartition('.')[2]
+                        if '.' in name and c.upper() in FAT_SHORT_CHARS)
+    for index in range(1, 10):
+        name11 = ('%s~%d' % (stem, index)).ljust(8).encode() + (
+            short_ext.upper()[:3].ljust(3).encode())
+        if name11 not in used:
+            break
+    used.add(name11)
+    checksum = 0
+    for byte in name11:
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + byte) & 0xFF
+    units = name.encode('utf-16-le')
+    if len(units) % 26:
+        units += b'\x00\x00'
+        units += b'\xff' * (-len(units) % 26)
+    count = len(units) // 26
+    entries = []
+    for index in reversed(range(count)):
+        chunk = units[index * 26:(index + 1) * 26]
+        order = index + 1 | (0x40 if index == count - 1 else 0)
+        entries.append(bytes([order]) + chunk[:10] +
+                       bytes([0x0F, 0, checksum]) + chunk[10:22] +
+                       bytes(2) + chunk[22:26])
+    return entries + [_fat_short_entry(name11, attr, cluster, size)]
+
+
+def make_fat_image(path, files, fat_bits=12, long_names=True,
+                   fragment=False):
+    """Write a FAT12, FAT16 or FAT32 image holding files to path.
+
+    files is {path: content}. Names which are not upper case 8.3 names are
+    written as long names with a generated short name, or if long_names is
+    False and they are lower case 8.3 names, as short names with the lower
+    case flags. With fragment, clusters of files are not contiguous.
+    """
+    sector = 512
+    total, reserved, root_entries = FAT_IMAGE_LAYOUTS[fat_bits]
+    fat_size = -(-(total + 2) * fat_bits // 8 // sector) + 1
+    root_sectors = root_entries * 32 // sector
+    data_start = reserved + 2 * fat_size + root_sectors
+    eoc = {12: 0xFFF, 16: 0xFFFF, 32: 0x0FFFFFFF}[fat_bits]
+
+    tree = {}
+    for fpath, content in files.items():
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+        node = tree
+        parts = fpath.strip('/').split('/')
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = content
+
+    fat = {0: eoc & ~0xFF | 0xF8, 1: eoc}
+    next_cluster = [2]
+
+    def allocate(size, spread=False):
+        clusters = []
+        for _ in range(max(-(-size // sector), 1)):
+            clusters.append(next_cluster[0])
+            next_cluster[0] += 2 if spread else 1
+        for current, following in zip(clusters, clusters[1:] + [eoc]):
+            fat[current] = following
+        return clusters
+
+    writes = []
+
+    def write_dir(node, clusters, parent_cluster, is_root):
+        used = set()
+        entries = []
+        if not is_root:
+            entries.append(_fat_short_entry(
+                b'.          ', 0x10, clusters[0], 0))
+            entries.append(_fat_short_entry(
+                b'..         ', 0x10, parent_cluster, 0))
+        for name in sorted(node):
+            child = node[name]
+            if isinstance(child, dict):
+                count = 2 + sum(len(n) // 13 + 2 for n in child)
+                child_clusters = allocate(count * 32)
+                entries.extend(_fat_entries(
+                    name, 0x10, child_clusters[0], 0, long_names, used))
+                write_dir(child, child_clusters,
+                          0 if is_root else clusters[0], False)
+            else:
+                first = 0
+                if child:
+                    file_clusters = allocate(len(child), fragment)
+                    first = file_clusters[0]
+                    for index, cluster in enumerate(file_clusters):
+                        writes.append(((data_start + cluster - 2) * sector,
+                                       child[index * sector:
+                                             (index + 1) * sector]))
+                entries.extend(_fat_entries(
+                    name, 0x20, first, len(child), long_names, used))
+        data = b''.join(entries)
+        if clusters is None:
+            assert len(data) <= root_entries * 32, 'Root directory is full'
+            writes.append(((reserved + 2 * fat_size) * sector, data))
+        else:
+            for index, cluster in enumerate(clusters):
+                writes.append(((data_start + cluster - 2) * sector,
+                               data[index * sector:(index + 1) * sector]))
+
+    if fat_bits == 32:
+        root_clusters = allocate(
+            (len(tree) + sum(len(n) // 13 + 2 for n in tree)) * 32)
+        write_dir(tree, root_clusters, 0, True)
+    else:
+        write_dir(tree, None, 0, True)
+
+    boot = bytearray(sector)
+    boot[0:11] = b'\xeb\x3c\x90MSWIN4.1'
+    struct.pack_into('<HBHBHHBH', boot, 11, sector, 1, reserved, 2,
+                     root_entries, total if total < 0x10000 else 0, 0xF8,
+                     0 if fat_bits == 32 else fat_size)
+    if total >= 0x10000:
+        struct.pack_into('<I', boot, 32, total)
+    if fat_bits == 32:
+        struct.pack_into('<IHHI', boot, 36, fat_size, 0, 0, 2)
+        boot[66] = 0x29
+        boot[71:90] = b'CIDATA     FAT32   '
+    else:
+        boot[38] = 0x29
+        boot[43:62] = ('CIDATA     FAT%d   ' % fat_bits).encode()
+    boot[510:512] = b'\x55\xaa'
+
+    table = bytearray(fat_size * sector)
+    for cluster, value in fat.items():
+        if fat_bits == 12:
+            offset = cluster + cluster // 2
+            if cluster & 1:
+                table[offset] = (table[offset] & 0x0F) | ((value << 4) & 0xF0)
+                table[offset + 1] = (value >> 4) & 0xFF
+            else:
+                table[offset] = value & 0xFF
+                table[offset + 1] = ((table[offset + 1] & 0xF0) |
+                                     ((value >> 8) & 0x0F))
+        else:
+            struct.pack_into('<H' if fat_bits == 16 else '<I', table,
+                             cluster * fat_bits // 8, value)
+
+    with open(path, 'wb') as fp:
+        fp.truncate(total * sector)
+        fp.write(boot)
+        for index in range(2):
+            fp.seek((reserved + index * fat_size) * sector)
+            fp.write(table)
+        for offset, data in writes:
+            fp.seek(offset)
+            fp.write(data)
+
+
 try:
     import jsonschema
     assert jsonschema  # avoid pyflakes error F401: import unused
@@ -0,0 +1,197 @@
+# This file is part of cloud-init. See LICENSE file for license information.
+
+"""Tests for cloudinit.blocktopology"""
+
+import json
+
+from cloudinit import blocktopology
+from cloudinit.subp import ProcessExecutionError
+from cloudinit.tests.helpers import (
+    CiTestCase, RecordedBlockTopology, mock, readResource)
+
+M_PATH = 'cloudinit.blocktopology.'
+
+
+def _names(devices):
+    return [device.name for device in devices]
+
+
+class TestParseLsblkJson(CiTestCase):
+
+    def parse(self, resource):
+        return blocktopology.parse_lsblk_json(
+            readResource('lsblk/%s' % resource))
+
+    def test_devices_listed_before_devices_on_them(self):
+        devices, children = self.parse('lsblk_kvm_lvm.json')
+        self.assertEqual(
+            ['sr0', 'vda', 'vda1', 'vda2', 'dm-0', 'vdb', 'vdb1', 'vdb2'],
+            list(devices))
+        self.assertEqual({'vda': ['vda1', 'vda2'], 'vda2': ['dm-0'],
+                          'vdb': ['vdb1', 'vdb2']}, children)
+
+    def test_partitions(self):
+        devices, _children = self.parse('lsblk_ec2_nvme.json')
+        self.assertEqual(
+            blocktopology.BlockDevice(
+                name='nvme0n1p15', path='/dev/nvme0n1p15', type='part',
+                fstype='vfat', label='UEFI', uuid='A1B2-C3D4',
+                size=111149056, parent='nvme0n1', partn=15,
+                mountpoint='/boot/efi'),
+            devices['nvme0n1p15'])
+        self.assertEqual(
+            blocktopology.BlockDevice(
+                name='nvme1n1', path='/dev/nvme1n1', type='disk',
+                fstype=None, label=None, uuid=None, size=950000000000,
+                parent=None, partn=None, mountpoint=None),
+            devices['nvme1n1'])
+
+    def test_device_mapper_devices_by_kernel_name(self):
+        devices, _children = self.parse('lsblk_kvm_lvm.json')
+        self.assertEqual('/dev/mapper/vg0-root', devices['dm-0'].path)
+        self.assertEqual('lvm', devices['dm-0'].type)
+        self.assertIsNone(devices['dm-0'].partn)
+
+    def test_older_lsblk_prints_strings(self):
+        """Sizes printed as strings are read as numbers, and device nodes
+        not printed are found from the name."""
+        devices, _children = self.parse('lsblk_xen_old.json')
+        self.assertEqual(10736369664, devices['xvda1'].size)
+        self.assertEqual('/dev/xvda1', devices['xvda1'].path)
+        self.assertEqual(1, devices['xvda1'].partn)
+        self.assertEqual('/mnt', devices['xvdb'].mountpoint)
+        self.assertEqual('ext3', devices['xvdb'].fstype)
+
+    def test_older_lsblk_device_mapper_path(self):
+        content = json.dumps({'blockdevices': [
+            {'name': 'sda', 'kname': 'sda', 'type': 'disk', 'size': '1024',
+             'children': [
+                 {'name': 'sda1', 'kname': 'sda1', 'type': 'part',
+                  'size': '512', 'children': [
+                      {'name': 'crypt-root', 'kname': 'dm-0',
+                       'type': 'crypt', 'size': '512', 'fstype': ''}]}]}]})
+        devices, _children = blocktopology.parse_lsblk_json(content)
+        self.assertEqual('/dev/mapper/crypt-root', devices['dm-0'].path)
+        self.assertIsNone(devices['dm-0'].fstype)
+
+    def test_partition_number_from_name_or_partn(self):
+        content = json.dumps({'blockdevices': [
+            {'name': 'mpatha', 'kname': 'mpatha', 'type': 'disk',
+             'children': [
+                 {'name': 'mpatha-part2', 'kname': 'mpatha-part2',
+                  'type': 'part'},
+                 {'name': 'odd', 'kname': 'odd', 'type': 'part'},
+                 {'name': 'named', 'kname': 'named', 'type': 'part',
+                  'partn': 3}]}]})
+        devices, _children = blocktopology.parse_lsblk_json(content)
+        self.assertEqual(2, devices['mpatha-part2'].partn)
+        self.assertIsNone(devices['odd'].partn)
+        self.assertEqual(3, devices['named'].partn)
+
+    def test_device_on_several_devices_listed_once(self):
+        raid = {'name': 'md0', 'kname': 'md0', 'type': 'raid1'}
+        content = json.dumps({'blockdevices': [
+            {'name': 'sda', 'kname': 'sda', 'type': 'disk',
+             'children': [raid]},
+            {'name': 'sdb', 'kname': 'sdb', 'type': 'disk',
+             'children': [raid]}]})
+        devices, children = blocktopology.parse_lsblk_json(content)
+        self.assertEqual(['sda', 'md0', 'sdb'], list(devices))
+        self.assertEqual('sda', devices['md0'].parent)
+        self.assertEqual({'sda': ['md0'], 'sdb': ['md0']}, children)
+
+
+class TestBlockTopology(CiTestCase):
+
+    with_logs = True
+
+    def setUp(self):
+        super(TestBlockTopology, self).setUp()
+        self.mountinfo = self.tmp_path('mountinfo')
+        with open(self.mountinfo, 'w') as stream:
+            stream.write(readResource('mountinfo_focal_nvme.txt'))
+        patcher = mock.patch(M_PATH + 'MOUNTINFO_PATH', self.mountinfo)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.add_patch(M_PATH + 'subp.subp', 'm_subp', return_value=(
+            readResource('lsblk/lsblk_ec2_nvme.json'), ''))
+
+    def test_lsblk_run_once_until_invalidated(self):
+        topology = blocktopology.BlockTopology()
+        self.assertEqual(0, self.m_subp.call_count)
+        self.assertEqual('disk', topology.lookup('/dev/nvme1n1').type)
+        self.assertEqual('part', topology.lookup('/dev/nvme0n1p1').type)
+        self.assertEqual(7, len(topology.devices()))
+        self.m_subp.assert_called_once_with(
+            ['lsblk', '--json', '--bytes', '--output-all'])
+        topology.invalidate()
+        topology.lookup('/dev/nvme1n1')
+        self.assertEqual(2, self.m_subp.call_count)
+
+    @mock.patch(M_PATH + 'os.path.realpath')
+    def test_lookup_resolves_links(self, m_realpath):
+        m_realpath.side_effect = lambda path: {
+            '/dev/disk/by-label/UEFI': '/dev/nvme0n1p15'}.get(path, path)
+        topology = blocktopology.BlockTopology()
+        self.assertEqual(
+            'nvme0n1p15', topology.lookup('/dev/disk/by-label/UEFI').name)
+
+    def test_lookup_of_unknown_devices_is_none(self):
+        topology = blocktopology.BlockTopology()
+        self.assertIsNone(topology.lookup('/dev/sdz'))
+        self.assertIsNone(topology.lookup(None))
+        self.assertIsNone(topology.lookup(self.mountinfo))
+
+    def test_lsblk_failure_looks_devices_up_as_none(self):
+        self.m_subp.side_effect = ProcessExecutionError(
+            cmd='lsblk', exit_code=1, stderr='lsblk: unknown option')
+        topology = blocktopology.BlockTopology()
+        self.assertIsNone(topology.lookup('/dev/nvme1n1'))
+        self.assertEqual([], topology.devices())
+        self.assertIn('Unable to list block devices', self.logs.getvalue())
+
+    def test_unparsable_lsblk_output_is_logged(self):
+        self.m_subp.return_value = ('NAME="sda"', '')
+        topology = blocktopology.BlockTopology()
+        self.assertIsNone(topology.lookup('/dev/sda'))
+        self.assertIn('Unable to parse lsblk output', self.logs.getvalue())
+
+    def test_children_and_descendants(self):
+        topology = RecordedBlockTopology('lsblk/lsblk_kvm_lvm.json')
+        vda = topology.lookup('/dev/vda')
+        self.assertEqual(['vda1', 'vda2'], _names(topology.children(vda)))
+        self.assertEqual(['vda1', 'vda2', 'dm-0'],
+                         _names(topology.descendants(vda)))
+        self.assertEqual([], topology.descendants(topology.lookup('/dev/sr0')))
+
+    def test_get_mount_info_from_mountinfo_read(self):
+        topology = blocktopology.BlockTopology()
+        self.assertEqual(('/dev/nvme0n1p1', 'ext4', '/'),
+                         topology.get_mount_info('/var/lib'))
+        self.assertEqual(
+            ('/dev/nvme0n1p15', 'vfat', '/boot/efi', 'rw,relatime'),
+            topology.get_mount_info('/boot/efi', get_mnt_opts=True))
+        # mountinfo is read again once invalidated
+        with open(self.mountinfo, 'w') as stream:
+            stream.write(readResource('mountinfo_precise_ext4.txt'))
+        self.assertEqual(('/dev/nvme0n1p1', 'ext4', '/'),
+                         topology.get_mount_info('/'))
+        topology.invalidate()
+        self.assertEqual(('/dev/mapper/vg0-root', 'ext4', '/'),
+                         topology.get_mount_info('/'))
+
+    @mock.patch(M_PATH + 'util.get_mount_info')
+    def test_get_mount_info_without_mountinfo(self, m_get_mount_info):
+        """Mounts are looked up by util without mountinfo, as on BSD."""
+        m_get_mount_info.return_value = ('/dev/da0p2', 'ufs', '/')
+        with mock.patch(M_PATH + 'MOUNTINFO_PATH', self.tmp_path('missing')):
+            topology = blocktopology.BlockTopology()
+            self.assertEqual(('/dev/da0p2', 'ufs', '/'),
+                             topology.get_mount_info('/', mock.sentinel.log))
+            topology.get_mount_info('/', mock.sentinel.log, get_mnt_opts=True)
+        self.assertEqual(
+            [mock.call('/', mock.sentinel.log),
+             mock.call('/', mock.sentinel.log, get_mnt_opts=True)],
+            m_get_mount_info.call_args_list)
+
+# vi: ts=4 expandtab
@@ -0,0 +1,252 @@
+# This file is part of cloud-init. See LICENSE file for license information.
+
+"""Tests for cloudinit.fsimage"""
+
+import struct
+
+from cloudinit import fsimage
+from cloudinit import util
+from cloudinit.tests.helpers import (
+    CiTestCase, make_fat_image, make_iso9660_image)
+
+SEED_FILES = {
+    'user-data': '#cloud-config\n',
+    'meta-data': 'instance-id: iid-1\n',
+    'openstack/latest/meta_data.json': '{"uuid": "iid-1"}',
+    'openstack/latest/user_data': b'\x00\x01' * 3000,
+    'empty': '',
+}
+
+
+def _as_bytes(files):
+    return {path: content if isinstance(content, bytes)
+            else content.encode('utf-8') for path, content in files.items()}
+
+
+class TestIso9660(CiTestCase):
+
+    def image(self, files=None, **kwargs):
+        path = self.tmp_path('seed.iso')
+        make_iso9660_image(path, files or SEED_FILES, **kwargs)
+        return path
+
+    def assert_files(self, path, files=None, fstype='iso9660'):
+        with fsimage.open_image(path) as view:
+            self.assertEqual(fstype, view.fstype)
+            self.assertEqual(_as_bytes(files or SEED_FILES), dict(view))
+
+    def test_iso9660_names(self):
+        """ISO9660 names are read without version, in lower case."""
+        self.assert_files(self.image())
+
+    def test_iso9660_names_match_case(self):
+        """ISO9660 names are only found in their case, as with Linux's
+        default check=strict."""
+        with fsimage.open_image(self.image()) as view:
+            self.assertFalse(view.exists('USER-DATA'))
+            self.assertFalse(view.isdir('OpenStack/Latest'))
+            self.assertTrue(view.isdir('openstack/latest'))
+
+    def test_joliet_names_match_any_case(self):
+        """Joliet names are found in any case, as with Linux's default
+        check=relaxed for Joliet."""
+        files = {'Mixed Case Name.json': '{}', 'dir/user-data': 'ud'}
+        with fsimage.open_image(self.image(files, joliet=True)) as view:
+            self.assertEqual(b'{}', view['mixed case name.JSON'])
+            self.assertTrue(view.isfile('DIR/User-Data'))
+
+    def test_rock_ridge_names_match_case(self):
+        files = {'Mixed Case Name.json': '{}'}
+        with fsimage.open_image(self.image(files, rock_ridge=True)) as view:
+            self.assertFalse(view.exists('mixed case name.json'))
+
+    def test_joliet_names(self):
+        files = {'Mixed Case Name.json': '{}', 'dir/user-data': 'ud'}
+        self.assert_files(self.image(files, joliet=True), files)
+
+    def test_rock_ridge_names(self):
+        """Rock Ridge names are used before short ISO9660 names."""
+        files = {'Mixed Case Name.json': '{}', 'dir/user-data': 'ud'}
+        self.assert_files(self.image(files, rock_ridge=True), files)
+
+    def test_rock_ridge_names_are_preferred_to_joliet(self):
+        files = dict(SEED_FILES, **{'Name.JSON': '{}'})
+        path = self.image(files, rock_ridge=True, joliet=True)
+        self.assert_files(path, files)
+        with fsimage.open_image(path) as view:
+            self.assertFalse(view.exists('name.json'))
+
+    def test_rock_ridge_continuation_areas(self):
+        """Rock Ridge names are read from continuation areas."""
+        files = {'x' * 240: 'long', 'dir/' + 'y' * 150: 'longer'}
+        self.assert_files(self.image(files, rock_ridge=True), files)
+
+    def test_rock_ridge_relocated_directories(self):
+        """Deep directories are read where they were relocated from."""
+        files = {'a/b/c/d/e/f/g/h/user-data': 'deep', 'a/meta-data': 'md'}
+        path = self.image(files, rock_ridge=True, relocated=['a/b/c/d/e/f/g'])
+        self.assert_files(path, files)
+        with fsimage.open_image(path) as view:
+            self.assertEqual([], view.listdir('rr_moved'))
+
+    def test_multi_extent_files(self):
+        self.assert_files(self.image(max_extent=2048))
+
+    def test_view_methods(self):
+        with fsimage.open_image(self.image()) as view:
+            self.assertEqual('#cloud-config\n', view.read('user-data'))
+            self.assertEqual(b'#cloud-config\n',
+                             view.read('./user-data', decode=False))
+            self.assertEqual(b'', view['empty'])
+            self.assertTrue(view.exists('openstack'))
+            self.assertTrue(view.isdir('openstack/latest/'))
+            self.assertFalse(view.isfile('openstack/latest'))
+            self.assertTrue(view.isfile('/openstack/latest/user_data'))
+            self.assertEqual(['latest'], view.listdir('openstack'))
+            self.assertFalse(view.exists('vendor-data'))
+            self.assertNotIn('openstack', view)
+            self.assertEqual(len(SEED_FILES), len(view))
+
+    def test_view_missing_files_raise_like_os(self):
+        with fsimage.open_image(self.image()) as view:
+            with self.assertRaises(FileNotFoundError):
+                view.read('vendor-data')
+            with self.assertRaises(IsADirectoryError):
+                view.read('openstack')
+            with self.assertRaises(NotADirectoryError):
+                view.listdir('user-data')
+            with self.assertRaises(KeyError):
+                view['openstack/latest']
+
+    def test_view_is_named_by_device(self):
+        path = self.image()
+        with fsimage.open_image(path) as view:
+            self.assertEqual(path, str(view))
+
+    def test_truncated_image_raises_image_error(self):
+        path = self.image()
+        content = util.load_file(path, decode=False)
+        util.write_file(path, content[:-2048], omode='wb')
+        with fsimage.open_image(path) as view:
+            self.assertEqual(b'{"uuid": "iid-1"}',
+                             view['openstack/latest/meta_data.json'])
+            with self.assertRaises(fsimage.ImageError):
+                view['user-data']
+
+    def test_directory_cycle_raises_image_error(self):
+        """Listing a corrupt image with a directory inside itself fails."""
+        path = self.image()
+        with fsimage.open_image(path) as view:
+            block_size = view._reader._block_size
+            parent = view._lookup('openstack')
+            child = view._lookup('openstack/latest')
+        content = bytearray(util.load_file(path, decode=False))
+        start = parent.location * block_size
+        pos = content.index(
+            struct.pack('<I', child.location), start, start + parent.size)
+        content[pos:pos + 8] = (struct.pack('<I', parent.location) +
+                                struct.pack('>I', parent.location))
+        util.write_file(path, bytes(content), omode='wb')
+        with fsimage.open_image(path) as view:
+            with self.assertRaises(fsimage.ImageError):
+                len(view)
+            self.assertEqual('#cloud-config\n', view.read('user-data'))
+
+    def test_unsupported_mtype_raises_image_error(self):
+        with self.assertRaises(fsimage.ImageError):
+            fsimage.open_image(self.image(), ['ext4'])
+
+    def test_mtypes_select_readers(self):
+        path = self.image()
+        for mtypes in (None, ['iso9660'], ['vfat', 'iso9660'], ['auto']):
+            with fsimage.open_image(path, mtypes) as view:
+                self.assertEqual('iso9660', view.fstype)
+        with self.assertRaises(fsimage.ImageError):
+            fsimage.open_image(path, ['vfat'])
+
+
+class TestFat(CiTestCase):
+
+    files = dict(SEED_FILES, **{
+        'Some Long Name.json': 'z' * 3000, 'UPPER.TXT': 'u',
+        'lower.txt': 'l'})
+
+    def image(self, files=None, **kwargs):
+        path = self.tmp_path('seed.img')
+        make_fat_image(path, files or self.files, **kwargs)
+        return path
+
+    def assert_files(self, path, files=None):
+        with fsimage.open_image(path) as view:
+            self.assertEqual('vfat', view.fstype)
+            self.assertEqual(_as_bytes(files or self.files), dict(view))
+
+    def test_fat12(self):
+        self.assert_files(self.image(fat_bits=12))
+
+    def test_fat16(self):
+        self.assert_files(self.image(fat_bits=16))
+
+    def test_fat32(self):
+        self.assert_files(self.image(fat_bits=32))
+
+    def test_fat_type_from_cluster_count(self):
+        for fat_bits in (12, 16, 32):
+            path = self.image(fat_bits=fat_bits)
+            with fsimage.open_image(path) as view:
+                self.assertEqual(fat_bits, view._reader.fat_bits)
+
+    def test_lower_case_short_names(self):
+        """Short names are read in lower case as the NT case flags say."""
+        self.assert_files(self.image(long_names=False))
+
+    def test_fragmented_files(self):
+        for fat_bits in (12, 16, 32):
+            self.assert_files(self.image(fat_bits=fat_bits, fragment=True))
+
+    def test_names_match_any_case(self):
+        with fsimage.open_image(self.image()) as view:
+            self.assertEqual(b'z' * 3000, view['some long name.JSON'])
+            self.assertEqual(b'l', view['LOWER.TXT'])
+
+    def test_cluster_chain_loop_raises_image_error(self):
+        path = self.image(fat_bits=16)
+        with fsimage.open_image(path) as view:
+            entry = view._lookup('Some Long Name.json')
+            fat_offset = view._reader._fat_offset
+        # Point the first cluster of the file back at itself
+        with open(path, 'r+b') as fp:
+            fp.seek(fat_offset + entry.location * 2)
+            fp.write(struct.pack('<H', entry.location))
+        with fsimage.open_image(path) as view:
+            with self.assertRaises(fsimage.ImageError):
+                view['Some Long Name.json']
+
+    def test_directory_cycle_raises_image_error(self):
+        """Listing a corrupt image with a directory inside itself fails."""
+        path = self.image()
+        with fsimage.open_image(path) as view:
+            parent = view._lookup('openstack')
+            start = view._reader._extents(parent)[0][0]
+        content = bytearray(util.load_file(path, decode=False))
+        pos = content.index(b'LATEST~1   ', start)
+        struct.pack_into('<H', content, pos + 26, parent.location)
+        util.write_file(path, bytes(content), omode='wb')
+        with fsimage.open_image(path) as view:
+            with self.assertRaises(fsimage.ImageError):
+                list(view)
+            self.assertEqual('#cloud-config\n', view.read('user-data'))
+
+    def test_not_fat_raises_image_error(self):
+        path = self.tmp_path('zeros.img')
+        util.write_file(path, b'\x00' * 65536, omode='wb')
+        with self.assertRaises(fsimage.ImageError):
+            fsimage.open_image(path)
+
+    def test_iso9660_is_not_read_as_fat(self):
+        path = self.tmp_path('seed.iso')
+        make_iso9660_image(path, SEED_FILES)
+        with self.assertRaises(fsimage.ImageError):
+            fsimage.open_image(path, ['vfat'])
+
+# vi: ts=4 expandtab
@@ -0,0 +1,97 @@
+# This file is part of cloud-init. See LICENSE file for license information.
+
+"""Tests for cloudinit.importer module index."""
+
+import json
+
+from cloudinit import importer
+from cloudinit import sources
+from cloudinit.sources import DataSourceEc2
+from cloudinit.tests.helpers import CiTestCase, mock
+from cloudinit.util import write_file
+
+M_PATH = 'cloudinit.importer.'
+
+
+class TestBuildModuleIndex(CiTestCase):
+
+    def test_config_modules_indexed_with_metadata(self):
+        """Config modules are indexed with their frequency and distros."""
+        from cloudinit.config import cc_ntp
+        entry = importer.build_module_index()['modules']['cc_ntp']
+        self.assertEqual(
+            {'module': 'cloudinit.config.cc_ntp',
+             'frequency': cc_ntp.frequency, 'distros': cc_ntp.distros},
+            entry)
+
+    def test_datasources_indexed_with_dependencies(self):
+        """Datasource modules are indexed with their classes' dependencies.
+        """
+        entry = importer.build_module_index()['datasources']['DataSourceEc2']
+        self.assertEqual('cloudinit.sources.DataSourceEc2', entry['module'])
+        self.assertEqual(
+            [(cls.__name__, sorted(deps))
+             for cls, deps in DataSourceEc2.datasources],
+            entry['datasources'])
+
+    def test_custom_datasource_list_not_indexed(self):
+        """Datasources are listed by importing modules which filter them."""
+        with mock.patch.object(
+                DataSourceEc2, 'get_datasource_list', return_value=[]):
+            entry = importer.build_module_index()['datasources'][
+                'DataSourceEc2']
+        self.assertEqual(
+            {'module': 'cloudinit.sources.DataSourceEc2',
+             'datasources': None}, entry)
+
+    def test_write_module_index_round_trips(self):
+        """The written index is what get_module_index returns."""
+        index_file = self.tmp_path('module-index.json')
+        importer.write_module_index(index_file)
+        with mock.patch(M_PATH + 'MODULE_INDEX_FILE', index_file):
+            with mock.patch(M_PATH + '_MODULE_INDEX', None):
+                self.assertEqual(
+                    json.loads(json.dumps(importer.build_module_index())),
+                    importer.get_module_index())
+
+
+class TestFindIndexedModule(CiTestCase):
+
+    index = {'datasources': {'DataSourceEc2': {
+        'module': 'cloudinit.sources.DataSourceEc2',
+        'datasources': [['DataSourceEc2', ['FILESYSTEM', 'NETWORK']]]}}}
+
+    def test_entry_in_search_paths_returned(self):
+        """Entries are returned when their package is searched."""
+        with mock.patch(M_PATH + '_MODULE_INDEX', self.index):
+            self.assertEqual(
+                self.index['datasources']['DataSourceEc2'],
+                importer.find_indexed_module(
+                    'datasources', 'DataSourceEc2', ['', 'cloudinit.sources']))
+            self.assertIsNone(importer.find_indexed_module(
+                'datasources', 'DataSourceEc2', ['']))
+            self.assertIsNone(importer.find_indexed_module(
+                'datasources', 'DataSourceGCE', ['cloudinit.sources']))
+            self.assertIsNone(importer.find_indexed_module(
+                'modules', 'cc_ntp', ['cloudinit.config']))
+
+    def test_missing_or_invalid_index_is_empty(self):
+        """Nothing is indexed when the index file is missing or invalid."""
+        index_file = self.tmp_path('module-index.json')
+        with mock.patch(M_PATH + 'MODULE_INDEX_FILE', index_file):
+            with mock.patch(M_PATH + '_MODULE_INDEX', None):
+                self.assertEqual({}, importer.get_module_index())
+            write_file(index_file, '{')
+            with mock.patch(M_PATH + '_MODULE_INDEX', None):
+                self.assertEqual({}, importer.get_module_index())
+
+    def test_list_sources_falls_back_to_find_module(self):
+        """Datasources missing from the index are found by importing them."""
+        with mock.patch(M_PATH + '_MODULE_INDEX', {}):
+            self.assertEqual(
+                [DataSourceEc2.DataSourceEc2],
+                sources.list_sources(
+                    ['Ec2'], [sources.DEP_FILESYSTEM, sources.DEP_NETWORK],
+                    ['cloudinit.sources']))
+
+# vi: ts=4 expandtab
@@ -3,8 +3,12 @@
 """Tests netinfo module functions and classes."""
 
 from copy import copy
+import socket
+import struct
 
-from cloudinit.netinfo import netdev_info, netdev_pformat, route_pformat
+from cloudinit.netinfo import (
+    netdev_info, netdev_pformat, route_info, route_pformat)
+from cloudinit.sources.helpers import netlink
 from cloudinit.tests.helpers import CiTestCase, mock, readResource
 
 
@@ -27,6 +31,12 @@ class TestNetInfo(CiTestCase):
     maxDiff = None
     with_logs = True
 
+    def setUp(self):
+        super(TestNetInfo, self).setUp()
+        # Use the command parsers, whatever the host supports
+        self.add_patch('cloudinit.netinfo._try_netlink', 'm_netlink',
+                       return_value=None)
+
     @mock.patch('cloudinit.netinfo.subp.which')
     @mock.patch('cloudinit.netinfo.subp.subp')
     def test_netdev_old_nettools_pformat(self, m_subp, m_which):
@@ -178,4 +188,143 @@ class TestNetInfo(CiTestCase):
             self.logs.getvalue())
         m_subp.assert_not_called()
 
+
+def _link_msg(index, name, flags, link_type=1, hwaddr=None):
+    attrs = {netlink.IFLA_IFNAME: name.encode() + b'\0'}
+    if hwaddr:
+        attrs[netlink.IFLA_ADDRESS] = bytes(
+            int(octet, 16) for octet in hwaddr.split(':'))
+    return netlink.NetlinkMessage(None, struct.pack(
+        netlink.IFINFOMSG_FMT, 0, link_type, index, flags, 0), attrs)
+
+
+def _addr_msg(index, family, addr, prefix, scope, bcast=None):
+    attrs = {netlink.IFA_ADDRESS: socket.inet_pton(family, addr)}
+    if bcast:
+        attrs[netlink.IFA_BROADCAST] = socket.inet_pton(family, bcast)
+    return netlink.NetlinkMessage(None, struct.pack(
+        netlink.IFADDRMSG_FMT, family, prefix, 0, scope, index), attrs)
+
+
+def _route_msg(family, dst, dst_len, oif, gateway=None, metric=None,
+               table=254, rtm_type=1, expires=0):
+    attrs = {netlink.RTA_OIF: struct.pack('I', oif),
+             netlink.RTA_TABLE: struct.pack('I', table),
+             netlink.RTA_CACHEINFO: struct.pack(
+                 netlink.RTA_CACHEINFO_FMT, 0, 0, expires, 0, 0, 0, 0, 0)}
+    if dst:
+        attrs[netlink.RTA_DST] = socket.inet_pton(family, dst)
+    if gateway:
+        attrs[netlink.RTA_GATEWAY] = socket.inet_pton(family, gateway)
+    if metric is not None:
+        attrs[netlink.RTA_PRIORITY] = struct.pack('I', metric)
+    return netlink.NetlinkMessage(None, struct.pack(
+        netlink.RTMSG_FMT, family, dst_len, 0, 0, min(table, 255), 0, 0,
+        rtm_type, 0), attrs)
+
+
+UP = 0x1 | 0x10000
+V4 = socket.AF_INET
+V6 = socket.AF_INET6
+GW6 = 'fe80::32ee:54de:cd43:b4e1'
+
+# Netlink dump equivalents of sample-ipaddrshow-output and the samples of
+# ip route output
+NETLINK_DUMPS = {
+    netlink.RTM_GETLINK: [
+        _link_msg(1, 'lo', UP, 772, '00:00:00:00:00:00'),
+        _link_msg(2, 'enp0s25', UP, 1, '50:7b:9d:2c:af:91'),
+        _link_msg(3, 'wlp3s0', 0x1, 1, '50:7b:9d:2c:af:92')],
+    netlink.RTM_GETADDR: [
+        _addr_msg(1, V4, '127.0.0.1', 8, 254),
+        _addr_msg(2, V4, '192.168.2.18', 24, 0, '192.168.2.255'),
+        _addr_msg(1, V6, '::1', 128, 254),
+        _addr_msg(2, V6, 'fe80::7777:2222:1111:eeee', 64, 0),
+        _addr_msg(2, V6, 'fe80::8107:2b92:867e:f8a6', 64, 253)],
+    netlink.RTM_GETROUTE: [
+        _route_msg(V4, None, 0, 2, '192.168.2.1', 100),
+        _route_msg(V4, None, 0, 3, '192.168.2.1', 150),
+        _route_msg(V4, '192.168.2.0', 24, 2, metric=100),
+        _route_msg(V4, '192.168.2.18', 32, 2, table=255, rtm_type=2),
+        _route_msg(V6, '2a00:abcd:82ae:cd33::657', 128, 2, metric=256,
+                   expires=2334),
+        _route_msg(V6, '2a00:abcd:82ae:cd33::', 64, 2, metric=100),
+        _route_msg(V6, '2a00:abcd:82ae:cd33::', 56, 2, GW6, 100),
+        _route_msg(V6, 'fd81:123f:654::657', 128, 2, metric=256),
+        _route_msg(V6, 'fd81:123f:654::', 64, 2, metric=100),
+        _route_msg(V6, 'fd81:123f:654::', 48, 2, GW6, 100),
+        _route_msg(V6, 'fe80::abcd:ef12:bc34:da21', 128, 2, metric=100),
+        _route_msg(V6, 'fe80::', 64, 2, metric=256),
+        _route_msg(V6, None, 0, 2, GW6, 100),
+        _route_msg(V6, '::1', 128, 1, metric=0, table=255, rtm_type=2)],
+}
+
+
+@mock.patch('cloudinit.netinfo.util.is_Linux', return_value=True)
+@mock.patch('cloudinit.netinfo.subp.subp')
+@mock.patch('cloudinit.netinfo.netlink.dump_netlink_messages')
+class TestNetInfoNetlink(CiTestCase):
+
+    maxDiff = None
+
+    def test_netdev_pformat_matches_iproute(self, m_dump, m_subp, _m_linux):
+        """Netlink devices render as the output of 'ip addr show' does."""
+        m_dump.side_effect = lambda msg_type, _request: NETLINK_DUMPS[
+            msg_type]
+        m_subp.return_value = (SAMPLE_IPADDRSHOW_OUT, '')
+        with mock.patch('cloudinit.netinfo.subp.which', return_value='ip'):
+            with mock.patch('cloudinit.netinfo._try_netlink',
+                            return_value=None):
+                expected = netdev_info()
+        devs = netdev_info()
+        self.assertEqual(1, m_subp.call_count)
+        self.assertEqual(
+            {'ipv4': [], 'ipv6': [], 'hwaddr': '50:7b:9d:2c:af:92',
+             'up': False},
+            devs.pop('wlp3s0'))
+        self.assertEqual(expected, devs)
+
+    def test_route_pformat_matches_iproute(self, m_dump, m_subp, _m_linux):
+        """Netlink unicast routes render as the output of 'ip route' does."""
+        m_dump.side_effect = lambda msg_type, _request: NETLINK_DUMPS[
+            msg_type]
+        self.assertEqual(ROUTE_FORMATTED_OUT, route_pformat())
+        self.assertEqual(
+            {'destination': '0.0.0.0', 'flags': 'UG', 'gateway':
+             '192.168.2.1', 'genmask': '0.0.0.0', 'iface': 'enp0s25',
+             'metric': '100'},
+            route_info()['ipv4'][0])
+        m_subp.assert_not_called()
+
+    def test_host_route_flags(self, m_dump, m_subp, _m_linux):
+        """IPv4 host routes are flagged as such and keep their gateway."""
+        dumps = {
+            netlink.RTM_GETLINK: [_link_msg(2, 'eth0', UP)],
+            netlink.RTM_GETROUTE: [
+                _route_msg(V4, '169.254.169.254', 32, 2, '10.0.0.1')]}
+        m_dump.side_effect = lambda msg_type, _request: dumps[msg_type]
+        self.assertEqual(
+            {'ipv4': [{'destination': '169.254.169.254', 'flags': 'UGH',
+                       'gateway': '10.0.0.1', 'genmask': '255.255.255.255',
+                       'iface': 'eth0', 'metric': ''}],
+             'ipv6': []},
+            route_info())
+
+    @mock.patch('cloudinit.netinfo.subp.which')
+    def test_falls_back_to_commands(self, m_which, m_dump, m_subp, _m_linux):
+        """The ip command is used when netlink dumps fail."""
+        m_dump.side_effect = netlink.NetlinkDumpError('Operation not allowed')
+        m_which.side_effect = lambda x: x if x == 'ip' else None
+        m_subp.return_value = (SAMPLE_IPADDRSHOW_OUT, '')
+        self.assertIn('enp0s25', netdev_info())
+        m_subp.assert_called_once_with(['ip', 'addr', 'show'])
+
+    @mock.patch('cloudinit.netinfo.subp.which', return_value=None)
+    def test_netlink_not_used_off_linux(
+            self, _m_which, m_dump, m_subp, m_linux):
+        """Netlink is only used on Linux."""
+        m_linux.return_value = False
+        self.assertEqual({}, netdev_info())
+        m_dump.assert_not_called()
+
 # vi: ts=4 expandtab
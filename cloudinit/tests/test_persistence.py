@@ -25,11 +25,18 @@ simple metaclass, ``_Collector``, to gather them up.
 """
 
 import pickle
+import struct
 from unittest import mock
 
 import pytest
 
-from cloudinit.persistence import CloudInitPickleMixin
+from cloudinit.persistence import (
+    CACHE_MAGIC,
+    CacheFormatError,
+    CloudInitCacheMixin,
+    CloudInitPickleMixin,
+    load_cache,
+)
 
 
 class _Collector(type):
@@ -125,3 +132,76 @@ class TestPickleMixin:
         part of the pickle load.
         """
         pickle.loads(pickle.dumps(cls()))
+
+
+class CachedThing(CloudInitCacheMixin):
+    """Top-level class restored by the CloudInitCacheMixin tests."""
+
+    _ci_pkl_version = 3
+    _cache_excluded_attrs = ('helper',)
+    _cache_lazy_attrs = ('big',)
+
+    def __init__(self):
+        self.helper = object()
+        self.small = {'instance-id': 'i-1', 'list': [1, 2.5, None, True]}
+        self.raw = b'\x00binary'
+        self.tupled = ('a', 1)
+        self.big = 'x' * 1024
+
+    def _unpickle(self, ci_pkl_version: int) -> None:
+        self.unpickled_version = ci_pkl_version
+
+
+class TestCacheMixin:
+    def test_round_trip_preserves_values_and_types(self):
+        """Values round-trip with their types; excluded attrs are supplied."""
+        helper = object()
+        thing = load_cache(CachedThing().to_cache(), helper=helper)
+        assert isinstance(thing, CachedThing)
+        assert helper is thing.helper
+        assert {'instance-id': 'i-1', 'list': [1, 2.5, None, True]} == (
+            thing.small)
+        assert b'\x00binary' == thing.raw
+        assert ('a', 1) == thing.tupled
+        assert 'x' * 1024 == thing.big
+        assert 3 == thing.unpickled_version
+
+    def test_lazy_attrs_are_decoded_on_first_access(self):
+        """Lazy attributes are not decoded until accessed."""
+        thing = load_cache(CachedThing().to_cache(), helper=None)
+        assert 'big' not in thing.__dict__
+        assert thing._has_state('big')
+        assert 'i-1' == thing.small['instance-id']
+        assert 'big' not in thing.__dict__
+        assert 'x' * 1024 == thing.big
+        assert 'big' in thing.__dict__
+
+    def test_missing_attr_raises_attribute_error(self):
+        thing = load_cache(CachedThing().to_cache(), helper=None)
+        assert not hasattr(thing, 'nonexistent')
+
+    def test_restored_object_can_be_pickled_and_recached(self):
+        """Pending lazy attributes are included in pickles and caches."""
+        thing = load_cache(CachedThing().to_cache(), helper=None)
+        assert 'x' * 1024 == pickle.loads(pickle.dumps(thing)).big
+        thing = load_cache(CachedThing().to_cache(), helper=None)
+        assert 'x' * 1024 == load_cache(thing.to_cache(), helper=None).big
+
+    def test_excluded_attrs_are_not_stored(self):
+        blob = CachedThing().to_cache()
+        thing = load_cache(blob)
+        assert 'helper' not in thing.__dict__
+
+    @pytest.mark.parametrize('blob', (
+        b'', b'garbage', pickle.dumps({'a': 1}),
+        CACHE_MAGIC + struct.pack('>HI', 999, 0),
+    ))
+    def test_unreadable_blobs_raise_cache_format_error(self, blob):
+        with pytest.raises(CacheFormatError):
+            load_cache(blob)
+
+    def test_unexpected_class_raises_cache_format_error(self):
+        """The cached class must subclass the requested base class."""
+        with pytest.raises(CacheFormatError, match='is not a'):
+            load_cache(
+                CachedThing().to_cache(), base_cls=UnpickleCanBeUnoverriden)
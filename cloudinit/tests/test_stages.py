@@ -4,9 +4,12 @@
 
 import os
 import stat
+import threading
+import types
 
 import pytest
 
+from cloudinit import config
 from cloudinit import stages
 from cloudinit import sources
 from cloudinit.sources import NetworkConfigSource
@@ -344,6 +347,190 @@ class TestInit(CiTestCase):
         self.init.distro.apply_network_config.assert_called_with(
             net_cfg, bring_up=True)
 
+    def test_write_to_cache_writes_obj_cache_and_removes_obj_pkl(self):
+        """_write_to_cache writes obj.cache and removes any stale obj.pkl."""
+        obj_pkl = self.init.paths.get_ipath_cur('obj_pkl')
+        write_file(obj_pkl, b'stale', omode='wb')
+        self.init.datasource.userdata_raw = b'#cloud-config\n'
+        self.assertTrue(self.init._write_to_cache())
+        self.assertFalse(os.path.exists(obj_pkl))
+        self.assertTrue(
+            os.path.exists(self.init.paths.get_ipath_cur('obj_cache')))
+        ds = self.init._restore_from_cache()
+        self.assertIsInstance(ds, FakeDataSource)
+        self.assertEqual(TEST_INSTANCE_ID, ds.get_instance_id())
+        self.assertIs(self.init.paths, ds.paths)
+        self.assertNotIn('userdata_raw', ds.__dict__)
+        self.assertEqual(b'#cloud-config\n', ds.get_userdata_raw())
+
+    def test_restore_from_cache_falls_back_to_obj_pkl(self):
+        """Caches written by previous cloud-init versions are still read."""
+        self.assertTrue(stages._pkl_store(
+            self.init.datasource, self.init.paths.get_ipath_cur('obj_pkl')))
+        ds = self.init._restore_from_cache()
+        self.assertIsInstance(ds, FakeDataSource)
+        self.assertEqual(TEST_INSTANCE_ID, ds.get_instance_id())
+
+    def test_restore_from_cache_ignores_unreadable_obj_cache(self):
+        """An obj.cache in an unknown format is a cache miss."""
+        write_file(
+            self.init.paths.get_ipath_cur('obj_cache'), b'garbage', omode='wb')
+        self.assertIsNone(self.init._restore_from_cache())
+        self.assertIn('Ignoring datasource cache', self.logs.getvalue())
+
+
+def _fake_module(name, handle, resources_read=None, resources_written=None):
+    """Return a fixed up config module named name which calls handle."""
+    mod = types.ModuleType('cc_' + name)
+    mod.handle = handle
+    mod.frequency = 'always'
+    if resources_read is not None:
+        mod.resources_read = resources_read
+    if resources_written is not None:
+        mod.resources_written = resources_written
+    return config.fixup_module(mod)
+
+
+class TestModules(CiTestCase):
+    with_logs = True
+    allowed_subp = False
+
+    def setUp(self):
+        super(TestModules, self).setUp()
+        self.tmpdir = self.tmp_dir()
+        self.init = stages.Init()
+        self.init._cfg = {'system_info': {
+            'distro': 'ubuntu', 'paths': {'cloud_dir': self.tmpdir,
+                                          'run_dir': self.tmpdir}}}
+        self.init.datasource = FakeDataSource(paths=self.init.paths)
+        self.events = []
+
+    def _recorder(self, name, wait_for=None):
+        """Return a handle recording start and end, waiting on an event."""
+        def handle(*_args):
+            self.events.append('start-' + name)
+            if wait_for:
+                self.events.append(
+                    '%s-saw-%s' % (name, wait_for.wait(timeout=2)))
+            self.events.append('end-' + name)
+        return handle
+
+    def _run(self, mods, serial=False):
+        modules = stages.Modules(self.init, serial=serial)
+        return modules._run_modules(
+            [[mod, name, None, []] for (name, mod) in mods])
+
+    def test_non_conflicting_modules_run_concurrently(self):
+        """Modules writing disjoint resources overlap in time."""
+        started_b = threading.Event()
+
+        def handle_b(*_args):
+            started_b.set()
+        mods = [
+            ('a', _fake_module('a', self._recorder('a', started_b),
+                               resources_written=['x'])),
+            ('b', _fake_module('b', handle_b, resources_written=['y']))]
+        which_ran, failures = self._run(mods)
+        self.assertEqual(['a', 'b'], which_ran)
+        self.assertEqual([], failures)
+        self.assertIn('a-saw-True', self.events)
+
+    def test_serial_runs_modules_in_order(self):
+        """serial=True runs one module at a time in configured order."""
+        started_b = threading.Event()
+
+        def handle_b(*_args):
+            started_b.set()
+            self.events.append('b')
+        mods = [
+            ('a', _fake_module('a', self._recorder('a', started_b),
+                               resources_written=['x'])),
+            ('b', _fake_module('b', handle_b, resources_written=['y']))]
+        with mock.patch.object(started_b, 'wait', return_value=False):
+            which_ran, _failures = self._run(mods, serial=True)
+        self.assertEqual(['a', 'b'], which_ran)
+        self.assertEqual(
+            ['start-a', 'a-saw-False', 'end-a', 'b'], self.events)
+
+    def test_conflicting_modules_keep_configured_order(self):
+        """A module reading a resource waits for earlier writers of it."""
+        mods = [
+            ('a', _fake_module('a', self._recorder('a'),
+                               resources_written=['x'])),
+            ('b', _fake_module('b', self._recorder('b'),
+                               resources_read=['x'], resources_written=[]))]
+        self._run(mods)
+        self.assertEqual(['start-a', 'end-a', 'start-b', 'end-b'],
+                         self.events)
+
+    def test_undeclared_modules_run_alone(self):
+        """Modules without resources_written never overlap another module."""
+        mods = [
+            ('a', _fake_module('a', self._recorder('a'),
+                               resources_written=['x'])),
+            ('b', _fake_module('b', self._recorder('b'))),
+            ('c', _fake_module('c', self._recorder('c'),
+                               resources_written=['y']))]
+        self._run(mods)
+        self.assertEqual(
+            ['start-a', 'end-a', 'start-b', 'end-b', 'start-c', 'end-c'],
+            self.events)
+
+    def test_failures_are_collected_in_configured_order(self):
+        """Failures of concurrent modules are reported in config order."""
+        def fail(*_args):
+            raise RuntimeError('boom')
+        mods = [
+            ('a', _fake_module('a', fail, resources_written=['x'])),
+            ('b', _fake_module('b', self._recorder('b'),
+                               resources_written=['y'])),
+            ('c', _fake_module('c', fail, resources_written=['z']))]
+        which_ran, failures = self._run(mods)
+        self.assertEqual(['a', 'b', 'c'], which_ran)
+        self.assertEqual(['a', 'c'], [name for (name, _e) in failures])
+        self.assertIn('Running module a', self.logs.getvalue())
+
+    def test_indexed_modules_imported_from_index(self):
+        """Modules in the module index are imported from their entry."""
+        index = {'modules': {'cc_ntp': {
+            'module': 'cloudinit.config.cc_ntp', 'frequency': 'once',
+            'distros': []}}}
+        modules = stages.Modules(self.init)
+        with mock.patch('cloudinit.importer._MODULE_INDEX', index):
+            with mock.patch('cloudinit.importer.find_module',
+                            return_value=([], [])) as m_find:
+                mostly_mods = modules._fixup_modules(
+                    [{'mod': 'ntp'}, {'mod': 'runcmd'}])
+        self.assertEqual(['cloudinit.config.cc_ntp'],
+                         [mod.__name__ for mod, *_rest in mostly_mods])
+        m_find.assert_called_once_with(
+            'cc_runcmd', ['', 'cloudinit.config'], ['handle'])
+
+
+@pytest.mark.parametrize('read_a,written_a,read_b,written_b,conflict', (
+    ([], None, [], ['x'], True),
+    ([], ['x'], [], ['x'], True),
+    ([], ['x'], ['x'], [], True),
+    (['x'], [], [], ['x'], True),
+    (['x'], [], ['x'], [], False),
+    ([], ['x'], [], ['y'], False),
+    ([], [], [], [], False),
+))
+def test_modules_conflict(read_a, written_a, read_b, written_b, conflict):
+    a = _fake_module('a', None, read_a, written_a)
+    b = _fake_module('b', None, read_b, written_b)
+    assert conflict is config.modules_conflict(a, b)
+    assert conflict is config.modules_conflict(b, a)
+
+
+def test_modules_writing_to_console_conflict():
+    """Modules printing to the console do not interleave their output."""
+    from cloudinit.config import (
+        cc_keys_to_console, cc_set_passwords, cc_ssh_authkey_fingerprints)
+    assert config.modules_conflict(
+        cc_keys_to_console, cc_ssh_authkey_fingerprints)
+    assert config.modules_conflict(cc_set_passwords, cc_keys_to_console)
+
 
 class TestInit_InitializeFilesystem:
     """Tests for cloudinit.stages.Init._initialize_filesystem.
@@ -1,8 +1,13 @@
 # This file is part of cloud-init. See LICENSE file for license information.
 
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
 from cloudinit.url_helper import (
-    NOT_FOUND, UrlError, REDACTED, oauth_headers, read_file_or_url,
-    retry_on_url_exc)
+    NOT_FOUND, UrlError, REDACTED, ConnectionPool, StringResponse,
+    get_connection_pool, oauth_headers, read_file_or_url, readurl,
+    retry_on_url_exc, wait_for_url)
 from cloudinit.tests.helpers import CiTestCase, mock, skipIf
 from cloudinit import util
 from cloudinit import version
@@ -153,6 +158,177 @@ class TestReadFileOrUrl(CiTestCase):
         self.assertEqual(m_response, response._response)
 
 
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = self.path.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Set-Cookie', 'session=%s' % self.path[1:])
+        self.send_header('X-Cookie', self.headers.get('Cookie', ''))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestConnectionPool(CiTestCase):
+
+    def setUp(self):
+        super(TestConnectionPool, self).setUp()
+        self.server = HTTPServer(('127.0.0.1', 0), _KeepAliveHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.pool = get_connection_pool()
+        self.addCleanup(self.pool.reset_stats)
+        self.addCleanup(self.pool.close)
+        self.pool.close()
+        self.pool.reset_stats()
+
+    def test_readurl_reuses_connections_across_calls(self):
+        """Sequential readurl calls to one host share a connection."""
+        for path in ('/one', '/two', '/three'):
+            self.assertEqual(
+                path.encode(), readurl(self.url + path).contents)
+        host_stats = {'requests': 3, 'connections': 1}
+        self.assertEqual(
+            {'requests': 3, 'connections': 1,
+             'hosts': {self.url: host_stats}},
+            self.pool.stats())
+
+    def test_close_drops_connections_but_keeps_stats(self):
+        """close() forces new connections; counters are preserved."""
+        readurl(self.url + '/one')
+        self.pool.close()
+        readurl(self.url + '/two')
+        stats = self.pool.stats()
+        self.assertEqual(2, stats['requests'])
+        self.assertEqual(2, stats['connections'])
+        self.pool.reset_stats()
+        self.assertEqual(
+            {'requests': 0, 'connections': 0, 'hosts': {}},
+            self.pool.stats())
+
+    def test_cookies_are_not_persisted(self):
+        """Pooled sessions do not replay cookies set by earlier responses."""
+        readurl(self.url + '/one')
+        response = readurl(self.url + '/two')
+        self.assertEqual('', response.headers['X-Cookie'])
+
+    def test_explicit_session_bypasses_pool(self):
+        """A session passed to readurl is used instead of the pool."""
+        session = requests.Session()
+        readurl(self.url + '/one', session=session)
+        self.assertEqual(0, self.pool.stats()['requests'])
+
+    def test_disabled_pool_uses_a_session_per_call(self):
+        """When the pool is disabled, readurl does not touch it."""
+        self.pool.enabled = False
+        self.addCleanup(setattr, self.pool, 'enabled', True)
+        readurl(self.url + '/one')
+        readurl(self.url + '/two')
+        self.assertEqual(0, self.pool.stats()['requests'])
+
+    def test_session_for_is_keyed_by_scheme_and_host(self):
+        """Each scheme://host gets its own session."""
+        pool = ConnectionPool()
+        self.addCleanup(pool.close)
+        session = pool.session_for('http://169.254.169.254/latest/')
+        self.assertIs(
+            session, pool.session_for('http://169.254.169.254/other'))
+        self.assertIsNot(
+            session, pool.session_for('https://169.254.169.254/latest/'))
+        self.assertIsNot(
+            session, pool.session_for('http://169.254.169.253/latest/'))
+
+
+class TestWaitForUrlRace(CiTestCase):
+
+    def _readurl(self, delays, failures=()):
+        """Return a fake readurl answering each url after delays[url]."""
+        def fake_readurl(url, *args, **kwargs):
+            time.sleep(delays[url])
+            if url in failures:
+                raise UrlError(IOError('no route'), url=url)
+            return StringResponse(url.encode())
+        return fake_readurl
+
+    @mock.patch(M_PATH + 'readurl')
+    def test_race_returns_first_successful_url(self, m_readurl):
+        """The fastest url wins without waiting on slower candidates."""
+        m_readurl.side_effect = self._readurl(
+            {'http://slow': 2, 'http://fast': 0})
+        start = time.time()
+        url, contents = wait_for_url(
+            ['http://slow', 'http://fast'], max_wait=5, timeout=5, race=True)
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual('http://fast', url)
+        self.assertEqual(b'http://fast', contents)
+
+    @mock.patch(M_PATH + 'readurl')
+    def test_race_reports_failures_through_callbacks(self, m_readurl):
+        """Failed candidates are passed to status_cb and exception_cb."""
+        m_readurl.side_effect = self._readurl(
+            {'http://bad': 0, 'http://good': 0.2}, failures=['http://bad'])
+        status_cb = mock.Mock()
+        exception_cb = mock.Mock()
+        headers_cb = mock.Mock(return_value={'key': 'value'})
+        url, _contents = wait_for_url(
+            ['http://bad', 'http://good'], max_wait=5, timeout=5, race=True,
+            status_cb=status_cb, exception_cb=exception_cb,
+            headers_cb=headers_cb)
+        self.assertEqual('http://good', url)
+        self.assertEqual(
+            [mock.call('http://bad'), mock.call('http://good')],
+            headers_cb.call_args_list)
+        self.assertEqual(1, status_cb.call_count)
+        self.assertIn("Calling 'http://bad' failed", status_cb.call_args[0][0])
+        self.assertEqual(
+            'http://bad', exception_cb.call_args[1]['exception'].url)
+
+    @mock.patch(M_PATH + 'readurl')
+    def test_race_honors_max_wait(self, m_readurl):
+        """Racing gives up once max_wait expires, even mid request."""
+        m_readurl.side_effect = self._readurl(
+            {'http://one': 0.1, 'http://two': 3}, failures=['http://one'])
+        start = time.time()
+        self.assertEqual(
+            (False, None),
+            wait_for_url(['http://one', 'http://two'], max_wait=0.5,
+                         timeout=3, race=True))
+        self.assertLess(time.time() - start, 2)
+
+    @mock.patch(M_PATH + 'time.sleep')
+    @mock.patch(M_PATH + 'readurl')
+    def test_race_retries_with_sleep_time_cb(self, m_readurl, m_sleep):
+        """A failed round sleeps per sleep_time_cb and races again."""
+        responses = iter([UrlError(IOError('down'), url='http://one'),
+                          StringResponse(b'up')])
+
+        def fake_readurl(url, *args, **kwargs):
+            response = next(responses)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        m_readurl.side_effect = fake_readurl
+        sleep_time_cb = mock.Mock(return_value=7)
+        self.assertEqual(
+            ('http://one', b'up'),
+            wait_for_url(['http://one'], max_wait=None, timeout=1,
+                         race=True, sleep_time_cb=sleep_time_cb))
+        self.assertEqual(
+            [mock.call(None, 0), mock.call(None, 1)],
+            sleep_time_cb.call_args_list)
+        m_sleep.assert_called_once_with(7)
+
+
 class TestRetryOnUrlExc(CiTestCase):
 
     def test_do_not_retry_non_urlerror(self):
@@ -9,9 +9,11 @@ import platform
 import pytest
 
 import cloudinit.util as util
+from cloudinit import fsimage
 from cloudinit import subp
 
-from cloudinit.tests.helpers import CiTestCase, mock
+from cloudinit.tests.helpers import (
+    CiTestCase, make_fat_image, make_iso9660_image, mock)
 from textwrap import dedent
 
 LOG = logging.getLogger(__name__)
@@ -315,16 +317,42 @@ class TestBlkid(CiTestCase):
     }
 
     blkid_out = dedent("""\
-        /dev/loop0: TYPE="squashfs"
-        /dev/loop1: TYPE="squashfs"
-        /dev/loop2: TYPE="squashfs"
-        /dev/loop3: TYPE="squashfs"
-        /dev/sda1: UUID="{id01}" TYPE="vfat" PARTUUID="{id02}"
-        /dev/sda2: UUID="{id03}" TYPE="ext4" PARTUUID="{id04}"
-        /dev/sda3: UUID="{id05}" TYPE="ext4" PARTUUID="{id06}"
-        /dev/sda4: LABEL="default" UUID="{id07}" UUID_SUB="{id08}" """
-                       """TYPE="zfs_member" PARTUUID="{id09}"
-        /dev/loop4: TYPE="squashfs"
+        DEVNAME=/dev/loop0
+        TYPE=squashfs
+
+        DEVNAME=/dev/loop1
+        TYPE=squashfs
+
+        DEVNAME=/dev/loop2
+        TYPE=squashfs
+
+        DEVNAME=/dev/loop3
+        TYPE=squashfs
+
+        DEVNAME=/dev/sda1
+        UUID={id01}
+        TYPE=vfat
+        PARTUUID={id02}
+
+        DEVNAME=/dev/sda2
+        UUID={id03}
+        TYPE=ext4
+        PARTUUID={id04}
+
+        DEVNAME=/dev/sda3
+        UUID={id05}
+        TYPE=ext4
+        PARTUUID={id06}
+
+        DEVNAME=/dev/sda4
+        LABEL=default
+        UUID={id07}
+        UUID_SUB={id08}
+        TYPE=zfs_member
+        PARTUUID={id09}
+
+        DEVNAME=/dev/loop4
+        TYPE=squashfs
       """)
 
     maxDiff = None
@@ -357,18 +385,70 @@ class TestBlkid(CiTestCase):
         m_subp.return_value = (
             self.blkid_out.format(**self.ids), "")
         self.assertEqual(self._get_expected(), util.blkid())
-        m_subp.assert_called_with(["blkid", "-o", "full"], capture=True,
-                                  decode="replace")
+        m_subp.assert_called_with(
+            ["blkid", "-c", "/dev/null", "-o", "export"], rcs=[0, 2],
+            decode="replace")
 
     @mock.patch("cloudinit.subp.subp")
     def test_blkid_no_cache_uses_no_cache(self, m_subp):
-        """blkid should turn off cache if disable_cache is true."""
+        """blkid should probe devices again if disable_cache is true."""
         m_subp.return_value = (
             self.blkid_out.format(**self.ids), "")
+        self.assertEqual(self._get_expected(), util.blkid())
         self.assertEqual(self._get_expected(),
                          util.blkid(disable_cache=True))
-        m_subp.assert_called_with(["blkid", "-o", "full", "-c", "/dev/null"],
-                                  capture=True, decode="replace")
+        self.assertEqual(2, m_subp.call_count)
+        m_subp.assert_called_with(
+            ["blkid", "-c", "/dev/null", "-o", "export"], rcs=[0, 2],
+            decode="replace")
+
+    @mock.patch("cloudinit.subp.subp")
+    def test_blkid_devs_from_inventory(self, m_subp):
+        """Devices in the inventory are looked up without running blkid."""
+        m_subp.return_value = (
+            self.blkid_out.format(**self.ids), "")
+        expected = self._get_expected()
+        self.assertEqual(
+            {"/dev/sda1": expected["/dev/sda1"]}, util.blkid(["/dev/sda1"]))
+        self.assertEqual(
+            {"/dev/loop4": expected["/dev/loop4"]},
+            util.blkid(["/dev/loop4"]))
+        self.assertEqual(1, m_subp.call_count)
+
+    @mock.patch("cloudinit.subp.subp")
+    def test_blkid_probes_devs_absent_from_inventory(self, m_subp):
+        """Devices absent from the inventory are probed with blkid."""
+        m_subp.side_effect = [
+            (self.blkid_out.format(**self.ids), ""),
+            ("DEVNAME=/dev/disk/by-label/default\nTYPE=zfs_member\n", "")]
+        self.assertEqual(
+            {"/dev/disk/by-label/default": {
+                "DEVNAME": "/dev/disk/by-label/default",
+                "TYPE": "zfs_member"}},
+            util.blkid(["/dev/disk/by-label/default"]))
+        m_subp.assert_called_with(
+            ["blkid", "-c", "/dev/null", "-o", "export",
+             "/dev/disk/by-label/default"], rcs=[0, 2], decode="replace")
+
+    @mock.patch("cloudinit.subp.subp")
+    def test_blkid_result_does_not_change_inventory(self, m_subp):
+        """Changing the devices returned leaves the inventory unchanged."""
+        m_subp.return_value = (
+            self.blkid_out.format(**self.ids), "")
+        util.blkid()["/dev/sda1"]["TYPE"] = "changed"
+        self.assertEqual(self._get_expected(), util.blkid())
+
+    def test_parse_blkid_export_unescapes_values(self):
+        """Values escaped by blkid are unescaped."""
+        content = dedent("""\
+            DEVNAME=/dev/vdb
+            LABEL=my\\ label\\$1#x
+            TYPE=ext4
+            """)
+        self.assertEqual(
+            {"/dev/vdb": {"DEVNAME": "/dev/vdb", "LABEL": "my label$1#x",
+                          "TYPE": "ext4"}},
+            util.parse_blkid_export(content))
 
 
 @mock.patch('cloudinit.subp.subp')
@@ -392,6 +472,15 @@ class TestUdevadmSettle(CiTestCase):
         util.udevadm_settle(exists=mydev)
         self.assertIsNone(m_subp.call_args)
 
+    def test_invalidates_blkid_inventory(self, m_subp):
+        """Settling forgets the blkid inventory, as devices may change."""
+        m_subp.return_value = ("DEVNAME=/dev/vdb\nTYPE=ext4\n", "")
+        self.assertEqual(["/dev/vdb"], util.find_devs_with("TYPE=ext4"))
+        util.udevadm_settle()
+        m_subp.return_value = ("DEVNAME=/dev/vdb\nTYPE=vfat\n", "")
+        self.assertEqual([], util.find_devs_with("TYPE=ext4"))
+        self.assertEqual(["/dev/vdb"], util.find_devs_with("TYPE=vfat"))
+
     def test_with_timeout_int(self, m_subp):
         """timeout can be an integer."""
         timeout = 9
@@ -840,6 +929,85 @@ class TestMountCb:
             mock.call(mock.ANY, mock.sentinel.data)
         ] == callback.call_args_list
 
+    @pytest.fixture
+    def unmounted_linux(self):
+        """Mock a Linux system with nothing mounted, yield the subp mock"""
+        with mock.patch("cloudinit.util.subp.subp") as m_subp:
+            with mock.patch("cloudinit.util.mounts", return_value={}):
+                with mock.patch("cloudinit.util.is_Linux",
+                                return_value=True):
+                    yield m_subp
+
+    @pytest.mark.parametrize("make_image", [
+        make_iso9660_image, make_fat_image])
+    def test_read_image_calls_callback_without_mounting(
+        self, make_image, tmpdir, unmounted_linux
+    ):
+        device = tmpdir.join("seed.img").strpath
+        make_image(device, {"user-data": "#cloud-config\n"})
+
+        def callback(view, data):
+            assert isinstance(view, fsimage.FilesystemView)
+            return view.read("user-data"), data
+
+        assert ("#cloud-config\n", 1) == util.mount_cb(
+            device, callback, data=1, read_image=True)
+        assert 0 == unmounted_linux.call_count
+
+    def test_read_image_mounts_device_it_cannot_read(
+        self, tmpdir, unmounted_linux
+    ):
+        device = tmpdir.join("ext4.img")
+        device.write(b"\x00" * 65536, mode="wb")
+        callback = mock.Mock()
+
+        util.mount_cb(device.strpath, callback, read_image=True)
+
+        assert ["mount", "-o", "ro", "-t", "auto", device.strpath] == (
+            unmounted_linux.call_args_list[0][0][0][:-1])
+        assert [mock.call(mock.ANY)] == callback.call_args_list
+        assert isinstance(callback.call_args[0][0], str)
+
+    def test_read_image_mounts_device_on_image_errors(
+        self, tmpdir, unmounted_linux
+    ):
+        device = tmpdir.join("seed.iso").strpath
+        make_iso9660_image(device, {"user-data": "#cloud-config\n"})
+        seeds = []
+
+        def callback(seed):
+            seeds.append(seed)
+            if isinstance(seed, fsimage.FilesystemView):
+                raise fsimage.ImageError("seed.iso is truncated")
+            return seed
+
+        mountpoint = util.mount_cb(device, callback, read_image=True)
+        assert isinstance(seeds[0], fsimage.FilesystemView)
+        assert [seeds[0], mountpoint] == seeds
+        assert "mount" == unmounted_linux.call_args_list[0][0][0][0]
+
+    def test_read_image_does_not_hide_callback_errors(
+        self, tmpdir, unmounted_linux
+    ):
+        device = tmpdir.join("seed.iso").strpath
+        make_iso9660_image(device, {"user-data": "#cloud-config\n"})
+        callback = mock.Mock(side_effect=util.MountFailedError("no seed"))
+
+        with pytest.raises(util.MountFailedError):
+            util.mount_cb(device, callback, read_image=True)
+        assert 0 == unmounted_linux.call_count
+
+    def test_read_image_uses_mountpoint_of_mounted_device(
+        self, already_mounted_device_and_mountdict
+    ):
+        device, mount_dict = already_mounted_device_and_mountdict
+        callback = mock.Mock()
+        with mock.patch("cloudinit.util.fsimage.open_image") as m_open:
+            util.mount_cb(device, callback, read_image=True)
+        assert 0 == m_open.call_count
+        assert [mock.call(mount_dict["mountpoint"] + "/")] == (
+            callback.call_args_list)
+
 
 @mock.patch("cloudinit.util.write_file")
 class TestEnsureFile:
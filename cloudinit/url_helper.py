@@ -11,8 +11,11 @@
 import copy
 import json
 import os
+import queue
+import threading
 import time
 from email.utils import parsedate
+from http.cookiejar import DefaultCookiePolicy
 from errno import ENOENT
 from functools import partial
 from http.client import NOT_FOUND
@@ -20,6 +23,7 @@ from itertools import count
 from urllib.parse import urlparse, urlunparse, quote
 
 import requests
+from requests import adapters
 from requests import exceptions
 
 from cloudinit import log as logging
@@ -170,6 +174,136 @@ class UrlError(IOError):
         self.url = url
 
 
+# Maximum number of idle keep-alive connections kept open to a single host.
+DEFAULT_POOL_MAXSIZE = 10
+
+
+class _CountingHTTPAdapter(adapters.HTTPAdapter):
+    """HTTPAdapter reporting each request sent and connection opened."""
+
+    def __init__(self, on_request, on_connection, **kwargs):
+        self._on_request = on_request
+        self._on_connection = on_connection
+        super(_CountingHTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(_CountingHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        pool_classes = self.poolmanager.pool_classes_by_scheme
+        self.poolmanager.pool_classes_by_scheme = dict(
+            (scheme, self._counting_pool_class(pool_cls))
+            for (scheme, pool_cls) in pool_classes.items())
+
+    def _counting_pool_class(self, pool_cls):
+        on_connection = self._on_connection
+
+        class CountingPool(pool_cls):
+            def _new_conn(self):
+                on_connection()
+                return super(CountingPool, self)._new_conn()
+
+        return CountingPool
+
+    def send(self, *args, **kwargs):
+        self._on_request()
+        return super(_CountingHTTPAdapter, self).send(*args, **kwargs)
+
+
+class ConnectionPool(object):
+    """Process-wide cache of keep-alive sessions, one per scheme and host.
+
+    readurl, and everything built upon it, requests urls through a session
+    from this pool unless a session is passed explicitly. Connections to a
+    host are therefore reused across calls instead of paying a new TCP (and
+    TLS) handshake for every request.
+
+    Counters of requests sent and connections opened per host are kept
+    across close() so the reuse rate of a whole boot stage can be reported.
+    Cookies are never persisted between requests.
+    """
+
+    def __init__(self, maxsize=DEFAULT_POOL_MAXSIZE):
+        self.maxsize = maxsize
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._stats = {}
+
+    @staticmethod
+    def _host_key(url):
+        parsed = urlparse(url)
+        return '%s://%s' % (parsed.scheme, parsed.netloc)
+
+    def _count(self, host, counter):
+        with self._lock:
+            host_stats = self._stats.setdefault(
+                host, {'requests': 0, 'connections': 0})
+            host_stats[counter] += 1
+
+    def session_for(self, url):
+        """Return the shared requests.Session used to talk to url's host."""
+        host = self._host_key(url)
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is not None:
+                return session
+            session = requests.Session()
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            adapter = _CountingHTTPAdapter(
+                on_request=partial(self._count, host, 'requests'),
+                on_connection=partial(self._count, host, 'connections'),
+                pool_connections=1, pool_maxsize=self.maxsize)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._sessions[host] = session
+            return session
+
+    def stats(self):
+        """Return request and new connection counters.
+
+        @returns: Dict with total 'requests' and 'connections' counts and a
+            'hosts' dict holding the same counters per scheme://host.
+        """
+        with self._lock:
+            hosts = copy.deepcopy(self._stats)
+        return {
+            'requests': sum(h['requests'] for h in hosts.values()),
+            'connections': sum(h['connections'] for h in hosts.values()),
+            'hosts': hosts,
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {}
+
+    def close(self):
+        """Close all pooled sessions and their idle connections.
+
+        The pool remains usable; later requests open new connections.
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions = {}
+        for session in sessions:
+            session.close()
+
+
+_CONNECTION_POOL = ConnectionPool()
+
+
+def get_connection_pool():
+    """Return the process-wide ConnectionPool used by readurl."""
+    return _CONNECTION_POOL
+
+
+def close_connection_pool():
+    """Log connection reuse and close the process-wide ConnectionPool."""
+    stats = _CONNECTION_POOL.stats()
+    if stats['requests']:
+        LOG.debug("Url connection pool made %d requests over %d connections",
+                  stats['requests'], stats['connections'])
+    _CONNECTION_POOL.close()
+
+
 def _get_ssl_args(url, ssl_details):
     ssl_args = {}
     scheme = urlparse(url).scheme
@@ -218,7 +352,9 @@ def readurl(url, data=None, timeout=None, retries=0, sec_between=1,
         as 'allow_redirects'. Default: True.
     :param exception_cb: Optional callable which accepts the params
         msg and exception and returns a boolean True if retries are permitted.
-    :param session: Optional exiting requests.Session instance to reuse.
+    :param session: Optional existing requests.Session instance to reuse.
+        When None, a keep-alive session for the url's host is taken from the
+        process-wide ConnectionPool. See get_connection_pool.
     :param infinite: Bool, set True to retry indefinitely. Default: False.
     :param log_req_resp: Set False to turn off verbose debug messages.
     :param request_method: String passed as 'method' to Session.request.
@@ -296,11 +432,14 @@ def readurl(url, data=None, timeout=None, retries=0, sec_between=1,
                           "infinite" if infinite else manual_tries, url,
                           filtered_req_args)
 
-            if session is None:
-                session = requests.Session()
-
-            with session as sess:
-                r = sess.request(**req_args)
+            if session is not None:
+                with session as sess:
+                    r = sess.request(**req_args)
+            elif _CONNECTION_POOL.enabled:
+                r = _CONNECTION_POOL.session_for(url).request(**req_args)
+            else:
+                with requests.Session() as sess:
+                    r = sess.request(**req_args)
 
             if check_status:
                 r.raise_for_status()
@@ -343,7 +482,8 @@ def readurl(url, data=None, timeout=None, retries=0, sec_between=1,
 
 def wait_for_url(urls, max_wait=None, timeout=None, status_cb=None,
                  headers_cb=None, headers_redact=None, sleep_time=1,
-                 exception_cb=None, sleep_time_cb=None, request_method=None):
+                 exception_cb=None, sleep_time_cb=None, request_method=None,
+                 race=False):
     """
     urls:      a list of urls to try
     max_wait:  roughly the maximum time to wait before giving up
@@ -360,6 +500,10 @@ def wait_for_url(urls, max_wait=None, timeout=None, status_cb=None,
     sleep_time_cb: call method with 2 arguments (response, loop_n) that
                    generates the next sleep time.
     request_method: indicate the type of HTTP request, GET, PUT, or POST
+    race:      request all urls at once on each try instead of one after
+               another. The first url to respond successfully is returned
+               and the responses of the remaining requests are discarded.
+               A positive max_wait is then the true upper bound of the wait.
     returns: tuple of (url, response contents), on failure, (False, None)
 
     the idea of this routine is to wait for the EC2 metadata service to
@@ -392,6 +536,98 @@ def wait_for_url(urls, max_wait=None, timeout=None, status_cb=None,
             return False
         return ((max_wait <= 0) or (time.time() - start_time > max_wait))
 
+    def read_url(url, timeout, headers_cb):
+        """Return a tuple of (response, reason, url_exc) for url."""
+        response = None
+        try:
+            if headers_cb is not None:
+                headers = headers_cb(url)
+            else:
+                headers = {}
+
+            response = readurl(
+                url, headers=headers, headers_redact=headers_redact,
+                timeout=timeout, check_status=False,
+                request_method=request_method)
+            if not response.contents:
+                reason = "empty response [%s]" % (response.code)
+                url_exc = UrlError(ValueError(reason), code=response.code,
+                                   headers=response.headers, url=url)
+            elif not response.ok():
+                reason = "bad status code [%s]" % (response.code)
+                url_exc = UrlError(ValueError(reason), code=response.code,
+                                   headers=response.headers, url=url)
+            else:
+                return response, "", None
+        except UrlError as e:
+            reason = "request error [%s]" % e
+            url_exc = e
+        except Exception as e:
+            reason = "unexpected error [%s]" % e
+            url_exc = e
+        return response, reason, url_exc
+
+    def report_failure(url, reason, url_exc):
+        time_taken = int(time.time() - start_time)
+        max_wait_str = "%ss" % max_wait if max_wait else "unlimited"
+        status_msg = "Calling '%s' failed [%s/%s]: %s" % (url,
+                                                          time_taken,
+                                                          max_wait_str,
+                                                          reason)
+        status_cb(status_msg)
+        if exception_cb:
+            # This can be used to alter the headers that will be sent
+            # in the future, for example this is what the MAAS datasource
+            # does.
+            exception_cb(msg=status_msg, exception=url_exc)
+
+    def race_urls(timeout):
+        """Request all urls concurrently, returning the first success.
+
+        headers_cb, status_cb and exception_cb are only called from this
+        thread. Requests still in flight once a url succeeds, or once
+        max_wait expires, are abandoned to daemon threads and bounded by
+        timeout.
+        """
+        results = queue.Queue()
+        response = None
+        pending = 0
+        for url in urls:
+            try:
+                headers = headers_cb(url) if headers_cb else {}
+            except Exception as e:
+                report_failure(url, "unexpected error [%s]" % e, e)
+                continue
+
+            def request(url=url, headers=headers):
+                results.put(
+                    (url,) + read_url(url, timeout, lambda _url: headers))
+
+            thread = threading.Thread(target=request)
+            thread.daemon = True
+            thread.start()
+            pending += 1
+        for _ in range(pending):
+            wait = None
+            if max_wait is not None and max_wait > 0:
+                wait = max(0, start_time + max_wait - time.time())
+            try:
+                (url, response, reason, url_exc) = results.get(timeout=wait)
+            except queue.Empty:
+                break
+            if url_exc is None:
+                return url, response
+            report_failure(url, reason, url_exc)
+        return None, response
+
+    def shorten_timeout(timeout):
+        now = time.time()
+        if (max_wait is not None and
+                timeout and (now + timeout > (start_time + max_wait))):
+            # shorten timeout to not run way over max_time
+            timeout = int((start_time + max_wait) - now)
+        return timeout
+
     loop_n = 0
     response = None
     while True:
@@ -399,57 +635,30 @@ def wait_for_url(urls, max_wait=None, timeout=None, status_cb=None,
             sleep_time = sleep_time_cb(response, loop_n)
         else:
             sleep_time = int(loop_n / 5) + 1
-        for url in urls:
-            now = time.time()
+        if race:
             if loop_n != 0:
                 if timeup(max_wait, start_time):
                     break
-                if (max_wait is not None and
-                        timeout and (now + timeout > (start_time + max_wait))):
-                    # shorten timeout to not run way over max_time
-                    timeout = int((start_time + max_wait) - now)
-
-            reason = ""
-            url_exc = None
-            try:
-                if headers_cb is not None:
-                    headers = headers_cb(url)
-                else:
-                    headers = {}
-
-                response = readurl(
-                    url, headers=headers, headers_redact=headers_redact,
-                    timeout=timeout, check_status=False,
-                    request_method=request_method)
-                if not response.contents:
-                    reason = "empty response [%s]" % (response.code)
-                    url_exc = UrlError(ValueError(reason), code=response.code,
-                                       headers=response.headers, url=url)
-                elif not response.ok():
-                    reason = "bad status code [%s]" % (response.code)
-                    url_exc = UrlError(ValueError(reason), code=response.code,
-                                       headers=response.headers, url=url)
-                else:
+                timeout = shorten_timeout(timeout)
+            url, url_response = race_urls(timeout)
+            if url_response is not None:
+                response = url_response
+            if url:
+                return url, response.contents
+        else:
+            for url in urls:
+                if loop_n != 0:
+                    if timeup(max_wait, start_time):
+                        break
+                    timeout = shorten_timeout(timeout)
+
+                url_response, reason, url_exc = read_url(
+                    url, timeout, headers_cb)
+                if url_response is not None:
+                    response = url_response
+                if url_exc is None:
                     return url, response.contents
-            except UrlError as e:
-                reason = "request error [%s]" % e
-                url_exc = e
-            except Exception as e:
-                reason = "unexpected error [%s]" % e
-                url_exc = e
-
-            time_taken = int(time.time() - start_time)
-            max_wait_str = "%ss" % max_wait if max_wait else "unlimited"
-            status_msg = "Calling '%s' failed [%s/%s]: %s" % (url,
-                                                              time_taken,
-                                                              max_wait_str,
-                                                              reason)
-            status_cb(status_msg)
-            if exception_cb:
-                # This can be used to alter the headers that will be sent
-                # in the future, for example this is what the MAAS datasource
-                # does.
-                exception_cb(msg=status_msg, exception=url_exc)
+                report_failure(url, reason, url_exc)
 
         if timeup(max_wait, start_time):
             break
@@ -8,12 +8,17 @@
 #
 # This file is part of cloud-init. See LICENSE file for license information.
 
+import hashlib
+import json
 import os
+import time
+from concurrent import futures
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.nonmultipart import MIMENonMultipart
 from email.mime.text import MIMEText
 
+from cloudinit import atomic_helper
 from cloudinit import handlers
 from cloudinit import log as logging
 from cloudinit import features
@@ -53,6 +58,11 @@ DECOMP_TYPES = [
 # Msg header used to track attachments
 ATTACHMENT_FIELD = 'Number-Attachments'
 
+# Urls of an #include fetched at the same time
+INCLUDE_MAX_WORKERS = 8
+# Size of the contents kept in the cache of #include urls
+INCLUDE_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
 # Only the following content types can have there launch index examined
 # in there payload, evey other content type can still provide a header
 EXAMINE_FOR_LAUNCH_INDEX = ["text/cloud-config"]
@@ -76,10 +86,116 @@ def _handle_error(error_message, source_exception=None):
         LOG.warning(error_message)
 
 
+class IncludeCache(object):
+    """Contents of #include urls kept across boots of an instance.
+
+    Contents are stored once in blobs/, named by their sha256 digest, and
+    index.json maps each url to the digest of its contents and the ETag and
+    Last-Modified headers they were served with. Those are sent back to
+    revalidate the contents, so unchanged urls are not downloaded again.
+    The least recently used urls are dropped when the contents stored
+    exceed max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=INCLUDE_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._index_file = os.path.join(cache_dir, 'index.json')
+        self._index = None
+        self._dirty = False
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = {}
+            try:
+                self._index = json.loads(util.load_file(self._index_file))
+            except (IOError, ValueError):
+                pass
+        return self._index
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, 'blobs', digest)
+
+    def request_headers(self, url):
+        """Return the headers revalidating the cached contents of url."""
+        entry = self.index.get(url)
+        if not entry or not os.path.isfile(self._blob_path(entry['sha256'])):
+            return {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last-modified'):
+            headers['If-Modified-Since'] = entry['last-modified']
+        return headers
+
+    def get(self, url):
+        """Return the cached contents of url, or None if not cached."""
+        entry = self.index.get(url)
+        if not entry:
+            return None
+        try:
+            contents = util.load_file(
+                self._blob_path(entry['sha256']), decode=False)
+        except IOError:
+            return None
+        entry['used'] = time.time()
+        self._dirty = True
+        return contents
+
+    def put(self, url, contents, headers):
+        """Cache contents of url if headers allow revalidating them."""
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if not (etag or last_modified) or len(contents) > self.max_bytes:
+            self.index.pop(url, None)
+            return
+        digest = hashlib.sha256(contents).hexdigest()
+        blob_path = self._blob_path(digest)
+        if not os.path.isfile(blob_path):
+            util.write_file(blob_path, contents, mode=0o600)
+        self.index[url] = {'sha256': digest, 'size': len(contents),
+                           'etag': etag, 'last-modified': last_modified,
+                           'used': time.time()}
+        self._dirty = True
+
+    def save(self):
+        """Write the index, dropping contents beyond max_bytes."""
+        if not self._dirty:
+            return
+        total = 0
+        kept = set()
+        by_use = sorted(self.index.items(), key=lambda item: item[1]['used'],
+                        reverse=True)
+        for url, entry in by_use:
+            if entry['sha256'] not in kept:
+                if total + entry['size'] > self.max_bytes:
+                    del self.index[url]
+                    continue
+                total += entry['size']
+                kept.add(entry['sha256'])
+        blobs_dir = os.path.join(self.cache_dir, 'blobs')
+        if os.path.isdir(blobs_dir):
+            for digest in os.listdir(blobs_dir):
+                if digest not in kept:
+                    util.del_file(os.path.join(blobs_dir, digest))
+        atomic_helper.write_json(self._index_file, self.index, mode=0o600)
+        self._dirty = False
+
+
 class UserDataProcessor(object):
     def __init__(self, paths):
         self.paths = paths
         self.ssl_details = util.fetch_ssl_details(paths)
+        self._include_cache = None
+
+    @property
+    def include_cache(self):
+        """The IncludeCache of the instance, None without instance paths."""
+        if self._include_cache is None and self.paths is not None:
+            self._include_cache = IncludeCache(os.path.join(
+                self.paths.get_ipath_cur('data'), 'urlcache'))
+        return self._include_cache
 
     def process(self, blob):
         accumulating_msg = MIMEMultipart()
@@ -204,11 +320,96 @@ class UserDataProcessor(object):
             _set_filename(msg, PART_FN_TPL % (attached_id))
         self._attach_launch_index(msg)
 
+    def _fetch_include(self, include_url, headers):
+        """Return the response fetching include_url, or an error tuple.
+
+        @return: Tuple of the response and None, or of None and the
+            (message, exception) arguments of _handle_error.
+        """
+        try:
+            resp = read_file_or_url(include_url, timeout=5, retries=10,
+                                    headers=headers,
+                                    ssl_details=self.ssl_details)
+        except UrlError as urle:
+            message = str(urle)
+            # Older versions of requests.exceptions.HTTPError may not
+            # include the errant url. Append it for clarity in logs.
+            if include_url not in message:
+                message += ' for url: {0}'.format(include_url)
+            return None, (message, urle)
+        except IOError as ioe:
+            error_message = "Fetching from {} resulted in {}".format(
+                include_url, ioe)
+            return None, (error_message, ioe)
+        return resp, None
+
+    def _fetch_includes(self, includes):
+        """Fetch the contents of includes at the same time.
+
+        @param includes: List of (include_url, include_once_on) tuples.
+        @return: List of (contents, error) tuples, in the order of includes,
+            holding the (message, exception) arguments of _handle_error
+            when an include could not be fetched.
+        """
+        results = [None] * len(includes)
+        cache = self.include_cache
+        pending = []
+        for idx, (include_url, include_once_on) in enumerate(includes):
+            if include_once_on:
+                include_once_fn = self._get_include_once_filename(include_url)
+                if os.path.isfile(include_once_fn):
+                    results[idx] = (util.load_file(include_once_fn), None)
+                    continue
+                headers = None
+            elif cache:
+                headers = cache.request_headers(include_url)
+            else:
+                headers = None
+            pending.append((idx, include_url, headers))
+        if not pending:
+            return results
+        max_workers = min(len(pending), INCLUDE_MAX_WORKERS)
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            fetches = [(idx, include_url, executor.submit(
+                self._fetch_include, include_url, headers))
+                for idx, include_url, headers in pending]
+        for idx, include_url, fetch in fetches:
+            resp, error = fetch.result()
+            if error is not None:
+                results[idx] = (None, error)
+                continue
+            include_once_on = includes[idx][1]
+            if resp.code == 304 and cache:
+                content = cache.get(include_url)
+                if content is not None:
+                    LOG.debug("Using cached contents of unchanged %s",
+                              include_url)
+                    results[idx] = (content, None)
+                    continue
+            if resp.ok():
+                if include_once_on:
+                    util.write_file(
+                        self._get_include_once_filename(include_url),
+                        resp.contents, mode=0o600)
+                elif cache:
+                    cache.put(include_url, resp.contents, resp.headers)
+                results[idx] = (resp.contents, None)
+            else:
+                error_message = (
+                    "Fetching from {} resulted in"
+                    " a invalid http code of {}".format(
+                        include_url, resp.code))
+                results[idx] = (None, (error_message, None))
+        if cache:
+            cache.save()
+        return results
+
     def _do_include(self, content, append_msg):
         # Include a list of urls, one per line
         # also support '#include <url here>'
         # or #include-once '<url here>'
         include_once_on = False
+        includes = []
         for line in content.splitlines():
             lc_line = line.lower()
             if lc_line.startswith("#include-once"):
@@ -227,41 +428,14 @@ class UserDataProcessor(object):
             include_url = line.strip()
             if not include_url:
                 continue
-
-            include_once_fn = None
-            content = None
-            if include_once_on:
-                include_once_fn = self._get_include_once_filename(include_url)
-            if include_once_on and os.path.isfile(include_once_fn):
-                content = util.load_file(include_once_fn)
-            else:
-                try:
-                    resp = read_file_or_url(include_url, timeout=5, retries=10,
-                                            ssl_details=self.ssl_details)
-                    if include_once_on and resp.ok():
-                        util.write_file(include_once_fn, resp.contents,
-                                        mode=0o600)
-                    if resp.ok():
-                        content = resp.contents
-                    else:
-                        error_message = (
-                            "Fetching from {} resulted in"
-                            " a invalid http code of {}".format(
-                                include_url, resp.code))
-                        _handle_error(error_message)
-                except UrlError as urle:
-                    message = str(urle)
-                    # Older versions of requests.exceptions.HTTPError may not
-                    # include the errant url. Append it for clarity in logs.
-                    if include_url not in message:
-                        message += ' for url: {0}'.format(include_url)
-                    _handle_error(message, urle)
-                except IOError as ioe:
-                    error_message = "Fetching from {} resulted in {}".format(
-                        include_url, ioe)
-                    _handle_error(error_message, ioe)
-
-            if content is not None:
+            includes.append((include_url, include_once_on))
+
+        # All urls are fetched before any is processed, but parts are
+        # attached in the order the urls were listed in.
+        for content, error in self._fetch_includes(includes):
+            if error is not None:
+                _handle_error(*error)
+            elif content is not None:
                 new_msg = convert_string(content)
                 self._process_msg(new_msg, append_msg)
 
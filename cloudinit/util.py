@@ -30,6 +30,7 @@ import stat
 import string
 import subprocess
 import sys
+import threading
 import time
 from base64 import b64decode, b64encode
 from errno import ENOENT
@@ -40,6 +41,7 @@ from cloudinit import importer
 from cloudinit import log as logging
 from cloudinit import subp
 from cloudinit import (
+    fsimage,
     mergers,
     safeyaml,
     temp_utils,
@@ -50,6 +52,9 @@ from cloudinit import (
 from cloudinit.settings import CFG_BUILTIN
 
 _DNS_REDIRECT_IP = None
+_BLKID_INVENTORY = None
+_BLKID_LOCK = threading.RLock()
+_BLKID_RUNS = 0
 LOG = logging.getLogger(__name__)
 
 # Helps cleanup filenames to ensure they aren't FS incompatible
@@ -1203,6 +1208,9 @@ def find_devs_with(criteria=None, oformat='device',
       TYPE=<filesystem>
       LABEL=<label>
       UUID=<uuid>
+
+    Device paths are found in the blkid inventory unless a path, tag or an
+    output format other than 'device' is given, which run blkid.
     """
     if is_FreeBSD():
         return find_devs_with_freebsd(criteria, oformat,
@@ -1214,6 +1222,16 @@ def find_devs_with(criteria=None, oformat='device',
         return find_devs_with_openbsd(criteria, oformat,
                                       tag, no_cache, path)
 
+    if _can_use_blkid_inventory(criteria, oformat, tag, path):
+        if no_cache:
+            invalidate_blkid_inventory()
+        devices = blkid_inventory()
+        if not criteria:
+            return list(devices)
+        name, _, value = criteria.partition('=')
+        return [dev for dev, tags in devices.items()
+                if tags.get(name) == value]
+
     blk_id_cmd = ['blkid']
     options = []
     if criteria:
@@ -1240,15 +1258,7 @@ def find_devs_with(criteria=None, oformat='device',
     if path:
         options.append(path)
     cmd = blk_id_cmd + options
-    # See man blkid for why 2 is added
-    try:
-        (out, _err) = subp.subp(cmd, rcs=[0, 2])
-    except subp.ProcessExecutionError as e:
-        if e.errno == ENOENT:
-            # blkid not found...
-            out = ""
-        else:
-            raise
+    out = _run_blkid(cmd)
     entries = []
     for line in out.splitlines():
         line = line.strip()
@@ -1257,35 +1267,112 @@ def find_devs_with(criteria=None, oformat='device',
     return entries
 
 
+def _can_use_blkid_inventory(criteria, oformat, tag, path):
+    """Whether find_devs_with can be answered from the blkid inventory."""
+    if oformat != 'device' or tag or path:
+        return False
+    return not criteria or '=' in criteria
+
+
+def _run_blkid(cmd, **kwargs):
+    """Run a blkid command, counting it, and return its output.
+
+    Exit code 2 (no devices found, see man blkid) and a missing blkid both
+    result in empty output.
+    """
+    global _BLKID_RUNS
+    with _BLKID_LOCK:
+        _BLKID_RUNS += 1
+    try:
+        (out, _err) = subp.subp(cmd, rcs=[0, 2], **kwargs)
+    except subp.ProcessExecutionError as e:
+        if e.errno == ENOENT:
+            # blkid not found...
+            return ""
+        raise
+    return out
+
+
+def blkid_runs():
+    """Return the number of times blkid was run by this process."""
+    return _BLKID_RUNS
+
+
+def blkid_inventory():
+    """Return the tags of every block device, keyed by device path.
+
+    The inventory is built from a single 'blkid -o export' probing every
+    device without using blkid's cache, and then kept in memory until
+    invalidate_blkid_inventory is called. Callers must not modify it.
+    """
+    global _BLKID_INVENTORY
+    with _BLKID_LOCK:
+        if _BLKID_INVENTORY is None:
+            # we have to decode with 'replace' as shlex.split can't take
+            # bytes. So this is potentially lossy of non-utf-8 chars in
+            # blkid output.
+            out = _run_blkid(['blkid', '-c', '/dev/null', '-o', 'export'],
+                             decode="replace")
+            _BLKID_INVENTORY = parse_blkid_export(out)
+            LOG.debug("Found %d block devices with blkid",
+                      len(_BLKID_INVENTORY))
+        return _BLKID_INVENTORY
+
+
+def invalidate_blkid_inventory():
+    """Forget the blkid inventory, once block devices may have changed."""
+    global _BLKID_INVENTORY
+    with _BLKID_LOCK:
+        _BLKID_INVENTORY = None
+
+
+def parse_blkid_export(content):
+    """Parse the output of 'blkid -o export' into a dict of device tags.
+
+    Each device is a block of KEY=value lines, starting with DEVNAME, which
+    are separated by empty lines. Values are escaped as in shell.
+    """
+    devices = {}
+    tags = {}
+    for line in content.splitlines():
+        line = line.strip()
+        if not line:
+            tags = {}
+            continue
+        try:
+            key, _, value = shlex.split(line)[0].partition('=')
+        except (IndexError, ValueError):
+            LOG.debug("Ignoring unparseable blkid output: %s", line)
+            continue
+        tags[key] = value
+        if key == 'DEVNAME':
+            devices[value] = tags
+    return devices
+
+
 def blkid(devs=None, disable_cache=False):
     """Get all device tags details from blkid.
 
+    Devices are looked up in the blkid inventory. Devices absent from it
+    may be aliases of a device, so blkid is run to probe them.
+
     @param devs: Optional list of device paths you wish to query.
     @param disable_cache: Bool, set True to start with clean cache.
 
     @return: Dict of key value pairs of info for the device.
     """
-    if devs is None:
-        devs = []
-    else:
-        devs = list(devs)
-
-    cmd = ['blkid', '-o', 'full']
     if disable_cache:
-        cmd.extend(['-c', '/dev/null'])
-    cmd.extend(devs)
+        invalidate_blkid_inventory()
+    devices = blkid_inventory()
+    if devs is None:
+        return obj_copy.deepcopy(devices)
 
-    # we have to decode with 'replace' as shelx.split (called by
-    # load_shell_content) can't take bytes.  So this is potentially
-    # lossy of non-utf-8 chars in blkid output.
-    out, _ = subp.subp(cmd, capture=True, decode="replace")
-    ret = {}
-    for line in out.splitlines():
-        dev, _, data = line.partition(":")
-        ret[dev] = load_shell_content(data)
-        ret[dev]["DEVNAME"] = dev
-
-    return ret
+    devs = list(devs)
+    if all(dev in devices for dev in devs):
+        return obj_copy.deepcopy(
+            dict((dev, devices[dev]) for dev in devs))
+    cmd = ['blkid', '-c', '/dev/null', '-o', 'export'] + devs
+    return parse_blkid_export(_run_blkid(cmd, decode="replace"))
 
 
 def peek_file(fname, max_bytes):
@@ -1642,7 +1729,7 @@ def mounts():
 
 
 def mount_cb(device, callback, data=None, mtype=None,
-             update_env_for_mount=None):
+             update_env_for_mount=None, read_image=False):
     """
     Mount the device, call method 'callback' passing the directory
     in which it was mounted, then unmount.  Return whatever 'callback'
@@ -1650,6 +1737,11 @@ def mount_cb(device, callback, data=None, mtype=None,
 
     mtype is a filesystem type.  it may be a list, string (a single fsname)
     or a list of fsnames.
+
+    If read_image is True, callback also takes a fsimage.FilesystemView.
+    A device which is not mounted and holds an ISO9660 or FAT filesystem is
+    then read without mounting it, falling back to mounting it if it cannot
+    be read.
     """
 
     if isinstance(mtype, str):
@@ -1680,6 +1772,22 @@ def mount_cb(device, callback, data=None, mtype=None,
         mtypes = ['']
 
     mounted = mounts()
+    if read_image and os.path.realpath(device) not in mounted:
+        try:
+            image = fsimage.open_image(device, mtypes)
+        except (IOError, OSError, fsimage.ImageError) as e:
+            LOG.debug("Mounting %s, it cannot be read as an image: %s",
+                      device, e)
+        else:
+            with image:
+                try:
+                    if data is None:
+                        return callback(image)
+                    return callback(image, data)
+                except fsimage.ImageError as e:
+                    LOG.debug("Mounting %s, failed reading it as an image:"
+                              " %s", device, e)
+
     with temp_utils.tempdir() as tmpd:
         umount = False
         if os.path.realpath(device) in mounted:
@@ -1717,6 +1825,25 @@ def mount_cb(device, callback, data=None, mtype=None,
             return ret
 
 
+def load_seed_file(seed, name, decode=True, quiet=False):
+    """Load file name of seed, a directory or a fsimage.FilesystemView."""
+    if isinstance(seed, fsimage.FilesystemView):
+        try:
+            return seed.read(name, decode=decode)
+        except IOError as e:
+            if not quiet or e.errno != ENOENT:
+                raise
+            return "" if decode else b""
+    return load_file(os.path.join(seed, name), decode=decode, quiet=quiet)
+
+
+def is_seed_file(seed, name):
+    """Whether seed, a directory or a fsimage.FilesystemView, has name."""
+    if isinstance(seed, fsimage.FilesystemView):
+        return seed.isfile(name)
+    return os.path.isfile(os.path.join(seed, name))
+
+
 def get_builtin_cfg():
     # Deep copy so that others can't modify
     return obj_copy.deepcopy(CFG_BUILTIN)
@@ -2378,7 +2505,8 @@ def expand_dotted_devname(dotted):
 
 def pathprefix2dict(base, required=None, optional=None, delim=os.path.sep):
     # return a dictionary populated with keys in 'required' and 'optional'
-    # by reading files in prefix + delim + entry
+    # by reading files in prefix + delim + entry, or the files named entry
+    # of base if it is a fsimage.FilesystemView
     if required is None:
         required = []
     if optional is None:
@@ -2388,7 +2516,11 @@ def pathprefix2dict(base, required=None, optional=None, delim=os.path.sep):
     ret = {}
     for f in required + optional:
         try:
-            ret[f] = load_file(base + delim + f, quiet=False, decode=False)
+            if isinstance(base, fsimage.FilesystemView):
+                ret[f] = base.read(f, decode=False)
+            else:
+                ret[f] = load_file(base + delim + f, quiet=False,
+                                   decode=False)
         except IOError as e:
             if e.errno != ENOENT:
                 raise
@@ -2605,7 +2737,11 @@ def udevadm_settle(exists=None, timeout=None):
     if timeout:
         settle_cmd.extend(['--timeout=%s' % timeout])
 
-    return subp.subp(settle_cmd)
+    try:
+        return subp.subp(settle_cmd)
+    finally:
+        # udev may have added, removed or changed devices
+        invalidate_blkid_inventory()
 
 
 def get_proc_ppid(pid):
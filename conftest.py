@@ -12,7 +12,7 @@ from unittest import mock
 
 import pytest
 
-from cloudinit import helpers, subp
+from cloudinit import helpers, net, subp, url_helper, util
 
 
 class _FixtureUtils:
@@ -157,6 +157,48 @@ def disable_subp_usage(request, fixture_utils):
         yield
 
 
+@pytest.yield_fixture(autouse=True)
+def reset_url_connection_pool():
+    """
+    Across all (pytest) tests, start with an empty url_helper connection pool.
+
+    Sessions cached by the process-wide pool would otherwise leak keep-alive
+    connections (and any mocks patched into them) from one test to the next.
+    """
+    pool = url_helper.get_connection_pool()
+    pool.close()
+    pool.reset_stats()
+    yield pool
+    pool.close()
+    pool.reset_stats()
+
+
+@pytest.yield_fixture(autouse=True)
+def reset_blkid_inventory():
+    """
+    Across all (pytest) tests, start without a blkid inventory.
+
+    The inventory built from the (mocked) blkid output of one test would
+    otherwise answer the block device lookups of the next.
+    """
+    util.invalidate_blkid_inventory()
+    yield
+    util.invalidate_blkid_inventory()
+
+
+@pytest.yield_fixture(autouse=True)
+def reset_net_snapshot():
+    """
+    Across all (pytest) tests, start without a shared net device snapshot.
+
+    The snapshot of the (mocked) sysfs of one test would otherwise answer
+    the interface lookups of the next.
+    """
+    net.invalidate_net_snapshot()
+    yield
+    net.invalidate_net_snapshot()
+
+
 @pytest.fixture(scope="session")
 def fixture_utils():
     """Return a namespace containing fixture utility functions.
@@ -18,6 +18,7 @@ import tempfile
 import platform
 
 import setuptools
+from setuptools.command.build_py import build_py
 from setuptools.command.install import install
 from setuptools.command.egg_info import egg_info
 
@@ -195,6 +196,39 @@ class MyEggInfo(egg_info):
         return ret
 
 
+class MyBuildPy(build_py):
+    """This writes the JSON files generated from the built modules.
+
+    These are the schema of all cloud-config modules, which
+    cloudinit.config.schema.get_schema loads instead of importing every
+    config module, and the index of config modules and datasources which
+    cloudinit.importer.find_indexed_module looks modules up in.
+    """
+
+    generated_files = (
+        (('cloudinit', 'config', 'cloud-config-schema.json'),
+         'from cloudinit.config import schema;'
+         ' schema.write_schema_file(sys.argv[1])'),
+        (('cloudinit', 'module-index.json'),
+         'from cloudinit import importer;'
+         ' importer.write_module_index(sys.argv[1])'),
+    )
+
+    def run(self):
+        build_py.run(self)
+        if self.dry_run:
+            return
+        env = dict(os.environ, PYTHONPATH=self.build_lib)
+        for path, writer in self.generated_files:
+            target = os.path.join(self.build_lib, *path)
+            cmd = [sys.executable, '-c', 'import sys; ' + writer, target]
+            try:
+                subprocess.check_call(cmd, env=env)
+            except subprocess.CalledProcessError as e:
+                # cloud-init imports the modules when the file is missing
+                self.warn('Not writing %s: %s' % (target, e))
+
+
 # TODO: Is there a better way to do this??
 class InitsysInstallData(install):
     init_system = None
@@ -269,6 +303,7 @@ if not platform.system().endswith('BSD'):
 # Use a subclass for install that handles
 # adding on the right init system configuration files
 cmdclass = {
+    'build_py': MyBuildPy,
     'install': InitsysInstallData,
     'egg_info': MyEggInfo,
 }
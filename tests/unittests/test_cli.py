@@ -87,11 +87,13 @@ class TestCLI(test_helpers.FilesystemMockingTestCase):
             return 'SomeDatasource', ['an error']
 
         myargs = FakeArgs(('ignored_name', myaction), True, 'bogusmode')
-        cli.status_wrapper('init', myargs, data_d, link_d)
+        with mock.patch('cloudinit.cmd.main.util.blkid_runs', return_value=3):
+            cli.status_wrapper('init', myargs, data_d, link_d)
         # No errors reported in status
         status_v1 = load_json(load_file(status_link))['v1']
         self.assertEqual(['an error'], status_v1['init-local']['errors'])
         self.assertEqual('SomeDatasource', status_v1['datasource'])
+        self.assertEqual(3, status_v1['init-local']['blkid_runs'])
         self.assertFalse(
             os.path.exists(self.tmp_path('result.json', data_d)),
             'unexpected result.json found')
@@ -135,6 +137,16 @@ class TestCLI(test_helpers.FilesystemMockingTestCase):
         self.assertEqual('init', parseargs.action[0])
         self.assertEqual('main_init', parseargs.action[1].__name__)
 
+    @mock.patch('cloudinit.cmd.main.url_helper.close_connection_pool')
+    @mock.patch('cloudinit.cmd.main.status_wrapper')
+    def test_connection_pool_closed_when_subcommand_fails(
+            self, m_status_wrapper, m_close_pool):
+        """Pooled connections are closed when the subcommand raises."""
+        m_status_wrapper.side_effect = RuntimeError('failed')
+        with self.assertRaises(RuntimeError):
+            self._call_main(['cloud-init', 'init'])
+        m_close_pool.assert_called_once_with()
+
     @mock.patch('cloudinit.cmd.main.status_wrapper')
     def test_modules_subcommand_parser(self, m_status_wrapper):
         """The subcommand 'modules' calls status_wrapper passing modules."""
@@ -145,6 +157,16 @@ class TestCLI(test_helpers.FilesystemMockingTestCase):
         self.assertEqual('modules', parseargs.action[0])
         self.assertEqual('main_modules', parseargs.action[1].__name__)
 
+    @mock.patch('cloudinit.cmd.main.status_wrapper')
+    def test_modules_subcommand_parser_serial(self, m_status_wrapper):
+        """The subcommand 'modules' accepts --serial, defaulting to False."""
+        self._call_main(['cloud-init', 'modules'])
+        (_name, parseargs) = m_status_wrapper.call_args_list[0][0]
+        self.assertFalse(parseargs.serial)
+        self._call_main(['cloud-init', 'modules', '--serial'])
+        (_name, parseargs) = m_status_wrapper.call_args_list[1][0]
+        self.assertTrue(parseargs.serial)
+
     def test_conditional_subcommands_from_entry_point_sys_argv(self):
         """Subcommands from entry-point are properly parsed from sys.argv."""
         stdout = io.StringIO()
@@ -170,7 +192,7 @@ class TestCLI(test_helpers.FilesystemMockingTestCase):
         """The subcommand cloud-init analyze calls the correct subparser."""
         self._call_main(['cloud-init', 'analyze'])
         # These subcommands only valid for cloud-init analyze script
-        expected_subcommands = ['blame', 'show', 'dump']
+        expected_subcommands = ['blame', 'show', 'dump', 'trace']
         error = self.stderr.getvalue()
         for subcommand in expected_subcommands:
             self.assertIn(subcommand, error)
@@ -5,6 +5,7 @@
 import gzip
 import logging
 import os
+import time
 from io import BytesIO, StringIO
 from unittest import mock
 
@@ -704,6 +705,119 @@ class TestConsumeUserDataHttp(TestConsumeUserData, helpers.HttprettyTestCase):
         self.assertTrue(cc.get('included'))
 
 
+class TestIncludeFetch(helpers.HttprettyTestCase):
+
+    def setUp(self):
+        super(TestIncludeFetch, self).setUp()
+        self.paths = c_helpers.Paths({'cloud_dir': self.tmp_dir()})
+        self.cache_dir = os.path.join(
+            self.paths.get_ipath_cur('data'), 'urlcache')
+
+    def _payloads(self, blob):
+        message = ud.UserDataProcessor(self.paths).process(blob)
+        return [part.get_payload(decode=True) for part in message.walk()
+                if not part.is_multipart()]
+
+    @mock.patch('cloudinit.url_helper.time.sleep')
+    def test_includes_attached_in_listed_order(self, m_sleep):
+        """Parts are attached in the order urls were listed, not fetched."""
+        def slow_callback(request, uri, headers):
+            time.sleep(0.2)
+            return (200, headers, '#cloud-config\nslow: true\n')
+
+        httpretty.register_uri(httpretty.GET, 'http://host/slow',
+                               body=slow_callback)
+        httpretty.register_uri(httpretty.GET, 'http://host/fast',
+                               '#cloud-config\nfast: true\n')
+        httpretty.register_uri(httpretty.GET, 'http://host/nested',
+                               '#include\nhttp://host/fast\n')
+        payloads = self._payloads(
+            '#include\nhttp://host/slow\nhttp://host/nested\n'
+            'http://host/fast\n')
+        self.assertEqual([b'#cloud-config\nslow: true\n',
+                          b'#cloud-config\nfast: true\n',
+                          b'#cloud-config\nfast: true\n'], payloads)
+
+    @mock.patch('cloudinit.url_helper.time.sleep')
+    def test_unchanged_include_is_revalidated(self, m_sleep):
+        """Cached includes are revalidated and not downloaded again."""
+        url = 'http://host/config'
+        data = '#cloud-config\nincluded: true\n'
+        requests = []
+
+        def callback(request, uri, headers):
+            requests.append(request.headers)
+            if request.headers.get('If-None-Match') == '"v1"':
+                return (304, headers, '')
+            headers['ETag'] = '"v1"'
+            return (200, headers, data)
+
+        httpretty.register_uri(httpretty.GET, url, body=callback)
+        blob = '#include\n%s\n' % url
+        self.assertEqual([data.encode()], self._payloads(blob))
+        self.assertIsNone(requests[0].get('If-None-Match'))
+        self.assertEqual([data.encode()], self._payloads(blob))
+        self.assertEqual('"v1"', requests[1].get('If-None-Match'))
+        index = util.load_json(
+            util.load_file(os.path.join(self.cache_dir, 'index.json')))
+        self.assertEqual(['"v1"'], [e['etag'] for e in index.values()])
+
+    @mock.patch('cloudinit.url_helper.time.sleep')
+    def test_include_without_validators_not_cached(self, m_sleep):
+        """Includes served without ETag or Last-Modified are not cached."""
+        httpretty.register_uri(httpretty.GET, 'http://host/config',
+                               '#cloud-config\nincluded: true\n')
+        self._payloads('#include\nhttp://host/config\n')
+        self._payloads('#include\nhttp://host/config\n')
+        self.assertEqual(2, len(httpretty.latest_requests()))
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    @mock.patch('cloudinit.url_helper.time.sleep')
+    def test_include_once_not_fetched_again(self, m_sleep):
+        """Urls after #include-once are fetched on the first run only."""
+        httpretty.register_uri(httpretty.GET, 'http://host/once',
+                               '#cloud-config\nonce: true\n')
+        blob = '#include-once\nhttp://host/once\n'
+        self.assertEqual([b'#cloud-config\nonce: true\n'],
+                         self._payloads(blob))
+        self.assertEqual([b'#cloud-config\nonce: true\n'],
+                         self._payloads(blob))
+        self.assertEqual(1, len(httpretty.latest_requests()))
+
+
+class TestIncludeCache(helpers.CiTestCase):
+
+    def test_least_recently_used_evicted(self):
+        """Contents beyond max_bytes are dropped, least recently used first.
+        """
+        cache_dir = self.tmp_dir()
+        cache = ud.IncludeCache(cache_dir, max_bytes=10)
+        headers = {'ETag': '"1"'}
+        with mock.patch('cloudinit.user_data.time.time', return_value=1):
+            cache.put('http://host/a', b'aaaa', headers)
+            cache.put('http://host/b', b'bbbb', headers)
+        with mock.patch('cloudinit.user_data.time.time', return_value=2):
+            self.assertEqual(b'aaaa', cache.get('http://host/a'))
+            cache.put('http://host/c', b'cccc', headers)
+            cache.save()
+        cache = ud.IncludeCache(cache_dir, max_bytes=10)
+        self.assertEqual(b'aaaa', cache.get('http://host/a'))
+        self.assertIsNone(cache.get('http://host/b'))
+        self.assertEqual(b'cccc', cache.get('http://host/c'))
+        self.assertEqual(2, len(os.listdir(os.path.join(cache_dir, 'blobs'))))
+
+    def test_request_headers_need_cached_contents(self):
+        """Validators are only sent while the cached contents exist."""
+        cache = ud.IncludeCache(self.tmp_dir())
+        cache.put('http://host/a', b'aaaa',
+                  {'ETag': '"1"', 'Last-Modified': 'Mon, 1 Jun 2020'})
+        self.assertEqual(
+            {'If-None-Match': '"1"', 'If-Modified-Since': 'Mon, 1 Jun 2020'},
+            cache.request_headers('http://host/a'))
+        util.del_dir(os.path.join(cache.cache_dir, 'blobs'))
+        self.assertEqual({}, cache.request_headers('http://host/a'))
+
+
 class TestUDProcess(helpers.ResourceUsingTestCase):
 
     def test_bytes_in_userdata(self):
@@ -377,7 +377,7 @@ class TestUserDataVsphere(CiTestCase):
         self.assertEqual(True, dsrc.user_data_vsphere())
         m_find_devs_with.assert_called_once_with('LABEL=CDROM')
         m_mount_cb.assert_called_once_with(
-            '/dev/mock/cdrom', dsac.read_user_data_callback)
+            '/dev/mock/cdrom', dsac.read_user_data_callback, read_image=True)
         with mock.patch.object(dsrc, 'get_cloud_type', return_value='VSPHERE'):
             self.assertEqual('vsphere (/dev/mock/cdrom)', dsrc.subplatform)
 
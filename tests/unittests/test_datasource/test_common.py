@@ -1,5 +1,6 @@
 # This file is part of cloud-init. See LICENSE file for license information.
 
+from cloudinit import importer
 from cloudinit import settings
 from cloudinit import sources
 from cloudinit import type_utils
@@ -92,6 +93,27 @@ class ExpectedDataSources(test_helpers.TestCase):
             ['AliYun'], self.deps_network, self.pkg_list)
         self.assertEqual(set([AliYun.DataSourceAliYun]), set(found))
 
+    def test_indexed_sources_found(self):
+        """Sources found through the module index are the same."""
+        with test_helpers.mock.patch.object(
+                importer, '_MODULE_INDEX', importer.build_module_index()):
+            self.assertEqual(set(DEFAULT_LOCAL), set(sources.list_sources(
+                self.builtin_list, self.deps_local, self.pkg_list)))
+            self.assertEqual(set(DEFAULT_NETWORK), set(sources.list_sources(
+                self.builtin_list, self.deps_network, self.pkg_list)))
+
+    def test_indexed_sources_only_import_matching_modules(self):
+        """Indexed modules without matching datasources are not imported."""
+        index = importer.build_module_index()
+        with test_helpers.mock.patch.object(importer, '_MODULE_INDEX', index):
+            with test_helpers.mock.patch.object(
+                    importer, 'import_module',
+                    side_effect=importer.import_module) as m_import:
+                found = sources.list_sources(
+                    ['Ec2', 'GCE', 'None'], self.deps_local, self.pkg_list)
+        self.assertEqual([Ec2.DataSourceEc2Local], found)
+        m_import.assert_called_once_with('cloudinit.sources.DataSourceEc2')
+
 
 class TestDataSourceInvariants(test_helpers.TestCase):
     def test_data_sources_have_valid_network_config_sources(self):
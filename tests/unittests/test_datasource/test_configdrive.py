@@ -4,6 +4,7 @@ from copy import copy, deepcopy
 import json
 import os
 
+from cloudinit import fsimage
 from cloudinit import helpers
 from cloudinit.net import eni
 from cloudinit.net import network_state
@@ -12,7 +13,9 @@ from cloudinit.sources import DataSourceConfigDrive as ds
 from cloudinit.sources.helpers import openstack
 from cloudinit import util
 
-from cloudinit.tests.helpers import CiTestCase, ExitStack, mock, populate_dir
+from cloudinit.tests.helpers import (
+    CiTestCase, ExitStack, make_fat_image, make_iso9660_image, mock,
+    populate_dir)
 
 
 PUBKEY = u'ssh-rsa AAAAB3NzaC1....sIkJhq8wdX+4I3A4cYbYP ubuntu@server-460\n'
@@ -377,6 +380,20 @@ class TestConfigDriveDataSource(CiTestCase):
         self.assertEqual(found['files']['/etc/foo.cfg'], CONTENT_0)
         self.assertEqual(found['files']['/etc/bar/bar.cfg'], CONTENT_1)
 
+    def test_image_read_as_dir(self):
+        """Verify a config drive image is read as its files in a dir are."""
+        populate_dir(self.tmp, CFG_DRIVE_FILES_V2)
+        expected = ds.read_config_drive(self.tmp)
+        images = (
+            (make_iso9660_image, {'rock_ridge': True, 'joliet': True}),
+            (make_iso9660_image, {'joliet': True}),
+            (make_fat_image, {}))
+        for make_image, kwargs in images:
+            image = self.tmp_path('config-2.img')
+            make_image(image, CFG_DRIVE_FILES_V2, **kwargs)
+            with fsimage.open_image(image) as view:
+                self.assertEqual(expected, ds.read_config_drive(view))
+
     def test_seed_dir_valid_extra(self):
         """Verify extra files do not affect datasource validity."""
 
@@ -7,7 +7,9 @@ from cloudinit.sources.DataSourceNoCloud import (
     _maybe_remove_top_network,
     parse_cmdline_data)
 from cloudinit import util
-from cloudinit.tests.helpers import CiTestCase, populate_dir, mock, ExitStack
+from cloudinit.tests.helpers import (
+    CiTestCase, ExitStack, make_fat_image, make_iso9660_image, mock,
+    populate_dir)
 
 import os
 import textwrap
@@ -36,7 +38,7 @@ class TestNoCloudDataSource(CiTestCase):
     def _test_fs_config_is_read(self, fs_label, fs_label_to_search):
         vfat_device = 'device-1'
 
-        def m_mount_cb(device, callback, mtype):
+        def m_mount_cb(device, callback, mtype, read_image=False):
             if (device == vfat_device):
                 return {'meta-data': yaml.dump({'instance-id': 'IID'})}
             else:
@@ -133,6 +135,33 @@ class TestNoCloudDataSource(CiTestCase):
     def test_fs_config_uppercase_label_search_uppercase(self, m_is_lxd):
         self._test_fs_config_is_read('CIDATA', 'CIDATA')
 
+    def test_fs_config_is_read_without_mounting(self, m_is_lxd):
+        """Seed images on ISO9660 and FAT devices are not mounted."""
+        m_is_lxd.return_value = False
+        md = {'instance-id': 'IID', 'dsmode': 'local'}
+        ud = b"#cloud-config\nruncmd: [ls]\n"
+        seed = {'user-data': ud, 'meta-data': yaml.safe_dump(md)}
+        images = (
+            (make_iso9660_image, {'rock_ridge': True, 'joliet': True}),
+            (make_fat_image, {}))
+        self.mocks.enter_context(
+            mock.patch.object(util, 'mounts', return_value={}))
+        m_subp = self.mocks.enter_context(mock.patch.object(util.subp, 'subp'))
+        m_find_devs_with = self.mocks.enter_context(
+            mock.patch.object(util, 'find_devs_with'))
+        for make_image, kwargs in images:
+            device = self.tmp_path('cidata.img')
+            make_image(device, seed, **kwargs)
+            m_find_devs_with.side_effect = (
+                lambda query='', path='': [device])
+            dsrc = dsNoCloud(sys_cfg={}, distro=None, paths=self.paths)
+            self.assertTrue(dsrc.get_data())
+            self.assertEqual(md, dsrc.metadata)
+            self.assertEqual(ud, dsrc.userdata_raw)
+            self.assertEqual('nocloud', dsrc.platform_type)
+            self.assertIn(device, dsrc.subplatform)
+        self.assertEqual(0, m_subp.call_count)
+
     def test_no_datasource_expected(self, m_is_lxd):
         # no source should be found if no cmdline, config, and fs_label=None
         sys_cfg = {'datasource': {'NoCloud': {'fs_label': None}}}
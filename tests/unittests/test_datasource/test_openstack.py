@@ -8,6 +8,8 @@ import copy
 import httpretty as hp
 import json
 import re
+import threading
+import time
 from io import StringIO
 from urllib.parse import urlparse
 
@@ -18,6 +20,7 @@ from cloudinit import settings
 from cloudinit.sources import BrokenMetadata, convert_vendordata, UNSET
 from cloudinit.sources import DataSourceOpenStack as ds
 from cloudinit.sources.helpers import openstack
+from cloudinit import url_helper
 from cloudinit import util
 
 BASE_URL = "http://169.254.169.254"
@@ -446,6 +449,21 @@ class TestOpenStackDataSource(test_helpers.HttprettyTestCase):
         self.assertEqual(VENDOR_DATA2, crawled_data['vendordata2'])
         self.assertEqual(2, crawled_data['version'])
 
+    def test_wb__crawl_metadata_bounded_by_crawl_max_wait(self):
+        """crawl_max_wait of the datasource config bounds the crawl."""
+        ds_os = ds.DataSourceOpenStack(
+            settings.CFG_BUILTIN, None, helpers.Paths({'run_dir': self.tmp}))
+        ds_os.metadata_address = BASE_URL
+        for (ds_cfg, max_wait) in (({}, -1), ({'crawl_max_wait': 30}, 30),
+                                   ({'crawl_max_wait': 'nope'}, -1)):
+            ds_os.ds_cfg = ds_cfg
+            with test_helpers.mock.patch.multiple(
+                    ds_os, wait_for_metadata_service=lambda: True):
+                with test_helpers.mock.patch(
+                        MOCK_PATH + 'read_metadata_service') as m_read:
+                    ds_os._crawl_metadata()
+            self.assertEqual(max_wait, m_read.call_args[1]['max_wait'])
+
 
 class TestVendorDataLoading(test_helpers.TestCase):
     def cvj(self, data):
@@ -720,5 +738,155 @@ class TestMetadataReader(test_helpers.HttprettyTestCase):
         self.assertEqual(expected, reader.read_v2())
         self.assertEqual(1, mock_read_ec2.call_count)
 
+    def register_ocata(self, md=None):
+        self.register_versions([openstack.OS_OCATA, openstack.OS_LATEST])
+        self.register_version(openstack.OS_OCATA, {
+            'meta_data.json': json.dumps(md or self.md_base),
+            'network_data.json': json.dumps({'links': []}),
+            'vendor_data.json': '{}',
+            'vendor_data2.json': '{}',
+        })
+
+    def test_read_v2_reads_documents_concurrently(self):
+        """The documents and the ec2 metadata are read at the same time."""
+        self.register_ocata()
+        reader = openstack.MetadataReader(self.burl)
+        # Only completes if the 5 documents and the ec2 metadata are read at
+        # the same time, after the versions
+        barrier = threading.Barrier(6, timeout=5)
+        path_read = reader._path_read
+
+        def read_together(path, decode=False):
+            if not path.endswith('/openstack'):
+                barrier.wait()
+            return path_read(path, decode=decode)
+
+        def read_ec2_together():
+            barrier.wait()
+            return {}
+
+        reader._path_read = read_together
+        reader._read_ec2_metadata = read_ec2_together
+        self.assertEqual(
+            json.loads(json.dumps(self.md_base)),
+            {k: v for k, v in reader.read_v2()['metadata'].items()
+             if k in self.md_base})
+
+    def test_read_v2_reads_files_concurrently(self):
+        """Files of the metadata are read at the same time."""
+        md = copy.deepcopy(self.md_base)
+        md['files'] = [{'path': '/etc/foo.cfg', 'content_path': '/content/0'},
+                       {'path': '/etc/bar.cfg', 'content_path': '/content/1'}]
+        md['network_config'] = {'content_path': '/content/2'}
+        self.register_ocata(md)
+        for index in range(3):
+            self.register('/content/%d' % index, 'content%d' % index)
+        reader = openstack.MetadataReader(self.burl)
+        reader._read_ec2_metadata = lambda: {}
+        barrier = threading.Barrier(3, timeout=5)
+        read_content_path = reader._read_content_path
+
+        def read_together(item, decode=False):
+            barrier.wait()
+            return read_content_path(item, decode=decode)
+
+        reader._read_content_path = read_together
+        result = reader.read_v2()
+        self.assertEqual({'/etc/foo.cfg': b'content0',
+                          '/etc/bar.cfg': b'content1'}, result['files'])
+        self.assertEqual('content2', result['network_config'])
+
+    def test_read_v2_with_one_worker_reads_in_order(self):
+        """With one worker documents are read one after another, lazily."""
+        self.register_ocata()
+        reader = openstack.MetadataReader(self.burl, max_workers=1)
+        reads = []
+        path_read = reader._path_read
+
+        def recorded_read(path, decode=False):
+            reads.append(path[len(self.burl):])
+            return path_read(path, decode=decode)
+
+        reader._path_read = recorded_read
+        reader._read_ec2_metadata = lambda: reads.append('ec2') or {}
+        concurrent = openstack.MetadataReader(self.burl)
+        concurrent._read_ec2_metadata = lambda: {}
+        self.assertEqual(concurrent.read_v2(), reader.read_v2())
+        self.assertEqual(
+            ['openstack'] + ['openstack/%s/%s' % (openstack.OS_OCATA, name)
+                             for name in ('meta_data.json', 'user_data',
+                                          'vendor_data.json',
+                                          'vendor_data2.json',
+                                          'network_data.json')] + ['ec2'],
+            reads)
+
+    def test_read_v2_missing_metadata_raises_non_readable(self):
+        """Optional and mandatory documents are handled as when serial."""
+        self.register_versions([openstack.OS_OCATA])
+        self.register_version(openstack.OS_OCATA, {'vendor_data.json': '{}'})
+        self.register('/%s/meta_data.json' % openstack.OS_OCATA, status=404)
+        reader = openstack.MetadataReader(self.burl, retries=0)
+        reader._read_ec2_metadata = lambda: {}
+        with self.assertRaises(openstack.NonReadable):
+            reader.read_v2()
+
+    def test_read_v2_missing_metadata_does_not_wait_for_other_reads(self):
+        """A missing meta_data.json fails without waiting on other reads."""
+        self.register_versions([openstack.OS_OCATA])
+        self.register_version(openstack.OS_OCATA, {'vendor_data.json': '{}'})
+        self.register('/%s/meta_data.json' % openstack.OS_OCATA, status=404)
+        reader = openstack.MetadataReader(self.burl, retries=0)
+        released = threading.Event()
+        slow_reads = []
+
+        def slow_ec2_read():
+            slow_reads.append(released.wait(5))
+            return {}
+
+        reader._read_ec2_metadata = slow_ec2_read
+        try:
+            with self.assertRaises(openstack.NonReadable):
+                reader.read_v2()
+            self.assertEqual([], slow_reads)
+        finally:
+            released.set()
+
+    def test_request_timeout_shortened_to_max_wait(self):
+        reader = openstack.MetadataReader(self.burl, timeout=10, max_wait=30)
+        self.assertEqual(10, reader._request_timeout(self.burl))
+        reader._deadline = time.time() + 2
+        self.assertLessEqual(reader._request_timeout(self.burl), 2)
+        self.assertTrue(reader._before_deadline(None, None))
+        reader._deadline = time.time() + 0.5
+        self.assertFalse(reader._before_deadline(None, None))
+        reader._deadline = time.time() - 1
+        with self.assertRaises(url_helper.UrlError):
+            reader._request_timeout(self.burl)
+        self.assertEqual({}, reader._read_ec2_metadata())
+
+    def test_read_v2_stops_retrying_at_max_wait(self):
+        """Requests are not retried once max_wait has passed."""
+        attempts = []
+
+        def readurl(url, retries=0, exception_cb=None, **kwargs):
+            # Fail every attempt, retrying as readurl does
+            for _ in range(retries + 1):
+                attempts.append(url)
+                error = url_helper.UrlError(IOError('timed out'), url=url)
+                if not exception_cb(kwargs, error):
+                    break
+                time.sleep(0.1)
+            raise error
+
+        reader = openstack.MetadataReader(
+            self.burl, retries=1000, max_wait=1.5)
+        start = time.time()
+        with test_helpers.mock.patch.object(
+                url_helper, 'readurl', side_effect=readurl):
+            with self.assertRaises(openstack.NonReadable):
+                reader.read_v2()
+        self.assertLess(time.time() - start, 3)
+        self.assertLess(len(attempts), 1000)
+
 
 # vi: ts=4 expandtab
@@ -702,7 +702,7 @@ class TestTransportIso9660(CiTestCase):
 
         self.assertEqual("mycontent", dsovf.transport_iso9660())
         self.m_mount_cb.assert_called_with(
-            "/dev/sr0", dsovf.get_ovf_env, mtype="iso9660")
+            "/dev/sr0", dsovf.get_ovf_env, mtype="iso9660", read_image=True)
 
     def test_mount_cb_called_on_blkdevs_with_iso9660_check_regex(self):
         """Check we call mount_cb on blockdevs with iso9660 and match regex"""
@@ -713,7 +713,7 @@ class TestTransportIso9660(CiTestCase):
 
         self.assertEqual("mycontent", dsovf.transport_iso9660())
         self.m_mount_cb.assert_called_with(
-            "/dev/sr0", dsovf.get_ovf_env, mtype="iso9660")
+            "/dev/sr0", dsovf.get_ovf_env, mtype="iso9660", read_image=True)
 
     def test_mount_cb_not_called_no_matches(self):
         """Check we don't call mount_cb if nothing matches"""
@@ -733,7 +733,7 @@ class TestTransportIso9660(CiTestCase):
             "mycontent", dsovf.transport_iso9660(require_iso=False))
 
         self.m_mount_cb.assert_called_with(
-            "/dev/xvdz", dsovf.get_ovf_env, mtype=None)
+            "/dev/xvdz", dsovf.get_ovf_env, mtype=None, read_image=True)
 
     def test_maybe_cdrom_device_none(self):
         """Test maybe_cdrom_device returns False for none/empty input"""
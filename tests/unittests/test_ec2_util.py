@@ -1,5 +1,8 @@
 # This file is part of cloud-init. See LICENSE file for license information.
 
+import functools
+import threading
+
 import httpretty as hp
 
 from cloudinit.tests import helpers
@@ -176,4 +179,119 @@ class TestEc2Util(helpers.HttprettyTestCase):
         self.assertEqual(iam['info']['LastUpdated'], '2016-10-27T17:29:39Z')
         self.assertNotIn('security-credentials', iam)
 
+    def test_metadata_fetch_concurrent_matches_serial(self):
+        """A concurrent crawl materializes the same tree as a serial one."""
+        base_url = 'http://169.254.169.254/%s/meta-data/' % (self.VERSION)
+        hp.register_uri(hp.GET, base_url, status=200,
+                        body="\n".join(['hostname',
+                                        'instance-id',
+                                        'block-device-mapping/',
+                                        'public-keys/']))
+        hp.register_uri(hp.GET, uh.combine_url(base_url, 'hostname'),
+                        status=200, body='ec2.fake.host.name.com')
+        hp.register_uri(hp.GET, uh.combine_url(base_url, 'instance-id'),
+                        status=200, body='123')
+        hp.register_uri(hp.GET,
+                        uh.combine_url(base_url, 'block-device-mapping/'),
+                        status=200,
+                        body="\n".join(['ami', 'ephemeral0']))
+        hp.register_uri(hp.GET,
+                        uh.combine_url(base_url, 'block-device-mapping/ami'),
+                        status=200, body="sdb")
+        hp.register_uri(hp.GET,
+                        uh.combine_url(base_url,
+                                       'block-device-mapping/ephemeral0'),
+                        status=200, body="sdc")
+        hp.register_uri(hp.GET, uh.combine_url(base_url, 'public-keys/'),
+                        status=200,
+                        body="\n".join(['0=my-public-key', '1=my-other-key']))
+        hp.register_uri(hp.GET,
+                        uh.combine_url(base_url, 'public-keys/0/openssh-key'),
+                        status=200, body='ssh-rsa AAAA.....wZEf my-public-key')
+        hp.register_uri(hp.GET,
+                        uh.combine_url(base_url, 'public-keys/1/openssh-key'),
+                        status=200, body='ssh-rsa AAAA.....wZEf my-other-key')
+        serial = eu.get_instance_metadata(
+            self.VERSION, retries=0, timeout=0.1, max_workers=1)
+        concurrent = eu.get_instance_metadata(
+            self.VERSION, retries=0, timeout=0.1, max_workers=4)
+        self.assertEqual(serial, concurrent)
+        self.assertEqual(
+            {'ami': 'sdb', 'ephemeral0': 'sdc'},
+            concurrent['block-device-mapping'])
+        self.assertEqual(2, len(concurrent['public-keys']))
+
+    def test_metadata_fetch_concurrent_honors_skip_retry_on_codes(self):
+        """Failures in a concurrent crawl surface like a serial crawl."""
+        base_url = 'http://169.254.169.254/%s/meta-data/' % (self.VERSION)
+        hp.register_uri(hp.GET, base_url, status=200,
+                        body="\n".join(['hostname', 'instance-id']))
+        hp.register_uri(hp.GET, uh.combine_url(base_url, 'hostname'),
+                        status=200, body='ec2.fake.host.name.com')
+        hp.register_uri(hp.GET, uh.combine_url(base_url, 'instance-id'),
+                        status=404)
+        exception_cb = functools.partial(
+            eu.skip_retry_on_codes, eu.SKIP_USERDATA_CODES)
+        md = eu.get_instance_metadata(
+            self.VERSION, retries=5, timeout=0.1, max_workers=4,
+            exception_cb=exception_cb)
+        self.assertEqual({}, md)
+        requested = [r.path for r in hp.latest_requests()]
+        self.assertEqual(
+            1, requested.count('/%s/meta-data/instance-id' % self.VERSION))
+
+
+class TestMetadataMaterializer(helpers.CiTestCase):
+
+    with_logs = True
+
+    def _tree_caller(self, tree, active=None):
+        """Return a caller serving tree, tracking in-flight requests."""
+        lock = threading.Lock()
+
+        def caller(url):
+            if active is not None:
+                with lock:
+                    active['now'] += 1
+                    active['max'] = max(active['max'], active['now'])
+            try:
+                return tree[url]
+            finally:
+                if active is not None:
+                    with lock:
+                        active['now'] -= 1
+        return caller
+
+    def test_concurrent_crawl_is_bounded_by_max_workers(self):
+        """No more than max_workers requests are in flight at once."""
+        base = 'http://md/'
+        tree = {}
+        names = ['key%d' % i for i in range(20)]
+        for name in names:
+            tree[base + name] = name.encode()
+        active = {'now': 0, 'max': 0}
+        materializer = eu.MetadataMaterializer(
+            '\n'.join(names), base, self._tree_caller(tree, active),
+            max_workers=3)
+        md = materializer.materialize()
+        self.assertEqual(dict((n, n) for n in names), md)
+        self.assertLessEqual(active['max'], 3)
+
+    def test_concurrent_crawl_duplicate_key_prefers_child(self):
+        """Duplicate leaf and child names keep the child, as serially."""
+        base = 'http://md/'
+        tree = {
+            base + 'dup/': b'leaf',
+            base + 'dup/leaf': b'child-value',
+            base + 'dup': b'leaf-value',
+        }
+        blob = 'dup/\ndup'
+        serial = eu.MetadataMaterializer(
+            blob, base, self._tree_caller(tree)).materialize()
+        concurrent = eu.MetadataMaterializer(
+            blob, base, self._tree_caller(tree), max_workers=2).materialize()
+        self.assertEqual({'dup': {'leaf': 'child-value'}}, serial)
+        self.assertEqual(serial, concurrent)
+        self.assertIn('Duplicate key found', self.logs.getvalue())
+
 # vi: ts=4 expandtab
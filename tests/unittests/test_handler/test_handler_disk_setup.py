@@ -1,9 +1,12 @@
 # This file is part of cloud-init. See LICENSE file for license information.
 
 import random
+import threading
 
 from cloudinit.config import cc_disk_setup
-from cloudinit.tests.helpers import CiTestCase, ExitStack, mock, TestCase
+from cloudinit.reporting import events
+from cloudinit.tests.helpers import (
+    CiTestCase, ExitStack, RecordedBlockTopology, mock, TestCase)
 
 
 class TestIsDiskUsed(TestCase):
@@ -239,5 +242,313 @@ class TestMkfsCommandHandling(CiTestCase):
         subp.assert_called_once_with(
             ['/sbin/mkswap', '/dev/xdb1', '-L', 'swap', '-f'], shell=False)
 
+    @mock.patch('cloudinit.config.cc_disk_setup.util.'
+                'invalidate_blkid_inventory')
+    def test_invalidates_blkid_inventory(self, m_invalidate, subp, *args):
+        """mkfs forgets the blkid inventory once the filesystem is made."""
+        def check_not_invalidated(*args, **kwargs):
+            self.assertEqual(0, m_invalidate.call_count)
+            return ('', '')
+
+        subp.side_effect = check_not_invalidated
+        cc_disk_setup.mkfs({
+            'cmd': 'mkfs -t %(filesystem)s %(device)s',
+            'filesystem': 'ext4',
+            'device': '/dev/xdb1',
+        })
+        m_invalidate.assert_called_once_with()
+
+
+class TestGetPhysicalDevice(TestCase):
+
+    def setUp(self):
+        super(TestGetPhysicalDevice, self).setUp()
+        self.links = {
+            '/dev/disk/by-label/data': '/dev/nvme0n1p2',
+            '/sys/class/block/nvme0n1p2':
+                '/sys/devices/pci0000:00/nvme/nvme0/nvme0n1/nvme0n1p2',
+            '/sys/class/block/sdb1': '/sys/devices/virtual/sdb/sdb1',
+        }
+        partitions = ('/sys/class/block/nvme0n1p2/partition',
+                      '/sys/class/block/sdb1/partition')
+        patches = ExitStack()
+        self.addCleanup(patches.close)
+        patches.enter_context(mock.patch(
+            'cloudinit.config.cc_disk_setup.os.path.realpath',
+            side_effect=lambda path: self.links.get(path, path)))
+        patches.enter_context(mock.patch(
+            'cloudinit.config.cc_disk_setup.os.path.exists',
+            side_effect=lambda path: path in partitions))
+
+    def test_partition_is_on_its_disk(self):
+        self.assertEqual(
+            '/dev/sdb', cc_disk_setup.get_physical_device('/dev/sdb1'))
+        self.assertEqual(
+            '/dev/nvme0n1',
+            cc_disk_setup.get_physical_device('/dev/disk/by-label/data'))
+
+    def test_disk_is_its_own_device(self):
+        self.assertEqual(
+            '/dev/sdb', cc_disk_setup.get_physical_device('/dev/sdb'))
+        self.assertIsNone(cc_disk_setup.get_physical_device(None))
+
+    def test_plan_groups_operations_by_disk_in_order(self):
+        operations = [
+            cc_disk_setup.DeviceOperation(device, device, '', '', None, ())
+            for device in ('/dev/sdb', '/dev/nvme0n1', '/dev/sdb1',
+                           '/dev/sdc', '/dev/disk/by-label/data')]
+        self.assertEqual(
+            [[operations[0], operations[2]], [operations[1], operations[4]],
+             [operations[3]]],
+            cc_disk_setup.plan_device_operations(operations))
+
+
+@mock.patch('cloudinit.config.cc_disk_setup.get_physical_device',
+            side_effect=lambda device: device.rstrip('0123456789'))
+@mock.patch('cloudinit.config.cc_disk_setup.util.udevadm_settle')
+class TestHandleDeviceOperations(CiTestCase):
+
+    with_logs = True
+
+    def setUp(self):
+        super(TestHandleDeviceOperations, self).setUp()
+        self.reporter = events.ReportEventStack(
+            name='init-network/config-disk_setup', description='disk setup',
+            reporting_enabled=False)
+        self.cloud = mock.Mock(reporter=self.reporter)
+        self.cloud.device_name_to_device.return_value = None
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def record(self, name, result=None):
+        def func(*args, **kwargs):
+            with self.lock:
+                self.calls.append((name, args[0], kwargs['settle']))
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return func
+
+    def handle(self, cfg):
+        cc_disk_setup.handle('disk_setup', cfg, self.cloud, cc_disk_setup.LOG,
+                             [])
+
+    def test_disks_are_partitioned_at_the_same_time(self, m_settle, *args):
+        """Each disk is partitioned while the others are."""
+        barrier = threading.Barrier(3, timeout=5)
+
+        def mkpart(device, definition, settle, topology):
+            barrier.wait()
+
+        with mock.patch.object(cc_disk_setup, 'mkpart', side_effect=mkpart):
+            self.handle({'disk_setup': {
+                '/dev/sdb': {'layout': True}, '/dev/sdc': {'layout': True},
+                '/dev/sdd': {'layout': True}}})
+        self.assertEqual(0, barrier.n_waiting)
+        self.assertFalse(barrier.broken)
+        self.assertEqual(
+            [events.status.SUCCESS] * 3,
+            [result for result, _msg in self.reporter.children.values()])
+
+    def test_operations_on_a_disk_run_in_order(self, m_settle, *args):
+        """Filesystems on a disk are made one after another, settling udev
+        before each but the first."""
+        fs_setup = [{'device': '/dev/sdb%d' % i, 'filesystem': 'ext4'}
+                    for i in range(1, 5)]
+        with mock.patch.object(cc_disk_setup, 'mkfs',
+                               side_effect=self.record('mkfs')):
+            self.handle({'fs_setup': fs_setup})
+        self.assertEqual(
+            [('mkfs', definition, i > 0)
+             for i, definition in enumerate(fs_setup)], self.calls)
+
+    def test_udev_settled_once_per_phase(self, m_settle, *args):
+        """udev is settled before starting and once each phase is done."""
+        with mock.patch.object(cc_disk_setup, 'mkpart',
+                               side_effect=self.record('mkpart')):
+            with mock.patch.object(cc_disk_setup, 'mkfs',
+                                   side_effect=self.record('mkfs')):
+                self.handle({
+                    'disk_setup': {'/dev/sdb': {'layout': True},
+                                   '/dev/sdc': {'layout': True}},
+                    'fs_setup': [{'device': '/dev/sdb1'},
+                                 {'device': '/dev/sdc1'}]})
+        self.assertEqual(3, m_settle.call_count)
+        self.assertEqual([False] * 4, [call[2] for call in self.calls])
+        self.assertEqual(['mkpart', 'mkpart', 'mkfs', 'mkfs'],
+                         [call[0] for call in self.calls])
+
+    def test_nothing_to_set_up_does_not_settle(self, m_settle, *args):
+        self.handle({'disk_setup': {'/dev/sdb': 'invalid'}})
+        self.assertEqual(0, m_settle.call_count)
+        self.assertIn('Invalid disk definition for /dev/sdb',
+                      self.logs.getvalue())
+
+    def test_events_reported_for_each_device(self, m_settle, *args):
+        """Each operation reports an event saying how long it took."""
+        with mock.patch.object(cc_disk_setup, 'mkpart',
+                               side_effect=self.record('mkpart')):
+            with mock.patch.object(cc_disk_setup, 'mkfs',
+                                   side_effect=self.record('mkfs')):
+                self.handle({
+                    'disk_setup': {'/dev/sdb': {'layout': True}},
+                    'fs_setup': [{'device': '/dev/sdb1'},
+                                 {'device': '/dev/sdc'}]})
+        self.assertEqual(
+            ['filesystem-0-sdb1', 'filesystem-1-sdc',
+             'partition-sdb'], sorted(self.reporter.children))
+        for result, message in self.reporter.children.values():
+            self.assertEqual(events.status.SUCCESS, result)
+        self.assertRegex(
+            self.reporter.children['filesystem-1-sdc'][1],
+            r'^Creating fs for /dev/sdc took \d+\.\d{3} seconds$')
+
+    def test_event_names_are_not_paths(self, m_settle, *args):
+        """Events are named by device name, as '/' separates event names."""
+        with mock.patch.object(cc_disk_setup, 'mkpart',
+                               side_effect=self.record('mkpart')):
+            with mock.patch.object(cc_disk_setup, 'mkfs',
+                                   side_effect=self.record('mkfs')):
+                self.handle({
+                    'disk_setup': {'/dev/disk/by-id/nvme-a': {'layout': True}},
+                    'fs_setup': [{'device': '/dev/nvme0n1p1'}]})
+        self.assertEqual(['filesystem-0-nvme0n1p1', 'partition-nvme-a'],
+                         sorted(self.reporter.children))
+        for name in self.reporter.children:
+            fullname = '/'.join([self.reporter.fullname, name])
+            self.assertEqual(
+                self.reporter.fullname.count('/') + 1, fullname.count('/'))
+
+    def test_failures_are_reported_and_others_continue(self, m_settle,
+                                                       *args):
+        """A failing operation is logged and reported, and the others on the
+        same and other disks still run."""
+        mkfs = self.record('mkfs')
+
+        def failing_mkfs(definition, settle, topology):
+            mkfs(definition, settle=settle, topology=topology)
+            if definition['device'] == '/dev/sdb1':
+                raise RuntimeError('mkfs.ext4 failed')
+
+        fs_setup = [{'device': '/dev/sdb1'}, {'device': '/dev/sdb2'},
+                    {'device': '/dev/sdc1'}]
+        with mock.patch.object(cc_disk_setup, 'mkfs',
+                               side_effect=failing_mkfs):
+            self.handle({'fs_setup': fs_setup})
+        self.assertEqual(3, len(self.calls))
+        self.assertIn('Failed during filesystem operation\nmkfs.ext4 failed',
+                      self.logs.getvalue())
+        result, message = self.reporter.children['filesystem-0-sdb1']
+        self.assertEqual(events.status.FAIL, result)
+        self.assertIn('mkfs.ext4 failed', message)
+        self.assertEqual(
+            events.status.SUCCESS,
+            self.reporter.children['filesystem-1-sdb2'][0])
+
+
+@mock.patch('cloudinit.config.cc_disk_setup.subp.subp')
+class TestBlockTopologyLookups(CiTestCase):
+
+    def setUp(self):
+        super(TestBlockTopologyLookups, self).setUp()
+        self.topology = RecordedBlockTopology('lsblk/lsblk_ec2_nvme.json')
+
+    def test_enumerate_disk_from_topology(self, m_subp):
+        """Devices are listed as lsblk --pairs lists them, without it."""
+        self.assertEqual([
+            {'name': 'nvme0n1', 'type': 'disk', 'fstype': '', 'label': ''},
+            {'name': 'nvme0n1p1', 'type': 'part', 'fstype': 'ext4',
+             'label': 'cloudimg-rootfs'},
+            {'name': 'nvme0n1p14', 'type': 'part', 'fstype': '',
+             'label': ''},
+            {'name': 'nvme0n1p15', 'type': 'part', 'fstype': 'vfat',
+             'label': 'UEFI'}],
+            list(cc_disk_setup.enumerate_disk(
+                '/dev/nvme0n1', topology=self.topology)))
+        self.assertEqual(
+            [{'name': 'nvme0n1', 'type': 'disk', 'fstype': '', 'label': ''}],
+            list(cc_disk_setup.enumerate_disk(
+                '/dev/nvme0n1', nodeps=True, topology=self.topology)))
+        self.assertEqual(0, m_subp.call_count)
+
+    def test_unknown_device_enumerated_with_lsblk(self, m_subp):
+        m_subp.return_value = (
+            'NAME="loop0" TYPE="loop" FSTYPE="" LABEL=""\n', '')
+        self.assertEqual(
+            [{'name': 'loop0', 'type': 'loop', 'fstype': '', 'label': ''}],
+            list(cc_disk_setup.enumerate_disk(
+                '/dev/loop0', topology=self.topology)))
+        self.assertEqual(1, m_subp.call_count)
+
+    def test_device_checks_from_topology(self, m_subp):
+        topology = self.topology
+        self.assertTrue(cc_disk_setup.is_disk_used('/dev/nvme0n1', topology))
+        self.assertTrue(cc_disk_setup.is_device_valid(
+            '/dev/nvme1n1', topology=topology))
+        self.assertTrue(cc_disk_setup.is_device_valid(
+            '/dev/nvme0n1p1', partition=True, topology=topology))
+        self.assertEqual(
+            ('/dev/nvme3n1', True),
+            cc_disk_setup.find_device_node(
+                '/dev/nvme3n1', fs_type='xfs', label='data',
+                topology=topology))
+        self.assertEqual(
+            ('/dev/nvme1n1', False),
+            cc_disk_setup.find_device_node(
+                '/dev/nvme1n1', fs_type='xfs', label='data',
+                topology=topology))
+        self.assertEqual(0, m_subp.call_count)
+        self.assertEqual(1, topology.reads)
+
+    def test_filesystems_probed_before_overwriting(self, m_subp):
+        """Whether a device has a filesystem is asked of blkid, not of the
+        udev data in the topology, as the device may be overwritten."""
+        m_subp.return_value = ('/dev/nvme1n1: TYPE="ext4"\n', '')
+        self.assertTrue(cc_disk_setup.is_disk_used(
+            '/dev/nvme1n1', topology=self.topology))
+        self.assertEqual(
+            (None, 'ext4', None), cc_disk_setup.check_fs('/dev/nvme1n1'))
+        self.assertEqual(
+            [mock.call([cc_disk_setup.BLKID_CMD, '-c', '/dev/null',
+                        '/dev/nvme1n1'], rcs=[0, 2])] * 2,
+            m_subp.call_args_list)
+
+    @mock.patch('cloudinit.config.cc_disk_setup.assert_and_settle_device')
+    def test_mkfs_reads_topology_again(self, m_assert, m_subp):
+        """The topology is read again once the filesystem is created, and
+        before looking the device up when settling udev for it."""
+        m_subp.return_value = ('', '')
+        definition = {'device': '/dev/nvme1n1', 'partition': 'auto',
+                      'filesystem': 'xfs', 'label': 'data1',
+                      'cmd': 'mkfs -t %(filesystem)s %(device)s'}
+        cc_disk_setup.mkfs(definition, settle=False, topology=self.topology)
+        m_subp.assert_called_once_with('mkfs -t xfs /dev/nvme1n1',
+                                       shell=True)
+        self.assertEqual(1, self.topology.reads)
+        self.topology.devices()
+        self.assertEqual(2, self.topology.reads)
+        cc_disk_setup.mkfs(definition, settle=True, topology=self.topology)
+        self.assertEqual(3, self.topology.reads)
+
+    @mock.patch('cloudinit.config.cc_disk_setup.util.udevadm_settle')
+    @mock.patch('cloudinit.config.cc_disk_setup.assert_and_settle_device')
+    def test_handle_looks_devices_up_in_cloud_topology(self, m_assert,
+                                                       m_settle, m_subp):
+        """Filesystems are created on the disks the topology of the cloud
+        lists as unused, without probing them."""
+        m_subp.return_value = ('', '')
+        cloud = mock.Mock(block_topology=self.topology, reporter=None)
+        cloud.device_name_to_device.return_value = None
+        fs_setup = [{'device': '/dev/nvme%dn1' % i, 'partition': 'auto',
+                     'filesystem': 'xfs', 'label': 'data',
+                     'cmd': 'mkfs -t %(filesystem)s %(device)s'}
+                    for i in (1, 2, 3)]
+        cc_disk_setup.handle('disk_setup', {'fs_setup': fs_setup}, cloud,
+                             cc_disk_setup.LOG, [])
+        self.assertEqual(
+            sorted([mock.call('mkfs -t xfs /dev/nvme1n1', shell=True),
+                    mock.call('mkfs -t xfs /dev/nvme2n1', shell=True)]),
+            sorted(m_subp.call_args_list))
+
 #
 # vi: ts=4 expandtab
@@ -4,7 +4,7 @@ from cloudinit import cloud
 from cloudinit.config import cc_growpart
 from cloudinit import subp
 
-from cloudinit.tests.helpers import TestCase
+from cloudinit.tests.helpers import RecordedBlockTopology, TestCase
 
 import errno
 import logging
@@ -160,10 +160,11 @@ class TestConfig(TestCase):
                                   (('mysizer', object),)
                                   ))
 
-            self.handle(self.name, {}, self.cloud_init, self.log, self.args)
+            self.handle(self.name, {}, self.cloud, self.log, self.args)
 
             factory.assert_called_once_with('auto')
-            rsdevs.assert_called_once_with(myresizer, ['/'])
+            rsdevs.assert_called_once_with(
+                myresizer, ['/'], self.cloud.block_topology)
 
 
 class TestResize(unittest.TestCase):
@@ -226,8 +227,36 @@ class TestResize(unittest.TestCase):
             cc_growpart.device_part_info = opinfo
             os.stat = real_stat
 
-
-def simple_device_part_info(devpath):
+    def test_device_part_info_from_block_topology(self):
+        """Partitions the block topology lists are not looked up in sysfs."""
+        topology = RecordedBlockTopology('lsblk/lsblk_ec2_nvme.json')
+        with mock.patch.object(os.path, 'exists') as m_exists:
+            self.assertEqual(
+                ('/dev/nvme0n1', '15'),
+                cc_growpart.device_part_info('/dev/nvme0n1p15', topology))
+        self.assertEqual(0, m_exists.call_count)
+
+    def test_resized_devices_read_block_topology_again(self):
+        topology = mock.Mock()
+        resizer = mock.Mock()
+        resizer.resize.side_effect = [(1024, 1024), (1024, 2048)]
+        with ExitStack() as mocks:
+            mocks.enter_context(mock.patch.object(
+                cc_growpart, 'device_part_info',
+                side_effect=simple_device_part_info))
+            mocks.enter_context(mock.patch.object(
+                os, 'stat', return_value=Bunch(st_mode=25008)))
+            resized = cc_growpart.resize_devices(
+                resizer, ['/dev/XXda1'], topology)
+            self.assertEqual(cc_growpart.RESIZE.NOCHANGE, resized[0][1])
+            self.assertEqual(0, topology.invalidate.call_count)
+            resized = cc_growpart.resize_devices(
+                resizer, ['/dev/XXda1'], topology)
+            self.assertEqual(cc_growpart.RESIZE.CHANGED, resized[0][1])
+            topology.invalidate.assert_called_once_with()
+
+
+def simple_device_part_info(devpath, topology=None):
     # simple stupid return (/dev/vda, 1) for /dev/vda
     ret = re.search("([^0-9]*)([0-9]*)$", devpath)
     x = (ret.group(1), ret.group(2))
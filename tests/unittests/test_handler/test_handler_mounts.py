@@ -133,6 +133,30 @@ class TestSanitizeDevname(test_helpers.FilesystemMockingTestCase):
             disk_path,
             cc_mounts.sanitize_devname(disk_path, None, mock.Mock()))
 
+    def test_partition_found_in_block_topology(self):
+        """A partition the block topology lists is used without sysfs."""
+        topology = test_helpers.RecordedBlockTopology(
+            'lsblk/lsblk_kvm_lvm.json')
+        self._touch('/dev/vdb')
+        self._touch('/dev/vdb1')
+        self.assertEqual(
+            '/dev/vdb1',
+            cc_mounts.sanitize_devname(
+                'ephemeral0', lambda x: 'vdb', mock.Mock(),
+                topology=topology))
+        self.assertIsNone(
+            cc_mounts.sanitize_devname(
+                'ephemeral0', lambda x: 'vdb', mock.Mock()))
+
+    def test_partition_of_another_disk_in_block_topology_returns_none(self):
+        topology = test_helpers.RecordedBlockTopology(
+            'lsblk/lsblk_kvm_lvm.json')
+        self.assertFalse(
+            cc_mounts._is_block_device('/dev/vdb', '/dev/vda1', topology))
+        self.assertFalse(
+            cc_mounts._is_block_device('/dev/vdb1', None, topology))
+        self.assertTrue(cc_mounts._is_block_device('/dev/vdb', None, topology))
+
 
 class TestSwapFileCreation(test_helpers.FilesystemMockingTestCase):
 
@@ -161,7 +185,9 @@ class TestSwapFileCreation(test_helpers.FilesystemMockingTestCase):
                                          'opts': 'rw,relatime,discard'
                                          }})
 
-        self.mock_cloud = mock.Mock()
+        self.topology = test_helpers.RecordedBlockTopology(
+            'lsblk/lsblk_kvm_lvm.json')
+        self.mock_cloud = mock.Mock(block_topology=self.topology)
         self.mock_log = mock.Mock()
         self.mock_cloud.device_name_to_device = self.device_name_to_device
 
@@ -273,7 +299,9 @@ class TestFstabHandling(test_helpers.FilesystemMockingTestCase):
                                          'opts': 'rw,relatime,discard'
                                          }})
 
-        self.mock_cloud = mock.Mock()
+        self.topology = test_helpers.RecordedBlockTopology(
+            'lsblk/lsblk_kvm_lvm.json')
+        self.mock_cloud = mock.Mock(block_topology=self.topology)
         self.mock_log = mock.Mock()
         self.mock_cloud.device_name_to_device = self.device_name_to_device
 
@@ -290,6 +318,14 @@ class TestFstabHandling(test_helpers.FilesystemMockingTestCase):
 
         return dev
 
+    def test_block_topology_read_again_once_mounted(self):
+        """Devices are read again after mounts and swap are activated."""
+        self.topology.devices()
+        cc_mounts.handle(None, {}, self.mock_cloud, self.mock_log, [])
+        self.assertEqual(1, self.topology.reads)
+        self.topology.devices()
+        self.assertEqual(2, self.topology.reads)
+
     def test_no_fstab(self):
         """ Handle images which do not include an fstab. """
         self.assertFalse(os.path.exists(cc_mounts.FSTAB_PATH))
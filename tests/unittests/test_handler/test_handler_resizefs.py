@@ -9,7 +9,8 @@ import logging
 
 from cloudinit.subp import ProcessExecutionError
 from cloudinit.tests.helpers import (
-    CiTestCase, mock, skipUnlessJsonSchema, util, wrap_and_call)
+    CiTestCase, RecordedBlockTopology, mock, skipUnlessJsonSchema, util,
+    wrap_and_call)
 
 
 LOG = logging.getLogger(__name__)
@@ -21,6 +22,9 @@ class TestResizefs(CiTestCase):
     def setUp(self):
         super(TestResizefs, self).setUp()
         self.name = "resizefs"
+        # Without mountinfo, as on BSD, mounts are read by util
+        self.topology = RecordedBlockTopology('lsblk/lsblk_kvm_lvm.json')
+        self.cloud = mock.Mock(block_topology=self.topology)
 
     @mock.patch('cloudinit.subp.subp')
     def test_skip_ufs_resize(self, m_subp):
@@ -64,7 +68,7 @@ class TestResizefs(CiTestCase):
     def test_handle_noops_on_disabled(self):
         """The handle function logs when the configuration disables resize."""
         cfg = {'resize_rootfs': False}
-        handle('cc_resizefs', cfg, _cloud=None, log=LOG, args=[])
+        handle('cc_resizefs', cfg, cloud=self.cloud, log=LOG, args=[])
         self.assertIn(
             'DEBUG: Skipping module named cc_resizefs, resizing disabled\n',
             self.logs.getvalue())
@@ -76,7 +80,7 @@ class TestResizefs(CiTestCase):
         Invalid values for resize_rootfs result in disabling the module.
         """
         cfg = {'resize_rootfs': 'junk'}
-        handle('cc_resizefs', cfg, _cloud=None, log=LOG, args=[])
+        handle('cc_resizefs', cfg, cloud=self.cloud, log=LOG, args=[])
         logs = self.logs.getvalue()
         self.assertIn(
             "WARNING: Invalid config:\nresize_rootfs: 'junk' is not one of"
@@ -91,7 +95,7 @@ class TestResizefs(CiTestCase):
         """handle warns when get_mount_info sees unknown filesystem for /."""
         m_get_mount_info.return_value = None
         cfg = {'resize_rootfs': True}
-        handle('cc_resizefs', cfg, _cloud=None, log=LOG, args=[])
+        handle('cc_resizefs', cfg, cloud=self.cloud, log=LOG, args=[])
         logs = self.logs.getvalue()
         self.assertNotIn("WARNING: Invalid config:\nresize_rootfs:", logs)
         self.assertIn(
@@ -118,11 +122,33 @@ class TestResizefs(CiTestCase):
                 {'is_container': {'return_value': False},
                  'get_mount_info': {'side_effect': fake_mount_info},
                  'get_cmdline': {'return_value': 'BOOT_IMAGE=/vmlinuz.efi'}},
-                handle, 'cc_resizefs', cfg, _cloud=None, log=LOG,
+                handle, 'cc_resizefs', cfg, cloud=self.cloud, log=LOG,
                 args=[])
         logs = self.logs.getvalue()
         self.assertIn("WARNING: Unable to find device '/dev/root'", logs)
 
+    @mock.patch('cloudinit.config.cc_resizefs.util.get_mount_info')
+    def test_handle_reads_mount_info_from_block_topology(
+            self, m_get_mount_info):
+        """handle looks / up in the mountinfo of the block topology and
+        reads it again once resized."""
+        topology = RecordedBlockTopology(
+            'lsblk/lsblk_ec2_nvme.json', 'mountinfo_focal_nvme.txt')
+        cfg = {'resize_rootfs': True}
+        with mock.patch('cloudinit.config.cc_resizefs.do_resize') as dresize:
+            wrap_and_call(
+                'cloudinit.config.cc_resizefs',
+                {'maybe_get_writable_device_path': {
+                    'return_value': '/dev/nvme0n1p1'}},
+                handle, 'cc_resizefs', cfg,
+                cloud=mock.Mock(block_topology=topology), log=LOG, args=[])
+        self.assertEqual(
+            ('resize2fs', '/dev/nvme0n1p1'), dresize.call_args[0][0])
+        self.assertEqual(0, m_get_mount_info.call_count)
+        self.assertEqual(1, topology.reads)
+        topology.devices()
+        self.assertEqual(2, topology.reads)
+
     def test_resize_zfs_cmd_return(self):
         zpool = 'zroot'
         devpth = 'gpt/system'
@@ -165,7 +191,7 @@ class TestResizefs(CiTestCase):
         cfg = {'resize_rootfs': True}
 
         with mock.patch('cloudinit.config.cc_resizefs.do_resize') as dresize:
-            handle('cc_resizefs', cfg, _cloud=None, log=LOG, args=[])
+            handle('cc_resizefs', cfg, cloud=self.cloud, log=LOG, args=[])
             ret = dresize.call_args[0][0]
 
         self.assertEqual(('zpool', 'online', '-e', 'vmzroot', disk), ret)
@@ -197,7 +223,7 @@ class TestResizefs(CiTestCase):
         with mock.patch('cloudinit.config.cc_resizefs.do_resize') as dresize:
             with mock.patch('cloudinit.config.cc_resizefs.os.stat') as m_stat:
                 m_stat.side_effect = fake_stat
-                handle('cc_resizefs', cfg, _cloud=None, log=LOG, args=[])
+                handle('cc_resizefs', cfg, cloud=self.cloud, log=LOG, args=[])
 
         self.assertEqual(('zpool', 'online', '-e', 'zroot', '/dev/' + disk),
                          dresize.call_args[0][0])
@@ -2,14 +2,16 @@
 import cloudinit
 from cloudinit.config.schema import (
     CLOUD_CONFIG_HEADER, SchemaValidationError, annotated_cloudconfig_file,
-    get_schema_doc, get_schema, validate_cloudconfig_file,
-    validate_cloudconfig_schema, main)
+    get_schema_doc, get_schema, get_validator, import_schema,
+    load_schema_file, validate_cloudconfig_file, validate_cloudconfig_schema,
+    write_schema_file, main)
 from cloudinit.util import write_file
 
 from cloudinit.tests.helpers import CiTestCase, mock, skipUnlessJsonSchema
 
 from copy import copy
 import itertools
+import json
 import os
 import pytest
 from pathlib import Path
@@ -53,6 +55,31 @@ class GetSchemaTest(CiTestCase):
         with mock.patch(m_schema_path, {'here': 'iam'}):
             self.assertEqual({'here': 'iam'}, get_schema())
 
+    @mock.patch('cloudinit.config.schema.FULL_SCHEMA', None)
+    def test_get_schema_loads_schema_file(self):
+        """Config modules are not imported when SCHEMA_FILE exists."""
+        schema_file = self.tmp_path('cloud-config-schema.json')
+        write_file(schema_file, json.dumps({'id': 'from-file'}))
+        with mock.patch(
+                'cloudinit.config.schema.SCHEMA_FILE', schema_file):
+            with mock.patch('cloudinit.config.schema.import_schema') as m_imp:
+                self.assertEqual({'id': 'from-file'}, get_schema())
+        self.assertEqual(0, m_imp.call_count)
+
+    @mock.patch('cloudinit.config.schema.FULL_SCHEMA', None)
+    def test_get_schema_imports_without_schema_file(self):
+        """Config modules are imported when SCHEMA_FILE is absent."""
+        with mock.patch('cloudinit.config.schema.SCHEMA_FILE',
+                        self.tmp_path('missing.json')):
+            self.assertEqual(import_schema(), get_schema())
+
+    def test_write_schema_file_matches_imported_schema(self):
+        """The schema file written at build time holds the full schema."""
+        schema_file = self.tmp_path('cloud-config-schema.json')
+        write_schema_file(schema_file)
+        self.assertEqual(json.loads(json.dumps(import_schema())),
+                         load_schema_file(schema_file))
+
 
 class SchemaValidationErrorTest(CiTestCase):
     """Test validate_cloudconfig_schema"""
@@ -117,6 +144,47 @@ class ValidateCloudConfigSchemaTest(CiTestCase):
             str(context_mgr.exception))
 
 
+class ValidatorCacheTest(CiTestCase):
+    """Tests for get_validator and validating configured modules."""
+
+    schema = {
+        '$schema': 'http://json-schema.org/draft-04/schema#',
+        'id': 'cloud-config-schema',
+        'allOf': [
+            {'id': 'cc_a', 'name': 'A', 'type': 'object',
+             'properties': {'a': {'type': 'string'}}},
+            {'id': 'cc_b', 'name': 'B',
+             'properties': {'b': {'type': 'integer'}}},
+        ]}
+
+    @skipUnlessJsonSchema()
+    def test_validator_created_once_per_schema(self):
+        """Validators are reused for the same schema dict."""
+        subschema = self.schema['allOf'][0]
+        validator = get_validator(subschema)
+        self.assertIs(validator, get_validator(subschema))
+        self.assertIsNot(validator, get_validator(copy(subschema)))
+
+    @skipUnlessJsonSchema()
+    def test_only_configured_modules_validated(self):
+        """Schemas of modules without configured properties are skipped."""
+        with mock.patch('cloudinit.config.schema.get_validator',
+                        side_effect=get_validator) as m_get_validator:
+            validate_cloudconfig_schema({'a': 'x'}, self.schema, strict=True)
+        m_get_validator.assert_called_once_with(self.schema['allOf'][0])
+
+    @skipUnlessJsonSchema()
+    def test_errors_of_all_configured_modules_sorted_by_path(self):
+        """Errors of each module's schema are reported together by path."""
+        with self.assertRaises(SchemaValidationError) as context_mgr:
+            validate_cloudconfig_schema(
+                {'b': 'x', 'a': 1, 'c': None}, self.schema, strict=True)
+        self.assertEqual(
+            (('a', "1 is not of type 'string'"),
+             ('b', "'x' is not of type 'integer'")),
+            context_mgr.exception.schema_errors)
+
+
 class TestCloudConfigExamples:
     schema = get_schema()
     params = [
@@ -6,9 +6,12 @@ from cloudinit.handlers import cloud_config
 from cloudinit.handlers import (CONTENT_START, CONTENT_END)
 
 from cloudinit import helpers as c_helpers
+from cloudinit import mergers
 from cloudinit import util
+from cloudinit.mergers import m_dict
 
 import collections
+import copy
 import glob
 import os
 import random
@@ -96,6 +99,31 @@ def make_dict(max_depth, seed=None):
     return _make_dict(0, max_depth, rand)
 
 
+class _CopyingDictMerger(m_dict.Merger):
+    """The dict merger as it was, copying every dict it merges into."""
+
+    def _on_dict(self, value, merge_with):
+        if not isinstance(merge_with, (dict)):
+            return value
+        value = dict(value)
+        do_replace = self._method == 'replace'
+        for (k, v) in merge_with.items():
+            if k in value:
+                if v is None and self._allow_delete:
+                    value.pop(k)
+                elif do_replace:
+                    value[k] = v
+                elif isinstance(v, (list, tuple)) and self._recurse_array:
+                    value[k] = self._merger.merge(value[k], v)
+                elif isinstance(v, str) and self._recurse_str:
+                    value[k] = self._merger.merge(value[k], v)
+                elif isinstance(v, (dict)) and self._recurse_dict:
+                    value[k] = self._merger.merge(value[k], v)
+            else:
+                value[k] = v
+        return value
+
+
 class TestSimpleRun(helpers.ResourceUsingTestCase):
     def _load_merge_files(self):
         merge_root = helpers.resourceLocation('merge_sources')
@@ -256,4 +284,121 @@ class TestSimpleRun(helpers.ResourceUsingTestCase):
         d = util.mergemanydict([a, b])
         self.assertEqual(c, d)
 
+
+class TestCopyOnWriteMerge(helpers.ResourceUsingTestCase):
+
+    MERGE_HOWS = (
+        'dict(replace)+list(append)+str()',
+        'dict(no_replace,recurse_list)+list(append)+str(append)',
+        'dict(recurse_array,allow_delete)+list(prepend)',
+        'list(extend)+dict(replace,recurse_dict)+str(no_replace)',
+    )
+
+    def _copying_mergemanydict(self, srcs):
+        with helpers.mock.patch.object(m_dict, 'Merger', _CopyingDictMerger):
+            with helpers.mock.patch.object(
+                    mergers, 'construct', mergers._construct):
+                return util.mergemanydict(srcs)
+
+    def _assert_same_merge(self, srcs):
+        expected = self._copying_mergemanydict(copy.deepcopy(srcs))
+        unchanged = copy.deepcopy(srcs)
+        self.assertEqual(expected, util.mergemanydict(srcs))
+        # Only the merge_how or merge_type of each source is popped
+        for src in unchanged:
+            src.pop('merge_how', None)
+            src.pop('merge_type', None)
+        self.assertEqual(unchanged, srcs)
+
+    def test_merges_random_dicts_as_copying_merger(self):
+        """Copy on write merges seeded random dicts as copying did."""
+        rand = random.Random(7)
+        for i in range(1, 10):
+            srcs = []
+            for j in range(1, 10):
+                src = make_dict(5, i * j)
+                src['merge_how'] = rand.choice(self.MERGE_HOWS)
+                srcs.append(src)
+            self._assert_same_merge(srcs)
+
+    def test_merges_sample_sources_as_copying_merger(self):
+        """Copy on write merges the merge_sources as copying did."""
+        merge_root = helpers.resourceLocation('merge_sources')
+        source_ids = collections.defaultdict(list)
+        for fn in glob.glob(os.path.join(merge_root, SOURCE_PAT)):
+            file_id = re.match(r"source(\d+)\-(\d+)[.]yaml",
+                               os.path.basename(fn)).group(1)
+            source_ids[file_id].append(fn)
+        for file_id in sorted(source_ids):
+            srcs = [util.load_yaml(util.load_file(fn))
+                    for fn in sorted(source_ids[file_id])]
+            self._assert_same_merge(srcs)
+
+    def test_unchanged_dicts_are_not_copied(self):
+        """Dicts the merge leaves unchanged are returned as they were."""
+        base = {'a': {'b': {'c': 'd'}}, 'e': {'f': 'g'}}
+        merger = mergers.construct(mergers.default_mergers())
+        merged = merger.merge(base, {'a': {'b': {'h': 'i'}}})
+        self.assertEqual(
+            {'a': {'b': {'c': 'd', 'h': 'i'}}, 'e': {'f': 'g'}}, merged)
+        self.assertIs(base['e'], merged['e'])
+        self.assertIsNot(base['a'], merged['a'])
+        self.assertEqual({'a': {'b': {'c': 'd'}}, 'e': {'f': 'g'}}, base)
+
+    def test_mergemanydict_does_not_change_sources(self):
+        """Merging leaves the nested values of the sources as they were."""
+        srcs = [{'a': {'b': {'c': 'd'}}, 'e': [{'f': 'g'}]},
+                {'a': {'b': {'c': 'x', 'k': 'l'}}, 'e': [{'m': 'n'}],
+                 'h': {'i': 'j'}}]
+        unchanged = copy.deepcopy(srcs)
+        merged = util.mergemanydict(srcs)
+        self.assertEqual(
+            {'a': {'b': {'c': 'd', 'k': 'l'}}, 'e': [{'f': 'g'}],
+             'h': {'i': 'j'}}, merged)
+        self.assertEqual(unchanged, srcs)
+
+    def test_allow_delete_does_not_change_sources(self):
+        """Keys deleted by allow_delete are only removed from the merge."""
+        base = {'a': {'b': 'c', 'd': 'e'}}
+        merged = util.mergemanydict([
+            {'a': {'b': None}, 'merge_how': 'dict(allow_delete)+list()'},
+            base], reverse=True)
+        self.assertEqual({'a': {'d': 'e'}}, merged)
+        self.assertEqual({'a': {'b': 'c', 'd': 'e'}}, base)
+
+
+class TestMergerConstruction(helpers.TestCase):
+
+    def test_construct_returns_same_merger_for_same_mergers(self):
+        """Mergers are constructed once for each list of parsed mergers."""
+        parsed = mergers.string_extract_mergers('dict(replace)+list(append)')
+        merger = mergers.construct(parsed)
+        self.assertIs(merger, mergers.construct(
+            mergers.string_extract_mergers('dict(replace)+list(append)')))
+        self.assertIsNot(merger, mergers.construct(
+            mergers.string_extract_mergers('dict(no_replace)+list()')))
+
+    def test_type_methods_found_once(self):
+        """The merge method of a type is only looked up on first use."""
+        merger = mergers.construct(mergers.default_mergers())
+        merger.merge({'a': 'b'}, {'c': 'd'})
+        with helpers.mock.patch.object(
+                merger, '_find_method',
+                side_effect=AssertionError('not cached')):
+            self.assertEqual(
+                {'a': 'b', 'c': 'd', 'e': 'f'},
+                merger.merge({'a': 'b', 'c': 'd'}, {'e': 'f'}))
+
+    def test_lookups_added_are_found(self):
+        """Methods are looked up again when mergers are added."""
+
+        class StrMerger(object):
+            def _on_str(self, value, merge_with):
+                return value + merge_with
+
+        merger = mergers.LookupMerger()
+        self.assertEqual('a', merger.merge('a', 'b'))
+        merger._lookups.append(StrMerger())
+        self.assertEqual('ab', merger.merge('a', 'b'))
+
 # vi: ts=4 expandtab
@@ -2690,15 +2690,20 @@ def _setup_test(tmp_dir, mock_get_devicelist, mock_read_sys_net,
 
     for dev in dev_attrs:
         os.makedirs(os.path.join(tmp_dir, dev))
-        with open(os.path.join(tmp_dir, dev, 'operstate'), 'w') as fh:
-            fh.write(dev_attrs[dev]['operstate'])
         os.makedirs(os.path.join(tmp_dir, dev, "device"))
-        for key in ['device/driver']:
-            if key in dev_attrs[dev] and dev_attrs[dev][key]:
-                target = dev_attrs[dev][key]
-                link = os.path.join(tmp_dir, dev, key)
-                print('symlink %s -> %s' % (link, target))
-                os.symlink(target, link)
+        for key, value in dev_attrs[dev].items():
+            if value is None or value is False:
+                # read_sys_net_safe returns False for missing attributes
+                continue
+            path = os.path.join(tmp_dir, dev, key)
+            if key == 'device/driver':
+                print('symlink %s -> %s' % (path, value))
+                os.symlink(value, path)
+            elif key == 'bridge':
+                os.makedirs(path)
+            else:
+                with open(path, 'w') as fh:
+                    fh.write(str(value))
 
     mock_sys_dev_path.side_effect = sys_dev_path
 
@@ -5095,6 +5100,15 @@ class TestNetRenderers(CiTestCase):
             self.assertTrue(result)
 
 
+def _net_device(name, **attrs):
+    """Return a NetDevice named name with attrs and no other attributes."""
+    fields = dict((field, None) for field in net.NetDevice._fields)
+    fields.update(is_bridge=False, is_bond=False, is_bonding_slave=False,
+                  has_ovs_upper=False)
+    fields.update(attrs, name=name)
+    return net.NetDevice(**fields)
+
+
 @mock.patch(
     "cloudinit.net.is_openvswitch_internal_interface",
     mock.Mock(return_value=False)
@@ -5148,18 +5162,24 @@ class TestGetInterfaces(CiTestCase):
     def _se_interface_has_own_mac(self, name):
         return name in self.data['own_macs']
 
+    def _se_get_net_snapshot(self):
+        return net.NetDeviceSnapshot([_net_device(
+            name, address=self._se_get_interface_mac(name),
+            addr_assign_type=0 if self._se_interface_has_own_mac(name) else 2,
+            is_bridge=self._se_is_bridge(name),
+            is_bond=name in self.data['bonds'],
+            devtype='vlan' if self._se_is_vlan(name) else None,
+            driver=self._se_device_driver(name),
+            device_id=self._se_device_devid(name))
+            for name in self._se_get_devicelist()])
+
     def _mock_setup(self):
         self.data = copy.deepcopy(self._data)
         self.data['devices'] = set(list(self.data['macs'].keys()))
-        mocks = ('get_devicelist', 'get_interface_mac', 'is_bridge',
-                 'interface_has_own_mac', 'is_vlan', 'device_driver',
-                 'device_devid')
-        self.mocks = {}
-        for n in mocks:
-            m = mock.patch('cloudinit.net.' + n,
-                           side_effect=getattr(self, '_se_' + n))
-            self.addCleanup(m.stop)
-            self.mocks[n] = m.start()
+        m = mock.patch('cloudinit.net.get_net_snapshot',
+                       side_effect=self._se_get_net_snapshot)
+        self.addCleanup(m.stop)
+        m.start()
 
     def test_gi_includes_duplicate_macs(self):
         self._mock_setup()
@@ -5181,8 +5201,6 @@ class TestGetInterfaces(CiTestCase):
     def test_gi_excludes_stolen_macs(self):
         self._mock_setup()
         ret = net.get_interfaces()
-        self.mocks['interface_has_own_mac'].assert_has_calls(
-            [mock.call('enp0s1'), mock.call('bond1')], any_order=True)
         expected = [
             ('enp0s2', 'aa:aa:aa:aa:aa:02', 'e1000', '0x5'),
             ('enp0s1', 'aa:aa:aa:aa:aa:01', 'virtio_net', '0x4'),
@@ -5205,10 +5223,6 @@ class TestGetInterfaces(CiTestCase):
         self.data['bridges'] = [f for f in self.data['devices'] if f != "b1"]
         ret = net.get_interfaces()
         self.assertEqual([('b1', 'aa:aa:aa:aa:aa:b1', None, '0x0')], ret)
-        self.mocks['is_bridge'].assert_has_calls(
-            [mock.call('bridge1'), mock.call('enp0s1'), mock.call('bond1'),
-             mock.call('b1')],
-            any_order=True)
 
 
 class TestInterfaceHasOwnMac(CiTestCase):
@@ -5284,21 +5298,23 @@ class TestGetInterfacesByMac(CiTestCase):
     def _se_interface_has_own_mac(self, name):
         return name in self.data['own_macs']
 
-    def _se_get_ib_interface_hwaddr(self, name, ethernet_format):
-        ib_hwaddr = self.data.get('ib_hwaddr', {})
-        return ib_hwaddr.get(name, {}).get(ethernet_format)
+    def _se_get_net_snapshot(self):
+        return net.NetDeviceSnapshot([_net_device(
+            name, address=self._se_get_interface_mac(name),
+            addr_assign_type=0 if self._se_interface_has_own_mac(name) else 2,
+            is_bridge=self._se_is_bridge(name),
+            is_bond=name in self.data['bonds'],
+            devtype='vlan' if self._se_is_vlan(name) else None,
+            type='32' if name in self.data.get('ib_hwaddr', {}) else '1')
+            for name in self._se_get_devicelist()])
 
     def _mock_setup(self):
         self.data = copy.deepcopy(self._data)
         self.data['devices'] = set(list(self.data['macs'].keys()))
-        mocks = ('get_devicelist', 'get_interface_mac', 'is_bridge',
-                 'interface_has_own_mac', 'is_vlan', 'get_ib_interface_hwaddr')
-        self.mocks = {}
-        for n in mocks:
-            m = mock.patch('cloudinit.net.' + n,
-                           side_effect=getattr(self, '_se_' + n))
-            self.addCleanup(m.stop)
-            self.mocks[n] = m.start()
+        m = mock.patch('cloudinit.net.get_net_snapshot',
+                       side_effect=self._se_get_net_snapshot)
+        self.addCleanup(m.stop)
+        m.start()
 
     def test_raise_exception_on_duplicate_macs(self):
         self._mock_setup()
@@ -5314,8 +5330,6 @@ class TestGetInterfacesByMac(CiTestCase):
     def test_excludes_stolen_macs(self):
         self._mock_setup()
         ret = net.get_interfaces_by_mac()
-        self.mocks['interface_has_own_mac'].assert_has_calls(
-            [mock.call('enp0s1'), mock.call('bond1')], any_order=True)
         self.assertEqual(
             {'aa:aa:aa:aa:aa:01': 'enp0s1', 'aa:aa:aa:aa:aa:02': 'enp0s2',
              'aa:aa:aa:aa:aa:03': 'bridge1-nic', '00:00:00:00:00:00': 'lo'},
@@ -5333,10 +5347,6 @@ class TestGetInterfacesByMac(CiTestCase):
         self.data['bridges'] = [f for f in self.data['devices'] if f != "b1"]
         ret = net.get_interfaces_by_mac()
         self.assertEqual({'aa:aa:aa:aa:aa:b1': 'b1'}, ret)
-        self.mocks['is_bridge'].assert_has_calls(
-            [mock.call('bridge1'), mock.call('enp0s1'), mock.call('bond1'),
-             mock.call('b1')],
-            any_order=True)
 
     def test_excludes_vlans(self):
         self._mock_setup()
@@ -5351,10 +5361,6 @@ class TestGetInterfacesByMac(CiTestCase):
         self.data['vlans'] = [f for f in self.data['devices'] if f != "b1"]
         ret = net.get_interfaces_by_mac()
         self.assertEqual({'aa:aa:aa:aa:aa:b1': 'b1'}, ret)
-        self.mocks['is_vlan'].assert_has_calls(
-            [mock.call('bridge1'), mock.call('enp0s1'), mock.call('bond1'),
-             mock.call('b1')],
-            any_order=True)
 
     def test_duplicates_of_empty_mac_are_ok(self):
         """Duplicate macs of 00:00:00:00:00:00 should be skipped."""
@@ -5434,14 +5440,19 @@ class TestGetIBHwaddrsByInterface(CiTestCase):
 
     def _mock_setup(self):
         self.data = copy.deepcopy(self._data)
-        mocks = ('get_devicelist', 'get_interface_mac', 'is_bridge',
-                 'interface_has_own_mac', 'get_ib_interface_hwaddr')
-        self.mocks = {}
-        for n in mocks:
-            m = mock.patch('cloudinit.net.' + n,
-                           side_effect=getattr(self, '_se_' + n))
-            self.addCleanup(m.stop)
-            self.mocks[n] = m.start()
+        m = mock.patch('cloudinit.net.get_net_snapshot',
+                       side_effect=self._se_get_net_snapshot)
+        self.addCleanup(m.stop)
+        m.start()
+
+    def _se_get_net_snapshot(self):
+        return net.NetDeviceSnapshot([_net_device(
+            name, address=self._se_get_interface_mac(name),
+            addr_assign_type=0 if self._se_interface_has_own_mac(name) else 2,
+            is_bridge=self._se_is_bridge(name),
+            is_bond=name in self.data['bonds'],
+            type='32' if name in self.data.get('ib_hwaddr', {}) else '1')
+            for name in self._se_get_devicelist()])
 
     def _se_get_devicelist(self):
         return self.data['devices']
@@ -5455,10 +5466,6 @@ class TestGetIBHwaddrsByInterface(CiTestCase):
     def _se_interface_has_own_mac(self, name):
         return name in self.data['own_macs']
 
-    def _se_get_ib_interface_hwaddr(self, name, ethernet_format):
-        ib_hwaddr = self.data.get('ib_hwaddr', {})
-        return ib_hwaddr.get(name, {}).get(ethernet_format)
-
     def test_ethernet(self):
         self._mock_setup()
         self.data['devices'].remove('ib0')
@@ -1,8 +1,10 @@
 # This file is part of cloud-init. See LICENSE file for license information.
 
+from cloudinit import fsimage
 from cloudinit import util
 
-from cloudinit.tests.helpers import TestCase, populate_dir
+from cloudinit.tests.helpers import (
+    TestCase, make_fat_image, make_iso9660_image, populate_dir)
 
 import shutil
 import tempfile
@@ -43,4 +45,16 @@ class TestPathPrefix2Dict(TestCase):
         ret = util.pathprefix2dict(self.tmp, required=['f1'], optional=['f2'])
         self.assertEqual(dirdata, ret)
 
+    def test_filesystem_view(self):
+        dirdata = {'f1': b'f1c', 'f2': b'f2c'}
+        for make_image in (make_iso9660_image, make_fat_image):
+            image = self.tmp + '/seed.img'
+            make_image(image, dirdata)
+            with fsimage.open_image(image) as view:
+                ret = util.pathprefix2dict(view, required=['f1'],
+                                           optional=['f2', 'f3'])
+                self.assertEqual(dirdata, ret)
+                self.assertRaises(ValueError, util.pathprefix2dict, view,
+                                  required=['f1', 'f3'])
+
 # vi: ts=4 expandtab
@@ -330,3 +330,90 @@ class TextKvpReporter(CiTestCase):
         self.assertEqual(2, len(kvps))
         self.assertNotEqual(kvps[0]["key"], kvps[1]["key"],
                             "duplicate keys for KVP entries")
+
+    def _write_kvps(self, keys):
+        reporter = HyperVKvpReportingHandler(kvp_file_path=self.tmp_file_path)
+        reporter._append_kvp_item(
+            [reporter._encode_kvp_item(key, 'value') for key in keys])
+        return reporter
+
+    def test_kvp_store_indexes_keys_by_incarnation(self):
+        """Keys are indexed by incarnation, including other writers' keys."""
+        reporter = self._write_kvps(
+            ['CLOUD_INIT|1|a', 'foreign', 'CLOUD_INIT|2|b'])
+        # Another process appending to the same pool file
+        self._write_kvps(['CLOUD_INIT|1|c'])
+        store = reporter._kvp_store
+        self.assertEqual({1, 2, None}, store.incarnations())
+        self.assertEqual(['CLOUD_INIT|1|a', 'CLOUD_INIT|1|c'], store.keys(1))
+        self.assertEqual(['foreign'], store.keys())
+        self.assertEqual(
+            ['CLOUD_INIT|2|b', 'CLOUD_INIT|1|c'],
+            [kvp['key'] for kvp in reporter._iterate_kvps(
+                2 * reporter.HV_KVP_RECORD_SIZE)])
+
+    def test_kvp_store_reindexes_rewritten_pool_file(self):
+        """The index is rebuilt when the pool file is rewritten."""
+        reporter = self._write_kvps(['CLOUD_INIT|1|a'])
+        self.assertEqual(['CLOUD_INIT|1|a'], reporter._kvp_store.keys(1))
+        with open(self.tmp_file_path, 'wb') as f:
+            f.write(reporter._encode_kvp_item('CLOUD_INIT|2|b', 'value'))
+        self.assertEqual({2}, reporter._kvp_store.incarnations())
+
+    def test_kvp_iteration_survives_store_close(self):
+        """Records are read from a file descriptor of their own, so closing
+        the store while iterating neither fails nor leaks it."""
+        reporter = self._write_kvps(['CLOUD_INIT|1|a', 'CLOUD_INIT|1|b'])
+        store = reporter._kvp_store
+        store.READ_CHUNK_RECORDS = 1
+        kvps = reporter._iterate_kvps(0)
+        self.assertEqual('CLOUD_INIT|1|a', next(kvps)['key'])
+        store.close()
+        self.assertEqual(['CLOUD_INIT|1|b'], [kvp['key'] for kvp in kvps])
+        fd_dir = '/proc/self/fd'
+        if os.path.isdir(fd_dir):
+            open_fds = len(os.listdir(fd_dir))
+            kvps = reporter._iterate_kvps(0)
+            next(kvps)
+            kvps.close()
+            store.close()
+            self.assertEqual(open_fds, len(os.listdir(fd_dir)))
+
+    def test_compact_drops_stale_incarnations(self):
+        """Compaction drops previous incarnations, keeping other records."""
+        reporter = self._write_kvps(['stub'])
+        current = reporter.incarnation_no
+        self._write_kvps([
+            'CLOUD_INIT|%d|old' % (current - 3600), 'foreign',
+            'CLOUD_INIT|%d|skewed' % (current - 1),
+            'CLOUD_INIT|%d|new' % current])
+        HyperVKvpReportingHandler._already_compacted_pool_file = False
+        reporter = HyperVKvpReportingHandler(
+            kvp_file_path=self.tmp_file_path, compact_pool=True)
+        self.assertEqual(
+            ['stub', 'foreign', 'CLOUD_INIT|%d|skewed' % (current - 1),
+             'CLOUD_INIT|%d|new' % current],
+            [kvp['key'] for kvp in reporter._iterate_kvps(0)])
+        self.assertEqual(
+            4 * reporter.HV_KVP_RECORD_SIZE,
+            os.path.getsize(self.tmp_file_path))
+
+    def test_compact_keeps_records_with_undecodable_keys(self):
+        """Keys which are not UTF-8 neither fail compaction nor are lost."""
+        reporter = self._write_kvps(['stub'])
+        current = reporter.incarnation_no
+        foreign = b'\xff\xfeforeign'.ljust(
+            reporter.HV_KVP_RECORD_SIZE, b'\x00')
+        reporter._append_kvp_item([
+            reporter._encode_kvp_item(
+                'CLOUD_INIT|%d|old' % (current - 3600), 'value'),
+            foreign])
+        HyperVKvpReportingHandler._already_compacted_pool_file = False
+        with mock.patch(
+                'cloudinit.reporting.handlers.LOG.warning') as m_warning:
+            HyperVKvpReportingHandler(
+                kvp_file_path=self.tmp_file_path, compact_pool=True)
+        self.assertEqual([], m_warning.call_args_list)
+        self.assertEqual(
+            reporter._encode_kvp_item('stub', 'value') + foreign,
+            util.load_file(self.tmp_file_path, decode=False))
@@ -5,6 +5,7 @@
 # This file is part of cloud-init. See LICENSE file for license information.
 
 from cloudinit.tests import helpers as test_helpers
+import os
 import textwrap
 
 from cloudinit import templater
@@ -166,4 +167,54 @@ $a,$b'''
             ' template, reverting to the basic renderer.',
             self.logs.getvalue())
 
+
+@test_helpers.skipUnlessJinja()
+class TestJinjaTemplateCache(test_helpers.CiTestCase):
+
+    def setUp(self):
+        super(TestJinjaTemplateCache, self).setUp()
+        for attr in ('_JINJA_ENV', '_BYTECODE_CACHE_DIR'):
+            patcher = test_helpers.mock.patch.object(templater, attr, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_templates_compiled_once_per_content(self):
+        """Templates of the same content are compiled once."""
+        tmpl_fn = self.tmp_path('hosts.tmpl')
+        write_file(tmpl_fn, '## template:jinja\n{{name}} {{fqdn}}\n')
+        template = templater.get_jinja_template('{{name}} {{fqdn}}\n')
+        self.assertIs(
+            template, templater.get_jinja_template('{{name}} {{fqdn}}\n'))
+        self.assertIsNot(template, templater.get_jinja_template('{{name}}'))
+        with test_helpers.mock.patch.object(
+                templater.JEnvironment, 'compile') as m_compile:
+            self.assertEqual(
+                'bob bob.example.com\n',
+                templater.render_from_file(
+                    tmpl_fn, {'name': 'bob', 'fqdn': 'bob.example.com'}))
+        self.assertEqual(0, m_compile.call_count)
+
+    def test_bytecode_cache_reused_by_new_environments(self):
+        """Bytecode written to the cache dir skips compiling templates."""
+        cache_dir = self.tmp_path('jinja_cache')
+        templater.set_bytecode_cache_dir(cache_dir)
+        content = '## template:jinja\n{% if a %}{{a}}{% endif %}\n'
+        self.assertEqual('1\n', templater.render_string(content, {'a': 1}))
+        self.assertEqual(1, len(os.listdir(cache_dir)))
+        templater._JINJA_ENV = None
+        with test_helpers.mock.patch.object(
+                templater.JEnvironment, 'compile') as m_compile:
+            self.assertEqual(
+                '2\n', templater.render_string(content, {'a': 2}))
+        self.assertEqual(0, m_compile.call_count)
+
+    def test_bytecode_cache_write_errors_ignored(self):
+        """Templates render when their bytecode cannot be written."""
+        cache_dir = self.tmp_path('jinja_cache')
+        templater.set_bytecode_cache_dir(cache_dir)
+        os.rmdir(cache_dir)
+        self.assertEqual(
+            'bob\n', templater.render_string(
+                '## template:jinja\n{{name}}\n', {'name': 'bob'}))
+
 # vi: ts=4 expandtab
@@ -891,16 +891,52 @@ class TestFindDevs:
     @mock.patch('cloudinit.subp.subp')
     def test_find_devs_with(self, m_subp):
         m_subp.return_value = (
-            '/dev/sda1: UUID="some-uuid" TYPE="ext4" PARTUUID="some-partid"',
+            'DEVNAME=/dev/sda1\nUUID=some-uuid\nTYPE=ext4\n'
+            'PARTUUID=some-partid\n\n'
+            'DEVNAME=/dev/sdb\nLABEL_FATBOOT=A_LABEL\nTYPE=vfat\n',
             ''
         )
         devlist = util.find_devs_with()
-        assert devlist == [
-            '/dev/sda1: UUID="some-uuid" TYPE="ext4" PARTUUID="some-partid"']
+        assert devlist == ['/dev/sda1', '/dev/sdb']
 
         devlist = util.find_devs_with("LABEL_FATBOOT=A_LABEL")
-        assert devlist == [
-            '/dev/sda1: UUID="some-uuid" TYPE="ext4" PARTUUID="some-partid"']
+        assert devlist == ['/dev/sdb']
+
+        devlist = util.find_devs_with("UUID=some-uuid")
+        assert devlist == ['/dev/sda1']
+
+        devlist = util.find_devs_with("LABEL=A_LABEL")
+        assert devlist == []
+
+        # All lookups are answered from a single blkid run
+        m_subp.assert_called_once_with(
+            ['blkid', '-c', '/dev/null', '-o', 'export'], rcs=[0, 2],
+            decode='replace')
+
+    @mock.patch('cloudinit.subp.subp')
+    def test_find_devs_with_no_cache_probes_again(self, m_subp):
+        m_subp.return_value = ('DEVNAME=/dev/sda1\nTYPE=ntfs\n', '')
+        assert util.find_devs_with('TYPE=ntfs') == ['/dev/sda1']
+        m_subp.return_value = ('DEVNAME=/dev/sda1\nTYPE=ext4\n', '')
+        assert util.find_devs_with('TYPE=ntfs') == ['/dev/sda1']
+        assert util.find_devs_with('TYPE=ntfs', no_cache=True) == []
+        assert m_subp.call_count == 2
+
+    @mock.patch('cloudinit.subp.subp')
+    def test_find_devs_with_path_runs_blkid(self, m_subp):
+        m_subp.return_value = ('/dev/sr0\n', '')
+        assert util.find_devs_with(path='/dev/sr0') == ['/dev/sr0']
+        m_subp.assert_called_once_with(
+            ['blkid', '-odevice', '/dev/sr0'], rcs=[0, 2])
+
+    @mock.patch('cloudinit.subp.subp')
+    def test_find_devs_with_counts_blkid_runs(self, m_subp):
+        m_subp.return_value = ('DEVNAME=/dev/sda1\nTYPE=ext4\n', '')
+        runs = util.blkid_runs()
+        util.find_devs_with('TYPE=vfat')
+        util.find_devs_with('TYPE=iso9660')
+        util.find_devs_with('TYPE=ext4', tag='UUID', oformat='value')
+        assert util.blkid_runs() == runs + 2
 
     @mock.patch('cloudinit.subp.subp')
     def test_find_devs_with_openbsd(self, m_subp):